@@ -0,0 +1,409 @@
+"""
+Functions to evaluate CMAQ output against monitor observations (e.g., AQS sites): find
+the grid cells of the sites, extract the model time series at all the sites at once,
+and compute paired statistics.
+"""
+
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import xarray as xr
+from . import utils
+
+
+# Site locators of the grids (see `site_locator`)
+SITE_LOCATORS = {}
+# Columns of the AQS pre-generated files (https://aqs.epa.gov/aqsweb/airdata/download_files.html)
+AQS_COLUMNS = {'State Code': 'state', 'County Code': 'county', 'Site Num': 'site', 'Latitude': 'latitude',
+               'Longitude': 'longitude', 'Date GMT': 'date', 'Time GMT': 'hour', 'Sample Measurement': 'obs',
+               'Date Local': 'date_local', 'Arithmetic Mean': 'obs_mean', 'Parameter Name': 'parameter'}
+
+
+class GridLocator:
+    """
+    Finds the grid cells that contain a set of points (e.g., monitor sites). Lambert
+    conformal grids use the projected coordinates of the points, which give the cell
+    indices directly. Other grids use a KD-tree of the cell centers on the unit sphere,
+    which is built once and can be pickled.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (e.g., the attributes of a CCTM file).
+    :param lat: `numpy.ndarray`
+        Latitudes of the cell centers (NROWS, NCOLS). Only used for the KD-tree.
+    :param lon: `numpy.ndarray`
+        Longitudes of the cell centers (NROWS, NCOLS). Only used for the KD-tree.
+    """
+    def __init__(self, grid, lat=None, lon=None):
+        self.grid = dict(grid)
+        self.projected = (int(grid.get('GDTYP', 0)) == 2) and all([key in grid for key in ['XORIG', 'YORIG', 'XCELL', 'YCELL']])
+        if self.projected:
+            self.shape = (int(grid['NROWS']), int(grid['NCOLS']))
+            self.tree = None
+        else:
+            from scipy.spatial import cKDTree
+            if (lat is None) or (lon is None):
+                raise ValueError('The cell latitudes and longitudes are needed for grids that are not Lambert conformal')
+            lat, lon = np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')
+            self.shape = lat.shape
+            xyz = unit_xyz(lat, lon)
+            self.tree = cKDTree(xyz.reshape(-1, 3))
+            # Points farther than the largest distance between neighboring centers are outside the grid
+            spacing = [np.linalg.norm(np.diff(xyz, axis=axis), axis=-1).max() for axis in [0, 1] if lat.shape[axis] > 1]
+            self.max_dist = max(spacing) if len(spacing) > 0 else np.inf
+
+    def fractional(self, lat, lon):
+        """
+        Converts points to fractional (row, column) indices, where the cell centers have
+        whole-number indices. Only available for Lambert conformal grids.
+
+        Parameters
+        ----------
+        :param lat: `numpy.ndarray`
+            Latitudes of the points.
+        :param lon: `numpy.ndarray`
+            Longitudes of the points.
+        :return rows, cols: `numpy.ndarray`
+            Fractional row and column indices.
+        """
+        if not self.projected:
+            raise ValueError('Fractional indices are only available for Lambert conformal grids')
+        x, y = utils.lcc_forward(np.asarray(lon, dtype='float64'), np.asarray(lat, dtype='float64'), self.grid)
+        return ((y - float(self.grid['YORIG'])) / float(self.grid['YCELL']) - 0.5,
+                (x - float(self.grid['XORIG'])) / float(self.grid['XCELL']) - 0.5)
+
+    def nearest(self, lat, lon):
+        """
+        Finds the cell that contains each point.
+
+        Parameters
+        ----------
+        :param lat: `numpy.ndarray`
+            Latitudes of the points.
+        :param lon: `numpy.ndarray`
+            Longitudes of the points.
+        :return rows, cols, inside: `numpy.ndarray`
+            Row and column indices of the cells, and whether each point is inside the grid
+            (the indices of points outside the grid are clipped to the edge).
+        """
+        if self.projected:
+            rows, cols = self.fractional(lat, lon)
+            rows, cols = np.floor(rows + 0.5).astype('int64'), np.floor(cols + 0.5).astype('int64')
+            inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+            return np.clip(rows, 0, self.shape[0] - 1), np.clip(cols, 0, self.shape[1] - 1), inside
+        dist, index = self.tree.query(unit_xyz(np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')))
+        rows, cols = np.unravel_index(index, self.shape)
+        return rows, cols, dist <= self.max_dist
+
+    def bilinear(self, lat, lon):
+        """
+        Finds the four cell centers around each point and their bilinear interpolation
+        weights. Points within half a cell of the grid edge use the values of the edge cells.
+        Only available for Lambert conformal grids.
+
+        Parameters
+        ----------
+        :param lat: `numpy.ndarray`
+            Latitudes of the points.
+        :param lon: `numpy.ndarray`
+            Longitudes of the points.
+        :return rows, cols, weights, inside: `numpy.ndarray`
+            Row and column indices (n_points, 4) of the corner cells, their weights (n_points, 4),
+            and whether each point is inside the grid.
+        """
+        rows, cols = self.fractional(lat, lon)
+        inside = (rows >= -0.5) & (rows < self.shape[0] - 0.5) & (cols >= -0.5) & (cols < self.shape[1] - 0.5)
+        row_0 = np.clip(np.floor(rows).astype('int64'), 0, max(self.shape[0] - 2, 0))
+        col_0 = np.clip(np.floor(cols).astype('int64'), 0, max(self.shape[1] - 2, 0))
+        t_row = np.clip(rows - row_0, 0., 1.) if self.shape[0] > 1 else np.zeros(rows.shape)
+        t_col = np.clip(cols - col_0, 0., 1.) if self.shape[1] > 1 else np.zeros(cols.shape)
+        row_1 = np.minimum(row_0 + 1, self.shape[0] - 1)
+        col_1 = np.minimum(col_0 + 1, self.shape[1] - 1)
+        corner_rows = np.stack([row_0, row_0, row_1, row_1], axis=-1)
+        corner_cols = np.stack([col_0, col_1, col_0, col_1], axis=-1)
+        weights = np.stack([(1 - t_row) * (1 - t_col), (1 - t_row) * t_col, t_row * (1 - t_col), t_row * t_col], axis=-1)
+        return corner_rows, corner_cols, weights, inside
+
+
+def unit_xyz(lat, lon):
+    """
+    Converts latitudes and longitudes to points on the unit sphere, where the straight-line
+    distances increase with the great-circle distances.
+
+    Parameters
+    ----------
+    :param lat: `numpy.ndarray`
+        Latitudes (degrees).
+    :param lon: `numpy.ndarray`
+        Longitudes (degrees).
+    :return xyz: `numpy.ndarray`
+        Coordinates with an extra last axis of size 3.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def site_locator(grid, lat=None, lon=None, cache_dir=None):
+    """
+    Gets the `GridLocator` of a grid. Locators are built once per grid (see `utils.grid_key`)
+    and kept in SITE_LOCATORS; KD-trees are also saved in cache_dir, so other sessions
+    and runs on the same grid can reuse them.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :param lat: `numpy.ndarray`
+        Latitudes of the cell centers (NROWS, NCOLS).
+    :param lon: `numpy.ndarray`
+        Longitudes of the cell centers (NROWS, NCOLS).
+    :param cache_dir: string
+        Directory where the KD-trees are saved.
+    :return locator: `GridLocator`
+    """
+    if all([key in grid for key in ['XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS']]):
+        key = utils.grid_key(grid)
+    else:
+        coords = np.ascontiguousarray(np.stack([lat, lon]), dtype='float64')
+        key = f'latlon_{coords.shape[2]}x{coords.shape[1]}_{hashlib.md5(coords.tobytes()).hexdigest()[:8]}'
+    if key in SITE_LOCATORS:
+        return SITE_LOCATORS[key]
+    cache_file = None if cache_dir is None else f'{cache_dir}/site_locator_{key}.pkl'
+    if (cache_file is not None) and os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            SITE_LOCATORS[key] = pickle.load(f)
+        return SITE_LOCATORS[key]
+    locator = GridLocator(grid, lat=lat, lon=lon)
+    if (cache_file is not None) and (locator.tree is not None):
+        utils.make_dirs(cache_dir)
+        with open(cache_file, 'wb') as f:
+            pickle.dump(locator, f)
+    SITE_LOCATORS[key] = locator
+    return locator
+
+
+def read_aqs(files, start=None, end=None):
+    """
+    Reads hourly or daily observations from AQS-style CSV files (e.g., the EPA pre-generated
+    hourly_44201_2016.csv or daily_88101_2016.csv). Files that already have siteid, latitude,
+    longitude, time, and obs columns (and optionally freq) are also accepted. Only the needed 
+    columns are read, and values from collocated monitors (POCs) are averaged. The freq 
+    column tells hourly observations (UTC times) from daily ones (local dates), which 
+    `pair_sites` compares with the model's local daily means.
+
+    Parameters
+    ----------
+    :param files: string or list of strings
+        Paths to the CSV files.
+    :param start: string or datetime
+        First time to keep. Hourly times are UTC; daily values use local dates.
+    :param end: string or datetime
+        Last time to keep.
+    :return obs: `pandas.DataFrame`
+        Observations with the siteid, latitude, longitude, time, obs, and freq ('hourly' or
+        'daily') columns.
+    """
+    if isinstance(files, str):
+        files = [files]
+    keep_columns = list(AQS_COLUMNS.keys()) + ['siteid', 'latitude', 'longitude', 'time', 'obs', 'freq']
+    parts = []
+    for file_name in files:
+        df = pd.read_csv(file_name, usecols=lambda col: col in keep_columns,
+                         dtype={'State Code': str, 'County Code': str, 'Site Num': str, 'siteid': str})
+        df = df.rename(columns=AQS_COLUMNS)
+        if 'siteid' not in df.columns:
+            df['siteid'] = df['state'].str.zfill(2) + df['county'].str.zfill(3) + df['site'].str.zfill(4)
+        if 'time' not in df.columns:
+            if 'hour' in df.columns:
+                df['time'] = pd.to_datetime(df['date'] + ' ' + df['hour'], format='%Y-%m-%d %H:%M')
+                df['freq'] = 'hourly'
+            else:
+                df['time'] = pd.to_datetime(df['date_local'], format='%Y-%m-%d')
+                df['obs'] = df['obs_mean']
+                df['freq'] = 'daily'
+        else:
+            df['time'] = pd.to_datetime(df['time'])
+            if 'freq' not in df.columns:
+                df['freq'] = 'hourly'
+        if start is not None:
+            df = df[df['time'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['time'] <= pd.Timestamp(end)]
+        parts.append(df[['siteid', 'latitude', 'longitude', 'time', 'obs', 'freq']])
+    obs = pd.concat(parts, ignore_index=True)
+    return obs.groupby(['siteid', 'freq', 'time'], as_index=False, sort=True).agg(
+        {'latitude': 'first', 'longitude': 'first', 'obs': 'mean'})[['siteid', 'latitude', 'longitude', 'time', 'obs', 'freq']]
+
+
+def extract_sites(ds, sites, method='nearest', cache_dir=None):
+    """
+    Extracts the model time series at all the sites in one vectorized read. The cells
+    are found with the grid's `GridLocator` (see `site_locator`), and the values are read
+    with one fancy-indexing selection (i.e., one pass over the time chunks of a lazy dataset).
+    Sites outside the grid are dropped.
+
+    Parameters
+    ----------
+    :param ds: `xarray.Dataset` or `xarray.DataArray`
+        Model output with the y and x dimensions and the latitude and longitude coordinates
+        (e.g., from `postcmaq.open_cctm`).
+    :param sites: `pandas.DataFrame`
+        Sites with the siteid, latitude, and longitude columns (e.g., from `read_aqs`;
+        repeated sites are only used once).
+    :param method: string
+        'nearest' uses the cell that contains each site; 'bilinear' interpolates the four
+        nearest cell centers (Lambert conformal grids only).
+    :param cache_dir: string
+        Directory where the grid's KD-tree is saved (see `site_locator`).
+    :return site_ds: `xarray.Dataset` or `xarray.DataArray`
+        Model values with the site dimension instead of (y, x), and the siteid, latitude,
+        and longitude of the sites.
+    """
+    if method not in ['nearest', 'bilinear']:
+        raise ValueError(f'method must be nearest or bilinear, not {method}')
+    sites = sites.drop_duplicates('siteid')
+    locator = site_locator(ds.attrs, ds['latitude'].values, ds['longitude'].values, cache_dir=cache_dir)
+    lat, lon = sites['latitude'].values, sites['longitude'].values
+    if method == 'nearest':
+        rows, cols, inside = locator.nearest(lat, lon)
+        rows, cols, weights = rows[:, None], cols[:, None], np.ones((len(rows), 1))
+    else:
+        rows, cols, weights, inside = locator.bilinear(lat, lon)
+    if not inside.all():
+        print(f'Warning: {(~inside).sum()} sites are outside the grid (e.g., {sites["siteid"].values[~inside][0]})')
+    sites = sites[inside]
+    rows, cols, weights = rows[inside], cols[inside], weights[inside]
+    ds = ds.drop_vars([coord for coord in ['latitude', 'longitude'] if coord in ds.coords])
+    site_ds = ds.isel(y=xr.DataArray(rows, dims=('site', 'corner')), x=xr.DataArray(cols, dims=('site', 'corner')))
+    if method == 'nearest':
+        site_ds = site_ds.isel(corner=0)
+    else:
+        with xr.set_options(keep_attrs=True):
+            site_ds = (site_ds * xr.DataArray(weights, dims=('site', 'corner'))).sum('corner', skipna=False)
+    site_ds = site_ds.assign_coords(site=sites['siteid'].values,
+                                    latitude=('site', lat[inside]), longitude=('site', lon[inside]),
+                                    row=('site', rows[:, 0]), col=('site', cols[:, 0]))
+    site_ds.attrs = dict(ds.attrs, site_method=method)
+    return site_ds
+
+
+def site_daily_means(model, utc_offset, min_frac=0.75):
+    """
+    Averages hourly model values at the sites to local (standard time) days, like 
+    `metrics.pm25_24h` does for grid cells.
+
+    Parameters
+    ----------
+    :param model: `pandas.DataFrame`
+        Hourly model values with the siteid, time (UTC), and model columns.
+    :param utc_offset: float or `pandas.Series`
+        Hours between local standard time and UTC, either for all the sites or indexed 
+        by siteid.
+    :param min_frac: float
+        Minimum fraction of valid hours in a day.
+    :return daily: `pandas.DataFrame`
+        Daily means with the siteid, time (local date), and model columns.
+    """
+    if np.ndim(utc_offset) == 0:
+        offsets = np.full(len(model), float(utc_offset))
+    else:
+        offsets = model['siteid'].map(utc_offset).values.astype('float64')
+    local_time = model['time'] + pd.to_timedelta(np.round(offsets), unit='h')
+    daily = model.assign(time=local_time.dt.floor('D')).groupby(['siteid', 'time'], as_index=False)['model'].agg(['mean', 'count'])
+    daily = daily[daily['count'] >= int(np.ceil(min_frac * 24))]
+    return daily.rename(columns={'mean': 'model'})[['siteid', 'time', 'model']]
+
+
+def pair_sites(site_da, obs, model_scale=1., utc_offset=None):
+    """
+    Pairs model time series at the sites (see `extract_sites`) with observations. Hourly
+    observations are matched by UTC time. Daily observations (freq column, see `read_aqs`)
+    are matched with the model means of the same local days (see `site_daily_means`).
+
+    Parameters
+    ----------
+    :param site_da: `xarray.DataArray`
+        Model values with the time and site dimensions (the surface layer is used if there
+        is a z dimension).
+    :param obs: `pandas.DataFrame`
+        Observations with the siteid, time, and obs columns (see `read_aqs`). Observations
+        without a freq column are hourly.
+    :param model_scale: float
+        Factor applied to the model values to match the observation units (e.g., 0.001 to
+        compare ppbV to ppm).
+    :param utc_offset: float or `pandas.Series`
+        Hours between local standard time and UTC for all the sites or for each siteid. 
+        Required for daily observations.
+    :return pairs: `pandas.DataFrame`
+        Observations with the model column, for the sites and times in both datasets.
+    """
+    if 'z' in site_da.dims:
+        site_da = site_da.isel(z=0)
+    model = (site_da.load() * model_scale).to_series().rename('model')
+    model.index = model.index.rename({'site': 'siteid'})
+    model = model.reset_index()[['siteid', 'time', 'model']]
+    daily = (obs['freq'] == 'daily') if 'freq' in obs.columns else np.zeros(len(obs), dtype=bool)
+    pairs = [obs[~daily].merge(model, on=['siteid', 'time'], how='inner')]
+    if daily.any():
+        if utc_offset is None:
+            raise ValueError('Daily observations need the UTC offsets of the sites to average the model to local days')
+        pairs.append(obs[daily].merge(site_daily_means(model, utc_offset), on=['siteid', 'time'], how='inner'))
+    pairs = pd.concat(pairs, ignore_index=True)
+    return pairs.dropna(subset=['obs', 'model'])
+
+
+def paired_stats(pairs, by='siteid', obs='obs', model='model', min_count=1):
+    """
+    Computes paired statistics with one grouped sum over all the pairs: number of pairs (N),
+    mean observation and model values, mean bias (MB), normalized mean bias and error (NMB
+    and NME, %), root mean square error (RMSE), and correlation (R).
+
+    Parameters
+    ----------
+    :param pairs: `pandas.DataFrame`
+        Paired values (see `pair_sites`).
+    :param by: string or list of strings
+        Columns to group by (e.g., 'siteid', 'date', or ['siteid', 'date']). A date column
+        is added from the times if needed. None gives the statistics of all the pairs.
+    :param obs: string
+        Column with the observations.
+    :param model: string
+        Column with the model values.
+    :param min_count: int
+        Smallest number of pairs in a group; groups with fewer pairs are dropped.
+    :return stats: `pandas.DataFrame`
+        Statistics of each group.
+    """
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    pairs = pairs.dropna(subset=[obs, model])
+    if ('date' in by) and ('date' not in pairs.columns):
+        pairs = pairs.assign(date=pairs['time'].dt.floor('D'))
+    o, m = pairs[obs].values.astype('float64'), pairs[model].values.astype('float64')
+    # Anomalies from the overall means keep the sums of squares accurate
+    o_c, m_c = o - o.mean(), m - m.mean()
+    diff = m - o
+    terms = pd.DataFrame({'N': np.ones(len(o)), 'obs': o, 'model': m, 'diff': diff, 'abs_diff': np.abs(diff),
+                          'sq_diff': diff**2, 'o_c': o_c, 'm_c': m_c, 'oo': o_c**2, 'mm': m_c**2, 'om': o_c * m_c})
+    if len(by) == 0:
+        sums = terms.sum().to_frame('all').T
+    else:
+        for col in by:
+            terms[col] = pairs[col].values
+        sums = terms.groupby(by, sort=True).sum()
+    n = sums['N']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sums['om'] - sums['o_c'] * sums['m_c'] / n
+        var_o = sums['oo'] - sums['o_c']**2 / n
+        var_m = sums['mm'] - sums['m_c']**2 / n
+        stats = pd.DataFrame({'N': n.astype('int64'),
+                              'MEAN_OBS': sums['obs'] / n,
+                              'MEAN_MOD': sums['model'] / n,
+                              'MB': sums['diff'] / n,
+                              'NMB': 100 * sums['diff'] / sums['obs'],
+                              'NME': 100 * sums['abs_diff'] / sums['obs'],
+                              'RMSE': np.sqrt(sums['sq_diff'] / n),
+                              'R': cov / np.sqrt(var_o * var_m)})
+    return stats[stats['N'] >= min_count]
@@ -0,0 +1,252 @@
+"""
+Functions to compute regulatory air quality metrics (e.g., MDA8 ozone and 24-hour PM2.5) 
+from CMAQ output.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+# Levels of the 2015 ozone and 2012 24-hour PM2.5 NAAQS (ppbV and ug/m3)
+NAAQS = {'MDA8_O3': 70., 'PM25_24H': 35.}
+
+
+def check_hourly(da):
+    """
+    Checks that a DataArray has continuous hourly time steps, which the rolling windows assume.
+
+    Parameters
+    ----------
+    :param da: `xarray.DataArray`
+        Hourly data with a time dimension.
+    """
+    steps = np.diff(da.indexes['time'].values).astype('timedelta64[m]').astype('int64')
+    if (steps != 60).any():
+        raise ValueError(f'{da.name} must have continuous hourly time steps (gaps or duplicates at '
+                         f'{list(da.indexes["time"][1:][steps != 60][:3])})')
+
+
+def gather_hours(values, offsets, shift, n_out):
+    """
+    Reorders hourly UTC values (time on the last axis) to local hours for each cell at once:
+    the local hour i of a cell with offset k is the UTC hour i + shift - k.
+
+    Parameters
+    ----------
+    :param values: `numpy.ndarray`
+        Hourly values with time on the last axis.
+    :param offsets: `numpy.ndarray`
+        Whole-hour UTC offsets that broadcast against values without the time axis.
+    :param shift: int
+        Smallest UTC offset, i.e., the offset of the first local hour.
+    :param n_out: int
+        Number of local hours.
+    :return local_values: `numpy.ndarray`
+        Values in local hours (NaN where there is no UTC data).
+    """
+    steps = np.arange(n_out) + (shift - np.asarray(offsets)[..., None])
+    steps = steps.reshape((1,) * (values.ndim - steps.ndim) + steps.shape)
+    valid = (steps >= 0) & (steps < values.shape[-1])
+    local_values = np.take_along_axis(values, np.clip(steps, 0, values.shape[-1] - 1), axis=-1)
+    return np.where(valid, local_values, np.nan)
+
+
+def to_local(da, utc_offset=-5):
+    """
+    Converts the time coordinate from UTC to local (standard) time. With one offset for the
+    whole domain, the time coordinate is shifted. With an offset for each grid cell (see 
+    `utils.utc_offset_grid`), the hours of every cell are gathered into a common local 
+    time axis in one vectorized operation (see `gather_hours`), so that local days can 
+    be aggregated for all the cells at once. The local time axis covers all the hours
+    that are available in any cell, and cells are NaN outside their own hours.
+
+    Parameters
+    ----------
+    :param da: `xarray.DataArray`
+        Hourly data with a time coordinate in UTC.
+    :param utc_offset: float or `numpy.ndarray`
+        Hours between local standard time and UTC (e.g., -5 for EST), or an array of 
+        offsets (y, x) for each grid cell.
+    :return da: `xarray.DataArray`
+        Data with the time coordinate in local time.
+    """
+    if np.ndim(utc_offset) == 0:
+        return da.assign_coords(time=da.indexes['time'] + pd.to_timedelta(utc_offset, unit='h'))
+    offsets = np.asarray(utc_offset, dtype='float64')
+    if not np.allclose(offsets, np.round(offsets)):
+        print('Warning: rounding the UTC offsets that are not whole hours')
+    offsets = np.round(offsets).astype('int64')
+    check_hourly(da)
+    times = da.indexes['time']
+    local_times = pd.date_range(times[0] + pd.Timedelta(hours=int(offsets.min())), 
+                                times[-1] + pd.Timedelta(hours=int(offsets.max())), freq='h')
+    if da.chunks is not None:
+        # Every hour of a cell must be in the same chunk, so split the chunks by rows instead
+        n_rows = max(1, int(np.prod([max(sizes) for sizes in da.chunks])) // (da.sizes['time'] * da.sizes['x']))
+        da = da.chunk({'time': -1, 'y': n_rows})
+    local = xr.apply_ufunc(gather_hours, da, xr.DataArray(offsets, dims=('y', 'x')), 
+                           kwargs={'shift': int(offsets.min()), 'n_out': len(local_times)},
+                           input_core_dims=[['time'], []], output_core_dims=[['local_time']], 
+                           dask='parallelized', output_dtypes=['float64'], 
+                           dask_gufunc_kwargs={'output_sizes': {'local_time': len(local_times)}})
+    return local.rename({'local_time': 'time'}).assign_coords(time=local_times).transpose(*da.dims)
+
+
+def daily_aggregate(da, how='mean', min_count=18):
+    """
+    Aggregates hourly local-time data to local days with a vectorized resample. Days with 
+    fewer than min_count valid hours (e.g., at the start and end of the period) are NaN.
+
+    Parameters
+    ----------
+    :param da: `xarray.DataArray`
+        Hourly data with a time coordinate in local time (see `to_local`).
+    :param how: string
+        Aggregation ('mean' or 'max').
+    :param min_count: int
+        Minimum number of valid hours in a day.
+    :return daily: `xarray.DataArray`
+        Daily values with a date dimension.
+    """
+    resampled = da.resample(time='1D')
+    daily = resampled.mean() if how == 'mean' else resampled.max()
+    n_valid = da.notnull().resample(time='1D').sum()
+    return daily.where(n_valid >= min_count).rename({'time': 'date'})
+
+
+def mda8(da, utc_offset=-5, start_hours=range(7, 24), min_hours=6, min_frac=0.75):
+    """
+    Computes the daily maximum 8-hour average (MDA8) following the 2015 ozone NAAQS 
+    (40 CFR Part 50, Appendix U): the 8-hour averages start at each local hour in 
+    start_hours (7:00 to 23:00), so the windows of one day end in the next day. The 
+    rolling windows are computed lazily over the whole period, so they cross the 
+    boundaries between the daily files.
+
+    Parameters
+    ----------
+    :param da: `xarray.DataArray`
+        Hourly ozone with a time coordinate in UTC (e.g., from `postcmaq.open_cctm`).
+    :param utc_offset: float or `numpy.ndarray`
+        Hours between local standard time and UTC (e.g., -5 for EST), or an array of 
+        offsets (y, x) for each grid cell (see `to_local`).
+    :param start_hours: list of ints
+        Local hours at which the 8-hour windows that count for a day start.
+    :param min_hours: int
+        Minimum number of valid hours in an 8-hour window.
+    :param min_frac: float
+        Minimum fraction of valid 8-hour windows in a day.
+    :return mda8: `xarray.DataArray`
+        Daily MDA8 values with a date dimension.
+    """
+    check_hourly(da)
+    # Label each 8-hour average with the hour that it starts
+    avg8 = da.rolling(time=8, min_periods=min_hours).mean().shift(time=-7)
+    avg8 = to_local(avg8, utc_offset=utc_offset)
+    avg8 = avg8.where(avg8['time'].dt.hour.isin(list(start_hours)))
+    return daily_aggregate(avg8, how='max', min_count=int(np.ceil(min_frac * len(start_hours))))
+
+
+def pm25_24h(da, utc_offset=-5, min_frac=0.75):
+    """
+    Computes 24-hour average PM2.5 for each local day.
+
+    Parameters
+    ----------
+    :param da: `xarray.DataArray`
+        Hourly PM2.5 with a time coordinate in UTC.
+    :param utc_offset: float or `numpy.ndarray`
+        Hours between local standard time and UTC (e.g., -5 for EST), or an array of 
+        offsets (y, x) for each grid cell (see `to_local`).
+    :param min_frac: float
+        Minimum fraction of valid hours in a day.
+    :return pm25_24h: `xarray.DataArray`
+        Daily averages with a date dimension.
+    """
+    check_hourly(da)
+    return daily_aggregate(to_local(da, utc_offset=utc_offset), how='mean', min_count=int(np.ceil(min_frac * 24)))
+
+
+def daily_metrics(ds, o3_var='O3', pm25_var='PM25_TOT', utc_offset=-5, start_hours=range(7, 24)):
+    """
+    Computes the daily MDA8 ozone and 24-hour PM2.5 of a dataset. The results are lazy if 
+    the dataset is (e.g., from `postcmaq.open_cctm`). Ozone in ppmV (e.g., from ACONC files) 
+    is converted to ppbV.
+
+    Parameters
+    ----------
+    :param ds: `xarray.Dataset`
+        Hourly data with a time coordinate in UTC. A z dimension of length one is dropped.
+    :param o3_var: string
+        Ozone variable, or None to skip MDA8.
+    :param pm25_var: string
+        PM2.5 variable, or None to skip the 24-hour average.
+    :param utc_offset: float or `numpy.ndarray`
+        Hours between local standard time and UTC (e.g., -5 for EST), or an array of 
+        offsets (y, x) for each grid cell (see `to_local`).
+    :param start_hours: list of ints
+        Local hours at which the 8-hour ozone windows start (see `mda8`).
+    :return daily_ds: `xarray.Dataset`
+        MDA8_O3 and PM25_24H with a date dimension. The source variable of each metric is
+        kept in its `source` attribute, and the ozone window start hours in `start_hours`.
+    """
+    if ('z' in ds.dims) and (ds.sizes['z'] == 1):
+        ds = ds.isel(z=0)
+    daily_ds = xr.Dataset()
+    if o3_var is not None:
+        o3 = ds[o3_var]
+        units = o3.attrs.get('units', 'ppbV').strip()
+        if units.lower().startswith('ppm'):
+            o3, units = o3 * 1000., 'ppbV'
+        daily_ds['MDA8_O3'] = mda8(o3, utc_offset=utc_offset, start_hours=start_hours)
+        daily_ds['MDA8_O3'].attrs = {'units': units, 'long_name': 'Daily maximum 8-hour average ozone', 'source': o3_var,
+                                     'start_hours': np.asarray(list(start_hours), dtype='int32')}
+    if pm25_var is not None:
+        daily_ds['PM25_24H'] = pm25_24h(ds[pm25_var], utc_offset=utc_offset)
+        daily_ds['PM25_24H'].attrs = {'units': ds[pm25_var].attrs.get('units', 'ug/m3').strip(), 
+                                      'long_name': '24-hour average PM2.5', 'source': pm25_var}
+    daily_ds.attrs = {'utc_offset': utc_offset if np.ndim(utc_offset) == 0 else 'local'}
+    for key in ['GDNAM', 'proj4_srs']:
+        if key in ds.attrs:
+            daily_ds.attrs[key] = ds.attrs[key]
+    return daily_ds
+
+
+def exceedances(daily_ds, thresholds=NAAQS, ranks={'MDA8_O3': 4}, percentiles={'PM25_24H': 98}):
+    """
+    Summarizes daily metrics for each grid cell: the number of days above the thresholds,
+    the maximum, the nth highest value (e.g., the 4th highest MDA8 used in ozone design 
+    values), and percentiles (e.g., the 98th percentile of 24-hour PM2.5).
+
+    Parameters
+    ----------
+    :param daily_ds: `xarray.Dataset`
+        Daily metrics (see `daily_metrics`).
+    :param thresholds: dict
+        Threshold for each daily metric. Days above the threshold are counted.
+    :param ranks: dict
+        Rank of the nth highest value reported for each daily metric.
+    :param percentiles: dict
+        Percentile (0-100) reported for each daily metric.
+    :return summary_ds: `xarray.Dataset`
+        Variables named {METRIC}_N_DAYS (valid days), {METRIC}_MAX, {METRIC}_EXCEED_DAYS, 
+        {METRIC}_{rank}TH_MAX (e.g., MDA8_O3_4TH_MAX), and {METRIC}_P{percentile} (e.g., 
+        PM25_24H_P98).
+    """
+    summary_ds = xr.Dataset()
+    for var in daily_ds.data_vars:
+        da = daily_ds[var]
+        units = da.attrs.get('units', '')
+        summary_ds[f'{var}_N_DAYS'] = da.notnull().sum(dim='date')
+        summary_ds[f'{var}_MAX'] = da.max(dim='date').assign_attrs(units=units)
+        if var in thresholds:
+            summary_ds[f'{var}_EXCEED_DAYS'] = (da > thresholds[var]).sum(dim='date').assign_attrs(threshold=thresholds[var])
+        if var in ranks:
+            # Sort each cell in descending order (NaNs last) and take the nth value
+            values = -np.sort(-da.transpose('date', ...).values, axis=0)
+            nth = values[ranks[var] - 1] if values.shape[0] >= ranks[var] else np.full(values.shape[1:], np.nan)
+            summary_ds[f'{var}_{ranks[var]}TH_MAX'] = (da.isel(date=0).dims, nth, {'units': units})
+        if var in percentiles:
+            summary_ds[f'{var}_P{percentiles[var]:g}'] = da.quantile(percentiles[var] / 100, dim='date', skipna=True).drop_vars('quantile').assign_attrs(units=units)
+    summary_ds.attrs = dict(daily_ds.attrs)
+    return summary_ds
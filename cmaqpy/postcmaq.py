@@ -0,0 +1,1089 @@
+"""
+Functions to help postprocess CMAQ output.
+"""
+
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+import xarray as xr
+from . import utils
+
+
+SPECDEF_FUNCS = {'MAX': np.maximum, 'MIN': np.minimum, 'ABS': np.abs, 'SQRT': np.sqrt,
+                 'EXP': np.exp, 'LOG': np.log, 'LOG10': np.log10}
+SPECDEF_TOKENS = re.compile(r'\s*(?:(?P<num>(?:\d+\.?\d*|\.\d+)(?:[eEdD][+-]?\d+)?)'
+                            r'|(?P<var>[A-Za-z_][A-Za-z0-9_]*)\s*\[\s*(?P<idx>\d+)\s*\]'
+                            r'|(?P<func>[A-Za-z_][A-Za-z0-9_]*)\s*(?=\()'
+                            r'|(?P<op>>=|<=|==|!=|[-+*/()?:<>,]))')
+# Latitudes and longitudes of each grid (see `grid_coords`)
+GRID_COORDS = {}
+# Dimension names used by monetio and `plots`
+CCTM_DIMS = {'TSTEP': 'time', 'LAY': 'z', 'ROW': 'y', 'COL': 'x'}
+
+
+def tokenize_expr(expr):
+    """
+    Splits a combine species definition expression into tokens.
+
+    Parameters
+    ----------
+    :param expr: string
+        Expression from a SpecDef file (e.g., "1000.0*O3[1]").
+    :return tokens: list of tuples
+        Token type (num, var, func, or op) and value. Variable values are (name, file index).
+    """
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = SPECDEF_TOKENS.match(expr, pos)
+        if (match is None) or (match.end() == pos):
+            raise ValueError(f'Cannot parse "{expr[pos:]}" in "{expr}"')
+        if match.group('num') is not None:
+            tokens.append(('num', float(match.group('num').replace('d', 'e').replace('D', 'e'))))
+        elif match.group('var') is not None:
+            tokens.append(('var', (match.group('var'), int(match.group('idx')))))
+        elif match.group('func') is not None:
+            if match.group('func').upper() not in SPECDEF_FUNCS:
+                raise ValueError(f'Unknown function {match.group("func")} in "{expr}"')
+            tokens.append(('func', match.group('func').upper()))
+        else:
+            tokens.append(('op', match.group('op')))
+        pos = match.end()
+        while (pos < len(expr)) and expr[pos].isspace():
+            pos += 1
+    return tokens
+
+
+def compile_expr(expr):
+    """
+    Compiles a combine species definition expression into a function that evaluates it
+    with array operations. Expressions can use +, -, *, /, parentheses, comparisons with
+    the conditional operator (a > b ? c : d), and the MAX, MIN, ABS, SQRT, EXP, LOG, and
+    LOG10 functions. VAR[n] refers to variable VAR in input file n, and VAR[0] refers to a
+    species that was defined earlier in the SpecDef file.
+
+    Parameters
+    ----------
+    :param expr: string
+        Expression from a SpecDef file (e.g., "ATOTI[0]*PM25AT[3]+ATOTJ[0]*PM25AC[3]").
+    :return evaluate: function
+        Function that takes a function get(name, file_index) returning arrays and
+        returns the array for the expression.
+    :return refs: set of tuples
+        Variables (name, file index) used in the expression.
+    """
+    tokens = tokenize_expr(expr)
+    refs = set()
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else (None, None)
+
+    def take(value=None):
+        token = peek()
+        if token[0] is None:
+            raise ValueError(f'Unexpected end of "{expr}"')
+        if (value is not None) and (token != ('op', value)):
+            raise ValueError(f'Expected "{value}" in "{expr}"')
+        pos[0] += 1
+        return token
+
+    def parse_cond():
+        test = parse_comparison()
+        if peek() == ('op', '?'):
+            take('?')
+            if_true = parse_cond()
+            take(':')
+            if_false = parse_cond()
+            return lambda get: np.where(test(get), if_true(get), if_false(get))
+        return test
+
+    def parse_comparison():
+        left = parse_sum()
+        ops = {'>': np.greater, '<': np.less, '>=': np.greater_equal, '<=': np.less_equal,
+               '==': np.equal, '!=': np.not_equal}
+        if (peek()[0] == 'op') and (peek()[1] in ops):
+            op = ops[take()[1]]
+            right = parse_sum()
+            return lambda get: op(left(get), right(get))
+        return left
+
+    def parse_sum():
+        node = parse_term()
+        while peek() in [('op', '+'), ('op', '-')]:
+            op, right, left = take()[1], parse_term(), node
+            node = (lambda l, r: lambda get: l(get) + r(get))(left, right) if op == '+' else \
+                   (lambda l, r: lambda get: l(get) - r(get))(left, right)
+        return node
+
+    def parse_term():
+        node = parse_unary()
+        while peek() in [('op', '*'), ('op', '/')]:
+            op, right, left = take()[1], parse_unary(), node
+            node = (lambda l, r: lambda get: l(get) * r(get))(left, right) if op == '*' else \
+                   (lambda l, r: lambda get: l(get) / r(get))(left, right)
+        return node
+
+    def parse_unary():
+        if peek() == ('op', '-'):
+            take('-')
+            operand = parse_unary()
+            return lambda get: -operand(get)
+        if peek() == ('op', '+'):
+            take('+')
+        return parse_atom()
+
+    def parse_atom():
+        kind, value = take()
+        if kind == 'num':
+            return lambda get: value
+        if kind == 'var':
+            refs.add(value)
+            return lambda get: get(*value)
+        if kind == 'func':
+            take('(')
+            args = [parse_cond()]
+            while peek() == ('op', ','):
+                take(',')
+                args.append(parse_cond())
+            take(')')
+            func = SPECDEF_FUNCS[value]
+            return lambda get: func(*[arg(get) for arg in args])
+        if (kind, value) == ('op', '('):
+            node = parse_cond()
+            take(')')
+            return node
+        raise ValueError(f'Unexpected "{value}" in "{expr}"')
+
+    evaluate = parse_cond()
+    if pos[0] != len(tokens):
+        raise ValueError(f'Unexpected "{tokens[pos[0]][1]}" in "{expr}"')
+    return evaluate, refs
+
+
+def parse_specdef(specdef_file):
+    """
+    Reads a combine species definition (SpecDef) file.
+
+    Parameters
+    ----------
+    :param specdef_file: string
+        Path to the SpecDef file (e.g., SpecDef_cb6r3_ae7_aq.txt).
+    :return species: list of dicts
+        Name, units, and expression of each species, in the order they are defined.
+    :return layer: int
+        Layer set with the #layer directive (1 is the surface), or None for all layers.
+    """
+    species = []
+    layer = None
+    with open(specdef_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if (len(line) == 0) or line.startswith('/') or line.startswith('!'):
+                continue
+            if line.startswith('#'):
+                fields = line[1:].split()
+                if (fields[0].lower() == 'layer') and (len(fields) > 1):
+                    layer = int(fields[1])
+                continue
+            fields = line.split(',', 2)
+            if len(fields) < 3:
+                raise ValueError(f'Cannot parse the species definition "{line}" in {specdef_file}')
+            species.append({'name': fields[0].strip(), 'units': fields[1].strip(),
+                            'expr': re.split(r'!(?!=)', fields[2])[0].strip()})
+    return species, layer
+
+
+def combine_day(specdef_file, in_files, out_file, layer=None, chunk_steps=6, complevel=4):
+    """
+    Python version of the CMAQ combine program for one day. Each species in the SpecDef
+    file is computed with array operations, the input variables are read a few time steps
+    at a time (only those used in the SpecDef file), and the output is written as a
+    compressed netCDF4 file with the same variable names as the combine output. The time
+    steps of the first input file are used, and the matching time steps are selected from
+    the other files (e.g., the METCRO files have an extra hour).
+
+    Parameters
+    ----------
+    :param specdef_file: string
+        Path to the SpecDef file.
+    :param in_files: list of strings
+        Input files in the order used by the SpecDef file (i.e., VAR[1] is read from the
+        first file).
+    :param out_file: string
+        Path where the output will be written.
+    :param layer: int
+        Layer to write (1 is the surface). Defaults to the #layer directive of the SpecDef
+        file, or all layers if there is none.
+    :param chunk_steps: int
+        Number of time steps computed at once.
+    :param complevel: int
+        Compression level (0-9) of the output.
+    :return var_names: list of strings
+        Species written to the output file.
+    """
+    species, spec_layer = parse_specdef(specdef_file)
+    if layer is None:
+        layer = spec_layer
+    compiled = [compile_expr(spec['expr']) for spec in species]
+    used_files = sorted(set([idx for _, refs in compiled for _, idx in refs if idx > 0]))
+    datasets = {}
+    try:
+        for idx in used_files:
+            if (idx > len(in_files)) or (not os.path.exists(in_files[idx-1])):
+                raise ValueError(f'Input file {idx} is needed by {specdef_file} but it does not exist')
+            datasets[idx] = xr.open_dataset(in_files[idx-1], mask_and_scale=False)
+        # Match the time steps of each file to those of the first file
+        ref_ds = datasets[used_files[0]] if 1 not in datasets else datasets[1]
+        tflag = ref_ds['TFLAG'].values[:, 0, :]
+        times = utils.tflag_to_datetime(tflag)
+        steps = {}
+        for idx, ds in datasets.items():
+            positions = utils.tflag_to_datetime(ds['TFLAG'].values[:, 0, :]).get_indexer(times)
+            if (positions < 0).any():
+                raise ValueError(f'{in_files[idx-1]} does not cover the times of {in_files[0]}')
+            steps[idx] = positions
+        n_lays = 1 if layer is not None else max([ds.sizes.get('LAY', 1) for ds in datasets.values()])
+        shape = (len(times), n_lays, ref_ds.sizes['ROW'], ref_ds.sizes['COL'])
+        out = {spec['name']: np.empty(shape, dtype='float32') for spec in species}
+        for t0 in range(0, len(times), chunk_steps):
+            t1 = min(t0 + chunk_steps, len(times))
+            cache = {}
+            computed = {}
+
+            def get(name, idx):
+                if idx == 0:
+                    if name not in computed:
+                        raise ValueError(f'{name}[0] is used before it is defined in {specdef_file}')
+                    return computed[name]
+                if (name, idx) not in cache:
+                    da = datasets[idx][name].isel(TSTEP=steps[idx][t0:t1])
+                    if (layer is not None) and ('LAY' in da.dims) and (da.sizes['LAY'] > 1):
+                        da = da.isel(LAY=[layer - 1])
+                    cache[(name, idx)] = da.values.astype('float64')
+                return cache[(name, idx)]
+
+            for spec, (evaluate, _) in zip(species, compiled):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    computed[spec['name']] = evaluate(get)
+                out[spec['name']][t0:t1] = np.broadcast_to(computed[spec['name']], (t1 - t0,) + shape[1:])
+    finally:
+        for ds in datasets.values():
+            ds.close()
+
+    # Write the output with IOAPI-like metadata
+    out_ds = xr.Dataset()
+    for spec in species:
+        out_ds[spec['name']] = (('TSTEP', 'LAY', 'ROW', 'COL'), out[spec['name']],
+                                {'long_name': f'{spec["name"]:<16}', 'units': f'{spec["units"]:<16}',
+                                 'var_desc': f'{spec["expr"]:<80}'[:80]})
+    out_ds.attrs = dict(ref_ds.attrs)
+    out_ds.attrs['NLAYS'] = np.int32(n_lays)
+    if layer is not None and 'VGLVLS' in out_ds.attrs:
+        out_ds.attrs['VGLVLS'] = np.asarray(out_ds.attrs['VGLVLS'])[layer-1:layer+1]
+    out_ds.attrs['FILEDESC'] = f'Combine output from {os.path.basename(specdef_file)}'
+    out_ds = utils.set_ioapi_vars(out_ds, tflag)
+    encoding = {var: {'zlib': complevel > 0, 'complevel': complevel, '_FillValue': None} for var in out_ds.data_vars}
+    out_ds.to_netcdf(out_file, format='NETCDF4', encoding=encoding)
+    return [spec['name'] for spec in species]
+
+
+def combine(specdef_file, in_files, out_files, n_procs=4, layer=None, chunk_steps=6, complevel=4):
+    """
+    Runs `combine_day` for several days in parallel.
+
+    Parameters
+    ----------
+    :param specdef_file: string
+        Path to the SpecDef file.
+    :param in_files: list of lists
+        Input files for each day (see `combine_day`).
+    :param out_files: list of strings
+        Output file for each day.
+    :param n_procs: int
+        Number of days processed at once. Use 1 to process them in this process.
+    :param layer: int
+        Layer to write (1 is the surface). Defaults to the #layer directive of the SpecDef file.
+    :param chunk_steps: int
+        Number of time steps computed at once.
+    :param complevel: int
+        Compression level (0-9) of the output.
+    :return out_files: list of strings
+        Output files that were written.
+    """
+    if len(in_files) != len(out_files):
+        raise ValueError('Each day needs a list of input files and an output file')
+    args = (repeat(specdef_file), in_files, out_files, repeat(layer), repeat(chunk_steps), repeat(complevel))
+    if n_procs > 1 and len(out_files) > 1:
+        with ProcessPoolExecutor(max_workers=n_procs) as pool:
+            list(pool.map(combine_day, *args))
+    else:
+        list(map(combine_day, *args))
+    return out_files
+
+
+def day_complete(file_name, n_steps=24):
+    """
+    Checks if CCTM has finished writing a daily output file, i.e., if the TFLAG values of 
+    every variable are set for all the time steps of the day. The file can be checked while
+    CCTM is still writing it.
+
+    Parameters
+    ----------
+    :param file_name: string
+        Path to the CCTM output file.
+    :param n_steps: int
+        Number of time steps in a complete file.
+    :return: bool
+        True if the file has all its time steps.
+    """
+    if not os.path.exists(file_name):
+        return False
+    try:
+        with xr.open_dataset(file_name, decode_cf=False, mask_and_scale=False, cache=False) as ds:
+            if ds.sizes.get('TSTEP', 0) < n_steps:
+                return False
+            tflag = ds['TFLAG'].values[:n_steps]
+    except (OSError, RuntimeError, ValueError, KeyError):
+        # The file is being created or its header is being written
+        return False
+    return bool((tflag[:, :, 0] > 0).all())
+
+
+def daily_summary(in_file, out_file, var_names=None, complevel=4):
+    """
+    Writes the daily mean and maximum of each variable in a daily file (e.g., a combine 
+    output file). The output has one time step and variables named {VAR}_MEAN and {VAR}_MAX.
+
+    Parameters
+    ----------
+    :param in_file: string
+        Path to the daily input file.
+    :param out_file: string
+        Path where the output will be written.
+    :param var_names: list of strings
+        Variables that are summarized. Defaults to all the variables.
+    :param complevel: int
+        Compression level (0-9) of the output.
+    :return out_file: string
+        Path to the output file.
+    """
+    with xr.open_dataset(in_file, mask_and_scale=False) as ds:
+        if var_names is None:
+            var_names = [var for var in ds.data_vars if var != 'TFLAG']
+        out_ds = xr.Dataset()
+        for var in var_names:
+            values = ds[var].values
+            for stat, func in [('MEAN', np.mean), ('MAX', np.max)]:
+                name = f'{var}_{stat}'[:16]
+                out_ds[name] = (('TSTEP', 'LAY', 'ROW', 'COL'), func(values, axis=0, keepdims=True).astype('float32'),
+                                {'long_name': f'{name:<16}', 'units': ds[var].attrs.get('units', f'{"":<16}'),
+                                 'var_desc': f'Daily {stat.lower()} of {var}'.ljust(80)})
+        out_ds.attrs = dict(ds.attrs)
+        tflag = ds['TFLAG'].values[:1, 0, :]
+    out_ds.attrs['TSTEP'] = np.int32(240000)
+    out_ds = utils.set_ioapi_vars(out_ds, tflag)
+    encoding = {var: {'zlib': complevel > 0, 'complevel': complevel, '_FillValue': None} for var in out_ds.data_vars}
+    out_ds.to_netcdf(out_file, format='NETCDF4', encoding=encoding)
+    return out_file
+
+
+def postprocess_day(date, combine_args, summary_files=None, day_funcs=[], layer=None, complevel=4):
+    """
+    Postprocesses one day of CCTM output: runs `combine_day` for each set of inputs, writes
+    the daily summaries of the combine outputs, and calls any other functions for the day.
+    Used by `CMAQModel.follow_postprocess` to process each day as soon as CCTM finishes it.
+
+    Parameters
+    ----------
+    :param date: `datetime.datetime`
+        Day that is processed.
+    :param combine_args: list of tuples
+        (specdef_file, in_files, out_file) for each call to `combine_day`.
+    :param summary_files: list of strings
+        Daily summary file written for each combine output (see `daily_summary`). Use 
+        None in the list (or for the whole list) to skip the summary.
+    :param day_funcs: list of functions
+        Other functions called as func(date, out_files) after the combine outputs are 
+        written. They must be defined at the top level of a module so that they can be
+        sent to other processes.
+    :param layer: int
+        Layer to write (1 is the surface). Defaults to the #layer directive of the SpecDef files.
+    :param complevel: int
+        Compression level (0-9) of the outputs.
+    :return out_files: list of strings
+        Files that were written.
+    """
+    if summary_files is None:
+        summary_files = [None] * len(combine_args)
+    out_files = []
+    for (specdef_file, in_files, out_file), summary_file in zip(combine_args, summary_files):
+        combine_day(specdef_file, in_files, out_file, layer=layer, complevel=complevel)
+        out_files.append(out_file)
+        if summary_file is not None:
+            out_files.append(daily_summary(out_file, summary_file, complevel=complevel))
+    for func in day_funcs:
+        func(date, list(out_files))
+    return out_files
+
+
+def file_times(file_name):
+    """
+    Reads the times of an IOAPI file from its TFLAG variable without reading the data variables.
+
+    Parameters
+    ----------
+    :param file_name: string
+        Path to the IOAPI file.
+    :return times, attrs: `pandas.DatetimeIndex`, dict
+        Time of each time step and the global attributes of the file.
+    """
+    with xr.open_dataset(file_name, decode_cf=False, mask_and_scale=False) as ds:
+        return utils.tflag_to_datetime(ds['TFLAG'][:, 0, :].values), dict(ds.attrs)
+
+
+def grid_coords(grid, gridcro2d_file=None):
+    """
+    Gets the latitudes and longitudes of the cell centers of a grid. They are computed once
+    per grid (see `utils.grid_key`) and kept in GRID_COORDS, so opening many files or runs on 
+    the same grid doesn't reread them.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (e.g., the attributes of a CCTM file).
+    :param gridcro2d_file: string
+        MCIP GRIDCRO2D file with the LAT and LON variables. If None (or it doesn't exist),
+        the coordinates are computed from the grid projection.
+    :return lat, lon: `numpy.ndarray`
+        Latitudes and longitudes with shape (NROWS, NCOLS).
+    """
+    key = utils.grid_key(grid)
+    if key not in GRID_COORDS:
+        if (gridcro2d_file is not None) and os.path.exists(gridcro2d_file):
+            with xr.open_dataset(gridcro2d_file) as ds:
+                lat, lon = ds['LAT'].values[0, 0], ds['LON'].values[0, 0]
+            if lat.shape != (int(grid['NROWS']), int(grid['NCOLS'])):
+                raise ValueError(f'The grid of {gridcro2d_file} does not match {key}')
+        else:
+            lon, lat = utils.grid_lonlat(grid)
+        GRID_COORDS[key] = (lat.astype('float32'), lon.astype('float32'))
+    return GRID_COORDS[key]
+
+
+def open_cctm(files, var_names=None, layers=None, start=None, end=None, gridcro2d_file=None, chunk_steps=24):
+    """
+    Opens a series of CCTM or combine output files (e.g., one per day) as one lazy, 
+    dask-backed dataset. The times are decoded from TFLAG without reading the data, 
+    the variable, layer, and time selections are applied before any data is read, and 
+    the latitudes and longitudes are added from the grid coordinates (see `grid_coords`).
+    The dimensions and coordinates are named like the monetio output (time, z, y, x, 
+    latitude, longitude) so the dataset can be used with `plots`. Time steps that appear 
+    in more than one file are taken from the first file.
+
+    Parameters
+    ----------
+    :param files: list of strings
+        Paths to the files, in time order.
+    :param var_names: list of strings
+        Variables to read. Defaults to all the variables.
+    :param layers: int or list of ints
+        Layer indices to read (0 is the surface). Defaults to all the layers.
+    :param start: string or datetime
+        First time (UTC) to read. Defaults to the first time in the files.
+    :param end: string or datetime
+        Last time (UTC) to read. Defaults to the last time in the files.
+    :param gridcro2d_file: string
+        MCIP GRIDCRO2D file used for the latitudes and longitudes.
+    :param chunk_steps: int
+        Number of time steps in each dask chunk.
+    :return ds: `xarray.Dataset`
+        Lazy dataset with dimensions (time, z, y, x).
+    """
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    if isinstance(layers, int):
+        layers = [layers]
+    parts, seen, attrs = [], pd.DatetimeIndex([]), None
+    for file_name in files:
+        times, file_attrs = file_times(file_name)
+        keep = ~times.isin(seen)
+        if start is not None:
+            keep &= times >= start
+        if end is not None:
+            keep &= times <= end
+        if not keep.any():
+            continue
+        attrs = file_attrs if attrs is None else attrs
+        seen = seen.append(times[keep])
+        # Select before chunking so that only the selection is read from the file
+        ds = xr.open_dataset(file_name)
+        ds = ds[[var for var in ds.data_vars if var != 'TFLAG'] if var_names is None else var_names]
+        selection = {'TSTEP': np.flatnonzero(keep)}
+        if layers is not None:
+            selection['LAY'] = layers
+        ds = ds.isel(selection).assign_coords(TSTEP=times[keep])
+        parts.append(ds.chunk({'TSTEP': chunk_steps}))
+    if len(parts) == 0:
+        raise ValueError(f'None of the files have times between {start} and {end}')
+    ds = xr.concat(parts, dim='TSTEP', data_vars='all', coords='minimal', compat='override', combine_attrs='override')
+    if not ds.indexes['TSTEP'].is_monotonic_increasing:
+        ds = ds.sortby('TSTEP')
+    ds = ds.rename({dim: name for dim, name in CCTM_DIMS.items() if dim in ds.dims})
+    lat, lon = grid_coords(attrs, gridcro2d_file=gridcro2d_file)
+    ds = ds.assign_coords(latitude=(('y', 'x'), lat), longitude=(('y', 'x'), lon))
+    ds.attrs = attrs
+    if 'proj4_srs' not in ds.attrs and int(attrs.get('GDTYP', 2)) == 2:
+        ds.attrs['proj4_srs'] = utils.grid_proj4(attrs)
+    return ds
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles of a stream of gridded values, kept for every grid cell as a 
+    histogram with a fixed number of bins. Each cell's bins start around its first values 
+    and are doubled in width (merging neighboring bins) whenever later values fall outside 
+    them, so the memory use doesn't depend on the number of values and the quantiles are 
+    accurate to about one bin width. Sketches of the same shape can be merged (e.g., 
+    partial results from several processes).
+
+    Parameters
+    ----------
+    :param shape: tuple
+        Shape of the grid (e.g., (NROWS, NCOLS)).
+    :param n_bins: int
+        Number of histogram bins (must be even).
+    """
+    def __init__(self, shape, n_bins=64):
+        if n_bins % 2 != 0:
+            raise ValueError(f'n_bins must be even, not {n_bins}')
+        self.shape = tuple(shape)
+        self.n_bins = n_bins
+        self.lo = np.full(self.shape, np.nan)
+        self.width = np.full(self.shape, np.nan)
+        self.counts = np.zeros((n_bins,) + self.shape, dtype='int64')
+        self.vmin = np.full(self.shape, np.inf)
+        self.vmax = np.full(self.shape, -np.inf)
+
+    def _cover(self, vmin, vmax):
+        """
+        Widens the bins of each cell until they cover [vmin, vmax] (NaN for cells without values).
+        """
+        new = np.isnan(self.width) & np.isfinite(vmin)
+        if new.any():
+            width = (vmax - vmin) / (self.n_bins - 1)
+            width = np.where(width > 0, width, np.maximum(np.abs(vmin), 1.) * 1e-6)
+            self.width = np.where(new, width, self.width)
+            self.lo = np.where(new, vmin - self.width / 2, self.lo)
+        with np.errstate(invalid='ignore'):
+            while True:
+                right = vmax >= self.lo + self.n_bins * self.width
+                left = (vmin < self.lo) & ~right
+                if not (right.any() or left.any()):
+                    break
+                merged = self.counts[0::2] + self.counts[1::2]
+                zeros = np.zeros_like(merged)
+                # Keep the lower edge and extend to the right, or the upper edge and extend to the left
+                self.counts = np.where(right, np.concatenate([merged, zeros]),
+                                       np.where(left, np.concatenate([zeros, merged]), self.counts))
+                self.lo = np.where(left, self.lo - self.n_bins * self.width, self.lo)
+                self.width = np.where(right | left, 2 * self.width, self.width)
+
+    def _add_counts(self, values, counts):
+        """
+        Adds counts to the bins holding values (with shape (n,) + shape) in each cell.
+        """
+        n_cells = int(np.prod(self.shape))
+        # Cells without values have no bins yet, but they have no counts either
+        lo, width = np.nan_to_num(self.lo), np.nan_to_num(self.width, nan=1.)
+        bins = np.clip(np.nan_to_num(np.floor((values - lo) / width)), 0, self.n_bins - 1).astype('int64')
+        cells = np.broadcast_to(np.arange(n_cells).reshape(self.shape), values.shape)
+        self.counts += np.bincount((bins * n_cells + cells).ravel(), weights=counts.ravel(), 
+                                   minlength=self.counts.size).reshape(self.counts.shape).astype('int64')
+
+    def add(self, values):
+        """
+        Adds values to the sketch.
+
+        Parameters
+        ----------
+        :param values: `numpy.ndarray`
+            Values with shape (n,) + shape. NaNs are ignored.
+        """
+        values = np.asarray(values, dtype='float64').reshape((-1,) + self.shape)
+        valid = np.isfinite(values)
+        if not valid.any():
+            return
+        vmin = np.where(valid, values, np.inf).min(axis=0)
+        vmax = np.where(valid, values, -np.inf).max(axis=0)
+        self.vmin, self.vmax = np.minimum(self.vmin, vmin), np.maximum(self.vmax, vmax)
+        has_values = valid.any(axis=0)
+        self._cover(np.where(has_values, vmin, np.nan), np.where(has_values, vmax, np.nan))
+        self._add_counts(np.where(valid, values, 0.), valid)
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch of the same shape. The other sketch's counts are
+        moved to the centers of their bins, which adds at most one bin width of error.
+
+        Parameters
+        ----------
+        :param other: `QuantileSketch`
+            Sketch to merge into this one.
+        :return self: `QuantileSketch`
+        """
+        if other.shape != self.shape:
+            raise ValueError(f'Cannot merge sketches with shapes {self.shape} and {other.shape}')
+        has_values = other.counts.sum(axis=0) > 0
+        if not has_values.any():
+            return self
+        self.vmin, self.vmax = np.minimum(self.vmin, other.vmin), np.maximum(self.vmax, other.vmax)
+        centers = other.lo + (np.arange(other.n_bins).reshape((-1,) + (1,) * len(self.shape)) + 0.5) * other.width
+        occupied = other.counts > 0
+        self._cover(np.where(has_values, np.where(occupied, centers, np.inf).min(axis=0), np.nan),
+                    np.where(has_values, np.where(occupied, centers, -np.inf).max(axis=0), np.nan))
+        # Use bins at least as wide as those of the other sketch
+        with np.errstate(invalid='ignore'):
+            while (self.width < other.width).any():
+                narrow = self.width < other.width
+                self._cover(np.where(narrow, self.lo, np.nan), np.where(narrow, self.lo + 2 * self.n_bins * self.width, np.nan))
+        self._add_counts(np.where(occupied, centers, 0.), other.counts)
+        return self
+
+    def quantile(self, q):
+        """
+        Estimates quantiles for each grid cell by interpolating within the histogram bins.
+
+        Parameters
+        ----------
+        :param q: float or list of floats
+            Quantiles between 0 and 1.
+        :return values: `numpy.ndarray`
+            Quantiles with shape (len(q),) + shape (or shape for a single quantile). Cells
+            without values are NaN.
+        """
+        qs = np.atleast_1d(q).astype('float64')
+        out = np.full((len(qs),) + self.shape, np.nan)
+        cum = np.cumsum(self.counts, axis=0)
+        total = cum[-1]
+        for ii, qq in enumerate(qs):
+            target = qq * total
+            bins = np.minimum((cum < target[None]).sum(axis=0), self.n_bins - 1)
+            before = np.where(bins > 0, np.take_along_axis(cum, np.maximum(bins - 1, 0)[None], axis=0)[0], 0)
+            in_bin = np.take_along_axis(self.counts, bins[None], axis=0)[0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                frac = np.clip(np.where(in_bin > 0, (target - before) / in_bin, 0.5), 0, 1)
+                out[ii] = np.where(total > 0, np.clip(self.lo + (bins + frac) * self.width, self.vmin, self.vmax), np.nan)
+        return out if np.ndim(q) > 0 else out[0]
+
+
+def open_run(run, file_type='COMBINE_ACONC', var_names=None, layer=0, start=None, end=None, chunk_steps=24):
+    """
+    Gets a lazy dataset for a simulation given as a `runcmaq.CMAQModel` (see 
+    `CMAQModel.open_output`), a dataset from `open_cctm`, or a list of files.
+
+    Parameters
+    ----------
+    :param run: `runcmaq.CMAQModel`, `xarray.Dataset`, or list of strings
+        Simulation.
+    :param file_type: string
+        Type of output file read from a `CMAQModel`.
+    :param var_names: list of strings
+        Variables to read.
+    :param layer: int
+        Layer index to read (0 is the surface). If None, all layers are read.
+    :param start: string or datetime
+        First time (UTC) to read.
+    :param end: string or datetime
+        Last time (UTC) to read.
+    :param chunk_steps: int
+        Number of time steps in each dask chunk.
+    :return ds: `xarray.Dataset`
+        Lazy dataset with dimensions (time, z, y, x).
+    """
+    if hasattr(run, 'open_output'):
+        return run.open_output(file_type, var_names=var_names, layers=layer, start=start, end=end, chunk_steps=chunk_steps)
+    if isinstance(run, xr.Dataset):
+        ds = run if var_names is None else run[var_names]
+        if (layer is not None) and ('z' in ds.dims) and (ds.sizes['z'] > 1):
+            ds = ds.isel(z=[layer])
+        return ds.sel(time=slice(start, end))
+    return open_cctm(run, var_names=var_names, layers=layer, start=start, end=end, chunk_steps=chunk_steps)
+
+
+def scenario_diff(base, scen, var_names, file_type='COMBINE_ACONC', layer=0, start=None, end=None, chunk_steps=24, 
+                  percentiles=[50, 95], n_bins=64, min_base=0.):
+    """
+    Compares a scenario with a base case without loading either of them into memory. The 
+    matching time steps of both simulations are read a chunk at a time, and the time means, 
+    minimums and maximums of both simulations and of their differences, as well as 
+    approximate percentiles of the differences (see `QuantileSketch`), are accumulated 
+    in one pass. The results are 2D fields with latitude and longitude coordinates that 
+    can be passed directly to `plots.conc_map` and `plots.conc_compare`.
+
+    For each variable VAR, the output has:
+        VAR_base_mean, VAR_scen_mean, VAR_base_max, VAR_scen_max: time mean and maximum of each simulation
+        VAR_diff_mean, VAR_diff_min, VAR_diff_max: time mean, minimum, and maximum of scen - base
+        VAR_pct_diff_mean: time mean of the percent differences (scen - base) / base * 100
+        VAR_pct_mean_diff: percent difference of the time means
+        VAR_diff_pNN, VAR_pct_diff_pNN: percentiles of the (percent) differences
+
+    Parameters
+    ----------
+    :param base: `runcmaq.CMAQModel`, `xarray.Dataset`, or list of strings
+        Base case (see `open_run`).
+    :param scen: `runcmaq.CMAQModel`, `xarray.Dataset`, or list of strings
+        Scenario (see `open_run`).
+    :param var_names: list of strings
+        Variables to compare (e.g., ['O3', 'PM25_TOT']).
+    :param file_type: string
+        Type of output file read from a `CMAQModel`.
+    :param layer: int
+        Layer index to compare (0 is the surface).
+    :param start: string or datetime
+        First time (UTC) to compare.
+    :param end: string or datetime
+        Last time (UTC) to compare.
+    :param chunk_steps: int
+        Number of time steps read at once.
+    :param percentiles: list of floats
+        Percentiles (0-100) of the differences.
+    :param n_bins: int
+        Number of bins used for the percentiles (see `QuantileSketch`).
+    :param min_base: float
+        Percent differences are only computed where the base case is larger than this.
+    :return diff_ds: `xarray.Dataset`
+        Statistics with dimensions (y, x).
+    """
+    base_ds = open_run(base, file_type=file_type, var_names=var_names, layer=layer, start=start, end=end, chunk_steps=chunk_steps)
+    scen_ds = open_run(scen, file_type=file_type, var_names=var_names, layer=layer, start=start, end=end, chunk_steps=chunk_steps)
+    times = base_ds.indexes['time'].intersection(scen_ds.indexes['time'])
+    if len(times) == 0:
+        raise ValueError('The base case and the scenario have no times in common')
+    n_unmatched = base_ds.sizes['time'] + scen_ds.sizes['time'] - 2 * len(times)
+    if n_unmatched > 0:
+        print(f'Warning: {n_unmatched} time steps are only in one of the simulations and are skipped')
+    shape = (base_ds.sizes['y'], base_ds.sizes['x'])
+    stats = {}
+    for var in var_names:
+        stats[var] = {'base_sum': np.zeros(shape), 'scen_sum': np.zeros(shape), 'diff_sum': np.zeros(shape),
+                      'pct_sum': np.zeros(shape), 'pct_count': np.zeros(shape),
+                      'base_max': np.full(shape, -np.inf), 'scen_max': np.full(shape, -np.inf),
+                      'diff_min': np.full(shape, np.inf), 'diff_max': np.full(shape, -np.inf),
+                      'diff_sketch': QuantileSketch(shape, n_bins=n_bins), 'pct_sketch': QuantileSketch(shape, n_bins=n_bins)}
+    for t0 in range(0, len(times), chunk_steps):
+        chunk_times = times[t0:t0 + chunk_steps]
+        base_chunk = base_ds.sel(time=chunk_times).load()
+        scen_chunk = scen_ds.sel(time=chunk_times).load()
+        for var in var_names:
+            b = base_chunk[var].values.reshape((len(chunk_times),) + shape).astype('float64')
+            s = scen_chunk[var].values.reshape((len(chunk_times),) + shape).astype('float64')
+            diff = s - b
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pct = np.where(b > min_base, diff / b * 100, np.nan)
+            st = stats[var]
+            st['base_sum'] += b.sum(axis=0)
+            st['scen_sum'] += s.sum(axis=0)
+            st['diff_sum'] += diff.sum(axis=0)
+            st['pct_sum'] += np.nansum(pct, axis=0)
+            st['pct_count'] += np.isfinite(pct).sum(axis=0)
+            st['base_max'] = np.maximum(st['base_max'], b.max(axis=0))
+            st['scen_max'] = np.maximum(st['scen_max'], s.max(axis=0))
+            st['diff_min'] = np.minimum(st['diff_min'], diff.min(axis=0))
+            st['diff_max'] = np.maximum(st['diff_max'], diff.max(axis=0))
+            if len(percentiles) > 0:
+                st['diff_sketch'].add(diff)
+                st['pct_sketch'].add(pct)
+
+    # Collect the 2D fields
+    diff_ds = xr.Dataset(coords={'latitude': base_ds['latitude'], 'longitude': base_ds['longitude']})
+    n_steps = len(times)
+    for var in var_names:
+        st = stats[var]
+        units = base_ds[var].attrs.get('units', '').strip()
+        fields = {'base_mean': (st['base_sum'] / n_steps, units), 'scen_mean': (st['scen_sum'] / n_steps, units),
+                  'base_max': (st['base_max'], units), 'scen_max': (st['scen_max'], units),
+                  'diff_mean': (st['diff_sum'] / n_steps, units), 'diff_min': (st['diff_min'], units), 
+                  'diff_max': (st['diff_max'], units)}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fields['pct_diff_mean'] = (np.where(st['pct_count'] > 0, st['pct_sum'] / st['pct_count'], np.nan), '%')
+            fields['pct_mean_diff'] = (np.where(st['base_sum'] / n_steps > min_base, st['diff_sum'] / st['base_sum'] * 100, np.nan), '%')
+        if len(percentiles) > 0:
+            for pp, diff_p, pct_p in zip(percentiles, st['diff_sketch'].quantile(np.asarray(percentiles) / 100), 
+                                         st['pct_sketch'].quantile(np.asarray(percentiles) / 100)):
+                fields[f'diff_p{pp:g}'] = (diff_p, units)
+                fields[f'pct_diff_p{pp:g}'] = (pct_p, '%')
+        for stat, (values, stat_units) in fields.items():
+            diff_ds[f'{var}_{stat}'] = (('y', 'x'), values.astype('float32'), {'units': stat_units})
+    diff_ds.attrs = {'start': str(times[0]), 'end': str(times[-1]), 'n_steps': n_steps}
+    for key in ['GDNAM', 'proj4_srs']:
+        if key in base_ds.attrs:
+            diff_ds.attrs[key] = base_ds.attrs[key]
+    return diff_ds
+
+
+class EnsembleStats:
+    """
+    Running statistics of gridded values from several ensemble members: the count, mean, 
+    and variance of each cell are updated one batch at a time with Welford's algorithm 
+    (in the batched form of Chan et al.), the minimum and maximum are kept along with the 
+    member that produced them, and the quantiles are estimated with a `QuantileSketch`. 
+    Partial statistics from several processes can be merged.
+
+    Parameters
+    ----------
+    :param shape: tuple
+        Shape of the grid (e.g., (NROWS, NCOLS)).
+    :param n_bins: int
+        Number of histogram bins used for the quantiles.
+    """
+    def __init__(self, shape, n_bins=64):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape)
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        self.argmin = np.full(self.shape, -1, dtype='int32')
+        self.argmax = np.full(self.shape, -1, dtype='int32')
+        self.sketch = QuantileSketch(self.shape, n_bins=n_bins)
+
+    def _combine(self, count, mean, m2):
+        """
+        Combines the moments with those of another batch (Chan et al.'s parallel algorithm).
+        """
+        total = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0.)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta**2 * self.count * count / total, 0.)
+        self.count = total
+
+    def _extremes(self, vmin, vmax, argmin, argmax):
+        """
+        Keeps the smaller minimums and larger maximums, and the members that produced them.
+        """
+        self.argmin = np.where(vmin < self.min, argmin, self.argmin)
+        self.argmax = np.where(vmax > self.max, argmax, self.argmax)
+        self.min, self.max = np.minimum(self.min, vmin), np.maximum(self.max, vmax)
+
+    def add(self, values, member):
+        """
+        Adds a batch of values from one member.
+
+        Parameters
+        ----------
+        :param values: `numpy.ndarray`
+            Values with shape (n,) + shape. NaNs are ignored.
+        :param member: int
+            Index of the member.
+        """
+        values = np.asarray(values, dtype='float64').reshape((-1,) + self.shape)
+        valid = np.isfinite(values)
+        count = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, np.where(valid, values, 0.).sum(axis=0) / count, 0.)
+            m2 = np.where(valid, (values - mean)**2, 0.).sum(axis=0)
+        self._combine(count, mean, m2)
+        self._extremes(np.where(valid, values, np.inf).min(axis=0), np.where(valid, values, -np.inf).max(axis=0), member, member)
+        self.sketch.add(values)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another `EnsembleStats` of the same shape.
+
+        Parameters
+        ----------
+        :param other: `EnsembleStats`
+            Statistics to merge into these.
+        :return self: `EnsembleStats`
+        """
+        if other.shape != self.shape:
+            raise ValueError(f'Cannot merge statistics with shapes {self.shape} and {other.shape}')
+        self._combine(other.count, other.mean, other.m2)
+        self._extremes(other.min, other.max, other.argmin, other.argmax)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self, percentiles=[5, 50, 95]):
+        """
+        Gets the statistics of each cell.
+
+        Parameters
+        ----------
+        :param percentiles: list of floats
+            Percentiles (0-100) that are estimated.
+        :return fields: dict
+            Arrays with the count, mean, std (sample standard deviation), min, max, argmin, 
+            argmax (indices of the members with the minimum and maximum), and pNN. Cells 
+            without values are NaN (or -1 for the member indices).
+        """
+        has_values = self.count > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fields = {'count': self.count,
+                      'mean': np.where(has_values, self.mean, np.nan),
+                      'std': np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan),
+                      'min': np.where(has_values, self.min, np.nan),
+                      'max': np.where(has_values, self.max, np.nan),
+                      'argmin': self.argmin, 'argmax': self.argmax}
+        if len(percentiles) > 0:
+            for pp, values in zip(percentiles, self.sketch.quantile(np.asarray(percentiles) / 100)):
+                fields[f'p{pp:g}'] = values
+        return fields
+
+
+def member_values(run, var_names, file_type='COMBINE_ACONC', layer=0, start=None, end=None, chunk_steps=24, time_stat='mean'):
+    """
+    Reads one ensemble member a chunk of time steps at a time and yields the values that
+    are added to the ensemble statistics.
+
+    Parameters
+    ----------
+    :param run: `runcmaq.CMAQModel`, `xarray.Dataset`, or list of strings
+        Ensemble member (see `open_run`).
+    :param time_stat: string
+        'mean' or 'max' to yield the time mean or maximum of each cell once at the end, 
+        or None to yield every time step.
+    :return: generator of (var, values)
+        Variable name and values with shape (n, NROWS, NCOLS).
+    """
+    if time_stat not in ['mean', 'max', None]:
+        raise ValueError(f'time_stat must be "mean", "max", or None, not {time_stat}')
+    ds = open_run(run, file_type=file_type, var_names=var_names, layer=layer, start=start, end=end, chunk_steps=chunk_steps)
+    shape = (ds.sizes['y'], ds.sizes['x'])
+    totals = {var: None for var in var_names}
+    for t0 in range(0, ds.sizes['time'], chunk_steps):
+        chunk = ds.isel(time=slice(t0, t0 + chunk_steps)).load()
+        for var in var_names:
+            values = chunk[var].values.reshape((-1,) + shape).astype('float64')
+            if time_stat is None:
+                yield var, values
+            elif time_stat == 'mean':
+                totals[var] = values.sum(axis=0) if totals[var] is None else totals[var] + values.sum(axis=0)
+            else:
+                totals[var] = values.max(axis=0) if totals[var] is None else np.maximum(totals[var], values.max(axis=0))
+    if time_stat is not None:
+        for var in var_names:
+            yield var, (totals[var] / ds.sizes['time'] if time_stat == 'mean' else totals[var])[None]
+
+
+def ensemble_partial(members, member_ids, var_names, shape, n_bins=64, **kwargs):
+    """
+    Computes the ensemble statistics of some of the members (e.g., in one worker process).
+
+    Parameters
+    ----------
+    :param members: list
+        Ensemble members (see `open_run`).
+    :param member_ids: list of ints
+        Index of each member in the whole ensemble.
+    :param var_names: list of strings
+        Variables.
+    :param shape: tuple
+        Shape of the grid.
+    :param n_bins: int
+        Number of histogram bins used for the quantiles.
+    :param kwargs:
+        Other options passed to `member_values`.
+    :return stats: dict
+        `EnsembleStats` for each variable.
+    """
+    stats = {var: EnsembleStats(shape, n_bins=n_bins) for var in var_names}
+    for run, member_id in zip(members, member_ids):
+        for var, values in member_values(run, var_names, **kwargs):
+            stats[var].add(values, member_id)
+    return stats
+
+
+def ensemble_stats(members, var_names, file_type='COMBINE_ACONC', layer=0, start=None, end=None, chunk_steps=24, 
+                   time_stat='mean', percentiles=[5, 50, 95], n_bins=64, n_procs=1, member_names=None):
+    """
+    Summarizes an ensemble of simulations (e.g., dozens of emissions scenarios) without 
+    opening the members together: each member is read a chunk of time steps at a time 
+    and added to running statistics (see `EnsembleStats`). With n_procs > 1, the members 
+    are split between worker processes and their partial statistics are merged at the end.
+
+    By default, each member is first reduced to its time mean (time_stat='mean'), so the
+    statistics describe the spread of the members' mean fields. With time_stat=None, the 
+    statistics are computed over every hour of every member.
+
+    For each variable VAR, the output has VAR_mean, VAR_std, VAR_min, VAR_max, VAR_pNN,
+    and VAR_argmin and VAR_argmax, the indices of the members with the minimum and 
+    maximum in each cell (the names are in the "members" attribute).
+
+    Parameters
+    ----------
+    :param members: list
+        Ensemble members as `runcmaq.CMAQModel` objects, datasets from `open_cctm`, or 
+        lists of files (see `open_run`). Members passed to worker processes must be 
+        CMAQModel objects or lists of files.
+    :param var_names: list of strings
+        Variables to summarize (e.g., ['O3', 'PM25_TOT']).
+    :param file_type: string
+        Type of output file read from a `CMAQModel`.
+    :param layer: int
+        Layer index to read (0 is the surface).
+    :param start: string or datetime
+        First time (UTC) to read.
+    :param end: string or datetime
+        Last time (UTC) to read.
+    :param chunk_steps: int
+        Number of time steps read at once.
+    :param time_stat: string
+        Statistic used to reduce each member over time ('mean' or 'max'), or None to use
+        every time step.
+    :param percentiles: list of floats
+        Percentiles (0-100) across the members.
+    :param n_bins: int
+        Number of histogram bins used for the percentiles (see `QuantileSketch`).
+    :param n_procs: int
+        Number of worker processes.
+    :param member_names: list of strings
+        Names of the members. Defaults to the application names of CMAQModel members or 
+        "member_N".
+    :return ens_ds: `xarray.Dataset`
+        Statistics with dimensions (y, x).
+    """
+    if len(members) == 0:
+        raise ValueError('The ensemble has no members')
+    if member_names is None:
+        member_names = [getattr(run, 'appl', f'member_{ii}') for ii, run in enumerate(members)]
+    ref_ds = open_run(members[0], file_type=file_type, var_names=var_names, layer=layer, start=start, end=end, chunk_steps=chunk_steps)
+    shape = (ref_ds.sizes['y'], ref_ds.sizes['x'])
+    kwargs = {'file_type': file_type, 'layer': layer, 'start': start, 'end': end, 'chunk_steps': chunk_steps, 'time_stat': time_stat}
+    member_ids = list(range(len(members)))
+    if n_procs > 1 and len(members) > 1:
+        groups = [member_ids[ii::n_procs] for ii in range(min(n_procs, len(members)))]
+        # Forked workers can inherit this process's open netCDF files (e.g., ref_ds) and hang
+        with ProcessPoolExecutor(max_workers=len(groups), mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(ensemble_partial, [members[ii] for ii in group], group, var_names, shape, n_bins=n_bins, **kwargs)
+                       for group in groups]
+            partials = [future.result() for future in futures]
+        stats = partials[0]
+        for partial in partials[1:]:
+            for var in var_names:
+                stats[var].merge(partial[var])
+    else:
+        stats = ensemble_partial(members, member_ids, var_names, shape, n_bins=n_bins, **kwargs)
+
+    # Collect the 2D fields
+    ens_ds = xr.Dataset(coords={'latitude': ref_ds['latitude'], 'longitude': ref_ds['longitude']})
+    for var in var_names:
+        units = ref_ds[var].attrs.get('units', '').strip()
+        for stat, values in stats[var].summary(percentiles=percentiles).items():
+            if stat == 'count':
+                continue
+            elif stat in ['argmin', 'argmax']:
+                ens_ds[f'{var}_{stat}'] = (('y', 'x'), values.astype('int32'), {'long_name': f'Index of the member with the {stat[3:]}imum'})
+            else:
+                ens_ds[f'{var}_{stat}'] = (('y', 'x'), values.astype('float32'), {'units': units})
+    ens_ds.attrs = {'members': ', '.join(member_names), 'time_stat': str(time_stat)}
+    for key in ['GDNAM', 'proj4_srs']:
+        if key in ref_ds.attrs:
+            ens_ds.attrs[key] = ref_ds.attrs[key]
+    return ens_ds
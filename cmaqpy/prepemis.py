@@ -2,7 +2,42 @@
 Functions to help prepare emissions for CMAQ.
 """
 
+import hashlib
+import io
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
 import pandas as pd
+import xarray as xr
+from scipy.spatial import cKDTree
+from . import utils
+
+# Columns in the FF10 point and hourly point inventories that hold identifiers or codes.
+# These are always read as strings so that leading zeros (e.g., in region_cd) are preserved.
+FF10_STR_COLS = ['country_cd', 'region_cd', 'tribal_code', 'facility_id', 'unit_id', 
+                 'rel_point_id', 'process_id', 'agy_facility_id', 'agy_unit_id', 
+                 'agy_rel_point_id', 'agy_process_id', 'scc', 'poll', 'op_type_cd', 
+                 'calc_method', 'date_updated', 'date', 'naics', 'fac_source_type', 
+                 'facility_name', 'design_capacity_units', 'reg_codes', 'fac_category_code',
+                 'oris_facility_code', 'oris_boiler_id', 'ipm_yn', 'calc_year', 
+                 'stkhgt_units', 'stkdiam_units', 'stktemp_units', 'stkflow_units',
+                 'stkvel_units', 'lat_lon_source', 'data_set_id', 'comment']
+# Columns used to identify a unit/process in the FF10 inventories
+FF10_INDEX = ['facility_id', 'unit_id', 'process_id']
+# FF10 stack parameters (in ft, F, and ft/s) with the matching SMOKE stack groups variable
+# and the conversion to its units (m, K, and m/s)
+FF10_STACK_PARAMS = {'stkhgt': ('STKHT', lambda ft: 0.3048 * ft),
+                     'stkdiam': ('STKDM', lambda ft: 0.3048 * ft),
+                     'stktemp': ('STKTK', lambda deg_f: (deg_f - 32.) * 5. / 9. + 273.15),
+                     'stkvel': ('STKVE', lambda ft_s: 0.3048 * ft_s)}
+# CMAQ species in the inline point files that are scaled with each predicted pollutant
+INLN_SPECIES = {'NOX': ['NO', 'NO2', 'HONO'], 'SO2': ['SO2', 'SULF']}
+# Columns used to identify a unit-hour in the ERTAC EGU calc_hourly_base.csv file
+CAMD_KEYS = ['orispl_code', 'unitid', 'op_date', 'op_hour']
+# Columns in the calc_hourly_base.csv file that update_camd replaces
+CAMD_UPD_COLS = ['co2_mass (tons)', 'so2_mass (lbs)', 'nox_mass (lbs)', 'gload (MW-hr)']
 
 def fmt_like_camd(data_file='./pred_xg_co2.csv', lu_file='./RGGI_to_NYISO.csv'):
     """
@@ -49,20 +84,30 @@ def fmt_like_camd(data_file='./pred_xg_co2.csv', lu_file='./RGGI_to_NYISO.csv'):
     return fmt_data_df
     
 
-def fmt_calc_hourly_base(base_file='calc_hourly_base.csv'):
+def fmt_calc_hourly_base(base_file='calc_hourly_base.csv', compact=False, usecols=None):
     """
     Format the calc_hourly_base.csv file output by the ERTAC EGU preprocessor.
 
+    The compact mode stores low-cardinality strings (regions, states, facility names, 
+    flags, dates, etc.) as categoricals, downcasts numeric columns where this is lossless,
+    and builds the datetime column from the unique dates rather than from concatenated
+    strings. This typically reduces the memory used by the national file several times over.
+    Use `utils.expand_df` before writing the DataFrame back to CSV.
+
     Parameters
     ----------
     :param base_file: string
         Full path for the `calc_hourly_base.csv` file.
+    :param compact: bool
+        Option to load the data in the memory-compact representation.
+    :param usecols: list of strings
+        Optional subset of columns to read. It must include `op_date` and `op_hour`.
     :return base_df: `pandas.DataFrame`
         DataFrame containing the properly formatted emissions data
         from the `calc_hourly_base.csv` file.
     """
     # Read in the generator data previously preprocessed by ERTAC EGU tool
-    base_df = pd.read_csv(base_file, dtype={'ertac_region': 'object',
+    base_df = pd.read_csv(base_file, usecols=usecols, dtype={'ertac_region': 'object',
                                             'ertac_fuel_unit_type_bin': 'object',
                                             'state': 'object',
                                             'facility_name': 'object',
@@ -86,12 +131,23 @@ def fmt_calc_hourly_base(base_file='calc_hourly_base.csv'):
                                             'co2_rate (tons/mmBtu)': 'float64',
                                             'co2_rate_measure_flg': 'object',
                                             'heat_input (mmBtu)': 'float64'})
+    if usecols is not None:
+        # Keep the requested column order (read_csv keeps the file's order)
+        base_df = base_df[usecols]
     # Change the orispl_code to a string
     base_df = base_df.astype({'orispl_code': 'str'})
     # Pad the string for formatting
     base_df['op_hour'] = base_df['op_hour'].str.zfill(2)
-    # Add a datetime column 
-    base_df['datetime'] = pd.to_datetime(base_df['op_date'] + ' ' + base_df['op_hour'])
+    if not compact:
+        # Add a datetime column 
+        base_df['datetime'] = pd.to_datetime(base_df['op_date'] + ' ' + base_df['op_hour'])
+    else:
+        base_df = utils.compact_df(base_df)
+        # Build the datetime column by parsing each unique date only once
+        op_date = base_df['op_date'].astype('category')
+        dates = pd.to_datetime(pd.Series(op_date.cat.categories)).values
+        hours = pd.to_timedelta(base_df['op_hour'].astype('int64'), unit='h').values
+        base_df['datetime'] = dates[op_date.cat.codes.values] + hours
 
     return base_df
 
@@ -99,11 +155,18 @@ def fmt_calc_hourly_base(base_file='calc_hourly_base.csv'):
 def update_camd(in_emis_file='calc_hourly_base.csv', co2_file='pred_xg_co2.csv', 
                 nox_file='pred_xg_nox.csv', so2_file='pred_xg_so2.csv', 
                 gen_file='thermal_without_renewable.csv', lu_file='RGGI_to_NYISO.csv', 
-                out_emis_file='Updated_calc_hourly_base.csv'):
+                out_emis_file='Updated_calc_hourly_base.csv', compact=False,
+                patch=False, delta_file=None):
     """
     Update the CAMD load and emissions data with that generated from the NY Simple Net 
     and the ML-based emissions estimates. 
 
+    In the patch mode only the key columns of the base file are read, and the output is 
+    written by copying the unchanged byte ranges of `in_emis_file` and re-serializing only
+    the rows of the edited units (see `apply_camd_delta`), so writing a scenario costs 
+    roughly the size of the change rather than the size of the national file. Unchanged 
+    rows are kept exactly as they appear in `in_emis_file`.
+
     Parameters
     ----------
     :param in_emis_file: string
@@ -121,9 +184,28 @@ def update_camd(in_emis_file='calc_hourly_base.csv', co2_file='pred_xg_co2.csv',
         EPA ORISPL and Unit ID to the NYISO ID and Name. 
     :param out_emis_file: string
         Path where the updated `calc_hourly_base.csv` file will be written.
+        If None, only the `delta_file` is written.
+    :param compact: bool
+        Option to hold the base emissions in the memory-compact representation
+        (see `fmt_calc_hourly_base`). The output file is identical either way.
+        Not used in the patch mode.
+    :param patch: bool
+        Option to write `out_emis_file` by patching `in_emis_file` in place of 
+        rewriting every row.
+    :param delta_file: string
+        Optional path where a CSV with the edited rows (row number, key columns, and
+        new values) will be written. This file can be audited or re-applied to
+        the base file later with `apply_camd_delta`.
+    :return delta_df: `pandas.DataFrame`
+        Edited rows indexed by their (zero-based) row number in `in_emis_file`.
     """
     # Read in the base emissions file
-    base_df = fmt_calc_hourly_base(base_file=in_emis_file)
+    if patch:
+        base_df = fmt_calc_hourly_base(base_file=in_emis_file, usecols=CAMD_KEYS)
+    else:
+        base_df = fmt_calc_hourly_base(base_file=in_emis_file, compact=compact)
+        # Make sure the columns we replace can hold the new values at full precision
+        base_df = base_df.astype({col: 'float64' for col in CAMD_UPD_COLS if base_df[col].dtype == 'float32'})
     # Read in ML CO2 emissions estimations
     ml_co2 = fmt_like_camd(data_file=co2_file, lu_file=lu_file)
     # Read in ML NOx emissions estimations
@@ -134,6 +216,7 @@ def update_camd(in_emis_file='calc_hourly_base.csv', co2_file='pred_xg_co2.csv',
     ed_gen = fmt_like_camd(data_file=gen_file, lu_file=lu_file)
     
     # Get the name of an individual EGU -- this is how units are identified in the NY Simple Net & the ML
+    edits = []
     for idx in ml_co2.index:
         # Get the ORISPL and the Unit ID
         egu_orispl = ml_co2.loc[idx].ORISPL
@@ -143,7 +226,7 @@ def update_camd(in_emis_file='calc_hourly_base.csv', co2_file='pred_xg_co2.csv',
         # Extract this ORISPL and UNIT ID from the base DataFrame
         egu_df = base_df.loc[(base_df['orispl_code'] == egu_orispl) & (base_df['unitid'] == egu_unitid)]
         # Extract the correct time window
-        egu_df = egu_df.loc[base_df['datetime'].isin(ml_co2.columns[5:])]
+        egu_df = egu_df.loc[base_df['datetime'].isin(ml_co2.columns[5:])].copy()
         if len(egu_df) == 0:
             print('Warning: this unit was not found in the CAMD data... skipping')
         else:
@@ -156,10 +239,1206 @@ def update_camd(in_emis_file='calc_hourly_base.csv', co2_file='pred_xg_co2.csv',
             egu_df['nox_mass (lbs)'] = ml_nox.loc[idx, ml_nox.columns[5:]].values
             # Replace the load values
             egu_df['gload (MW-hr)'] = ed_gen.loc[idx, ed_gen.columns[5:]].values
-            # Combine this new unit data back into the base_df
-            base_df.update(egu_df)
+            edits.append(egu_df[CAMD_KEYS + CAMD_UPD_COLS])
+            if not patch:
+                # Combine this new unit data back into the base_df
+                base_df.update(egu_df)
+
+    # Collect the edited rows
+    if len(edits) > 0:
+        delta_df = pd.concat(edits).astype({col: 'float64' for col in CAMD_UPD_COLS}).sort_index()
+    else:
+        delta_df = pd.DataFrame(columns=CAMD_KEYS + CAMD_UPD_COLS)
+    delta_df.index.name = 'row'
+    if delta_file is not None:
+        delta_df.to_csv(delta_file)
+
+    if out_emis_file is not None:
+        if patch:
+            apply_camd_delta(in_emis_file, delta_df, out_emis_file)
+        else:
+            # Save the updated emissions to a new CSV 
+            # (after dropping the datetime column that we added)
+            base_df = utils.expand_df(base_df.drop(columns=['datetime']))
+            base_df.to_csv(out_emis_file, index=False) 
+
+    return delta_df
+
+
+def read_camd_delta(delta_file):
+    """
+    Reads a delta file written by `update_camd`.
+
+    Parameters
+    ----------
+    :param delta_file: string
+        Path to the delta file.
+    :return delta_df: `pandas.DataFrame`
+        Edited rows indexed by their (zero-based) row number in the base file.
+    """
+    delta_df = pd.read_csv(delta_file, index_col='row', 
+                           dtype={**{col: 'str' for col in CAMD_KEYS}, **{col: 'float64' for col in CAMD_UPD_COLS}})
+    return delta_df
+
+
+def apply_camd_delta(in_emis_file, delta, out_emis_file, block_size=2**24):
+    """
+    Applies the edits in a delta (see `update_camd`) to a `calc_hourly_base.csv` file.
+    The byte ranges between edited rows are copied straight from `in_emis_file` and only 
+    the edited rows are parsed and re-serialized. The key columns of each edited row are 
+    checked against the delta, so a delta can't be silently applied to the wrong base file.
+
+    Parameters
+    ----------
+    :param in_emis_file: string
+        Path to baseline emissions file (i.e., ERTAC EGU `calc_hourly_base.csv`).
+    :param delta: string or `pandas.DataFrame`
+        Path to the delta file or the DataFrame returned by `update_camd`.
+    :param out_emis_file: string
+        Path where the updated `calc_hourly_base.csv` file will be written.
+    :param block_size: int
+        Number of bytes to copy at a time.
+    :return n_edited: int
+        Number of rows that were replaced.
+    """
+    if isinstance(delta, pd.DataFrame):
+        delta_df = delta.sort_index()
+    else:
+        delta_df = read_camd_delta(delta).sort_index()
+    if delta_df.index.has_duplicates:
+        raise ValueError('The delta has more than one edit for the same row')
+    # Row numbers don't count the line with the column names
+    starts, ends = utils.find_line_offsets(in_emis_file, delta_df.index.values + 1, block_size=block_size)
+
+    with open(in_emis_file, 'rb') as f:
+        header = f.readline()
+        # Parse the edited rows as text so that unedited fields are kept as they are
+        lines = []
+        for start, end in zip(starts, ends):
+            f.seek(start)
+            lines.append(f.read(end - start).rstrip(b'\r\n') + b'\n')
+    edit_df = pd.read_csv(io.BytesIO(header + b''.join(lines)), dtype='str', keep_default_na=False)
+    # Make sure the delta was made from this base file
+    keys_match = ((edit_df['orispl_code'].values == delta_df['orispl_code'].astype('str').values) 
+                  & (edit_df['unitid'].values == delta_df['unitid'].astype('str').values)
+                  & (edit_df['op_date'].values == delta_df['op_date'].astype('str').values)
+                  & (edit_df['op_hour'].astype('int').values == delta_df['op_hour'].astype('int').values))
+    if not keys_match.all():
+        bad_row = delta_df.index[~keys_match][0]
+        raise ValueError(f'Row {bad_row} of {in_emis_file} does not match the delta (was it made from a different file?)')
+    for col in CAMD_UPD_COLS:
+        if col in delta_df.columns:
+            edit_df[col] = delta_df[col].values
+    newline = b'\r\n' if header.endswith(b'\r\n') else b'\n'
+    new_lines = edit_df.to_csv(header=False, index=False, lineterminator=newline.decode()).encode().splitlines(keepends=True)
+
+    # Copy everything between the edited rows and write the new rows in their place
+    with open(in_emis_file, 'rb') as f_in, open(out_emis_file, 'wb') as f_out:
+        pos = 0
+        for start, end, new_line in zip(starts, ends, new_lines):
+            utils.copy_bytes(f_in, f_out, pos, start, block_size=block_size)
+            f_out.write(new_line)
+            pos = end
+        utils.copy_bytes(f_in, f_out, pos, None, block_size=block_size)
+
+    return len(delta_df)
+
+
+def read_ff10_header(ff10_file):
+    """
+    Reads the header block (i.e., the lines starting with "#") and the column
+    names from an FF10 inventory file without reading any of the data.
+
+    Parameters
+    ----------
+    :param ff10_file: string
+        Path to the FF10 point (e.g., `*_fs_ff10_future.csv`) or hourly point 
+        (e.g., `*_fs_ff10_hourly_future.csv`) inventory file.
+    :return header: list of strings
+        Header lines, including the trailing newline characters, exactly as 
+        they appear at the top of the file.
+    :return columns: list of strings
+        Column names.
+    """
+    header = []
+    with open(ff10_file, 'r') as f:
+        for line in f:
+            if line.startswith('#'):
+                header.append(line)
+            else:
+                columns = [col.strip().strip('"') for col in line.rstrip('\n').split(',')]
+                break
+    return header, columns
+
+
+def ff10_dtypes(columns):
+    """
+    Get the dtypes used to parse an FF10 inventory with typed columns. Identifier and 
+    code columns are read as strings, the pollutant column is categorical, and all 
+    other columns (emissions values, stack parameters, etc.) are read as float64.
+
+    Parameters
+    ----------
+    :param columns: list of strings
+        Column names from the FF10 inventory file (see `read_ff10_header`).
+    :return dtypes: dict
+        Dictionary of dtypes that can be passed to `pandas.read_csv`.
+    """
+    dtypes = {}
+    for col in columns:
+        if col in FF10_STR_COLS:
+            dtypes[col] = 'object'
+        else:
+            dtypes[col] = 'float64'
+    return dtypes
+
+
+def ff10_hour_columns(columns):
+    """
+    Get the hourly value columns (e.g., hrval0-hrval23 or hrvl1-hrvl24) from an
+    FF10 hourly point inventory.
+
+    Parameters
+    ----------
+    :param columns: list of strings
+        Column names from the FF10 inventory file.
+    :return: list of strings
+        Names of the 24 hourly value columns.
+    """
+    return [col for col in columns if col.startswith('hrv') and col[-1].isdigit()]
+
+
+def read_ff10(ff10_file, usecols=None, index=True, chunksize=None):
+    """
+    Reads an FF10 point or hourly point inventory file with typed columns. 
+
+    Parameters
+    ----------
+    :param ff10_file: string
+        Path to the FF10 inventory file.
+    :param usecols: list of strings
+        Subset of columns to read. Defaults to None, which reads all columns. 
+    :param index: bool
+        Option to index the rows by facility, unit, and process IDs. Defaults to True.
+    :param chunksize: int
+        If specified, returns an iterator over DataFrames with `chunksize` rows
+        rather than reading the whole file at once.
+    :return ff10_df: `pandas.DataFrame` (or iterator over `pandas.DataFrame`)
+        Inventory data. The header block is stored in `ff10_df.attrs['header']` and 
+        the original column order in `ff10_df.attrs['columns']`.
+    """
+    header, columns = read_ff10_header(ff10_file)
+    dtypes = ff10_dtypes(columns)
+    if usecols is not None:
+        dtypes = {col: dtypes[col] for col in usecols}
+    reader = pd.read_csv(ff10_file, skiprows=len(header), dtype=dtypes, usecols=usecols, 
+                         chunksize=chunksize, skipinitialspace=True)
+
+    def _fmt(ff10_df):
+        if 'poll' in ff10_df.columns:
+            ff10_df['poll'] = ff10_df['poll'].astype('category')
+        if index and all(col in ff10_df.columns for col in FF10_INDEX):
+            ff10_df = ff10_df.set_index(FF10_INDEX)
+        ff10_df.attrs['header'] = header
+        ff10_df.attrs['columns'] = [col for col in columns if usecols is None or col in usecols]
+        return ff10_df
+
+    if chunksize is None:
+        return _fmt(reader)
+    else:
+        return (_fmt(chunk) for chunk in reader)
+
+
+def write_ff10(ff10_df, ff10_file, header=None, clear_comments=False, mode='w'):
+    """
+    Writes a DataFrame to an FF10 inventory file, including the header block.
+
+    Parameters
+    ----------
+    :param ff10_df: `pandas.DataFrame`
+        Inventory data, e.g., from `read_ff10`. If the DataFrame is indexed by 
+        facility, unit, and process IDs, the index is written back into the
+        columns in their original FF10 order.
+    :param ff10_file: string
+        Path where the FF10 file will be written.
+    :param header: list of strings
+        Header lines to write at the top of the file. Defaults to None, in which 
+        case the header stored in `ff10_df.attrs['header']` (if any) is used.
+    :param clear_comments: bool
+        Option to blank out the comment column. Long comments can cause SMOKE to 
+        fail with "ERROR: Overflow prevented while parsing line PARSLINE."
+    :param mode: string
+        File mode. Use "a" to append rows (without the header block or column 
+        names) to an existing file.
+    """
+    if list(ff10_df.index.names) == FF10_INDEX:
+        ff10_df = ff10_df.reset_index()
+    if 'columns' in ff10_df.attrs:
+        ff10_df = ff10_df[ff10_df.attrs['columns']]
+    if clear_comments and 'comment' in ff10_df.columns:
+        ff10_df = ff10_df.assign(comment=np.nan)
+    if mode == 'w':
+        if header is None:
+            header = ff10_df.attrs.get('header', [])
+        with open(ff10_file, 'w') as f:
+            f.writelines(header)
+            ff10_df.to_csv(f, index=False)
+    else:
+        ff10_df.to_csv(ff10_file, mode='a', index=False, header=False)
+
+
+def edit_ff10_hourly(in_ff10_file, out_ff10_file, units, action='scale', factor=1.0, 
+                     new_values=None, polls=None, clear_comments=False, chunksize=200000):
+    """
+    Scale, replace, or zero the hourly values for selected units in an FF10 hourly point 
+    inventory. The file is processed in chunks, so the full national inventory is never 
+    held in memory, and the header block is copied to the new file.
+
+    Parameters
+    ----------
+    :param in_ff10_file: string
+        Path to the FF10 hourly point inventory (e.g., `*_fs_ff10_hourly_future.csv`).
+    :param out_ff10_file: string
+        Path where the edited FF10 hourly point inventory will be written.
+    :param units: list of tuples
+        Units to edit, identified by (facility_id, unit_id) or (facility_id, unit_id, process_id).
+        If empty, the inventory is copied without edits.
+    :param action: string
+        Edit to apply to the selected units. Options are [scale, replace, zero].
+    :param factor: float
+        Multiplicative factor applied to the hourly values when `action='scale'`.
+    :param new_values: `pandas.DataFrame`
+        Hourly values used when `action='replace'`. Must be indexed by 
+        (facility_id, unit_id, process_id, poll, date) and hold one column per hour 
+        with the same names as the hourly columns in `in_ff10_file`. Rows in the 
+        inventory that do not appear in `new_values`, and hours that are NaN in
+        `new_values`, are left untouched.
+    :param polls: list of strings
+        Pollutants to edit. Defaults to None, which edits all pollutants. 
+    :param clear_comments: bool
+        Option to blank out the comment column. 
+    :param chunksize: int
+        Number of rows to process at a time.
+    :return n_edited: int
+        Number of rows that were edited.
+    """
+    if action not in ['scale', 'replace', 'zero']:
+        raise ValueError(f'Action "{action}" not recognized. Please use "scale", "replace", or "zero"')
+    if action == 'replace' and new_values is None:
+        raise ValueError('new_values must be specified when action="replace"')
+    if len(units) == 0 and not clear_comments:
+        shutil.copyfile(in_ff10_file, out_ff10_file)
+        return 0
+    header, columns = read_ff10_header(in_ff10_file)
+    hour_cols = ff10_hour_columns(columns)
+    # Build the index of units to edit
+    n_levels = len(units[0]) if len(units) > 0 else len(FF10_INDEX)
+    unit_idx = pd.MultiIndex.from_tuples([tuple(str(i) for i in unit) for unit in units], names=FF10_INDEX[:n_levels])
+
+    n_edited = 0
+    mode = 'w'
+    for chunk in read_ff10(in_ff10_file, index=False, chunksize=chunksize):
+        # Find the rows belonging to the selected units
+        chunk_idx = pd.MultiIndex.from_frame(chunk[FF10_INDEX[:n_levels]])
+        edit = chunk_idx.isin(unit_idx)
+        if polls is not None:
+            edit &= chunk['poll'].isin(polls)
+        if action == 'scale':
+            chunk.loc[edit, hour_cols] = chunk.loc[edit, hour_cols] * factor
+        elif action == 'zero':
+            chunk.loc[edit, hour_cols] = 0.0
+        elif action == 'replace':
+            key_cols = FF10_INDEX + ['poll', 'date']
+            row_keys = pd.MultiIndex.from_frame(chunk.loc[edit, key_cols].astype({'poll': 'object'}))
+            matched = row_keys.isin(new_values.index)
+            rows = chunk.index[edit][matched]
+            replace_vals = new_values.loc[row_keys[matched], hour_cols].values
+            chunk.loc[rows, hour_cols] = np.where(np.isnan(replace_vals), chunk.loc[rows, hour_cols].values, replace_vals)
+            edit = chunk.index.isin(rows)
+        # Keep the daily totals consistent with the hourly values
+        if 'daytot' in chunk.columns:
+            chunk.loc[edit, 'daytot'] = chunk.loc[edit, hour_cols].sum(axis=1)
+        n_edited += int(edit.sum())
+        write_ff10(chunk, out_ff10_file, header=header, clear_comments=clear_comments, mode=mode)
+        mode = 'a'
+    if mode == 'w':
+        # The inventory has no rows, so just copy the header block and column names
+        write_ff10(pd.DataFrame(columns=columns), out_ff10_file, header=header)
+    return n_edited
+
+
+def read_unit_predictions(data_file='./pred_xg_co2.csv', lu_file='./RGGI_to_NYISO.csv'):
+    """
+    Reads data output from either the NY Simple Net or the ML Emissions Estimator and
+    splits it among the EPA ORISPL and Unit IDs associated with each NYISO name. This
+    is a vectorized counterpart to `fmt_like_camd` that keeps time along the index.
+
+    Parameters
+    ----------
+    :param data_file: string or `pandas.DataFrame`
+        File containing emissions (or generation) data for a single pollutant throughout time,
+        or the equivalent DataFrame indexed by TimeStamp (e.g., from `ingest_predictions`).
+    :param lu_file: string
+        File containing the look-up table to convert from EPA ORISPL and Unit ID
+        to the NYISO ID and Name.
+    :return unit_df: `pandas.DataFrame`
+        Data indexed by TimeStamp with one column for each (ORISPL, Unit ID) combination.
+    """
+    if isinstance(data_file, pd.DataFrame):
+        raw_data_df = data_file
+    else:
+        raw_data_df = pd.read_csv(data_file, parse_dates=['TimeStamp'], index_col='TimeStamp')
+    lu_df = pd.read_csv(lu_file, header=1, dtype={'Unit ID': 'str'})
+    lu_df = lu_df[lu_df['NYISO Name'].isin(raw_data_df.columns)].reset_index(drop=True)
+    # Split the data evenly among all the units associated with each name
+    n_units = lu_df.groupby('NYISO Name')['NYISO Name'].transform('size').values
+    unit_df = raw_data_df[lu_df['NYISO Name']].astype('float64') / n_units
+    unit_df.columns = pd.MultiIndex.from_arrays([lu_df['ORISPL'].astype('int').astype('str'), lu_df['Unit ID']],
+                                                names=['ORISPL', 'Unit ID'])
+    return unit_df
+
+
+def ff10_unit_xref(ff10_point_file):
+    """
+    Creates a cross-reference between EPA ORISPL/boiler IDs and the FF10 facility, unit, 
+    and process IDs using the FF10 point inventory (i.e., EMISINV_A).
+
+    Parameters
+    ----------
+    :param ff10_point_file: string
+        Path to the FF10 point inventory (e.g., `*_fs_ff10_future.csv`).
+    :return xref_df: `pandas.DataFrame`
+        DataFrame with ORISPL, Unit ID, facility_id, unit_id, and process_id columns.
+    """
+    usecols = FF10_INDEX + ['oris_facility_code', 'oris_boiler_id']
+    xref_df = read_ff10(ff10_point_file, usecols=usecols, index=False)
+    xref_df = xref_df.dropna(subset=['oris_facility_code', 'oris_boiler_id']).drop_duplicates()
+    xref_df = xref_df.rename(columns={'oris_facility_code': 'ORISPL', 'oris_boiler_id': 'Unit ID'})
+    return xref_df.reset_index(drop=True)
+
+
+def ml_to_ff10_hourly(in_ff10_hourly_file, out_ff10_hourly_file, ff10_point_file, 
+                      lu_file='RGGI_to_NYISO.csv', pred_files=None, to_tons=None, process_split='even', 
+                      clear_comments=False, cache_dir=None, chunksize=200000):
+    """
+    Write the NY Simple Net/ML emissions predictions directly into the FF10 hourly point
+    inventory (i.e., EMISHOUR_A) that SMOKE reads. This skips the `update_camd` -> ERTAC EGU
+    round trip when only the NY units change. Rows for units, pollutants, or days 
+    without predictions are copied through untouched.
+
+    Parameters
+    ----------
+    :param in_ff10_hourly_file: string
+        Path to the base FF10 hourly point inventory (e.g., `*_fs_ff10_hourly_future.csv`).
+    :param out_ff10_hourly_file: string
+        Path where the updated FF10 hourly point inventory will be written.
+    :param ff10_point_file: string
+        Path to the FF10 point inventory (e.g., `*_fs_ff10_future.csv`) that is used to 
+        match ORISPL and Unit IDs to FF10 facility, unit, and process IDs. 
+    :param lu_file: string
+        Path to the file containing the look-up table to convert from
+        EPA ORISPL and Unit ID to the NYISO ID and Name. 
+    :param pred_files: dict
+        Paths to the unit-level emissions predictions keyed by the FF10 pollutant name.
+        Defaults to {'NOX': 'pred_xg_nox.csv', 'SO2': 'pred_xg_so2.csv'}.
+    :param to_tons: dict
+        Factors to convert the predictions for each pollutant to tons. The ML 
+        predictions follow CAMD conventions: NOx and SO2 in lbs and CO2 in tons. 
+        Defaults to {'NOX': 1 / 2000, 'SO2': 1 / 2000, 'CO2': 1}.
+    :param process_split: string
+        How to split unit-level emissions among the FF10 processes that belong to the 
+        same unit. Options are [even, base]. "even" divides the emissions evenly, and 
+        "base" splits them in proportion to the base inventory (this requires an extra
+        read of the affected rows). 
+    :param clear_comments: bool
+        Option to blank out the comment column. 
+    :param cache_dir: string
+        Directory used by `ingest_predictions` to cache the validated predictions. 
+        Defaults to None, in which case the predictions are not cached.
+    :param chunksize: int
+        Number of rows to process at a time.
+    :return n_edited: int
+        Number of rows that were replaced.
+    """
+    if process_split not in ['even', 'base']:
+        raise ValueError(f'process_split "{process_split}" not recognized. Please use "even" or "base"')
+    if pred_files is None:
+        pred_files = {'NOX': 'pred_xg_nox.csv', 'SO2': 'pred_xg_so2.csv'}
+    if to_tons is None:
+        to_tons = {'NOX': 1 / 2000, 'SO2': 1 / 2000, 'CO2': 1}
+    _, columns = read_ff10_header(in_ff10_hourly_file)
+    hour_cols = ff10_hour_columns(columns)
+    xref_df = ff10_unit_xref(ff10_point_file)
+
+    # Stack all the predictions into long format: (ORISPL, Unit ID, poll, TimeStamp) -> tons
+    pred_lst = []
+    for poll, pred_file in pred_files.items():
+        pred_data, _ = ingest_predictions(pred_file, lu_file=lu_file, cache_dir=cache_dir)
+        unit_df = read_unit_predictions(data_file=pred_data, lu_file=lu_file) * to_tons[poll]
+        pred_df = unit_df.melt(ignore_index=False, value_name='value').reset_index()
+        pred_df['poll'] = poll
+        pred_lst.append(pred_df)
+    pred_df = pd.concat(pred_lst, ignore_index=True)
+
+    # Map the predictions onto the FF10 processes
+    pred_df = pred_df.merge(xref_df, on=['ORISPL', 'Unit ID'], how='inner')
+    if len(pred_df) == 0:
+        print('Warning: none of the predicted units were found in the FF10 point inventory')
+    pred_df['date'] = pred_df['TimeStamp'].dt.strftime('%Y%m%d')
+    pred_df['hour'] = np.asarray(hour_cols)[pred_df['TimeStamp'].dt.hour.values]
+    if process_split == 'even':
+        n_procs = pred_df.groupby(['ORISPL', 'Unit ID', 'poll', 'TimeStamp'])['process_id'].transform('size')
+        pred_df['value'] = pred_df['value'] / n_procs
+    else:
+        # Get the base hourly values for the affected processes
+        units = list(xref_df[FF10_INDEX].itertuples(index=False, name=None))
+        unit_idx = pd.MultiIndex.from_tuples(units)
+        base_lst = []
+        for chunk in read_ff10(in_ff10_hourly_file, usecols=FF10_INDEX + ['poll', 'date'] + hour_cols,
+                               index=False, chunksize=chunksize):
+            base_lst.append(chunk[pd.MultiIndex.from_frame(chunk[FF10_INDEX]).isin(unit_idx)])
+        base_df = pd.concat(base_lst).astype({'poll': 'object'})
+        base_df = base_df.melt(id_vars=FF10_INDEX + ['poll', 'date'], value_vars=hour_cols,
+                               var_name='hour', value_name='base')
+        pred_df = pred_df.merge(base_df, on=FF10_INDEX + ['poll', 'date', 'hour'], how='left')
+        pred_df['base'] = pred_df['base'].fillna(0.0)
+        grp = pred_df.groupby(['ORISPL', 'Unit ID', 'poll', 'TimeStamp'])
+        base_sum = grp['base'].transform('sum')
+        n_procs = grp['base'].transform('size')
+        frac = (pred_df['base'] / base_sum).where(base_sum > 0, 1 / n_procs)
+        pred_df['value'] = pred_df['value'] * frac
+
+    # Pivot to one row per (facility_id, unit_id, process_id, poll, date) with hourly columns
+    new_values = pred_df.pivot_table(index=FF10_INDEX + ['poll', 'date'], columns='hour', 
+                                     values='value', aggfunc='sum')
+    new_values = new_values.reindex(columns=hour_cols)
+    units = list(new_values.index.droplevel(['poll', 'date']).unique())
+    return edit_ff10_hourly(in_ff10_hourly_file, out_ff10_hourly_file, units, action='replace',
+                            new_values=new_values, clear_comments=clear_comments, chunksize=chunksize)
+
+
+def ingest_predictions(data_file, lu_file='RGGI_to_NYISO.csv', clip_min=0.0, max_gap=3, freq='h', 
+                       cache_dir=None, verbose=False):
+    """
+    Parse, clean, and validate a NY Simple Net or ML Emissions Estimator prediction file. 
+    This replaces the "Remove Negative Emissions" and "File checks" notebooks:
 
-    # Save the updated emissions to a new CSV 
-    # (after dropping the datetime column that we added)
-    base_df = base_df.drop(columns=['datetime'])
-    base_df.to_csv(out_emis_file, index=False) 
+    1. The predictions are read with a datetime index and reindexed to a complete
+       time series (duplicate time stamps are dropped).
+    2. Values below `clip_min` (i.e., negative emissions) are clipped, and gaps of up 
+       to `max_gap` time steps are filled by linear interpolation. Longer gaps are 
+       left as NaN and reported.
+    3. The NYISO names are checked against the look-up table to find units that are
+       missing or that have multiple ORISPL/Unit ID entries.
+
+    If `cache_dir` is specified, the results are saved as a pickle keyed by the checksums
+    of the input files and the options, so repeated calls skip all of the above. 
+
+    Parameters
+    ----------
+    :param data_file: string
+        File containing emissions (or generation) data for a single pollutant throughout time.
+    :param lu_file: string
+        File containing the look-up table to convert from EPA ORISPL and Unit ID
+        to the NYISO ID and Name.
+    :param clip_min: float
+        Minimum allowed value. Set to None to skip clipping.
+    :param max_gap: int
+        Maximum number of consecutive missing time steps that will be interpolated.
+    :param freq: string
+        Expected frequency of the predictions.
+    :param cache_dir: string
+        Directory where the validated predictions are cached. Defaults to None, in 
+        which case the predictions are not cached.
+    :param verbose: bool
+        When True, prints warnings about missing units and unfilled gaps.
+    :return pred_df: `pandas.DataFrame`
+        Cleaned predictions indexed by TimeStamp with one float64 column per NYISO name.
+    :return report: `pandas.DataFrame`
+        Validation report indexed by NYISO name with the number of lookup entries, 
+        clipped values, missing values, and unfilled values as well as a status of 
+        [found, multiple, missing, no predictions].
+    """
+    # Check for cached results
+    if cache_dir is not None:
+        key = hashlib.sha256(f'{utils.file_checksum(data_file)}{utils.file_checksum(lu_file)}'
+                             f'{clip_min}{max_gap}{freq}'.encode()).hexdigest()[:16]
+        cache_file = f'{cache_dir}/{os.path.splitext(os.path.basename(data_file))[0]}_{key}.pkl'
+        if os.path.exists(cache_file):
+            return pd.read_pickle(cache_file)
+
+    # Read the predictions and make sure there's a complete, unique time series
+    pred_df = pd.read_csv(data_file, parse_dates=['TimeStamp'], index_col='TimeStamp')
+    pred_df = pred_df[~pred_df.index.duplicated(keep='first')].sort_index()
+    pred_df = pred_df.apply(pd.to_numeric, errors='coerce').astype('float64')
+    pred_df = pred_df.reindex(pd.date_range(pred_df.index[0], pred_df.index[-1], freq=freq, name='TimeStamp'))
+
+    # Clip the values
+    missing = pred_df.isna()
+    if clip_min is not None:
+        n_clipped = (pred_df < clip_min).sum()
+        pred_df = pred_df.clip(lower=clip_min)
+    else:
+        n_clipped = pd.Series(0, index=pred_df.columns)
+
+    # Fill short gaps. The length of each interior gap is the difference between the 
+    # running count of missing values at the next and previous valid time steps.
+    n_missing = missing.cumsum().where(~missing)
+    gap_len = n_missing.bfill() - n_missing.ffill()
+    fill = missing & (gap_len <= max_gap)
+    pred_df = pred_df.mask(fill, pred_df.interpolate(limit_area='inside'))
+
+    # Validate the names against the lookup table
+    lu_df = pd.read_csv(lu_file, header=1)
+    lu_names = lu_df['NYISO Name'][lu_df['NYISO Name'] != 'n/a'].dropna()
+    n_entries = lu_names.value_counts()
+    report = pd.DataFrame(index=pred_df.columns.union(n_entries.index))
+    report.index.name = 'NYISO Name'
+    report['n_entries'] = n_entries.reindex(report.index, fill_value=0)
+    report['n_clipped'] = n_clipped.reindex(report.index, fill_value=0)
+    report['n_missing'] = missing.sum().reindex(report.index, fill_value=0)
+    report['n_unfilled'] = pred_df.isna().sum().reindex(report.index, fill_value=0)
+    report['status'] = np.select([~report.index.isin(pred_df.columns), report['n_entries'] == 0, report['n_entries'] > 1],
+                                 ['no predictions', 'missing', 'multiple'], default='found')
+    if verbose:
+        for name in report.index[report['status'] == 'missing']:
+            print(f'Warning: {name} is not in the lookup table and will be skipped')
+        for name in report.index[report['n_unfilled'] > 0]:
+            print(f'Warning: {name} has {report.loc[name, "n_unfilled"]} missing values that were not filled')
+
+    if cache_dir is not None:
+        utils.make_dirs(cache_dir)
+        pd.to_pickle((pred_df, report), cache_file)
+    return pred_df, report
+
+
+def stack_cells(stack_groups_file, griddesc_file, grid_name):
+    """
+    Computes the 2D grid cell of each stack in a SMOKE stack groups file from the
+    stacks' projected coordinates (XLOCA, YLOCA) and the grid definition.
+
+    Parameters
+    ----------
+    :param stack_groups_file: string
+        Path to the SMOKE `stack_groups_*.ncf` file.
+    :param griddesc_file: string
+        Path to the GRIDDESC file.
+    :param grid_name: string
+        Grid name, which should match that in the GRIDDESC file (e.g., 12OTC2).
+    :return cells: `numpy.ndarray`
+        Flattened (row * NCOLS + col) cell index of each stack, or -1 for stacks 
+        outside the grid.
+    :return grid: dict
+        Grid parameters (see `utils.read_griddesc`).
+    """
+    grid = utils.read_griddesc(griddesc_file, grid_name)
+    with xr.open_dataset(stack_groups_file) as ds:
+        if ('XLOCA' not in ds) or ('YLOCA' not in ds):
+            raise ValueError(f'{stack_groups_file} does not contain the XLOCA and YLOCA variables')
+        x = ds['XLOCA'].values.ravel().astype('float64')
+        y = ds['YLOCA'].values.ravel().astype('float64')
+    col = np.floor((x - grid['XORIG']) / grid['XCELL']).astype('int64')
+    row = np.floor((y - grid['YORIG']) / grid['YCELL']).astype('int64')
+    inside = (col >= 0) & (col < grid['NCOLS']) & (row >= 0) & (row < grid['NROWS'])
+    cells = np.where(inside, row * grid['NCOLS'] + col, -1)
+    return cells, grid
+
+
+def inln_to_2d(inln_file, out_file, cells, grid):
+    """
+    Python replacement for the SMOKE `inlineto2d` utility. Sums the in-line point source 
+    emissions of all stacks in each grid cell (for every species and hour) and writes 
+    the result to an IOAPI-compatible 2D (single layer) gridded file.
+
+    Parameters
+    ----------
+    :param inln_file: string
+        Path to the SMOKE `inln_mole_*.ncf` file.
+    :param out_file: string
+        Path where the 2D emissions file will be written.
+    :param cells: `numpy.ndarray`
+        Flattened cell index of each stack (see `stack_cells`).
+    :param grid: dict
+        Grid parameters (see `utils.read_griddesc`).
+    :return n_outside: int
+        Number of stacks that are outside the grid (and are therefore dropped).
+    """
+    ncols, nrows = grid['NCOLS'], grid['NROWS']
+    n_cells = ncols * nrows
+    inside = cells >= 0
+    with xr.open_dataset(inln_file) as ds:
+        n_steps = ds.sizes['TSTEP']
+        n_stacks = ds.sizes['ROW'] * ds.sizes['COL']
+        if n_stacks != len(cells):
+            raise ValueError(f'{inln_file} has {n_stacks} stacks, but the stack groups have {len(cells)}')
+        # Index into the flattened (TSTEP, ROW, COL) output array for each (hour, stack) pair
+        idx = (np.arange(n_steps)[:, None] * n_cells + cells[inside][None, :]).ravel()
+        out_ds = xr.Dataset()
+        out_ds['TFLAG'] = ds['TFLAG']
+        for spc in [var for var in ds.data_vars if var != 'TFLAG']:
+            emis = ds[spc].values.reshape(n_steps, -1)[:, inside]
+            gridded = np.bincount(idx, weights=emis.ravel(), minlength=n_steps * n_cells)
+            out_ds[spc] = (('TSTEP', 'LAY', 'ROW', 'COL'), gridded.reshape(n_steps, 1, nrows, ncols).astype('float32'))
+            out_ds[spc].attrs = ds[spc].attrs
+        out_ds.attrs = dict(ds.attrs)
+    # Update the IOAPI header for a gridded file
+    out_ds.attrs['FTYPE'] = np.int32(1)
+    out_ds.attrs['NLAYS'] = np.int32(1)
+    out_ds.attrs['VGLVLS'] = np.array(out_ds.attrs.get('VGLVLS', [1.0, 0.0])[:2], dtype='float32')
+    out_ds.attrs['GDNAM'] = f'{grid["GDNAM"]:<16}'
+    for key in ['GDTYP', 'NCOLS', 'NROWS', 'NTHIK']:
+        out_ds.attrs[key] = np.int32(grid[key])
+    for key in ['P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT', 'XORIG', 'YORIG', 'XCELL', 'YCELL']:
+        out_ds.attrs[key] = np.float64(grid[key])
+    out_ds.attrs['UPNAM'] = f'{"INLN_TO_2D":<16}'
+    encoding = {var: {'_FillValue': None} for var in out_ds.data_vars}
+    out_ds.to_netcdf(out_file, format='NETCDF3_64BIT', encoding=encoding)
+    return int((~inside).sum())
+
+
+def stack_unit_xref(stack_groups_file, ff10_point_file, tolerance=1e-3, rtol=0.01):
+    """
+    Creates a cross-reference between the stacks in a SMOKE stack groups file and EPA 
+    ORISPL/boiler IDs. The stack groups file doesn't hold any facility identifiers, so
+    stacks are matched to the release points in the FF10 point inventory by location.
+    When several stacks are within the tolerance (e.g., the stacks of a multi-unit plant), 
+    they are told apart by their parameters (height, diameter, temperature, and velocity).
+
+    Parameters
+    ----------
+    :param stack_groups_file: string
+        Path to the SMOKE `stack_groups_*.ncf` file.
+    :param ff10_point_file: string
+        Path to the FF10 point inventory (e.g., `*_fs_ff10_future.csv`) used by SMOKE.
+    :param tolerance: float
+        Maximum distance (in degrees) between a stack and an FF10 release point.
+    :param rtol: float
+        Relative tolerance used to compare the stack parameters.
+    :return xref_df: `pandas.DataFrame`
+        DataFrame with the (zero-based) stack index, ORISPL, and Unit ID.
+    """
+    _, columns = read_ff10_header(ff10_point_file)
+    param_cols = [col for col in FF10_STACK_PARAMS if col in columns]
+    usecols = FF10_INDEX + ['rel_point_id', 'oris_facility_code', 'oris_boiler_id', 'latitude', 'longitude'] + param_cols
+    ff10_df = read_ff10(ff10_point_file, usecols=usecols, index=False)
+    ff10_df = ff10_df.dropna(subset=['oris_facility_code', 'oris_boiler_id', 'latitude', 'longitude'])
+    # Each release point only needs to be matched once
+    ff10_df = ff10_df.drop_duplicates(subset=['facility_id', 'rel_point_id', 'oris_facility_code', 'oris_boiler_id'])
+    with xr.open_dataset(stack_groups_file) as ds:
+        stk_lat = ds['LATITUDE'].values.ravel()
+        stk_lon = ds['LONGITUDE'].values.ravel()
+        stk_params = {col: ds[var].values.ravel().astype('float64') for col, (var, _) in FF10_STACK_PARAMS.items()
+                      if (col in param_cols) and (var in ds)}
+    tree = cKDTree(np.column_stack([stk_lon, stk_lat]))
+    candidates = tree.query_ball_point(ff10_df[['longitude', 'latitude']].values, r=tolerance)
+    stack = np.full(len(ff10_df), -1)
+    n_ambiguous = 0
+    for ii, stacks in enumerate(candidates):
+        if len(stacks) == 1:
+            stack[ii] = stacks[0]
+        elif len(stacks) > 1:
+            # SMOKE converts the FF10 stack parameters to metric units
+            stacks = np.array(stacks)
+            match = np.ones(len(stacks), dtype='bool')
+            for col, values in stk_params.items():
+                value = FF10_STACK_PARAMS[col][1](ff10_df[col].values[ii])
+                if np.isfinite(value):
+                    match &= np.isclose(values[stacks], value, rtol=rtol)
+            if (match.sum() == 1) and (len(stk_params) > 0):
+                stack[ii] = stacks[match][0]
+            else:
+                n_ambiguous += 1
+                print(f'CMAQPyError: FF10 release point {ff10_df["facility_id"].values[ii]}/{ff10_df["rel_point_id"].values[ii]} '
+                      f'matches {match.sum()} of the {len(stacks)} stacks at its location ({stacks.tolist()})')
+    if n_ambiguous > 0:
+        raise ValueError(f'{n_ambiguous} FF10 release points could not be matched to a single stack')
+    found = stack >= 0
+    if (~found).any():
+        print(f'Warning: {(~found).sum()} FF10 release points with ORIS IDs were not matched to any stack')
+    xref_df = pd.DataFrame({'stack': stack[found],
+                            'ORISPL': ff10_df['oris_facility_code'].values[found],
+                            'Unit ID': ff10_df['oris_boiler_id'].values[found]})
+    return xref_df.drop_duplicates().reset_index(drop=True)
+
+
+def stack_scaling_factors(xref_df, base_df, scen_df, utc_offset=-5):
+    """
+    Computes hourly scaling factors for each stack as the ratio of the scenario to the 
+    base emissions of all the units that are matched to the stack.
+
+    Parameters
+    ----------
+    :param xref_df: `pandas.DataFrame`
+        Stack cross-reference (see `stack_unit_xref`).
+    :param base_df: `pandas.DataFrame`
+        Base-case unit emissions indexed by TimeStamp with (ORISPL, Unit ID) columns 
+        (see `read_unit_predictions`).
+    :param scen_df: `pandas.DataFrame`
+        Scenario unit emissions in the same format as `base_df`.
+    :param utc_offset: int
+        Offset (hours) of the prediction time stamps from UTC. The predictions follow CAMD
+        conventions and use local standard time (i.e., -5 for EST).
+    :return factor_df: `pandas.DataFrame`
+        Scaling factors indexed by UTC time with one column per stack.
+    """
+    units = base_df.columns.intersection(scen_df.columns)
+    unit_pos = pd.Series(np.arange(len(units)), index=units)
+    xref_df = xref_df[pd.MultiIndex.from_frame(xref_df[['ORISPL', 'Unit ID']]).isin(units)]
+    stacks = np.unique(xref_df['stack'].values)
+    # Sum the units on each stack with a (unit x stack) matrix
+    unit_to_stack = np.zeros((len(units), len(stacks)))
+    unit_to_stack[unit_pos.loc[list(zip(xref_df['ORISPL'], xref_df['Unit ID']))].values,
+                  np.searchsorted(stacks, xref_df['stack'].values)] = 1.0
+    time_index = base_df.index.intersection(scen_df.index)
+    stack_base = base_df.loc[time_index, units].fillna(0.0).values @ unit_to_stack
+    stack_scen = scen_df.loc[time_index, units].fillna(0.0).values @ unit_to_stack
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factors = np.where(stack_base > 0, stack_scen / stack_base, 1.0)
+    n_unscalable = ((stack_base <= 0) & (stack_scen > 0)).sum()
+    if n_unscalable > 0:
+        print(f'Warning: {n_unscalable} stack-hours have zero base but nonzero scenario emissions and were left unchanged')
+    factor_df = pd.DataFrame(factors, index=time_index - pd.Timedelta(hours=utc_offset), columns=stacks)
+    return factor_df
+
+
+def scale_inln(in_inln_file, out_inln_file, factors, species=INLN_SPECIES):
+    """
+    Scales the emissions of selected stacks in a SMOKE inline point source file with
+    hourly factors and writes the result to a new inline file with the same structure.
+
+    Parameters
+    ----------
+    :param in_inln_file: string
+        Path to the base `inln_mole_*.ncf` file (unzipped).
+    :param out_inln_file: string
+        Path where the scaled file will be written.
+    :param factors: dict
+        Scaling factors (see `stack_scaling_factors`) keyed by pollutant. Hours without
+        a factor are left unchanged.
+    :param species: dict
+        CMAQ species scaled by the factors of each pollutant. Species that aren't in the 
+        file are skipped.
+    :return n_stacks: int
+        Number of stacks that were scaled.
+    """
+    with xr.open_dataset(in_inln_file) as ds:
+        ds = ds.load()
+    times = utils.tflag_to_datetime(ds['TFLAG'].values[:, 0, :])
+    scaled_stacks = set()
+    for poll, factor_df in factors.items():
+        if len(factor_df.columns) == 0:
+            continue
+        stacks = factor_df.columns.values
+        # (TSTEP, stack) factors for the hours in this file
+        factor = factor_df.reindex(times).fillna(1.0).values
+        for spc in species.get(poll, []):
+            if spc not in ds:
+                continue
+            emis = ds[spc].values
+            emis[:, 0, stacks, 0] = (emis[:, 0, stacks, 0] * factor).astype(emis.dtype)
+            ds[spc].values = emis
+        scaled_stacks.update(stacks)
+    encoding = {var: {'_FillValue': None} for var in ds.data_vars}
+    ds.to_netcdf(out_inln_file, format='NETCDF3_64BIT', encoding=encoding)
+    return len(scaled_stacks)
+
+
+def ml_scale_inln(inln_files, out_dir, stack_groups_file, ff10_point_file, lu_file='RGGI_to_NYISO.csv',
+                  pred_files={'NOX': ('pred_without_renewable_xg_nox.csv', 'pred_xg_nox.csv'),
+                              'SO2': ('pred_without_renewable_xg_so2.csv', 'pred_xg_so2.csv')},
+                  species=INLN_SPECIES, utc_offset=-5, cache_dir=None):
+    """
+    Creates scenario inline point source files by scaling the stacks of the predicted units
+    in existing SMOKE outputs (e.g., `inln_mole_ptertac_*`) with the ratio of the scenario 
+    to the base ML/ED predictions. This skips the ERTAC EGU -> SMOKE cycle for scenarios 
+    that only change the hourly emissions of individual units. The stack groups file is 
+    linked into `out_dir`, so `out_dir` can be used in place of the base directory 
+    (e.g., LOC_ERTAC) by `CMAQModel.setup_inpdir`.
+
+    Parameters
+    ----------
+    :param inln_files: list of strings
+        Paths to the base `inln_mole_*.ncf` files (unzipped).
+    :param out_dir: string
+        Directory where the scaled files are written (with the same file names).
+    :param stack_groups_file: string
+        Path to the SMOKE `stack_groups_*.ncf` file for these inline files.
+    :param ff10_point_file: string
+        Path to the FF10 point inventory (e.g., `*_fs_ff10_future.csv`) used by SMOKE.
+    :param lu_file: string
+        Path to the file containing the look-up table to convert from
+        EPA ORISPL and Unit ID to the NYISO ID and Name. 
+    :param pred_files: dict
+        Paths to the (base, scenario) unit-level predictions keyed by pollutant. The 
+        defaults compare the S0 (with renewables) predictions with the base case (without 
+        renewables) ones.
+    :param species: dict
+        CMAQ species scaled by the factors of each pollutant.
+    :param utc_offset: int
+        Offset (hours) of the prediction time stamps from UTC.
+    :param cache_dir: string
+        Directory used by `ingest_predictions` to cache the validated predictions.
+    :return out_files: list of strings
+        Paths of the scaled files.
+    """
+    utils.make_dirs(out_dir)
+    xref_df = stack_unit_xref(stack_groups_file, ff10_point_file)
+    factors = {}
+    for poll, (base_file, scen_file) in pred_files.items():
+        base_data, _ = ingest_predictions(base_file, lu_file=lu_file, cache_dir=cache_dir)
+        scen_data, _ = ingest_predictions(scen_file, lu_file=lu_file, cache_dir=cache_dir)
+        factors[poll] = stack_scaling_factors(xref_df, read_unit_predictions(base_data, lu_file=lu_file),
+                                              read_unit_predictions(scen_data, lu_file=lu_file), 
+                                              utc_offset=utc_offset)
+    out_files = []
+    for inln_file in inln_files:
+        out_file = os.path.join(out_dir, os.path.basename(inln_file))
+        n_stacks = scale_inln(inln_file, out_file, factors, species=species)
+        print(f'Scaled {n_stacks} stacks in {out_file}')
+        out_files.append(out_file)
+    # Link the stack groups so the new directory is complete
+    out_stack_groups_file = os.path.join(out_dir, os.path.basename(stack_groups_file))
+    if not os.path.exists(out_stack_groups_file):
+        os.symlink(os.path.abspath(stack_groups_file), out_stack_groups_file)
+    return out_files
+
+
+def merge_gridded(in_files, out_file):
+    """
+    Merges gridded emissions files for the same grid and time period (e.g., several 
+    `emis_mole_*` sectors for one day) into a single file, so that CCTM opens and 
+    interpolates one file instead of one per sector. Species found in several files 
+    are summed, and each species is read from each file only when it is needed. 
+
+    Parameters
+    ----------
+    :param in_files: list of strings
+        Paths to the gridded emissions files (unzipped).
+    :param out_file: string
+        Path where the merged file will be written.
+    :return var_names: list of strings
+        Species in the merged file.
+    """
+    datasets = [xr.open_dataset(in_file) for in_file in in_files]
+    try:
+        ref = datasets[0]
+        for in_file, ds in zip(in_files[1:], datasets[1:]):
+            for key in ['NCOLS', 'NROWS', 'NLAYS', 'XORIG', 'YORIG', 'XCELL', 'YCELL', 'SDATE', 'STIME', 'TSTEP']:
+                if np.any(ds.attrs.get(key) != ref.attrs.get(key)):
+                    raise ValueError(f'{in_file} is not compatible with {in_files[0]} ({key} differs)')
+            if ds.sizes['TSTEP'] != ref.sizes['TSTEP']:
+                raise ValueError(f'{in_file} is not compatible with {in_files[0]} (number of time steps differs)')
+        # Keep the species in the order that they first appear
+        var_names = []
+        for ds in datasets:
+            var_names += [var for var in ds.data_vars if (var != 'TFLAG') and (var not in var_names)]
+        out_ds = xr.Dataset()
+        for var in var_names:
+            total = None
+            for ds in datasets:
+                if var in ds:
+                    values = ds[var].values
+                    total = values.astype('float64') if total is None else total + values
+                    attrs = ds[var].attrs
+            out_ds[var] = (('TSTEP', 'LAY', 'ROW', 'COL'), total.astype('float32'), attrs)
+        out_ds.attrs = dict(ref.attrs)
+        out_ds = utils.set_ioapi_vars(out_ds, ref['TFLAG'].values[:, 0, :])
+        out_ds.attrs['FILEDESC'] = 'Merged gridded emissions: ' + ', '.join([os.path.basename(in_file) for in_file in in_files])
+    finally:
+        for ds in datasets:
+            ds.close()
+    encoding = {var: {'_FillValue': None} for var in out_ds.data_vars}
+    out_ds.to_netcdf(out_file, format='NETCDF3_64BIT', encoding=encoding)
+    return var_names
+
+
+def merge_inline(inln_files, stack_groups_files, out_inln_file, out_stack_groups_file, date=None):
+    """
+    Merges inline point source sectors into a single stack list: the stack groups are 
+    concatenated (with the stacks renumbered), and the emissions of each sector are stacked 
+    along the same dimension. Species and stack parameters that are missing from a sector 
+    (e.g., the ACRESBURNED of fire sectors) are set to zero for its stacks.
+
+    Sectors that use representative days (e.g., othpt with ${mwdss_N}) are stamped with 
+    their representative day, which CCTM accepts with STK_EM_SYM_DATE. When `date` is given,
+    the merged file is stamped with that day and the sectors only need to share STIME and
+    TSTEP. Otherwise, they also need to share SDATE.
+
+    Parameters
+    ----------
+    :param inln_files: list of strings
+        Paths to the `inln_mole_*` files for each sector (unzipped).
+    :param stack_groups_files: list of strings
+        Paths to the `stack_groups_*` files for each sector (in the same order).
+    :param out_inln_file: string
+        Path where the merged emissions will be written.
+    :param out_stack_groups_file: string
+        Path where the merged stack groups will be written.
+    :param date: `datetime.datetime`
+        Simulation day that the merged file is stamped with.
+    :return n_stacks: int
+        Number of stacks in the merged file.
+    """
+    if len(inln_files) != len(stack_groups_files):
+        raise ValueError('Each inline emissions file needs a stack groups file')
+    emis = [xr.open_dataset(inln_file) for inln_file in inln_files]
+    stks = [xr.open_dataset(stk_file) for stk_file in stack_groups_files]
+    try:
+        for inln_file, ds, stk in zip(inln_files, emis, stks):
+            for key in ['STIME', 'TSTEP'] if date is not None else ['SDATE', 'STIME', 'TSTEP']:
+                if np.any(ds.attrs.get(key) != emis[0].attrs.get(key)):
+                    raise ValueError(f'{inln_file} is not compatible with {inln_files[0]} ({key} differs)')
+            if ds.sizes['TSTEP'] != emis[0].sizes['TSTEP']:
+                raise ValueError(f'{inln_file} is not compatible with {inln_files[0]} (number of time steps differs)')
+            if ds.sizes['ROW'] != stk.sizes['ROW']:
+                raise ValueError(f'{inln_file} and its stack groups file have a different number of stacks')
+        n_stacks = [ds.sizes['ROW'] for ds in emis]
+        # Emissions: concatenate each species along the stack (ROW) dimension
+        var_names = []
+        for ds in emis:
+            var_names += [var for var in ds.data_vars if (var != 'TFLAG') and (var not in var_names)]
+        n_steps = emis[0].sizes['TSTEP']
+        out_emis = xr.Dataset()
+        for var in var_names:
+            values = [ds[var].values if var in ds else np.zeros((n_steps, 1, n_stk, 1), dtype='float32')
+                      for ds, n_stk in zip(emis, n_stacks)]
+            attrs = [ds[var].attrs for ds in emis if var in ds][0]
+            out_emis[var] = (('TSTEP', 'LAY', 'ROW', 'COL'), np.concatenate(values, axis=2), attrs)
+        out_emis.attrs = dict(emis[0].attrs)
+        out_emis.attrs['NROWS'] = np.int32(sum(n_stacks))
+        tflag = emis[0]['TFLAG'].values[:, 0, :]
+        if date is not None:
+            # Stamp the time steps of the representative days with the simulation day
+            start = pd.Timestamp(date).normalize() + utils.hhmmss_to_timedelta(emis[0].attrs.get('STIME', 0))
+            tflag = utils.datetime_to_tflag(start + np.arange(n_steps) * utils.hhmmss_to_timedelta(emis[0].attrs.get('TSTEP', 10000)))
+            out_emis.attrs['SDATE'] = tflag[0, 0]
+        out_emis = utils.set_ioapi_vars(out_emis, tflag)
+        # Stack groups: concatenate the stack parameters and renumber the stacks
+        stk_vars = []
+        for stk in stks:
+            stk_vars += [var for var in stk.data_vars if (var != 'TFLAG') and (var not in stk_vars)]
+        out_stk = xr.Dataset()
+        for var in stk_vars:
+            ref_var = [stk[var] for stk in stks if var in stk][0]
+            values = [stk[var].values if var in stk else 
+                      np.zeros(ref_var.shape[:2] + (n_stk,) + ref_var.shape[3:], dtype=ref_var.dtype)
+                      for stk, n_stk in zip(stks, n_stacks)]
+            out_stk[var] = (ref_var.dims, np.concatenate(values, axis=2), ref_var.attrs)
+        if 'ISTACK' in out_stk:
+            out_stk['ISTACK'].values[0, 0, :, 0] = np.arange(1, sum(n_stacks) + 1)
+        out_stk.attrs = dict(stks[0].attrs)
+        out_stk.attrs['NROWS'] = np.int32(sum(n_stacks))
+        out_stk = utils.set_ioapi_vars(out_stk, stks[0]['TFLAG'].values[:, 0, :])
+    finally:
+        for ds in emis + stks:
+            ds.close()
+    out_emis.to_netcdf(out_inln_file, format='NETCDF3_64BIT', encoding={var: {'_FillValue': None} for var in out_emis.data_vars})
+    out_stk.to_netcdf(out_stack_groups_file, format='NETCDF3_64BIT', encoding={var: {'_FillValue': None} for var in out_stk.data_vars})
+    return sum(n_stacks)
+
+
+def emis_file_stats(file_name, sector='', var_names=None, chunk_steps=6):
+    """
+    Computes the total, minimum, maximum, and the number of negative and NaN values of each 
+    species in a gridded (`emis_mole_*`) or inline (`inln_mole_*`) emissions file. Each 
+    species is read a few time steps at a time, so only one chunk is held in memory. 
+
+    Parameters
+    ----------
+    :param file_name: string
+        Path to the emissions file (unzipped).
+    :param sector: string
+        Sector label to use in the output.
+    :param var_names: list of strings
+        Species to check. If None, all species in the file are checked.
+    :param chunk_steps: int
+        Number of time steps to read at once.
+    :return stats_df: `pandas.DataFrame`
+        One row per species with the sector, file, date, species, units, total, min, max,
+        n_neg and n_nan.
+    """
+    rows = []
+    with xr.open_dataset(file_name, mask_and_scale=False) as ds:
+        date = utils.tflag_to_datetime([ds.attrs['SDATE'], ds.attrs.get('STIME', 0)])[0].normalize()
+        if var_names is None:
+            var_names = [var for var in ds.data_vars if var != 'TFLAG']
+        n_steps = ds.sizes['TSTEP']
+        for var in var_names:
+            if var not in ds:
+                continue
+            total, vmin, vmax, n_neg, n_nan = 0.0, np.inf, -np.inf, 0, 0
+            for t0 in range(0, n_steps, chunk_steps):
+                values = ds[var].isel(TSTEP=slice(t0, t0 + chunk_steps)).values.astype('float64')
+                finite = np.isfinite(values)
+                n_nan += int(values.size - finite.sum())
+                values = values[finite]
+                if values.size > 0:
+                    total += values.sum()
+                    vmin = min(vmin, values.min())
+                    vmax = max(vmax, values.max())
+                    n_neg += int((values < 0).sum())
+            rows.append({'sector': sector, 'file': os.path.basename(file_name), 'date': date, 'species': var, 
+                         'units': str(ds[var].attrs.get('units', '')).strip(), 'total': total, 
+                         'min': vmin, 'max': vmax, 'n_neg': n_neg, 'n_nan': n_nan})
+    return pd.DataFrame(rows)
+
+
+def emis_qa(emis_files, n_procs=4, var_names=None, jump_factor=5.0, chunk_steps=6, report_file=None):
+    """
+    Runs a quick QA of the emissions inputs before running CCTM. The files are scanned in 
+    parallel with `emis_file_stats`, and each sector/species/day is flagged when it has 
+    negative values (negative), NaNs (nan), a zero total on a day when the species is emitted 
+    on other days (zero_day), or a total that changes by more than `jump_factor` from the 
+    previous day or becomes non-zero after a zero day (jump). Files that do not exist are 
+    flagged as missing. 
+
+    Parameters
+    ----------
+    :param emis_files: dict
+        Lists of emissions files keyed by sector label.
+    :param n_procs: int
+        Number of processes used to read the files. Use 1 to read them in this process.
+    :param var_names: list of strings
+        Species to check. If None, all species are checked.
+    :param jump_factor: float
+        Day-to-day ratio of the totals (in either direction) that is flagged as a jump.
+    :param chunk_steps: int
+        Number of time steps read at once from each file.
+    :param report_file: string
+        Path to a text file where a summary by sector and the flagged rows will be written.
+    :return stats_df: `pandas.DataFrame`
+        Per-sector, per-species, per-day statistics with a `flags` column.
+    """
+    sectors = [sector for sector, file_names in emis_files.items() for _ in file_names]
+    file_names = [file_name for file_names in emis_files.values() for file_name in file_names]
+    exists = [os.path.exists(file_name) for file_name in file_names]
+    missing_df = pd.DataFrame({'sector': [sector for sector, ok in zip(sectors, exists) if not ok],
+                               'file': [os.path.basename(file_name) for file_name, ok in zip(file_names, exists) if not ok]})
+    sectors = [sector for sector, ok in zip(sectors, exists) if ok]
+    file_names = [file_name for file_name, ok in zip(file_names, exists) if ok]
+    args = (file_names, sectors, repeat(var_names), repeat(chunk_steps))
+    if n_procs > 1 and len(file_names) > 1:
+        with ProcessPoolExecutor(max_workers=n_procs) as pool:
+            stats = list(pool.map(emis_file_stats, *args))
+    else:
+        stats = list(map(emis_file_stats, *args))
+    stats = [df for df in stats if len(df) > 0]
+    if len(stats) > 0:
+        stats_df = pd.concat(stats, ignore_index=True)
+    else:
+        stats_df = pd.DataFrame(columns=['sector', 'file', 'date', 'species', 'units', 'total', 'min', 'max', 'n_neg', 'n_nan'])
+    stats_df = stats_df.sort_values(['sector', 'species', 'date']).reset_index(drop=True)
+
+    # Flag the suspicious sector/species/days
+    grouped = stats_df.groupby(['sector', 'species'])['total']
+    prev_total = grouped.shift(1)
+    ratio = stats_df['total'] / prev_total
+    ratio_jump = (prev_total > 0) & ((ratio > jump_factor) | (ratio < 1 / jump_factor))
+    flags = pd.DataFrame({'negative': stats_df['n_neg'] > 0,
+                          'nan': stats_df['n_nan'] > 0,
+                          'zero_day': (stats_df['total'] == 0) & (grouped.transform('max') > 0),
+                          'jump': (stats_df['total'] > 0) & (ratio_jump | (prev_total == 0))})
+    stats_df['flags'] = [';'.join(flags.columns[row]) for row in flags.values]
+    if len(missing_df) > 0:
+        missing_df['flags'] = 'missing'
+        stats_df = pd.concat([stats_df, missing_df], ignore_index=True)
+
+    if report_file is not None:
+        flagged_df = stats_df[stats_df['flags'] != '']
+        summary_df = stats_df.groupby('sector').agg(files=('file', 'nunique'), days=('date', 'nunique'), 
+                                                    species=('species', 'nunique'), 
+                                                    flagged=('flags', lambda x: (x != '').sum()))
+        with open(report_file, 'w') as f:
+            f.write('Emissions QA summary\n')
+            f.write(summary_df.to_string() + '\n\n')
+            if len(flagged_df) > 0:
+                f.write(f'Flagged rows (jump_factor={jump_factor})\n')
+                f.write(flagged_df.drop(columns=['file']).to_string(index=False) + '\n')
+            else:
+                f.write('No problems found.\n')
+    return stats_df
+
+
+def emis_file_differs(base_file, scen_file, var_names=None):
+    """
+    Checks if a scenario emissions file differs from the base case file. Links to the
+    same file and files with the same checksum are unchanged. Otherwise, the species 
+    (and TFLAG) are compared exactly, one at a time, so files that only differ in 
+    their metadata (e.g., the file description or creation time) are unchanged.
+
+    Parameters
+    ----------
+    :param base_file: string
+        Path to the base case emissions file.
+    :param scen_file: string
+        Path to the scenario emissions file.
+    :param var_names: list of strings
+        Species to compare. If None, all species are compared.
+    :return: bool
+        True if the emissions in the files differ.
+    """
+    base_exists, scen_exists = os.path.exists(base_file), os.path.exists(scen_file)
+    if not (base_exists and scen_exists):
+        if base_exists or scen_exists:
+            return True
+        print(f'Warning: neither {base_file} nor {scen_file} exist')
+        return False
+    if os.path.realpath(base_file) == os.path.realpath(scen_file):
+        return False
+    if utils.file_checksum(base_file) == utils.file_checksum(scen_file):
+        return False
+    with xr.open_dataset(base_file, mask_and_scale=False) as base, xr.open_dataset(scen_file, mask_and_scale=False) as scen:
+        if var_names is None:
+            if set(base.data_vars) != set(scen.data_vars):
+                return True
+            var_names = list(base.data_vars)
+        for var in var_names:
+            if (var in base) != (var in scen):
+                return True
+            if var not in base:
+                continue
+            if base[var].shape != scen[var].shape:
+                return True
+            if not np.array_equal(base[var].values, scen[var].values, equal_nan=True):
+                return True
+    return False
+
+
+def emis_changes(base_files, scen_files, dates, n_procs=4, var_names=None):
+    """
+    Finds the days on which the emissions inputs of a scenario differ from those of its 
+    base case, for each sector (see `emis_file_differs`). The file pairs are compared
+    in parallel.
+
+    Parameters
+    ----------
+    :param base_files: dict
+        Lists of base case emissions files (one per day) keyed by sector label.
+    :param scen_files: dict
+        Lists of scenario emissions files keyed by sector label, in the same order.
+    :param dates: list of `datetime.datetime`
+        Date of each file in the lists.
+    :param n_procs: int
+        Number of processes used to compare the files. Use 1 to compare them in this process.
+    :param var_names: list of strings
+        Species to compare. If None, all species are compared.
+    :return changes_df: `pandas.DataFrame`
+        Booleans indexed by date with one column per sector that are True when the
+        scenario emissions differ. 
+    """
+    if set(base_files) != set(scen_files):
+        raise ValueError('The base case and scenario must have the same sectors')
+    sectors = list(base_files)
+    for sector in sectors:
+        if not (len(base_files[sector]) == len(scen_files[sector]) == len(dates)):
+            raise ValueError(f'The {sector} sector needs one base case and one scenario file for each date')
+    base_lst = [file_name for sector in sectors for file_name in base_files[sector]]
+    scen_lst = [file_name for sector in sectors for file_name in scen_files[sector]]
+    args = (base_lst, scen_lst, repeat(var_names))
+    if n_procs > 1 and len(base_lst) > 1:
+        with ProcessPoolExecutor(max_workers=n_procs) as pool:
+            differs = list(pool.map(emis_file_differs, *args))
+    else:
+        differs = list(map(emis_file_differs, *args))
+    differs = np.array(differs, dtype=bool).reshape(len(sectors), len(dates))
+    return pd.DataFrame(differs.T, index=pd.DatetimeIndex(pd.to_datetime(dates), name='date'), columns=sectors)
@@ -0,0 +1,274 @@
+"""
+Functions to aggregate CMAQ output over regions (e.g., states, counties, or NYISO zones):
+the region polygons are rasterized onto the grid once, with the fraction of each cell
+they cover, and the regional means or totals of any variable come from one sparse
+matrix product.
+"""
+
+import hashlib
+import os
+import numpy as np
+import scipy.sparse as sparse
+import xarray as xr
+from . import utils
+
+
+# Region weights of the grids (see `region_weights`)
+REGION_WEIGHTS = {}
+# Natural Earth states and provinces, as drawn by `plots`
+NATURAL_EARTH_STATES = 'admin_1_states_provinces_lakes'
+
+
+def geometry_rings(geometry):
+    """
+    Gets the rings (exteriors and holes) of a shapely Polygon or MultiPolygon.
+
+    Parameters
+    ----------
+    :param geometry: shapely geometry, or list of `numpy.ndarray`
+        Geometry in longitude and latitude. Lists of rings are returned as they are.
+    :return rings: list of `numpy.ndarray`
+        Longitudes and latitudes (n_points, 2) of each ring.
+    """
+    if isinstance(geometry, (list, tuple)):
+        return [np.asarray(ring, dtype='float64')[:, :2] for ring in geometry]
+    if hasattr(geometry, 'geoms'):
+        return [ring for part in geometry.geoms for ring in geometry_rings(part)]
+    return [np.asarray(ring.coords, dtype='float64')[:, :2] for ring in [geometry.exterior] + list(geometry.interiors)]
+
+
+def read_regions(shapefile, name_field='name', names=None):
+    """
+    Reads region polygons from a shapefile with cartopy. Records with the same name (e.g.,
+    the parts of a zone) are merged into one region.
+
+    Parameters
+    ----------
+    :param shapefile: string
+        Path to a shapefile in longitude and latitude (EPSG:4326), or 'states' for the
+        Natural Earth states and provinces used by `plots`.
+    :param name_field: string
+        Attribute with the region names (e.g., name for 'states').
+    :param names: list of strings
+        Regions to read. Defaults to all the regions.
+    :return regions: dict
+        Rings of each region (see `geometry_rings`).
+    """
+    import cartopy.io.shapereader as shpreader
+    if shapefile == 'states':
+        shapefile = shpreader.natural_earth(resolution='10m', category='cultural', name=NATURAL_EARTH_STATES)
+    regions = {}
+    for record in shpreader.Reader(shapefile).records():
+        name = str(record.attributes[name_field])
+        if (names is None) or (name in names):
+            regions.setdefault(name, []).extend(geometry_rings(record.geometry))
+    if len(regions) == 0:
+        raise ValueError(f'No regions were found in {shapefile} (name_field = {name_field}, names = {names})')
+    return regions
+
+
+def scanline_inside(xs, ys, rings):
+    """
+    Tests which points of a regular lattice are inside a set of rings (even-odd rule, so
+    holes and multiple parts are handled). Each edge crossing is added to its lattice row
+    at once, so the cost grows with the number of edges and rows rather than points.
+
+    Parameters
+    ----------
+    :param xs: `numpy.ndarray`
+        Increasing x coordinates of the lattice columns.
+    :param ys: `numpy.ndarray`
+        Increasing y coordinates of the lattice rows.
+    :param rings: list of `numpy.ndarray`
+        x and y coordinates (n_points, 2) of each ring.
+    :return inside: `numpy.ndarray`
+        Boolean array (len(ys), len(xs)).
+    """
+    crossings = np.zeros((len(ys), len(xs) + 1), dtype='int32')
+    for ring in rings:
+        x_0, y_0 = ring[:, 0], ring[:, 1]
+        x_1, y_1 = np.roll(x_0, -1), np.roll(y_0, -1)
+        # Lattice rows with y_lo <= y < y_hi cross each (non-horizontal) edge
+        row_lo = np.searchsorted(ys, np.minimum(y_0, y_1), side='left')
+        row_hi = np.searchsorted(ys, np.maximum(y_0, y_1), side='left')
+        n_rows = row_hi - row_lo
+        edges = np.repeat(np.arange(len(ring)), n_rows)
+        if len(edges) == 0:
+            continue
+        rows = row_lo[edges] + np.arange(len(edges)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+        t = (ys[rows] - y_0[edges]) / (y_1[edges] - y_0[edges])
+        x_cross = x_0[edges] + t * (x_1[edges] - x_0[edges])
+        # Points to the left of a crossing (index < k) are toggled
+        np.add.at(crossings, (rows, np.searchsorted(xs, x_cross, side='left')), 1)
+    # Number of crossings to the right of each point
+    right = np.cumsum(crossings[:, ::-1], axis=1)[:, ::-1]
+    return right[:, 1:] % 2 == 1
+
+
+def polygon_coverage(grid, rings, n_sub=5):
+    """
+    Computes the fraction of each grid cell covered by a region, from n_sub x n_sub
+    sample points per cell. Only the cells in the region's bounding box are sampled.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (Lambert conformal).
+    :param rings: list of `numpy.ndarray`
+        Longitudes and latitudes (n_points, 2) of the region's rings.
+    :param n_sub: int
+        Number of sample points along each side of a cell.
+    :return rows, cols, fractions: `numpy.ndarray`
+        Row and column indices of the covered cells and their coverage fractions.
+    """
+    cell_rings = []
+    for ring in rings:
+        if (np.abs(ring[:, 0]) > 360).any() or (np.abs(ring[:, 1]) > 90).any():
+            raise ValueError('The region polygons must be in longitude and latitude (EPSG:4326)')
+        x, y = utils.lcc_forward(ring[:, 0], ring[:, 1], grid)
+        cell_rings.append(np.column_stack([(x - float(grid['XORIG'])) / float(grid['XCELL']),
+                                           (y - float(grid['YORIG'])) / float(grid['YCELL'])]))
+    bounds = np.concatenate(cell_rings)
+    col_lo, col_hi = max(int(np.floor(bounds[:, 0].min())), 0), min(int(np.ceil(bounds[:, 0].max())), int(grid['NCOLS']))
+    row_lo, row_hi = max(int(np.floor(bounds[:, 1].min())), 0), min(int(np.ceil(bounds[:, 1].max())), int(grid['NROWS']))
+    if (col_hi <= col_lo) or (row_hi <= row_lo):
+        return np.array([], dtype='int64'), np.array([], dtype='int64'), np.array([])
+    offsets = (np.arange(n_sub) + 0.5) / n_sub
+    xs = (np.arange(col_lo, col_hi)[:, None] + offsets).ravel()
+    ys = (np.arange(row_lo, row_hi)[:, None] + offsets).ravel()
+    inside = scanline_inside(xs, ys, cell_rings)
+    coverage = inside.reshape(row_hi - row_lo, n_sub, col_hi - col_lo, n_sub).mean(axis=(1, 3))
+    rows, cols = np.nonzero(coverage)
+    return rows + row_lo, cols + col_lo, coverage[rows, cols]
+
+
+def rasterize_regions(grid, regions, n_sub=5):
+    """
+    Rasterizes regions onto a grid as a sparse matrix of cell coverage fractions.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (Lambert conformal).
+    :param regions: dict
+        Rings or shapely geometry of each region, in longitude and latitude.
+    :param n_sub: int
+        Number of sample points along each side of a cell (see `polygon_coverage`).
+    :return names, weights: list of strings, `scipy.sparse.csr_matrix`
+        Region names and their coverage of the flattened grid (n_regions, NROWS * NCOLS).
+    """
+    n_cols = int(grid['NCOLS'])
+    names, region_index, cell_index, fractions = list(regions.keys()), [], [], []
+    for ii, name in enumerate(names):
+        rows, cols, fraction = polygon_coverage(grid, geometry_rings(regions[name]), n_sub=n_sub)
+        if len(fraction) == 0:
+            print(f'Warning: region {name} does not overlap the grid')
+        region_index.append(np.full(len(fraction), ii))
+        cell_index.append(rows * n_cols + cols)
+        fractions.append(fraction)
+    weights = sparse.csr_matrix((np.concatenate(fractions), (np.concatenate(region_index), np.concatenate(cell_index))),
+                                shape=(len(names), int(grid['NROWS']) * n_cols))
+    return names, weights
+
+
+def region_weights(grid, regions, name_field='name', names=None, n_sub=5, cache_dir=None):
+    """
+    Gets the sparse coverage weights of regions on a grid (see `rasterize_regions`). They
+    are computed once per grid and set of regions and kept in REGION_WEIGHTS and, optionally,
+    in cache_dir, so other analyses and runs on the same grid reuse them.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (e.g., the attributes of a CCTM file).
+    :param regions: string or dict
+        Shapefile (see `read_regions`) or the rings or shapely geometry of each region.
+    :param name_field: string
+        Shapefile attribute with the region names.
+    :param names: list of strings
+        Shapefile regions to use. Defaults to all the regions.
+    :param n_sub: int
+        Number of sample points along each side of a cell.
+    :param cache_dir: string
+        Directory where the weights are saved.
+    :return names, weights: list of strings, `scipy.sparse.csr_matrix`
+        Region names and their coverage of the flattened grid (n_regions, NROWS * NCOLS).
+    """
+    if isinstance(regions, str):
+        source = regions if regions == 'states' else utils.file_checksum(regions)
+        region_key = hashlib.md5(f'{source} {name_field} {names} {n_sub}'.encode()).hexdigest()[:8]
+    else:
+        md5 = hashlib.md5(f'{n_sub}'.encode())
+        for name, geometry in regions.items():
+            md5.update(str(name).encode())
+            for ring in geometry_rings(geometry):
+                md5.update(np.ascontiguousarray(ring).tobytes())
+        region_key = md5.hexdigest()[:8]
+    key = f'{utils.grid_key(grid)}_{region_key}'
+    if key in REGION_WEIGHTS:
+        return REGION_WEIGHTS[key]
+    cache_file = None if cache_dir is None else f'{cache_dir}/regions_{key}.npz'
+    if (cache_file is not None) and os.path.exists(cache_file):
+        with np.load(cache_file) as saved:
+            weights = sparse.csr_matrix((saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape']))
+            REGION_WEIGHTS[key] = (saved['names'].tolist(), weights)
+        return REGION_WEIGHTS[key]
+    if isinstance(regions, str):
+        regions = read_regions(regions, name_field=name_field, names=names)
+    REGION_WEIGHTS[key] = rasterize_regions(grid, regions, n_sub=n_sub)
+    if cache_file is not None:
+        utils.make_dirs(cache_dir)
+        region_names, weights = REGION_WEIGHTS[key]
+        np.savez(cache_file, data=weights.data, indices=weights.indices, indptr=weights.indptr,
+                 shape=np.array(weights.shape), names=np.array(region_names))
+    return REGION_WEIGHTS[key]
+
+
+def regional_series(ds, names, weights, how='mean'):
+    """
+    Aggregates every time step (and layer) of gridded data over the regions with one sparse
+    matrix product per chunk. Means are weighted by the cell coverage fractions (the cells
+    of a Lambert conformal grid have nearly equal areas). Regions that do not cover any
+    cell (e.g., outside the grid) are NaN.
+
+    Parameters
+    ----------
+    :param ds: `xarray.Dataset` or `xarray.DataArray`
+        Gridded data with the y and x dimensions (e.g., from `postcmaq.open_cctm`).
+    :param names: list of strings
+        Region names (see `region_weights`).
+    :param weights: `scipy.sparse.csr_matrix`
+        Coverage of the flattened grid (n_regions, NROWS * NCOLS).
+    :param how: string
+        'mean' for coverage-weighted means, or 'sum' for coverage-weighted totals (e.g.,
+        of emissions or deposition per cell).
+    :return region_ds: `xarray.Dataset` or `xarray.DataArray`
+        Regional values with the region dimension instead of (y, x).
+    """
+    n_cells = ds.sizes['y'] * ds.sizes['x']
+    if weights.shape != (len(names), n_cells):
+        raise ValueError(f'The weights {weights.shape} do not match {len(names)} regions on a grid of {n_cells} cells')
+    coverage = np.asarray(weights.sum(axis=1)).ravel()
+    mask = coverage <= 0
+    if how == 'mean':
+        with np.errstate(divide='ignore'):
+            weights = sparse.diags(np.where(mask, 0., 1. / coverage)) @ weights
+    elif how != 'sum':
+        raise ValueError(f'how must be mean or sum, not {how}')
+    weights_t = sparse.csr_matrix(weights.T)
+
+    def aggregate(values):
+        flat = values.reshape(-1, n_cells)
+        out = np.asarray(flat @ weights_t)
+        out[:, mask] = np.nan
+        return out.reshape(values.shape[:-2] + (len(names),))
+
+    ds = ds.drop_vars([coord for coord in ['latitude', 'longitude'] if coord in ds.coords])
+    if isinstance(ds, xr.Dataset):
+        ds = ds[[var for var in ds.data_vars if ('y' in ds[var].dims) and ('x' in ds[var].dims)]]
+    if ds.chunks:
+        ds = ds.chunk({'y': -1, 'x': -1})
+    region_ds = xr.apply_ufunc(aggregate, ds, input_core_dims=[['y', 'x']], output_core_dims=[['region']],
+                               dask='parallelized', output_dtypes=['float64'], keep_attrs=True,
+                               dask_gufunc_kwargs={'output_sizes': {'region': len(names)}})
+    return region_ds.assign_coords(region=list(names))
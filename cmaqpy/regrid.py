@@ -0,0 +1,237 @@
+"""
+Functions to regrid CMAQ output between grids (e.g., the 12-km and 4-km domains): the
+weights are computed once from the cell polygons in the Lambert conformal projection and
+kept as a sparse matrix, so regridding any variable and time range is a sparse product.
+"""
+
+import os
+import numpy as np
+import scipy.sparse as sparse
+import xarray as xr
+from . import utils
+from .evaluate import GridLocator
+from .postcmaq import grid_coords
+
+
+# Regridding weights between grids (see `regrid_weights`)
+REGRID_WEIGHTS = {}
+# Attributes that define a grid's coordinate system, and the rest of the grid
+PROJ_ATTRS = ['GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT']
+GRID_ATTRS = PROJ_ATTRS + ['GDNAM', 'XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS']
+
+
+def same_projection(src_grid, dst_grid):
+    """
+    Checks whether two grids are on the same projection, so their cells are aligned
+    rectangles in the same projected coordinates.
+
+    Parameters
+    ----------
+    :param src_grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :param dst_grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :return: bool
+    """
+    return all([np.isclose(float(src_grid[key]), float(dst_grid[key])) for key in PROJ_ATTRS])
+
+
+def overlap_1d(src_edges, dst_edges):
+    """
+    Computes the fraction of each destination interval that each source interval covers.
+
+    Parameters
+    ----------
+    :param src_edges: `numpy.ndarray`
+        Increasing edges of the source intervals (n_src + 1).
+    :param dst_edges: `numpy.ndarray`
+        Increasing edges of the destination intervals (n_dst + 1).
+    :return overlap: `numpy.ndarray`
+        Covered fractions (n_dst, n_src).
+    """
+    lo = np.maximum(dst_edges[:-1, None], src_edges[None, :-1])
+    hi = np.minimum(dst_edges[1:, None], src_edges[None, 1:])
+    return np.clip(hi - lo, 0., None) / np.diff(dst_edges)[:, None]
+
+
+def cell_edges(grid):
+    """
+    Gets the projected x and y coordinates (m) of the cell edges of a grid.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :return x_edges, y_edges: `numpy.ndarray`
+        Edges along the columns (NCOLS + 1) and rows (NROWS + 1).
+    """
+    return (float(grid['XORIG']) + np.arange(int(grid['NCOLS']) + 1) * float(grid['XCELL']),
+            float(grid['YORIG']) + np.arange(int(grid['NROWS']) + 1) * float(grid['YCELL']))
+
+
+def conservative_weights(src_grid, dst_grid, n_sub=5):
+    """
+    Computes area-weighted (first-order conservative) regridding weights: the fraction of
+    each destination cell covered by each source cell. When the grids share a projection,
+    their cells are aligned rectangles and the overlaps are exact products of the row and
+    column overlaps. Otherwise, each destination cell is sampled with n_sub x n_sub points
+    that are located on the source grid.
+
+    Parameters
+    ----------
+    :param src_grid: dict
+        Grid parameters of the source grid using the IOAPI attribute names.
+    :param dst_grid: dict
+        Grid parameters of the destination grid.
+    :param n_sub: int
+        Number of sample points along each side of a destination cell (only used when the
+        projections differ).
+    :return weights: `scipy.sparse.csr_matrix`
+        Weights (NROWS * NCOLS of dst_grid, NROWS * NCOLS of src_grid). Rows sum to the
+        fraction of the destination cell inside the source grid.
+    """
+    if same_projection(src_grid, dst_grid):
+        src_x, src_y = cell_edges(src_grid)
+        dst_x, dst_y = cell_edges(dst_grid)
+        # The cells are numbered row by row, so the 2D overlaps are Kronecker products
+        return sparse.kron(sparse.csr_matrix(overlap_1d(src_y, dst_y)), sparse.csr_matrix(overlap_1d(src_x, dst_x)), format='csr')
+    n_cols, n_rows = int(dst_grid['NCOLS']), int(dst_grid['NROWS'])
+    offsets = (np.arange(n_sub) + 0.5) / n_sub
+    x = float(dst_grid['XORIG']) + (np.arange(n_cols)[:, None] + offsets).ravel() * float(dst_grid['XCELL'])
+    y = float(dst_grid['YORIG']) + (np.arange(n_rows)[:, None] + offsets).ravel() * float(dst_grid['YCELL'])
+    lon, lat = utils.lcc_inverse(*np.meshgrid(x, y), dst_grid)
+    rows, cols, inside = GridLocator(src_grid).nearest(lat, lon)
+    sample_rows, sample_cols = np.meshgrid(np.arange(n_rows).repeat(n_sub), np.arange(n_cols).repeat(n_sub), indexing='ij')
+    dst_index = (sample_rows * n_cols + sample_cols)[inside]
+    src_index = (rows * int(src_grid['NCOLS']) + cols)[inside]
+    # Repeated (dst, src) pairs are summed
+    return sparse.csr_matrix((np.full(len(dst_index), 1. / n_sub**2), (dst_index, src_index)),
+                             shape=(n_rows * n_cols, int(src_grid['NROWS']) * int(src_grid['NCOLS'])))
+
+
+def bilinear_weights(src_grid, dst_grid):
+    """
+    Computes bilinear interpolation weights from the source cell centers to the destination
+    cell centers (see `evaluate.GridLocator.bilinear`).
+
+    Parameters
+    ----------
+    :param src_grid: dict
+        Grid parameters of the source grid using the IOAPI attribute names.
+    :param dst_grid: dict
+        Grid parameters of the destination grid.
+    :return weights: `scipy.sparse.csr_matrix`
+        Weights (NROWS * NCOLS of dst_grid, NROWS * NCOLS of src_grid). Rows of the
+        destination cells outside the source grid are empty.
+    """
+    lon, lat = utils.grid_lonlat(dst_grid)
+    rows, cols, weights, inside = GridLocator(src_grid).bilinear(lat.ravel(), lon.ravel())
+    dst_index = np.repeat(np.arange(lat.size), 4).reshape(-1, 4)
+    src_index = rows * int(src_grid['NCOLS']) + cols
+    return sparse.csr_matrix((weights[inside].ravel(), (dst_index[inside].ravel(), src_index[inside].ravel())),
+                             shape=(lat.size, int(src_grid['NROWS']) * int(src_grid['NCOLS'])))
+
+
+def regrid_weights(src_grid, dst_grid, method='conservative', n_sub=5, cache_dir=None):
+    """
+    Gets the regridding weights between two grids. They are computed once per pair of grids
+    and method, and kept in REGRID_WEIGHTS and, optionally, in cache_dir.
+
+    Parameters
+    ----------
+    :param src_grid: dict
+        Grid parameters of the source grid using the IOAPI attribute names (e.g., the
+        attributes of a CCTM file or the output of `utils.read_griddesc`).
+    :param dst_grid: dict
+        Grid parameters of the destination grid.
+    :param method: string
+        'conservative' (see `conservative_weights`) or 'bilinear' (see `bilinear_weights`).
+    :param n_sub: int
+        Number of sample points along each side of a destination cell for conservative
+        weights between different projections.
+    :param cache_dir: string
+        Directory where the weights are saved.
+    :return weights: `scipy.sparse.csr_matrix`
+        Weights (destination cells, source cells).
+    """
+    if method not in ['conservative', 'bilinear']:
+        raise ValueError(f'method must be conservative or bilinear, not {method}')
+    key = f'{utils.grid_key(src_grid)}_to_{utils.grid_key(dst_grid)}_{method}'
+    if (method == 'conservative') and not same_projection(src_grid, dst_grid):
+        key += f'_{n_sub}'
+    if key in REGRID_WEIGHTS:
+        return REGRID_WEIGHTS[key]
+    cache_file = None if cache_dir is None else f'{cache_dir}/regrid_{key}.npz'
+    if (cache_file is not None) and os.path.exists(cache_file):
+        REGRID_WEIGHTS[key] = sparse.load_npz(cache_file).tocsr()
+        return REGRID_WEIGHTS[key]
+    if method == 'conservative':
+        weights = conservative_weights(src_grid, dst_grid, n_sub=n_sub)
+    else:
+        weights = bilinear_weights(src_grid, dst_grid)
+    weights.eliminate_zeros()
+    REGRID_WEIGHTS[key] = weights
+    if cache_file is not None:
+        utils.make_dirs(cache_dir)
+        sparse.save_npz(cache_file, weights)
+    return weights
+
+
+def regrid(ds, dst_grid, method='conservative', weights=None, min_coverage=0.5, cache_dir=None):
+    """
+    Regrids every time step (and layer) of gridded data with one sparse matrix product per
+    chunk. Destination cells covered less than min_coverage by the source grid are NaN.
+
+    Parameters
+    ----------
+    :param ds: `xarray.Dataset` or `xarray.DataArray`
+        Gridded data with the y and x dimensions and the grid attributes (e.g., from
+        `postcmaq.open_cctm`).
+    :param dst_grid: dict
+        Grid parameters of the destination grid (e.g., from `utils.read_griddesc`).
+    :param method: string
+        'conservative' or 'bilinear' (see `regrid_weights`).
+    :param weights: `scipy.sparse.csr_matrix`
+        Precomputed weights. Defaults to those of the grid of ds (see `regrid_weights`).
+    :param min_coverage: float
+        Smallest fraction of a destination cell that must be inside the source grid.
+    :param cache_dir: string
+        Directory where the weights are saved.
+    :return dst_ds: `xarray.Dataset` or `xarray.DataArray`
+        Data on the destination grid, with its latitudes, longitudes, and grid attributes.
+    """
+    n_src = ds.sizes['y'] * ds.sizes['x']
+    n_rows, n_cols = int(dst_grid['NROWS']), int(dst_grid['NCOLS'])
+    if weights is None:
+        weights = regrid_weights(ds.attrs, dst_grid, method=method, cache_dir=cache_dir)
+    if weights.shape != (n_rows * n_cols, n_src):
+        raise ValueError(f'The weights {weights.shape} do not match the grids ({n_rows * n_cols}, {n_src})')
+    coverage = np.asarray(weights.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(coverage >= min_coverage, 1. / coverage, np.nan)
+    weights_t = sparse.csr_matrix((sparse.diags(np.nan_to_num(scale)) @ weights).T)
+    mask = np.isnan(scale)
+
+    def apply_weights(values):
+        flat = values.reshape(-1, n_src)
+        out = np.asarray(flat @ weights_t)
+        out[:, mask] = np.nan
+        return out.reshape(values.shape[:-2] + (n_rows, n_cols))
+
+    attrs = dict(ds.attrs)
+    ds = ds.drop_vars([coord for coord in ['latitude', 'longitude'] if coord in ds.coords])
+    if isinstance(ds, xr.Dataset):
+        ds = ds[[var for var in ds.data_vars if ('y' in ds[var].dims) and ('x' in ds[var].dims)]]
+    if ds.chunks:
+        ds = ds.chunk({'y': -1, 'x': -1})
+    dst_ds = xr.apply_ufunc(apply_weights, ds, input_core_dims=[['y', 'x']], output_core_dims=[['dst_y', 'dst_x']],
+                            dask='parallelized', output_dtypes=['float64'], keep_attrs=True,
+                            dask_gufunc_kwargs={'output_sizes': {'dst_y': n_rows, 'dst_x': n_cols}})
+    dst_ds = dst_ds.rename({'dst_y': 'y', 'dst_x': 'x'})
+    lat, lon = grid_coords(dst_grid)
+    dst_ds = dst_ds.assign_coords(latitude=(('y', 'x'), lat), longitude=(('y', 'x'), lon))
+    attrs.update({key: dst_grid[key] for key in GRID_ATTRS if key in dst_grid})
+    attrs['proj4_srs'] = utils.grid_proj4(dst_grid)
+    attrs['REGRID_METHOD'] = method
+    dst_ds.attrs = attrs
+    return dst_ds
@@ -1,8 +1,19 @@
+import copy
 import datetime
+import glob
 import os
 import sys
 import time
-from . import utils
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import xarray as xr
+from . import evaluate, metrics, utils
+from .postcmaq import combine, day_complete, open_cctm, postprocess_day
+from .prepemis import emis_changes, emis_qa, merge_gridded, merge_inline
+from .regions import region_weights, regional_series
+from .regrid import regrid, regrid_weights
+from .runsmoke import SLURM_ACTIVE_STATES
 from .data.fetch_data import fetch_yaml
 
 
@@ -57,12 +68,17 @@ class CMAQModel:
         Method for creating boundary conditions. Options are [profile, regrid].
     :param verbose: bool
         When True, additional information is prited to the screen about simulation progress.
+    :param base_sim: `CMAQModel`
+        Base case simulation to hot-start from (see `hot_start`). 
+    :param hot_start_date: string
+        Date on which this simulation diverges from `base_sim`. The simulation starts on
+        this date from the base case's CGRID file for the previous day.
 
     See also
     --------
     SMOKEModel: setup and run the SMOKE model. 
     """
-    def __init__(self, start_datetime, end_datetime, appl, coord_name, grid_name, chem_mech='cb6r3_ae7_aq', cctm_vrsn='v533', setup_yaml='dirpaths.yml', compiler='gcc', compiler_vrsn='9.3.1', new_mcip=True, new_icon=False, icon_vrsn='v532', icon_type='regrid', new_bcon=True, bcon_vrsn='v532', bcon_type='regrid', verbose=False):
+    def __init__(self, start_datetime, end_datetime, appl, coord_name, grid_name, chem_mech='cb6r3_ae7_aq', cctm_vrsn='v533', setup_yaml='dirpaths.yml', compiler='gcc', compiler_vrsn='9.3.1', new_mcip=True, new_icon=False, icon_vrsn='v532', icon_type='regrid', new_bcon=True, bcon_vrsn='v532', bcon_type='regrid', verbose=False, base_sim=None, hot_start_date=None):
         self.appl = appl
         self.coord_name = coord_name
         self.grid_name = grid_name
@@ -78,6 +94,8 @@ class CMAQModel:
         self.bcon_type = bcon_type
         self.verbose = verbose
         self.cctm_runid = f'{self.cctm_vrsn}_{self.compiler}{self.compiler_vrsn}_{self.appl}'
+        # Label for the CCTM scripts and logs (differs from appl for the segments of a parallel-in-time run)
+        self.cctm_appl = self.appl
         if self.verbose:
             print(f'Application name: {self.appl}\nCoordinate name: {self.coord_name}\nGrid name: {self.grid_name}')
             print(f'CCTM RUNID: {self.cctm_runid}')
@@ -137,6 +155,8 @@ class CMAQModel:
         self.CCTM_PT = f'{self.CCTM_INPDIR}/emis/inln_point'
         self.CCTM_LAND = f'{self.CCTM_INPDIR}/land'
         self.POST = f'{self.CMAQ_DATA}/{self.appl}/post'
+        # Values that only depend on the grid (e.g., time zones) are shared by all runs
+        self.GRID_CACHE = f'{self.CMAQ_DATA}/grid_cache'
         if new_icon:
             self.LOC_IC = self.CCTM_OUTDIR
         else:
@@ -151,6 +171,7 @@ class CMAQModel:
         self.LOC_IN_PT = self.dirpaths.get('LOC_IN_PT')
         self.LOC_ERTAC = self.dirpaths.get('LOC_ERTAC')
         self.LOC_SMK_MERGE_DATES = self.dirpaths.get('LOC_SMK_MERGE_DATES')
+        self.rep_dates = utils.RepDates(self.LOC_SMK_MERGE_DATES)
         self.LOC_LAND = self.dirpaths.get('LOC_LAND')
         self.DIR_TEMPLATES = self.dirpaths.get('DIR_TEMPLATES')
         self.InMetDir = self.dirpaths.get('InMetDir')
@@ -170,6 +191,61 @@ class CMAQModel:
         self.CMD_RM = 'rm %s'
         self.CMD_GUNZIP = 'gunzip %s'
 
+        # Optionally start from a base case simulation
+        self.base_sim = None
+        self.hot_start_date = None
+        if (base_sim is not None) and (hot_start_date is not None):
+            self.hot_start(base_sim, hot_start_date)
+
+    def hot_start(self, base_sim, hot_start_date):
+        """
+        Sets up this simulation (e.g., an emissions scenario) to start from a base case 
+        simulation that uses the same meteorology and whose emissions only differ from 
+        `hot_start_date` on. The base case's CGRID, MEDIA_CONC, and SOILOUT files for the 
+        previous day are linked into CCTM_OUTDIR as the restart files, the start date is 
+        moved to `hot_start_date`, and CCTM will be run as a restart (NEW_START = FALSE).
+
+        Parameters
+        ----------
+        :param base_sim: `CMAQModel`
+            Base case simulation that has been run through the day before `hot_start_date`.
+        :param hot_start_date: string
+            First day on which this simulation differs from the base case.
+        :return n_files: int
+            Number of restart files linked.
+        """
+        if isinstance(hot_start_date, str):
+            hot_start_date = utils.format_date(hot_start_date)
+        if base_sim.grid_name != self.grid_name:
+            raise ValueError(f'The base case grid ({base_sim.grid_name}) does not match this grid ({self.grid_name})')
+        if (hot_start_date < self.start_datetime) or (hot_start_date > self.end_datetime):
+            raise ValueError(f'hot_start_date must be between {self.start_datetime} and {self.end_datetime}')
+        yesterday = (hot_start_date - datetime.timedelta(days=1)).strftime('%Y%m%d')
+        base_cgrid = f'{base_sim.CCTM_OUTDIR}/CCTM_CGRID_{base_sim.cctm_runid}_{yesterday}.nc'
+        if not os.path.exists(base_cgrid):
+            raise ValueError(f'The base case has no CGRID file for {yesterday} ({base_cgrid})')
+        # Link the restart files for the day before the hot start
+        utils.make_dirs(self.CCTM_OUTDIR)
+        cmd = 'echo "Linking restart files..."'
+        n_files = 0
+        for prefix in ['CGRID', 'MEDIA_CONC', 'SOILOUT']:
+            base_file = f'{base_sim.CCTM_OUTDIR}/CCTM_{prefix}_{base_sim.cctm_runid}_{yesterday}.nc'
+            if os.path.exists(base_file):
+                cmd = cmd + '; ' + self.CMD_LN % (base_file, f'{self.CCTM_OUTDIR}/CCTM_{prefix}_{self.cctm_runid}_{yesterday}.nc')
+                n_files += 1
+            else:
+                print(f'Warning: the base case has no {prefix} file for {yesterday}')
+        os.system(cmd)
+        # Start this simulation on the hot start date
+        self.base_sim = base_sim
+        self.hot_start_date = hot_start_date
+        self.start_datetime = hot_start_date
+        self.delt = self.end_datetime - self.start_datetime
+        self.LOC_IC = base_sim.CCTM_OUTDIR
+        if self.verbose:
+            print(f'Hot-starting {self.appl} on {hot_start_date.strftime("%Y-%m-%d")} from {base_sim.appl}')
+        return n_files
+
     def run_mcip(self, mcip_start_datetime=None, mcip_end_datetime=None, metfile_list=[], geo_file='geo_em.d01.nc', t_step=60, run_hours=4, setup_only=False):
         """
         Setup and run MCIP, which formats meteorological files (e.g. wrfout*.nc) for CMAQ.
@@ -613,16 +689,13 @@ class CMAQModel:
         # Make a list of the start dates for date-specific inputs
         start_datetimes_lst = [single_date for single_date in (self.start_datetime + datetime.timedelta(n) for n in range(self.delt.days + 1))]
 
-        # Make lists of representative days
-        # These are necessary because some of the point sectors use representative days
-        # Right now, this simply links the smoke merge dates, but it could actually use the representative days at some point in the future
+        # Link the smoke merge dates, which the run script uses to find the representative days
+        # that some of the point sectors use
         utils.make_dirs(f'{self.CCTM_INPDIR}/emis')
         cmd = 'echo "Starting to link files..."'
-        for date in start_datetimes_lst:
-            cmd = cmd + '; ' + self.CMD_LN % (f'{self.LOC_SMK_MERGE_DATES}/smk_merge_dates_{date.strftime("%Y%m")}*', f'{self.CCTM_INPDIR}/emis')
+        for month in sorted(set([date.strftime("%Y%m") for date in start_datetimes_lst])):
+            cmd = cmd + '; ' + self.CMD_LN % (f'{self.LOC_SMK_MERGE_DATES}/smk_merge_dates_{month}*', f'{self.CCTM_INPDIR}/emis')
         os.system(cmd)
-        mwdss_N_lst = utils.get_rep_dates(f'{self.LOC_SMK_MERGE_DATES}', start_datetimes_lst, date_type='  mwdss_N')
-        mwdss_Y_lst = utils.get_rep_dates(f'{self.LOC_SMK_MERGE_DATES}', start_datetimes_lst, date_type='  mwdss_Y')
 
         # Link the GRIDDESC to $INPDIR
         cmd = self.CMD_LN % (self.GRIDDESC, f'{self.CCTM_INPDIR}/')
@@ -663,7 +736,9 @@ class CMAQModel:
         for ii in range(n_emis_pt + 1):
             if self.verbose:
                     print(f'Linking the {pt_emis_labs[ii-1]} sector emissions')
-            for date in start_datetimes_lst:
+            # Sectors that use representative days only need the files for those days
+            emis_name = self.filenames.get(f'STK_EMIS_{str((ii - 1) % n_emis_pt + 1).zfill(3)}', '')
+            for date in self.emis_dates(emis_name, start_datetimes_lst):
                 # Link the day-dependent point sector emissions file
                 if pt_emis_labs[ii-1] == 'ptertac':
                     local_point_file = f'{self.LOC_ERTAC}/inln_mole_ptertac_{date.strftime("%Y%m%d")}*'
@@ -673,6 +748,7 @@ class CMAQModel:
                     print(f'... Linking: {local_point_file}')
                 cmd = cmd + '; ' + self.CMD_LN % (local_point_file, f'{self.CCTM_PT}/')
                 cmd_gunzip = cmd_gunzip + ' >/dev/null 2>&1; ' +  self.CMD_GUNZIP % (local_point_file)
+            for date in start_datetimes_lst:
                 # Link the day-dependent stack groups file (e.g., for fire sectors)
                 if stkgrps_daily[ii-1]:
                     local_stkgrps_file = f'{self.LOC_IN_PT}/{pt_emis_labs[ii-1]}/stack_groups_{pt_emis_labs[ii-1]}_{date.strftime("%Y%m%d")}*'
@@ -711,13 +787,344 @@ class CMAQModel:
         # Remove broken links from the input dir
         os.system(f'find {self.CCTM_INPDIR} -xtype l -delete')    
     
+    def expand_emis_name(self, name, date, stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j'):
+        """
+        Fills in the csh variables used in the emissions file names in the yaml file 
+        (e.g., ${YYYYMMDD}, ${mwdss_N}, ${STKCASEE}) for a single date.
+
+        Parameters
+        ----------
+        :param name: string
+            File name from the file_names section of the yaml file.
+        :param date: `datetime.datetime`
+            Simulation date.
+        :param stkcaseg: string
+            Stack group version label.
+        :param stkcasee: string
+            Stack emission version label
+        :return name: string
+            File name for this date.
+        """
+        name = name.replace('${YYYYMMDD}', date.strftime('%Y%m%d'))
+        name = name.replace('${GRID_NAME}', self.grid_name)
+        name = name.replace('${STKCASEG}', stkcaseg).replace('${STKCASEE}', stkcasee)
+        for date_type in self.rep_dates.DATE_TYPES:
+            if f'${{{date_type}}}' in name:
+                rep_date = self.rep_dates.lookup([date], date_type)[0]
+                name = name.replace(f'${{{date_type}}}', rep_date.strftime('%Y%m%d'))
+        return name
+
+    def emis_dates(self, name, dates):
+        """
+        Gets the dates of the emissions files needed for a list of simulation dates. 
+        If the file name from the yaml file uses a representative date (e.g., ${mwdss_N}),
+        these are the unique representative dates. Otherwise, they are the simulation dates.
+
+        Parameters
+        ----------
+        :param name: string
+            File name from the file_names section of the yaml file.
+        :param dates: list of `datetime.datetime`
+            Simulation dates.
+        :return: list of `Timestamp` (or `datetime.datetime`)
+            Dates of the emissions files.
+        """
+        for date_type in self.rep_dates.DATE_TYPES:
+            if f'${{{date_type}}}' in name:
+                return list(self.rep_dates.unique(dates, date_type))
+        return dates
+
+    def merge_emissions(self, gr_emis_labs=['all', 'rwc'], 
+        pt_emis_labs=['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12'],
+        stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j', 
+        merge_gr=True, merge_pt=True, keep_labs=[], gr_merge_lab='gr_merged', pt_merge_lab='pt_merged'):
+        """
+        Merges the emissions sectors linked by `setup_inpdir` so that CCTM opens fewer files 
+        each hour: the gridded sectors are summed into one file per day, and the inline point
+        sectors are combined into a single stack list per day (see `prepemis.merge_gridded` 
+        and `prepemis.merge_inline`). The merged point files are stamped with the simulation
+        day, including the sectors that use representative days. Sectors listed in 
+        `keep_labs` keep their own stream. 
+
+        Parameters
+        ----------
+        :param gr_emis_labs: list of strings
+            Labels for each of the gridded emissions sectors.
+        :param pt_emis_labs: list of strings
+            Labels for each of the point emissions sectors.
+        :param stkcaseg: string
+            Stack group version label.
+        :param stkcasee: string
+            Stack emission version label
+        :param merge_gr: bool
+            Option to merge the gridded sectors.
+        :param merge_pt: bool
+            Option to merge the inline point sectors.
+        :param keep_labs: list of strings
+            Labels of sectors that should not be merged.
+        :param gr_merge_lab: string
+            Label for the merged gridded stream.
+        :param pt_merge_lab: string
+            Label for the merged point stream.
+        :return gr_streams: list of dicts
+            Label and (csh) file path of each gridded emissions stream for the CCTM run script. 
+        :return pt_streams: list of dicts
+            Label and (csh) file paths of each point emissions stream for the CCTM run script. 
+        """
+        gr_streams = [{'label': lab, 'name': self.filenames.get(f'GR_EMIS_{str(ii).zfill(3)}'),
+                       'emis': f'{self.CCTM_GRIDDED}/{self.filenames.get(f"GR_EMIS_{str(ii).zfill(3)}")}'}
+                      for ii, lab in enumerate(gr_emis_labs, start=1)]
+        pt_streams = [{'label': lab, 'name': self.filenames.get(f'STK_EMIS_{str(ii).zfill(3)}'),
+                       'stk_name': self.filenames.get(f'STK_GRPS_{str(ii).zfill(3)}'),
+                       'emis': f'$IN_PTpath/{self.filenames.get(f"STK_EMIS_{str(ii).zfill(3)}")}',
+                       'stk_grps': f'$IN_PTpath/stack_groups/{self.filenames.get(f"STK_GRPS_{str(ii).zfill(3)}")}'}
+                      for ii, lab in enumerate(pt_emis_labs, start=1)]
+        start_datetimes_lst = [self.start_datetime + datetime.timedelta(n) for n in range(self.delt.days + 1)]
+
+        # Merge the gridded sectors
+        gr_merge = [stream for stream in gr_streams if stream['label'] not in keep_labs]
+        if merge_gr and len(gr_merge) > 1:
+            for date in start_datetimes_lst:
+                in_files = [f'{self.CCTM_GRIDDED}/{self.expand_emis_name(stream["name"], date, stkcaseg, stkcasee)}' for stream in gr_merge]
+                out_file = f'{self.CCTM_GRIDDED}/emis_mole_{gr_merge_lab}_{date.strftime("%Y%m%d")}.ncf'
+                if self.verbose:
+                    print(f'Merging {[stream["label"] for stream in gr_merge]} into {out_file}')
+                merge_gridded(in_files, out_file)
+            gr_streams = [stream for stream in gr_streams if stream['label'] in keep_labs]
+            gr_streams.append({'label': gr_merge_lab, 'emis': f'{self.CCTM_GRIDDED}/emis_mole_{gr_merge_lab}_${{YYYYMMDD}}.ncf'})
+
+        # Merge the inline point sectors
+        pt_merge = [stream for stream in pt_streams if stream['label'] not in keep_labs]
+        if merge_pt and len(pt_merge) > 1:
+            for date in start_datetimes_lst:
+                inln_files = [f'{self.CCTM_PT}/{self.expand_emis_name(stream["name"], date, stkcaseg, stkcasee)}' for stream in pt_merge]
+                stk_files = [f'{self.CCTM_PT}/stack_groups/{self.expand_emis_name(stream["stk_name"], date, stkcaseg, stkcasee)}' for stream in pt_merge]
+                out_inln_file = f'{self.CCTM_PT}/inln_mole_{pt_merge_lab}_{date.strftime("%Y%m%d")}.ncf'
+                out_stk_file = f'{self.CCTM_PT}/stack_groups/stack_groups_{pt_merge_lab}_{date.strftime("%Y%m%d")}.ncf'
+                if self.verbose:
+                    print(f'Merging {[stream["label"] for stream in pt_merge]} into {out_inln_file}')
+                merge_inline(inln_files, stk_files, out_inln_file, out_stk_file, date=date)
+            pt_streams = [stream for stream in pt_streams if stream['label'] in keep_labs]
+            pt_streams.append({'label': pt_merge_lab, 
+                               'emis': f'$IN_PTpath/inln_mole_{pt_merge_lab}_${{YYYYMMDD}}.ncf',
+                               'stk_grps': f'$IN_PTpath/stack_groups/stack_groups_{pt_merge_lab}_${{YYYYMMDD}}.ncf'})
+        return gr_streams, pt_streams
+
+    def emis_files(self, gr_emis_labs=['all', 'rwc'], 
+        pt_emis_labs=['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12'],
+        stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j'):
+        """
+        Lists the gridded and inline emissions files that CCTM reads on each day of the
+        simulation, in the locations where `setup_inpdir` links them.
+
+        Parameters
+        ----------
+        :param gr_emis_labs: list of strings
+            Labels for each of the gridded emissions sectors.
+        :param pt_emis_labs: list of strings
+            Labels for each of the point emissions sectors.
+        :param stkcaseg: string
+            Stack group version label.
+        :param stkcasee: string
+            Stack emission version label
+        :return emis_files: dict
+            Lists of emissions files (one per simulation day) keyed by sector label.
+        """
+        start_datetimes_lst = [self.start_datetime + datetime.timedelta(n) for n in range(self.delt.days + 1)]
+        emis_files = {}
+        for ii, lab in enumerate(gr_emis_labs, start=1):
+            name = self.filenames.get(f'GR_EMIS_{str(ii).zfill(3)}')
+            emis_files[lab] = [f'{self.CCTM_GRIDDED}/{self.expand_emis_name(name, date, stkcaseg, stkcasee)}' for date in start_datetimes_lst]
+        for ii, lab in enumerate(pt_emis_labs, start=1):
+            name = self.filenames.get(f'STK_EMIS_{str(ii).zfill(3)}')
+            emis_files[lab] = [f'{self.CCTM_PT}/{self.expand_emis_name(name, date, stkcaseg, stkcasee)}' for date in start_datetimes_lst]
+        return emis_files
+
+    def qa_emissions(self, gr_emis_labs=['all', 'rwc'], 
+        pt_emis_labs=['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12'],
+        stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j', 
+        n_procs=8, var_names=None, jump_factor=5.0, report_file=None):
+        """
+        Checks the gridded and inline emissions files linked by `setup_inpdir` for each 
+        day of the simulation (see `prepemis.emis_qa`) and writes a compact report to 
+        $INPDIR/emis, so broken inputs can be caught before CCTM is submitted.
+
+        Parameters
+        ----------
+        :param gr_emis_labs: list of strings
+            Labels for each of the gridded emissions sectors.
+        :param pt_emis_labs: list of strings
+            Labels for each of the point emissions sectors.
+        :param stkcaseg: string
+            Stack group version label.
+        :param stkcasee: string
+            Stack emission version label
+        :param n_procs: int
+            Number of processes used to read the files.
+        :param var_names: list of strings
+            Species to check. If None, all species are checked.
+        :param jump_factor: float
+            Day-to-day ratio of the totals that is flagged as a jump.
+        :param report_file: string
+            Path to the report. Defaults to $INPDIR/emis/emis_qa_{appl}.txt.
+        :return stats_df: `pandas.DataFrame`
+            Per-sector, per-species, per-day statistics with a `flags` column.
+        """
+        if report_file is None:
+            report_file = f'{self.CCTM_INPDIR}/emis/emis_qa_{self.appl}.txt'
+        emis_files = self.emis_files(gr_emis_labs=gr_emis_labs, pt_emis_labs=pt_emis_labs, stkcaseg=stkcaseg, stkcasee=stkcasee)
+        stats_df = emis_qa(emis_files, n_procs=n_procs, var_names=var_names, jump_factor=jump_factor, report_file=report_file)
+        n_flagged = (stats_df['flags'] != '').sum()
+        if n_flagged > 0:
+            print(f'Warning: {n_flagged} emissions sector/species/days were flagged. See {report_file}')
+        elif self.verbose:
+            print(f'Emissions QA found no problems. See {report_file}')
+        return stats_df
+
+    def emis_changes(self, base_sim, gr_emis_labs=['all', 'rwc'], 
+        pt_emis_labs=['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12'],
+        stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j', n_procs=8, var_names=None):
+        """
+        Compares the emissions inputs of this simulation (the scenario) with those of a base 
+        case for each day and sector (see `prepemis.emis_changes`). The inputs of both 
+        simulations need to be linked with `setup_inpdir`, and the base case needs to cover 
+        the scenario period.
+
+        Parameters
+        ----------
+        :param base_sim: `CMAQModel`
+            Base case simulation with the same sectors.
+        :param gr_emis_labs: list of strings
+            Labels for each of the gridded emissions sectors.
+        :param pt_emis_labs: list of strings
+            Labels for each of the point emissions sectors.
+        :param stkcaseg: string
+            Stack group version label.
+        :param stkcasee: string
+            Stack emission version label
+        :param n_procs: int
+            Number of processes used to compare the files.
+        :param var_names: list of strings
+            Species to compare. If None, all species are compared.
+        :return changes_df: `pandas.DataFrame`
+            Booleans indexed by date with one column per sector that are True when the
+            scenario emissions differ from the base case. 
+        """
+        start_datetimes_lst = [self.start_datetime + datetime.timedelta(n) for n in range(self.delt.days + 1)]
+        scen_files = self.emis_files(gr_emis_labs=gr_emis_labs, pt_emis_labs=pt_emis_labs, stkcaseg=stkcaseg, stkcasee=stkcasee)
+        base_files = {}
+        for lab, files in scen_files.items():
+            base_files[lab] = [f'{os.path.dirname(file_name).replace(self.CCTM_INPDIR, base_sim.CCTM_INPDIR)}/{os.path.basename(file_name)}' 
+                               for file_name in files]
+        changes_df = emis_changes(base_files, scen_files, start_datetimes_lst, n_procs=n_procs, var_names=var_names)
+        if self.verbose:
+            changed = changes_df.index[changes_df.any(axis=1)]
+            print(f'Emissions differ from {base_sim.appl} on {len(changed)} of {len(changes_df)} days')
+        return changes_df
+
+    def link_outputs(self, base_sim, dates):
+        """
+        Links the CCTM output files of a base case simulation for the given days into 
+        this simulation's output directory, renamed with this simulation's RUNID, so 
+        the days that a scenario does not change do not have to be rerun.
+
+        Parameters
+        ----------
+        :param base_sim: `CMAQModel`
+            Base case simulation.
+        :param dates: list of `datetime.datetime`
+            Days to link.
+        :return n_files: int
+            Number of files linked.
+        """
+        utils.make_dirs(self.CCTM_OUTDIR)
+        cmd = 'echo "Linking base case outputs..."'
+        n_files = 0
+        for date in dates:
+            base_tag = f'_{base_sim.cctm_runid}_{date.strftime("%Y%m%d")}'
+            for base_file in sorted(glob.glob(f'{base_sim.CCTM_OUTDIR}/CCTM_*{base_tag}*')):
+                out_file = os.path.basename(base_file).replace(base_tag, f'_{self.cctm_runid}_{date.strftime("%Y%m%d")}')
+                cmd = cmd + '; ' + self.CMD_LN % (base_file, f'{self.CCTM_OUTDIR}/{out_file}')
+                n_files += 1
+        os.system(cmd)
+        if self.verbose:
+            print(f'Linked {n_files} output files from {base_sim.CCTM_OUTDIR}')
+        return n_files
+
+    def run_cctm_scenario(self, base_sim, n_emis_gr=2, gr_emis_labs=['all', 'rwc'], n_emis_pt=9, 
+        pt_emis_labs=['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12'],
+        stkgrps_daily=[False, False, False, True, True, True, False, False, False],
+        stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j', n_procs_compare=8, **kwargs):
+        """
+        Runs CCTM for an emissions scenario that shares its meteorology, boundary conditions, 
+        and initial conditions with a base case simulation, only for the days that need to 
+        be rerun. The scenario emissions are compared with the base case (see `emis_changes`), 
+        the base case outputs are reused for the days before the first day that differs, and 
+        CCTM is restarted on that day from the base case's restart files (see `hot_start`). 
+        The start date, initial conditions, and hot start state that `hot_start` sets are only 
+        used for the CCTM run: start_datetime, delt, LOC_IC, base_sim, and hot_start_date are 
+        restored afterwards, so the postprocessing methods cover the linked days too and later 
+        runs are not forced to restart.
+
+        Parameters
+        ----------
+        :param base_sim: `CMAQModel`
+            Base case simulation that has been run for the whole scenario period.
+        :param n_emis_gr: int
+            Number of gridded emissions sectors.
+        :param gr_emis_labs: list of strings
+            Labels for each of the gridded emissions sectors.
+        :param n_emis_pt: int
+            Number of point emissions sectors.
+        :param pt_emis_labs: list of strings
+            Labels for each of the point emissions sectors.
+        :param stkgrps_daily: list of bools 
+            Boolean indicating if each point sector uses daily stack groups files.
+        :param stkcaseg: string
+            Stack group version label.
+        :param stkcasee: string
+            Stack emission version label
+        :param n_procs_compare: int
+            Number of processes used to compare the emissions files.
+        :param kwargs: 
+            Other options passed to `run_cctm` (e.g., n_procs, run_hours, setup_only).
+        :return changes_df: `pandas.DataFrame`
+            Days and sectors on which the scenario emissions differ from the base case.
+        """
+        # Link the scenario inputs for the whole period and compare them with the base case
+        self.setup_inpdir(n_emis_gr=n_emis_gr, gr_emis_labs=gr_emis_labs, 
+            n_emis_pt=n_emis_pt, pt_emis_labs=pt_emis_labs, stkgrps_daily=stkgrps_daily)
+        changes_df = self.emis_changes(base_sim, gr_emis_labs=gr_emis_labs, pt_emis_labs=pt_emis_labs, 
+            stkcaseg=stkcaseg, stkcasee=stkcasee, n_procs=n_procs_compare)
+        changed = changes_df.index[changes_df.any(axis=1)]
+        if len(changed) == 0:
+            print(f'The emissions do not differ from {base_sim.appl}, so the base case outputs are used for all days')
+            self.link_outputs(base_sim, list(changes_df.index))
+            return changes_df
+        # Reuse the base case outputs before the first day that differs and start CCTM on that day
+        first_day = changed[0].to_pydatetime()
+        saved = (self.start_datetime, self.delt, self.LOC_IC, self.base_sim, self.hot_start_date)
+        try:
+            if first_day > self.start_datetime:
+                self.link_outputs(base_sim, list(changes_df.index[changes_df.index < first_day]))
+                self.hot_start(base_sim, first_day)
+                kwargs['delete_existing_output'] = 'TRUE'
+            if self.verbose:
+                print(f'Running CCTM for {self.appl} from {self.start_datetime.strftime("%Y-%m-%d")}')
+            self.run_cctm(n_emis_gr=n_emis_gr, gr_emis_labs=gr_emis_labs, n_emis_pt=n_emis_pt, 
+                pt_emis_labs=pt_emis_labs, stkgrps_daily=stkgrps_daily, stkcaseg=stkcaseg, stkcasee=stkcasee, **kwargs)
+        finally:
+            self.start_datetime, self.delt, self.LOC_IC, self.base_sim, self.hot_start_date = saved
+        return changes_df
+
     def run_cctm(self, n_emis_gr=2, gr_emis_labs=['all', 'rwc'], n_emis_pt=9, 
         pt_emis_labs=['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12'],
         stkgrps_daily=[False, False, False, True, True, True, False, False, False],
         ctm_abflux='Y',
         stkcaseg = '12US1_2016fh_16j', stkcasee = '12US1_cmaq_cb6_2016fh_16j', 
         delete_existing_output='TRUE', new_sim='FALSE', tstep='010000', 
-        cctm_hours=24, n_procs=16, gb_mem=50, run_hours=24, setup_only=False):
+        cctm_hours=24, n_procs=16, gb_mem=50, run_hours=24, setup_only=False,
+        merge_gr_emis=False, merge_pt_emis=False, keep_emis_labs=[], qa_emis=False, follow_post=False):
         """
         Setup and run CCTM, CMAQ's chemical transport model.
 
@@ -759,7 +1166,25 @@ class CMAQModel:
             Run length, in hours, to request from the scheduler.
         :param setup_only: bool
             Option to setup the directories and write the scripts without running CCTM.
+        :param merge_gr_emis: bool
+            Option to merge the gridded emissions sectors into a single file for each day
+            before running CCTM (see `merge_emissions`).
+        :param merge_pt_emis: bool
+            Option to merge the inline point sectors into a single stack list for each day
+            before running CCTM (see `merge_emissions`).
+        :param keep_emis_labs: list of strings
+            Labels of sectors that are not merged, so they keep their own emissions stream
+            (e.g., for sector-specific emissions scaling or diagnostics).
+        :param qa_emis: bool
+            Option to check the linked emissions files before running CCTM (see `qa_emissions`).
+        :param follow_post: bool
+            Option to postprocess each day while CCTM simulates the following days (see 
+            `follow_postprocess`). Ignored if setup_only is True.
         """
+        # Hot-started simulations are restarts from the base case
+        if (self.hot_start_date is not None) and (new_sim.upper() != 'FALSE'):
+            print(f'Warning: setting new_sim to FALSE to hot-start from {self.base_sim.appl}')
+            new_sim = 'FALSE'
         # Check that a consistent number of labels were passed
         if len(gr_emis_labs) != n_emis_gr:
             raise ValueError(f'n_emis_gr ({n_emis_gr}) should match the length of gr_emis_labs (len={len(gr_emis_labs)})')
@@ -769,16 +1194,27 @@ class CMAQModel:
             raise ValueError(f'n_emis_pt ({n_emis_pt}) should match the length of stkgrps_daily (len={len(stkgrps_daily)})')
         ## SETUP CCTM
         # Copy the template CCTM run script to the scripts directory
-        run_cctm_path = f'{self.CCTM_SCRIPTS}/run_cctm_{self.appl}.csh'
+        run_cctm_path = f'{self.CCTM_SCRIPTS}/run_cctm_{self.cctm_appl}.csh'
         cmd = self.CMD_CP % (f'{self.DIR_TEMPLATES}/template_run_cctm.csh', run_cctm_path)
         os.system(cmd)
         # Copy the template CCTM submission script to the scripts directory
-        submit_cctm_path = f'{self.CCTM_SCRIPTS}/submit_cctm.csh'
+        if self.cctm_appl == self.appl:
+            submit_cctm_path = f'{self.CCTM_SCRIPTS}/submit_cctm.csh'
+        else:
+            submit_cctm_path = f'{self.CCTM_SCRIPTS}/submit_cctm_{self.cctm_appl}.csh'
+        self.submit_cctm_path = submit_cctm_path
         cmd = self.CMD_CP % (f'{self.DIR_TEMPLATES}/template_submit_cctm.csh', submit_cctm_path)
         os.system(cmd)
         # Setup the input directory using the setup_inpdir method
         self.setup_inpdir(n_emis_gr=n_emis_gr, gr_emis_labs=gr_emis_labs, 
             n_emis_pt=n_emis_pt, pt_emis_labs=pt_emis_labs,stkgrps_daily=stkgrps_daily)
+        # Optionally check the emissions inputs
+        if qa_emis:
+            self.qa_emissions(gr_emis_labs=gr_emis_labs, pt_emis_labs=pt_emis_labs, stkcaseg=stkcaseg, stkcasee=stkcasee)
+        # Optionally merge the emissions sectors to cut the number of files CCTM reads
+        gr_streams, pt_streams = self.merge_emissions(gr_emis_labs=gr_emis_labs, pt_emis_labs=pt_emis_labs,
+            stkcaseg=stkcaseg, stkcasee=stkcasee, merge_gr=merge_gr_emis, merge_pt=merge_pt_emis, 
+            keep_labs=keep_emis_labs)
 
         # Write CCTM setup options to the run script
         cctm_runtime =  f'#> Toggle Diagnostic Mode which will print verbose information to standard output\n'
@@ -886,12 +1322,11 @@ class CMAQModel:
         # NOTE: the two spaces at the beginning of each of these lines are necessary 
         # because this is all happening inside a loop in the csh script.
         cctm_gr  = f'   #> Gridded Emissions Files\n'
-        cctm_gr += f'   setenv N_EMIS_GR {n_emis_gr}                          #> Number of gridded emissions groups\n'
-        for ii in range(1, n_emis_gr + 1):
-            gr_emis_file = self.filenames.get(f'GR_EMIS_{str(ii).zfill(3)}')
-            cctm_gr += f'   setenv GR_EMIS_{str(ii).zfill(3)} {self.CCTM_GRIDDED}/{gr_emis_file}\n'
+        cctm_gr += f'   setenv N_EMIS_GR {len(gr_streams)}                          #> Number of gridded emissions groups\n'
+        for ii in range(1, len(gr_streams) + 1):
+            cctm_gr += f'   setenv GR_EMIS_{str(ii).zfill(3)} {gr_streams[ii-1]["emis"]}\n'
             cctm_gr += f'   # Label each gridded emissions stream\n'
-            cctm_gr += f'   setenv GR_EMIS_LAB_{str(ii).zfill(3)} {gr_emis_labs[ii-1]}\n'
+            cctm_gr += f'   setenv GR_EMIS_LAB_{str(ii).zfill(3)} {gr_streams[ii-1]["label"]}\n'
             cctm_gr += f'   # Do not allow CMAQ to use gridded source files with dates that do not match the model date\n'
             cctm_gr += f'   setenv GR_EM_SYM_DATE_{str(ii).zfill(3)} F\n'
         utils.write_to_template(run_cctm_path, cctm_gr, id='%GRIDDED%')
@@ -900,18 +1335,16 @@ class CMAQModel:
         # NOTE: the two spaces at the beginning of each of these lines are necessary 
         # because this is all happening inside a loop in the csh script.
         cctm_pt  = f'   #> In-line point emissions configuration\n'
-        cctm_pt += f'   setenv N_EMIS_PT {n_emis_pt}                          #> Number of elevated source groups\n'
+        cctm_pt += f'   setenv N_EMIS_PT {len(pt_streams)}                          #> Number of elevated source groups\n'
         cctm_pt += f'   set STKCASEG = {stkcaseg}                             # Stack Group Version Label\n'
         cctm_pt += f'   set STKCASEE = {stkcasee}                             # Stack Emission Version Label\n'
-        for ii in range(1, n_emis_pt + 1):
-            stk_emis_file = self.filenames.get(f'STK_EMIS_{str(ii).zfill(3)}')
-            stk_grps_file = self.filenames.get(f'STK_GRPS_{str(ii).zfill(3)}')
+        for ii in range(1, len(pt_streams) + 1):
             cctm_pt += f'   # Time-Independent Stack Parameters for Inline Point Sources\n'
-            cctm_pt += f'   setenv STK_GRPS_{str(ii).zfill(3)} $IN_PTpath/stack_groups/{stk_grps_file}\n'
+            cctm_pt += f'   setenv STK_GRPS_{str(ii).zfill(3)} {pt_streams[ii-1]["stk_grps"]}\n'
             cctm_pt += f'   # Time-Dependent Emissions file\n'
-            cctm_pt += f'   setenv STK_EMIS_{str(ii).zfill(3)} $IN_PTpath/{stk_emis_file}\n'
+            cctm_pt += f'   setenv STK_EMIS_{str(ii).zfill(3)} {pt_streams[ii-1]["emis"]}\n'
             cctm_pt += f'   # Label Each Emissions Stream\n'
-            cctm_pt += f'   setenv STK_EMIS_LAB_{str(ii).zfill(3)} {pt_emis_labs[ii-1]}\n'
+            cctm_pt += f'   setenv STK_EMIS_LAB_{str(ii).zfill(3)} {pt_streams[ii-1]["label"]}\n'
             cctm_pt += f'   # Allow CMAQ to Use Point Source files with dates that do not match the internal model date\n'
             cctm_pt += f'   setenv STK_EM_SYM_DATE_{str(ii).zfill(3)} T\n'
         utils.write_to_template(run_cctm_path, cctm_pt, id='%POINT%')
@@ -919,7 +1352,7 @@ class CMAQModel:
         # Write CCTM submission script
         cctm_sub =  f'#!/bin/csh\n'
         cctm_sub += f'\n'
-        cctm_sub += f'#SBATCH -J cctm_{self.appl}                  # Job name\n'
+        cctm_sub += f'#SBATCH -J cctm_{self.cctm_appl}                  # Job name\n'
         # cctm_sub += f'#SBATCH -o {self.CCTM_SCRIPTS}/out.cctm_{self.appl}              # Name of stdout output file\n'
         cctm_sub += f'#SBATCH -o /dev/null              # Name of stdout output file\n'
         # cctm_sub += f'#SBATCH -e {self.CCTM_SCRIPTS}/errors.cctm_{self.appl}           # Name of stderr output file\n'
@@ -932,7 +1365,7 @@ class CMAQModel:
         cctm_sub += f'#SBATCH --mem={gb_mem}000M            # memory required per node\n'
         cctm_sub += f'#SBATCH --partition=default_cpu # Which queue it should run on.\n'
         cctm_sub += f'\n'
-        cctm_sub += f'{self.CCTM_SCRIPTS}/run_cctm_{self.appl}.csh >&! {self.CCTM_SCRIPTS}/cctm_{self.appl}.log\n'
+        cctm_sub += f'{self.CCTM_SCRIPTS}/run_cctm_{self.cctm_appl}.csh >&! {self.CCTM_SCRIPTS}/cctm_{self.cctm_appl}.log\n'
         utils.write_to_template(submit_cctm_path, cctm_sub, id='%ALL%')
 
         if self.verbose:
@@ -941,20 +1374,24 @@ class CMAQModel:
         ## RUN CCTM
         if not setup_only:
             # Remove logs from previous runs
-            os.system(self.CMD_RM % (f'{self.CCTM_SCRIPTS}/CTM_LOG*{self.appl}*'))
+            os.system(self.CMD_RM % (f'{self.CCTM_SCRIPTS}/CTM_LOG*{self.cctm_appl}*'))
             # Submit CCTM to Slurm
-            CMD_CCTM = f'sbatch --requeue {submit_cctm_path}'
-            os.system(CMD_CCTM)
+            self.cctm_job_id = utils.submit_job(submit_cctm_path, options='--requeue')
+            if self.cctm_job_id is None:
+                return False
             # Give the log a few seconds to reset itself.
             time.sleep(10)
             # Sleep until the run_cctm_{self.appl}.log file exists
-            while not os.path.exists(f'{self.CCTM_SCRIPTS}/cctm_{self.appl}.log'):
+            while not os.path.exists(f'{self.CCTM_SCRIPTS}/cctm_{self.cctm_appl}.log'):
                 time.sleep(1)
             # Begin CCTM simulation clock
             simstart = datetime.datetime.now()
             if self.verbose:
                 print('Starting CCTM at: ' + str(simstart))
                 sys.stdout.flush()
+            # Optionally postprocess the days as CCTM finishes them
+            if follow_post:
+                self.follow_postprocess(job_id=self.cctm_job_id)
             cctm_sim = self.finish_check('cctm')
             while cctm_sim != 'complete':
                 if cctm_sim == 'failed':
@@ -968,6 +1405,235 @@ class CMAQModel:
                 sys.stdout.flush()
         return True
 
+    def cctm_segments(self, n_segments=4, spinup_days=5):
+        """
+        Splits the simulation period into segments for a parallel-in-time CCTM run (see 
+        `run_cctm_parallel`). The days that are kept are split as evenly as possible, and 
+        each segment after the first starts `spinup_days` before its first kept day.
+
+        Parameters
+        ----------
+        :param n_segments: int
+            Number of segments.
+        :param spinup_days: int
+            Number of spin-up days simulated before the first kept day of each segment 
+            (except the first).
+        :return segments: list of dicts
+            Segment number, first simulated day (start), first kept day (keep_start), 
+            and last day (end) of each segment.
+        """
+        days = [self.start_datetime + datetime.timedelta(n) for n in range(self.delt.days + 1)]
+        if (n_segments < 1) or (n_segments > len(days)):
+            raise ValueError(f'n_segments must be between 1 and the number of days ({len(days)})')
+        bounds = [len(days) * k // n_segments for k in range(n_segments + 1)]
+        segments = []
+        for k in range(n_segments):
+            keep_days = days[bounds[k]:bounds[k+1]]
+            if k == 0:
+                start = keep_days[0]
+            else:
+                start = max(self.start_datetime, keep_days[0] - datetime.timedelta(days=spinup_days))
+            segments.append({'segment': k + 1, 'start': start, 'keep_start': keep_days[0], 'end': keep_days[-1]})
+        return segments
+
+    def segment_sim(self, segment, ic_dir=None):
+        """
+        Makes a copy of this simulation for one segment of a parallel-in-time CCTM run, 
+        with its own input and output directories and scripts (labeled with _segNN). 
+
+        Parameters
+        ----------
+        :param segment: dict
+            Segment from `cctm_segments`.
+        :param ic_dir: string
+            Directory with the CGRID files on this grid for the day before the start of each 
+            segment after the first (e.g., the output directory of an earlier run on the same 
+            grid). These segments are restarted from them (NEW_START = FALSE), so ic_dir is 
+            required for them. CGRID files from a coarser grid cannot be used.
+        :return seg_sim: `CMAQModel`
+            Simulation for the segment.
+        """
+        if (segment['segment'] > 1) and (ic_dir is None):
+            raise ValueError(f'ic_dir is needed to start segment {segment["segment"]} from CGRID files')
+        lab = f'seg{str(segment["segment"]).zfill(2)}'
+        seg_sim = copy.copy(self)
+        seg_sim.segment = segment
+        seg_sim.cctm_appl = f'{self.appl}_{lab}'
+        seg_sim.start_datetime = segment['start']
+        seg_sim.end_datetime = segment['end']
+        seg_sim.delt = seg_sim.end_datetime - seg_sim.start_datetime
+        seg_sim.CCTM_INPDIR = f'{self.CCTM_INPDIR}_{lab}'
+        seg_sim.CCTM_OUTDIR = f'{self.CCTM_OUTDIR}_{lab}'
+        seg_sim.ICBC = f'{seg_sim.CCTM_INPDIR}/icbc'
+        seg_sim.CCTM_GRIDDED = f'{seg_sim.CCTM_INPDIR}/emis/gridded_area'
+        seg_sim.CCTM_PT = f'{seg_sim.CCTM_INPDIR}/emis/inln_point'
+        seg_sim.CCTM_LAND = f'{seg_sim.CCTM_INPDIR}/land'
+        if segment['segment'] > 1:
+            seg_sim.base_sim = None
+            seg_sim.hot_start_date = None
+            seg_sim.LOC_IC = ic_dir
+        return seg_sim
+
+    def run_cctm_parallel(self, n_segments=4, spinup_days=5, ic_dir=None, setup_only=False, wait=True, poll_seconds=300,
+        conv_file_type='ACONC', conv_var_names=['O3', 'NO', 'NO2', 'CO', 'SO2', 'ASO4J', 'ANO3J'], **kwargs):
+        """
+        Runs CCTM in parallel in time: the simulation period is split into segments that 
+        are submitted to Slurm at the same time (see `cctm_segments`). The segments after
+        the first are restarted from the `ic_dir` CGRID files several spin-up days before 
+        the days that they keep. When all the segments finish, the kept days are 
+        linked into this simulation's CCTM_OUTDIR as one continuous set of outputs, and a 
+        convergence report compares each segment's spin-up days with its predecessor 
+        (see `segment_convergence`).
+
+        Parameters
+        ----------
+        :param n_segments: int
+            Number of segments.
+        :param spinup_days: int
+            Number of spin-up days for each segment after the first.
+        :param ic_dir: string
+            Directory with the CGRID files on this grid used to start the segments after the 
+            first (see `segment_sim`). Required if n_segments > 1.
+        :param setup_only: bool
+            Option to setup the directories and write the scripts of all the segments
+            without running CCTM.
+        :param wait: bool
+            Option to wait for the segments to finish, then stitch the outputs and write 
+            the convergence report. If False, the segments are only submitted.
+        :param poll_seconds: int
+            Number of seconds between checks of the segments' Slurm jobs.
+        :param conv_file_type: string
+            CCTM output file used in the convergence report (e.g., ACONC or CONC).
+        :param conv_var_names: list of strings
+            Species compared in the convergence report.
+        :param kwargs: 
+            Other options passed to `run_cctm` for each segment (e.g., emissions sectors, 
+            n_procs, run_hours).
+        :return seg_sims: list of `CMAQModel`
+            Simulations for each segment.
+        """
+        segments = self.cctm_segments(n_segments=n_segments, spinup_days=spinup_days)
+        if (n_segments > 1) and (ic_dir is None):
+            raise ValueError('ic_dir is needed to start the segments after the first from CGRID files')
+        for segment in segments[1:]:
+            yesterday = (segment['start'] - datetime.timedelta(days=1)).strftime('%Y%m%d')
+            if len(glob.glob(f'{ic_dir}/CCTM_CGRID_*{yesterday}.nc')) == 0:
+                print(f'Warning: {ic_dir} has no CGRID file for {yesterday} to start segment {segment["segment"]}')
+        seg_sims = []
+        for segment in segments:
+            seg_sim = self.segment_sim(segment, ic_dir=ic_dir)
+            seg_kwargs = dict(kwargs)
+            if segment['segment'] > 1:
+                seg_kwargs['new_sim'] = 'FALSE'
+            if self.verbose:
+                print(f'Segment {segment["segment"]}: {segment["start"].strftime("%Y-%m-%d")} to {segment["end"].strftime("%Y-%m-%d")}'
+                      f' (keeping {segment["keep_start"].strftime("%Y-%m-%d")} on)')
+            seg_sim.run_cctm(setup_only=True, **seg_kwargs)
+            seg_sims.append(seg_sim)
+        if setup_only:
+            return seg_sims
+
+        # Submit all the segments at once
+        for seg_sim in seg_sims:
+            seg_sim.cctm_job_id = utils.submit_job(seg_sim.submit_cctm_path, options='--requeue')
+            if self.verbose:
+                print(f'Submitted {seg_sim.cctm_appl} as job {seg_sim.cctm_job_id}')
+        if not wait:
+            return seg_sims
+
+        # Wait for the segments to finish 
+        simstart = datetime.datetime.now()
+        while True:
+            time.sleep(poll_seconds)
+            active = [seg_sim for seg_sim in seg_sims if seg_sim.cctm_job_id is not None and 
+                      any([state in SLURM_ACTIVE_STATES for state, _ in utils.job_states(seg_sim.cctm_job_id).values()])]
+            if len(active) == 0:
+                break
+        if self.verbose:
+            print(f'CCTM segments ran in: {utils.strfdelta(datetime.datetime.now() - simstart)}')
+        failed = [seg_sim.cctm_appl for seg_sim in seg_sims if not os.path.exists(
+            f'{seg_sim.CCTM_OUTDIR}/CCTM_CGRID_{seg_sim.cctm_runid}_{seg_sim.end_datetime.strftime("%Y%m%d")}.nc')]
+        if len(failed) > 0:
+            print(f'CMAQPyError: CCTM did not finish for {failed}. See the logs in {self.CCTM_SCRIPTS}')
+            return seg_sims
+        self.stitch_segments(seg_sims)
+        self.segment_convergence(seg_sims, file_type=conv_file_type, var_names=conv_var_names)
+        return seg_sims
+
+    def stitch_segments(self, seg_sims):
+        """
+        Links the kept days of each segment of a parallel-in-time CCTM run into this 
+        simulation's CCTM_OUTDIR, so they form one continuous set of outputs.
+
+        Parameters
+        ----------
+        :param seg_sims: list of `CMAQModel`
+            Simulations for each segment (see `run_cctm_parallel`).
+        :return n_files: int
+            Number of files linked.
+        """
+        n_files = 0
+        for seg_sim in seg_sims:
+            keep_days = pd.date_range(seg_sim.segment['keep_start'], seg_sim.segment['end'])
+            n_files += self.link_outputs(seg_sim, list(keep_days))
+        return n_files
+
+    def segment_convergence(self, seg_sims, file_type='ACONC', var_names=['O3', 'NO', 'NO2', 'CO', 'SO2', 'ASO4J', 'ANO3J'],
+        layer=0, tolerance=0.05, report_file=None):
+        """
+        Compares the spin-up days of each segment of a parallel-in-time CCTM run with the 
+        same days of the previous segment (see `utils.ioapi_diff_stats`). The differences 
+        should shrink over the spin-up days, and they should be small on the last one. 
+
+        Parameters
+        ----------
+        :param seg_sims: list of `CMAQModel`
+            Simulations for each segment (see `run_cctm_parallel`).
+        :param file_type: string
+            CCTM output file to compare (e.g., ACONC or CONC).
+        :param var_names: list of strings
+            Species to compare. If None, all species are compared.
+        :param layer: int
+            Index of the layer to compare. If None, all layers are compared.
+        :param tolerance: float
+            Normalized mean absolute difference on the last spin-up day above which a 
+            warning is printed.
+        :param report_file: string
+            Path to the report. Defaults to CCTM_OUTDIR/segment_convergence_{appl}.csv.
+        :return conv_df: `pandas.DataFrame`
+            Difference statistics for each segment, spin-up day, and species.
+        """
+        if report_file is None:
+            report_file = f'{self.CCTM_OUTDIR}/segment_convergence_{self.appl}.csv'
+        conv = []
+        for prev_sim, seg_sim in zip(seg_sims[:-1], seg_sims[1:]):
+            spinup_days = pd.date_range(seg_sim.segment['start'], seg_sim.segment['keep_start'] - datetime.timedelta(days=1))
+            for ii, day in enumerate(spinup_days, start=1):
+                file_name = f'{seg_sim.CCTM_OUTDIR}/CCTM_{file_type}_{seg_sim.cctm_runid}_{day.strftime("%Y%m%d")}.nc'
+                ref_file_name = f'{prev_sim.CCTM_OUTDIR}/CCTM_{file_type}_{prev_sim.cctm_runid}_{day.strftime("%Y%m%d")}.nc'
+                if not (os.path.exists(file_name) and os.path.exists(ref_file_name)):
+                    print(f'Warning: cannot compare the {file_type} files of {seg_sim.cctm_appl} for {day.strftime("%Y-%m-%d")}')
+                    continue
+                stats_df = utils.ioapi_diff_stats(file_name, ref_file_name, var_names=var_names, layer=layer).reset_index()
+                stats_df.insert(0, 'spinup_day', ii)
+                stats_df.insert(0, 'date', day)
+                stats_df.insert(0, 'segment', seg_sim.segment['segment'])
+                conv.append(stats_df)
+        if len(conv) == 0:
+            print('Warning: no spin-up days to compare')
+            return pd.DataFrame()
+        conv_df = pd.concat(conv, ignore_index=True)
+        conv_df.to_csv(report_file, index=False)
+        # Check the last spin-up day of each segment
+        last_df = conv_df[conv_df['spinup_day'] == conv_df.groupby('segment')['spinup_day'].transform('max')]
+        not_converged = last_df[last_df['nmae'] > tolerance]
+        for _, row in not_converged.iterrows():
+            print(f'Warning: segment {row["segment"]} {row["variable"]} differs from the previous segment by '
+                  f'{row["nmae"]:.1%} (NMAE) at the end of its spin-up')
+        if self.verbose:
+            print(f'Wrote the segment convergence report to {report_file}')
+        return conv_df
+
     def run_combine(self, run_hours=2, mem_per_node=20, combine_vrsn='v532'):
         """
         Setup and run the combine program. Combine is a CMAQ post-processing program that formats 
@@ -1051,6 +1717,394 @@ class CMAQModel:
         CMD_COMBINE = f'sbatch --requeue {run_combine_path}'
         os.system(CMD_COMBINE)
 
+    def cctm_dates(self):
+        """
+        Gets the days of the simulation period.
+
+        Parameters
+        ----------
+        :return dates: list of `datetime.datetime`
+            Each day from start_datetime to end_datetime.
+        """
+        return [self.start_datetime + datetime.timedelta(n) for n in range(self.delt.days + 1)]
+
+    def combine_day_args(self, date, spec_conc=None, spec_dep=None, dep=True):
+        """
+        Gets the SpecDef files, input files, and output files used to postprocess one day 
+        with `postcmaq.combine_day`. The inputs are the same as those used by `run_combine`.
+
+        Parameters
+        ----------
+        :param date: `datetime.datetime`
+            Day that is processed.
+        :param spec_conc: string
+            SpecDef file for the concentrations. Defaults to the one used by `run_combine`.
+        :param spec_dep: string
+            SpecDef file for the deposition. Defaults to the one used by `run_combine`.
+        :param dep: bool
+            Option to also process the deposition.
+        :return combine_args: list of tuples
+            (specdef_file, in_files, out_file) for the concentrations and, if dep is True, 
+            the deposition.
+        """
+        if spec_conc is None:
+            spec_conc = f'{self.COMBINE_SCRIPTS}/spec_def_files/SpecDef_{self.chem_mech}.txt'
+        if spec_dep is None:
+            spec_dep = f'{self.COMBINE_SCRIPTS}/spec_def_files/SpecDef_Dep_{self.chem_mech}.txt'
+        ymd, yymmdd = date.strftime('%Y%m%d'), date.strftime('%y%m%d')
+        combine_args = [(spec_conc, [f'{self.CCTM_OUTDIR}/CCTM_ACONC_{self.cctm_runid}_{ymd}.nc', f'{self.MCIP_OUT}/METCRO3D_{yymmdd}.nc',
+                                     f'{self.CCTM_OUTDIR}/CCTM_APMDIAG_{self.cctm_runid}_{ymd}.nc', f'{self.MCIP_OUT}/METCRO2D_{yymmdd}.nc'],
+                         f'{self.POST}/COMBINE_ACONC_{self.cctm_runid}_{ymd}.nc')]
+        if dep:
+            combine_args.append((spec_dep, [f'{self.CCTM_OUTDIR}/CCTM_DRYDEP_{self.cctm_runid}_{ymd}.nc', f'{self.CCTM_OUTDIR}/CCTM_WETDEP1_{self.cctm_runid}_{ymd}.nc',
+                                            f'{self.MCIP_OUT}/METCRO2D_{yymmdd}.nc'],
+                                 f'{self.POST}/COMBINE_DEP_{self.cctm_runid}_{ymd}.nc'))
+        return combine_args
+
+    def combine(self, n_procs=8, spec_conc=None, spec_dep=None, layer=None, complevel=4, dep=True):
+        """
+        Python alternative to `run_combine` that computes the combine species for each day 
+        in parallel on the current node (see `postcmaq.combine`). It reads the same input 
+        files and SpecDef files as `run_combine`, and writes daily compressed netCDF files
+        (COMBINE_ACONC_{RUNID}_YYYYMMDD.nc and COMBINE_DEP_{RUNID}_YYYYMMDD.nc) to POST.
+
+        Parameters
+        ----------
+        :param n_procs: int
+            Number of days processed at once.
+        :param spec_conc: string
+            SpecDef file for the concentrations. Defaults to the one used by `run_combine`.
+        :param spec_dep: string
+            SpecDef file for the deposition. Defaults to the one used by `run_combine`.
+        :param layer: int
+            Layer to write (1 is the surface). Defaults to the #layer directive of the SpecDef files.
+        :param complevel: int
+            Compression level (0-9) of the output.
+        :param dep: bool
+            Option to also process the deposition.
+        :return out_files: list of strings
+            Output files that were written.
+        """
+        combine_args = [self.combine_day_args(date, spec_conc=spec_conc, spec_dep=spec_dep, dep=dep) 
+                        for date in self.cctm_dates()]
+        utils.make_dirs(self.POST)
+        out_files = []
+        for ii in range(2 if dep else 1):
+            specdef_file = combine_args[0][ii][0]
+            out_files += combine(specdef_file, [args[ii][1] for args in combine_args], [args[ii][2] for args in combine_args],
+                                 n_procs=n_procs, layer=layer, complevel=complevel)
+        if self.verbose:
+            print(f'Wrote {len(out_files)} combine files to {self.POST}')
+        return out_files
+
+    def open_output(self, file_type='COMBINE_ACONC', var_names=None, layers=None, start=None, end=None, chunk_steps=24):
+        """
+        Opens this simulation's daily output files as one lazy dataset (see `postcmaq.open_cctm`),
+        with the latitudes and longitudes from the MCIP GRIDCRO2D file.
+
+        Parameters
+        ----------
+        :param file_type: string
+            Type of output file. Combine outputs start with COMBINE_ (e.g., COMBINE_ACONC, 
+            read from POST, including the monthly files from `run_combine` if there are no 
+            daily files) and DAILY_ (see `follow_postprocess`). Other types are CCTM 
+            outputs (e.g., ACONC, DRYDEP) read from CCTM_OUTDIR.
+        :param var_names: list of strings
+            Variables to read. Defaults to all the variables.
+        :param layers: int or list of ints
+            Layer indices to read (0 is the surface). Defaults to all the layers.
+        :param start: string or datetime
+            First time (UTC) to read. Defaults to the start of the simulation.
+        :param end: string or datetime
+            Last time (UTC) to read. Defaults to the end of the simulation.
+        :param chunk_steps: int
+            Number of time steps in each dask chunk.
+        :return ds: `xarray.Dataset`
+            Lazy dataset with dimensions (time, z, y, x).
+        """
+        dates = self.cctm_dates()
+        if file_type.startswith('COMBINE_') or file_type.startswith('DAILY_'):
+            files = [f'{self.POST}/{file_type}_{self.cctm_runid}_{date.strftime("%Y%m%d")}.nc' for date in dates]
+            if not any([os.path.exists(file) for file in files]):
+                files = sorted(glob.glob(f'{self.POST}/{file_type}_{self.cctm_runid}_[0-9][0-9][0-9][0-9][0-9][0-9].nc'))
+        else:
+            files = [f'{self.CCTM_OUTDIR}/CCTM_{file_type}_{self.cctm_runid}_{date.strftime("%Y%m%d")}.nc' for date in dates]
+        missing = [file for file in files if not os.path.exists(file)]
+        if len(missing) > 0:
+            print(f'Warning: {len(missing)} {file_type} files are missing (e.g., {missing[0]})')
+        gridcro2d_file = f'{self.MCIP_OUT}/GRIDCRO2D_{dates[0].strftime("%y%m%d")}.nc'
+        return open_cctm([file for file in files if os.path.exists(file)], var_names=var_names, layers=layers, 
+                         start=self.start_datetime if start is None else start, 
+                         end=self.end_datetime + datetime.timedelta(hours=23) if end is None else end,
+                         gridcro2d_file=gridcro2d_file, chunk_steps=chunk_steps)
+
+    def local_offsets(self, ds=None, date=None):
+        """
+        Gets the UTC offset of each grid cell from its time zone (see `utils.utc_offset_grid`), 
+        cached in GRID_CACHE for all the runs on this grid.
+
+        Parameters
+        ----------
+        :param ds: `xarray.Dataset`
+            Dataset from `open_output` with the grid attributes and coordinates. Defaults 
+            to the COMBINE_ACONC output.
+        :param date: string or datetime
+            Date for which daylight saving time is applied. Defaults to standard time.
+        :return offsets: `numpy.ndarray`
+            UTC offsets (hours) of each grid cell.
+        """
+        if ds is None:
+            ds = self.open_output('COMBINE_ACONC', layers=0)
+        return utils.utc_offset_grid(ds.attrs, ds['latitude'].values, ds['longitude'].values, date=date, cache_dir=self.GRID_CACHE)
+
+    def daily_metrics(self, file_type='COMBINE_ACONC', o3_var='O3', pm25_var='PM25_TOT', utc_offset=-5, 
+        start_hours=range(7, 24), overwrite=False):
+        """
+        Computes the daily MDA8 ozone and 24-hour PM2.5 of the surface layer (see 
+        `metrics.daily_metrics`) and caches them in POST, so later calls with the same 
+        options read the saved file instead of the hourly outputs. The saved metrics are
+        only reused if they were computed from the same variables and ozone start hours.
+
+        Parameters
+        ----------
+        :param file_type: string
+            Type of output file (see `open_output`).
+        :param o3_var: string
+            Ozone variable, or None to skip MDA8.
+        :param pm25_var: string
+            PM2.5 variable, or None to skip the 24-hour average.
+        :param utc_offset: float or string
+            Hours between local standard time and UTC (e.g., -5 for EST), or 'local' to 
+            use the standard time zone of each grid cell (see `local_offsets`).
+        :param start_hours: list of ints
+            Local hours at which the 8-hour ozone windows start (see `metrics.mda8`).
+        :param overwrite: bool
+            Option to recompute the metrics even if they were saved before.
+        :return daily_ds: `xarray.Dataset`
+            MDA8_O3 and PM25_24H with a date dimension.
+        """
+        metrics_file = (f'{self.POST}/METRICS_{file_type}_{self.cctm_runid}_{self.start_datetime.strftime("%Y%m%d")}_'
+                        f'{self.end_datetime.strftime("%Y%m%d")}_{"LST" if utc_offset == "local" else f"UTC{utc_offset:+g}"}.nc')
+        metric_vars = {name: var for name, var in [('MDA8_O3', o3_var), ('PM25_24H', pm25_var)] if var is not None}
+        if os.path.exists(metrics_file) and not overwrite:
+            daily_ds = xr.open_dataset(metrics_file)
+            same_vars = all([(name in daily_ds) and (daily_ds[name].attrs.get('source') == var) for name, var in metric_vars.items()])
+            same_hours = ('MDA8_O3' not in metric_vars) or \
+                (list(np.atleast_1d(daily_ds['MDA8_O3'].attrs.get('start_hours', []))) == list(start_hours))
+            if same_vars and same_hours:
+                if self.verbose:
+                    print(f'Reading the daily metrics from {metrics_file}')
+                return daily_ds
+            daily_ds.close()
+        ds = self.open_output(file_type, var_names=[var for var in [o3_var, pm25_var] if var is not None], layers=0)
+        if utc_offset == 'local':
+            utc_offset = self.local_offsets(ds)
+        daily_ds = metrics.daily_metrics(ds, o3_var=o3_var, pm25_var=pm25_var, utc_offset=utc_offset, start_hours=start_hours)
+        utils.make_dirs(self.POST)
+        if os.path.exists(metrics_file):
+            os.remove(metrics_file)
+        daily_ds.to_netcdf(metrics_file)
+        if self.verbose:
+            print(f'Wrote the daily metrics to {metrics_file}')
+        return xr.open_dataset(metrics_file)
+
+    def match_obs(self, obs, var_name, file_type='COMBINE_ACONC', method='nearest', model_scale=1., utc_offset='local'):
+        """
+        Pairs this simulation's surface values with monitor observations (see `evaluate`). 
+        The site locator of the grid is cached in GRID_CACHE, and the model values at all 
+        the sites are read at once. Daily observations are paired with the model means of 
+        the same local days (see `evaluate.pair_sites`). Use `evaluate.paired_stats` for 
+        the statistics by site or by day.
+
+        Parameters
+        ----------
+        :param obs: `pandas.DataFrame`, string, or list of strings
+            Observations (see `evaluate.read_aqs`) or paths to AQS-style CSV files.
+        :param var_name: string
+            Model variable to compare (e.g., O3 or PM25_TOT).
+        :param file_type: string
+            Type of output file (see `open_output`).
+        :param method: string
+            'nearest' or 'bilinear' (see `evaluate.extract_sites`).
+        :param model_scale: float
+            Factor applied to the model values to match the observation units.
+        :param utc_offset: float or string
+            Hours between local standard time and UTC (e.g., -5 for EST), or 'local' to 
+            use the standard time zone of the cell of each site (see `local_offsets`). 
+            Only used for daily observations.
+        :return pairs: `pandas.DataFrame`
+            Observations with the model column.
+        """
+        start, end = self.start_datetime, self.end_datetime + datetime.timedelta(hours=23)
+        if not isinstance(obs, pd.DataFrame):
+            obs = evaluate.read_aqs(obs, start=start, end=end)
+        ds = self.open_output(file_type, var_names=[var_name], layers=0)
+        site_ds = evaluate.extract_sites(ds, obs, method=method, cache_dir=self.GRID_CACHE)
+        if utc_offset == 'local':
+            if ('freq' in obs.columns) and (obs['freq'] == 'daily').any():
+                offsets = self.local_offsets(ds)[site_ds['row'].values, site_ds['col'].values]
+                utc_offset = pd.Series(offsets, index=site_ds['site'].values)
+            else:
+                utc_offset = None
+        return evaluate.pair_sites(site_ds[var_name], obs, model_scale=model_scale, utc_offset=utc_offset)
+
+    def region_series(self, regions, var_names, name_field='name', names=None, file_type='COMBINE_ACONC', layers=0, 
+        how='mean', n_sub=5):
+        """
+        Computes regional time series (e.g., for states or NYISO zones) of this simulation's 
+        outputs (see `regions.regional_series`). The region weights are computed once per 
+        grid and shapefile and cached in GRID_CACHE.
+
+        Parameters
+        ----------
+        :param regions: string or dict
+            Shapefile in longitude and latitude, 'states', or the polygons of each region
+            (see `regions.region_weights`).
+        :param var_names: list of strings
+            Variables to aggregate.
+        :param name_field: string
+            Shapefile attribute with the region names.
+        :param names: list of strings
+            Shapefile regions to use. Defaults to all the regions.
+        :param file_type: string
+            Type of output file (see `open_output`).
+        :param layers: int or list of ints
+            Layer indices to read (0 is the surface).
+        :param how: string
+            'mean' or 'sum' over each region.
+        :param n_sub: int
+            Number of sample points along each side of a cell for the coverage fractions.
+        :return region_ds: `xarray.Dataset`
+            Lazy regional values with dimensions (time, z, region).
+        """
+        ds = self.open_output(file_type, var_names=var_names, layers=layers)
+        region_names, weights = region_weights(ds.attrs, regions, name_field=name_field, names=names, n_sub=n_sub, 
+                                               cache_dir=self.GRID_CACHE)
+        return regional_series(ds, region_names, weights, how=how)
+
+    def open_regridded(self, grid_name, file_type='COMBINE_ACONC', var_names=None, layers=None, start=None, end=None, 
+        method='conservative', min_coverage=0.5):
+        """
+        Opens this simulation's outputs (see `open_output`) regridded to another grid in 
+        GRIDDESC (see `regrid.regrid`), e.g., a 4-km run on the 12-km grid so it can be 
+        compared cell by cell with a 12-km run. The weights are computed once per pair of 
+        grids and cached in GRID_CACHE.
+
+        Parameters
+        ----------
+        :param grid_name: string
+            Destination grid name in GRIDDESC (e.g., 12OTC2).
+        :param file_type: string
+            Type of output file (see `open_output`).
+        :param var_names: list of strings
+            Variables to read. Defaults to all the variables.
+        :param layers: int or list of ints
+            Layer indices to read (0 is the surface). Defaults to all the layers.
+        :param start: string or datetime
+            First time (UTC) to read. Defaults to the start of the simulation.
+        :param end: string or datetime
+            Last time (UTC) to read. Defaults to the end of the simulation.
+        :param method: string
+            'conservative' or 'bilinear' (see `regrid.regrid_weights`).
+        :param min_coverage: float
+            Smallest fraction of a destination cell that must be inside this grid.
+        :return ds: `xarray.Dataset`
+            Lazy dataset on the destination grid.
+        """
+        dst_grid = utils.read_griddesc(self.GRIDDESC, grid_name)
+        ds = self.open_output(file_type, var_names=var_names, layers=layers, start=start, end=end)
+        weights = regrid_weights(ds.attrs, dst_grid, method=method, cache_dir=self.GRID_CACHE)
+        return regrid(ds, dst_grid, method=method, weights=weights, min_coverage=min_coverage)
+
+    def follow_postprocess(self, n_procs=4, poll_seconds=60, spec_conc=None, spec_dep=None, layer=None, complevel=4, 
+        dep=True, summary=True, day_funcs=[], n_steps=24, job_id=None):
+        """
+        Follows a running CCTM simulation and postprocesses each day as soon as CCTM has 
+        written all its time steps (see `postcmaq.day_complete`), so that the postprocessing
+        finishes shortly after the last day is simulated. Each day is combined (see `combine`), 
+        summarized with its daily mean and maximum (DAILY_ACONC_{RUNID}_YYYYMMDD.nc and 
+        DAILY_DEP_{RUNID}_YYYYMMDD.nc in POST), and passed to any other day_funcs on a pool 
+        of worker processes. This returns when all the days are processed, or when CCTM
+        stops before writing the remaining days.
+
+        Parameters
+        ----------
+        :param n_procs: int
+            Number of days processed at once.
+        :param poll_seconds: int
+            Number of seconds between checks of the CCTM outputs.
+        :param spec_conc: string
+            SpecDef file for the concentrations. Defaults to the one used by `run_combine`.
+        :param spec_dep: string
+            SpecDef file for the deposition. Defaults to the one used by `run_combine`.
+        :param layer: int
+            Layer to write (1 is the surface). Defaults to the #layer directive of the SpecDef files.
+        :param complevel: int
+            Compression level (0-9) of the outputs.
+        :param dep: bool
+            Option to also process the deposition.
+        :param summary: bool
+            Option to write the daily summaries of the combine outputs.
+        :param day_funcs: list of functions
+            Other functions called as func(date, out_files) for each day (see 
+            `postcmaq.postprocess_day`).
+        :param n_steps: int
+            Number of time steps in a complete daily CCTM output file.
+        :param job_id: string
+            Slurm job ID of CCTM. If given, CCTM is considered to be running while the job
+            is active. Otherwise, CCTM is only considered to have stopped when its log shows 
+            that it failed (see `finish_check`), since it reports a successful completion 
+            after every day.
+        :return out_files: list of strings
+            Files that were written.
+        """
+        utils.make_dirs(self.POST)
+        pending = {}
+        for date in self.cctm_dates():
+            combine_args = self.combine_day_args(date, spec_conc=spec_conc, spec_dep=spec_dep, dep=dep)
+            summary_files = [out_file.replace('/COMBINE_', '/DAILY_') if summary else None for _, _, out_file in combine_args]
+            pending[date] = (combine_args, summary_files)
+        running, out_files, processed = {}, [], []
+        poststart = datetime.datetime.now()
+        with ProcessPoolExecutor(max_workers=n_procs) as pool:
+            while True:
+                # Check CCTM before the outputs, so that days finished at the end are not missed 
+                if len(pending) == 0:
+                    cctm_running = False
+                elif job_id is not None:
+                    # Jobs that were just submitted may not be listed yet
+                    job_states = utils.job_states(job_id)
+                    cctm_running = (len(job_states) == 0) or any([state in SLURM_ACTIVE_STATES for state, _ in job_states.values()])
+                else:
+                    cctm_running = self.finish_check('cctm') != 'failed'
+                for date in list(pending):
+                    combine_args, summary_files = pending[date]
+                    cctm_files = [in_file for _, in_files, _ in combine_args for in_file in in_files if in_file.startswith(self.CCTM_OUTDIR)]
+                    if all([day_complete(in_file, n_steps=n_steps) for in_file in cctm_files]):
+                        running[date] = pool.submit(postprocess_day, date, combine_args, summary_files=summary_files,
+                                                    day_funcs=day_funcs, layer=layer, complevel=complevel)
+                        del pending[date]
+                        if self.verbose:
+                            print(f'Postprocessing {date.strftime("%Y-%m-%d")}')
+                            sys.stdout.flush()
+                for date in [date for date, future in running.items() if future.done()]:
+                    future = running.pop(date)
+                    if future.exception() is not None:
+                        print(f'CMAQPyError: postprocessing {date.strftime("%Y-%m-%d")} failed with: {future.exception()}')
+                    else:
+                        out_files += future.result()
+                        processed.append(date)
+                if len(pending) == 0 and len(running) == 0:
+                    break
+                if not cctm_running and len(pending) > 0:
+                    print(f'Warning: CCTM stopped before finishing {", ".join([date.strftime("%Y-%m-%d") for date in pending])}')
+                    pending = {}
+                time.sleep(poll_seconds if len(pending) > 0 else 1)
+        if self.verbose:
+            print(f'Postprocessed {len(processed)} days; finished '
+                  f'{utils.strfdelta(datetime.datetime.now() - poststart)} after starting')
+        return out_files
+
     def finish_check(self, program, custom_log=None):
         """
         Check if a specified CMAQ subprogram has finished running.
@@ -1090,7 +2144,7 @@ class CMAQModel:
             if custom_log is not None:
                 msg = utils.read_last(custom_log, n_lines=40)
             else:
-                msg = utils.read_last(f'{self.CCTM_SCRIPTS}/cctm_{self.appl}.log', n_lines=40)
+                msg = utils.read_last(f'{self.CCTM_SCRIPTS}/cctm_{self.cctm_appl}.log', n_lines=40)
             complete = '|>---   PROGRAM COMPLETED SUCCESSFULLY   ---<|' in msg
             failed = 'Runscript Detected an Error' in msg
         else:
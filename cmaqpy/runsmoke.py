@@ -2,19 +2,27 @@
 A Class for processing EGU emissions using SMOKE.
 """
 import datetime
+import glob
 import os
+import re
 import sys
 import time
+from collections import Counter
+import pandas as pd
 from . import utils
+from .prepemis import inln_to_2d, stack_cells
 from .data.fetch_data import fetch_yaml
 
+# SMOKE programs reported (in this order) by the log timing summary
+SMOKE_PROGRAMS = ['smkinven', 'spcmat', 'grdmat', 'elevpoint', 'laypoint', 'temporal', 'smkmerge']
+# Slurm states for jobs that are still in the queue or running
+SLURM_ACTIVE_STATES = ['PENDING', 'CONFIGURING', 'RUNNING', 'COMPLETING', 'REQUEUED', 'RESIZING', 'SUSPENDED', 'UNKNOWN']
+
 
 class SMOKEModel:
     """
     This Class provides a framework for running the ptegu/ptertac sectors in SMOKE.
 
-    NOTE: `run_months` actually doesn't do anything currently...
-
     Parameters
     ----------
     :param appl: string
@@ -34,7 +42,8 @@ class SMOKEModel:
         files for a sector. Note that currently, I've only tested ptegu and ptertac sectors,
         but it could probably be adapted without too much trouble. 
     :param run_months: list
-        Integers identifying which months you want to run. Not yet implemented. 
+        Integers identifying which months you want to run. These are written to the
+        RUN_MONTHS variable in the onetime and daily run scripts.
     :param ertac_case: string
         ERTAC EGU case name, which is used for identifying sector input files for the
         ptertac sector.
@@ -95,10 +104,17 @@ class SMOKEModel:
         self.ERTAC_HOME = dirpaths.get('ERTAC_HOME')
         self.CMAQ_DATA = dirpaths.get('CMAQ_DATA')
         self.DIR_TEMPLATES = dirpaths.get('DIR_TEMPLATES')
+        self.SMOKE_LOGS = f'{self.NEI_HOME}/{self.nei_case_name}/intermed/{self.sector}/logs'
         
         filepaths = dirs.get('file_paths')
         self.GRIDDESC = filepaths.get('GRIDDESC')
 
+        # Slurm job IDs of the most recent submissions
+        self.onetime_job_id = None
+        self.daily_job_id = None
+        self.daily_season = 'summer'
+        self.daily_split_months = True
+
         # Define linux command aliai
         self.CMD_LN = 'ln -sf %s %s'
         self.CMD_CP = 'cp %s %s'
@@ -138,9 +154,10 @@ class SMOKEModel:
         case_info += f'setenv EMF_SPC "{self.chem_mech}"\n'
         utils.write_to_template(dir_def_path, case_info, id='%CASE%')   
 
-    def run_sector(self, type='onetime', season='summer', n_procs=1, gb_mem=100, run_hours=12, setup_only=False):
+    def run_sector(self, type='onetime', season='summer', n_procs=1, gb_mem=100, run_hours=12, setup_only=False,
+                   split_months=False, depend_on=None):
         """
-        Run the onetime step for a point sector.
+        Run the onetime or daily step for a point sector.
 
         Parameters
         ----------
@@ -160,7 +177,17 @@ class SMOKEModel:
         :param setup_only: bool
             Option to setup the directories and write the scripts without running SMOKE 
             for the sector.
+        :param split_months: bool
+            Option to submit the daily processing as a Slurm job array with one element
+            per month in `run_months`, so that the months are processed in parallel.
+            Only used when type is "daily".
+        :param depend_on: string
+            Slurm job ID that must complete successfully before this job starts (e.g.,
+            the ID of the onetime job when submitting the daily processing).
+        :return job_id: string
+            Slurm job ID, or None if the script wasn't submitted.
         """
+        split_months = split_months and (type == 'daily')
         # Copy the template onetime run script to the scripts directory
         if type == 'onetime':
             run_script_path = f'{self.NEI_CASESCRIPTS}/point/Annual_{self.sector}_onetime_{self.grid_name}_{self.nei_case_name}.csh'
@@ -181,8 +208,21 @@ class SMOKEModel:
         slurm_info += f'#SBATCH -t {run_hours}:00:00		# Run time (hh:mm:ss)\n'
         slurm_info += f'#SBATCH --mem={gb_mem}000M		# memory required per node\n'
         slurm_info += f'#SBATCH --partition=default_cpu	# Which queue it should run on\n'
+        if split_months:
+            slurm_info += f'#SBATCH --array=1-{len(self.run_months)}	# One array element per month\n'
+            slurm_info += f'#SBATCH -o {self.SMOKE_LOGS}/out_{self.sector}_{season}.%A_%a	# Name of stdout output file (%A_%a expands to jobId_taskId)\n'
+        elif type == 'daily':
+            slurm_info += f'#SBATCH -o {self.SMOKE_LOGS}/out_{self.sector}_{season}.%j	# Name of stdout output file (%j expands to jobId)\n'
         utils.write_to_template(run_script_path, slurm_info, id='%SLURM%')
 
+        # Write the months to process
+        if split_months:
+            months_info  = f'set MONTHS_LIST = ( {" ".join([str(month) for month in self.run_months])} )\n'
+            months_info += f'setenv RUN_MONTHS " $MONTHS_LIST[$SLURM_ARRAY_TASK_ID] "'
+        else:
+            months_info = f'setenv RUN_MONTHS " {" ".join([str(month) for month in self.run_months])} "'
+        utils.write_to_template(run_script_path, months_info, id='%MONTHS%')
+
         # Write directory definition info
         dir_info = f'source {self.NEI_CASESCRIPTS}/directory_definitions.csh'
         utils.write_to_template(run_script_path, dir_info, id='%DIR_DEF%')
@@ -198,10 +238,100 @@ class SMOKEModel:
         emis_files += f'setenv EMISHOUR_A "{self.ERTAC_HOME}/{self.ertac_case}/for_SMOKE/{self.emishour_a}"\n'
         utils.write_to_template(run_script_path, emis_files, id='%EMIS%')
 
-        # Submit the onetime script to the scheduler
-        if not setup_only:
-            os.system(f'sbatch {run_script_path}')
-        return
+        # Submit the script to the scheduler
+        if setup_only:
+            return None
+        job_id = utils.submit_job(run_script_path, depend_on=depend_on)
+        if type == 'onetime':
+            self.onetime_job_id = job_id
+        else:
+            self.daily_job_id = job_id
+            self.daily_season = season
+            self.daily_split_months = split_months
+        if self.verbose:
+            print(f'Submitted {type} {self.sector} processing for months {self.run_months} as job {job_id}')
+        return job_id
+
+    def run_sector_pipeline(self, season='summer', n_procs=1, onetime_gb_mem=100, onetime_run_hours=12,
+                            daily_gb_mem=50, daily_run_hours=12, setup_only=False):
+        """
+        Submit the onetime step once, followed by the daily processing as a job array
+        (one element per month in `run_months`) that only starts once the onetime step 
+        has completed successfully. Use `daily_status` to follow the daily processing.
+
+        Parameters
+        ----------
+        :param season: string
+            Season for which you are running SMOKE (see `run_sector`).
+        :param n_procs: int
+            Number of processors to request from the scheduler for each job. 
+        :param onetime_gb_mem: int
+            Number of GB of memory per node to request for the onetime step.
+        :param onetime_run_hours: int
+            Number of hours to request for the onetime step.
+        :param daily_gb_mem: int
+            Number of GB of memory per node to request for each month of daily processing.
+        :param daily_run_hours: int
+            Number of hours to request for each month of daily processing.
+        :param setup_only: bool
+            Option to write the scripts without submitting them.
+        :return job_ids: tuple of strings
+            Slurm job IDs of the onetime job and the daily job array.
+        """
+        onetime_id = self.run_sector(type='onetime', season=season, n_procs=n_procs, gb_mem=onetime_gb_mem,
+                                     run_hours=onetime_run_hours, setup_only=setup_only)
+        if (onetime_id is None) and (not setup_only):
+            print('CMAQPyError: the onetime step was not submitted, so the daily processing was not submitted either')
+            return None, None
+        daily_id = self.run_sector(type='daily', season=season, n_procs=n_procs, gb_mem=daily_gb_mem,
+                                   run_hours=daily_run_hours, setup_only=setup_only, split_months=True,
+                                   depend_on=onetime_id)
+        return onetime_id, daily_id
+
+    def daily_status(self, job_id=None, season=None):
+        """
+        Get the status of each month of daily processing submitted by `run_sector_pipeline`
+        (or `run_sector` with `split_months=True`), including any errors found in the 
+        stdout file of each array element.
+
+        Parameters
+        ----------
+        :param job_id: string
+            Slurm job ID of the daily job array. Defaults to the most recent submission.
+        :param season: string
+            Season used when submitting the daily processing. Defaults to that of the 
+            most recent submission.
+        :return status_df: `pandas.DataFrame`
+            Slurm state, elapsed time, number of errors, and the first error message
+            for each month.
+        """
+        if job_id is None:
+            job_id = self.daily_job_id
+            split_months = self.daily_split_months
+        else:
+            split_months = True
+        if season is None:
+            season = self.daily_season
+        if job_id is None:
+            raise ValueError('No daily processing job has been submitted')
+        states = utils.job_states(job_id)
+        status = []
+        if split_months:
+            elements = [(task_id, month, f'{self.SMOKE_LOGS}/out_{self.sector}_{season}.{job_id}_{task_id}')
+                        for task_id, month in enumerate(self.run_months, start=1)]
+        else:
+            elements = [(None, ' '.join([str(month) for month in self.run_months]), 
+                         f'{self.SMOKE_LOGS}/out_{self.sector}_{season}.{job_id}')]
+        for task_id, month, out_file in elements:
+            state, elapsed = states.get(task_id, ('UNKNOWN', ''))
+            errors = utils.find_errors(out_file)
+            status.append({'month': month, 'task_id': task_id, 'state': state, 'elapsed': elapsed,
+                           'n_errors': len(errors), 'first_error': errors[0] if len(errors) > 0 else '',
+                           'stdout': out_file})
+        status_df = pd.DataFrame(status).set_index('month')
+        if self.verbose:
+            print(status_df[['state', 'elapsed', 'n_errors']])
+        return status_df
 
     def run_inlineto2d(self, date, run_hours=1, mem_per_node=20):
         """
@@ -257,3 +387,260 @@ class SMOKEModel:
         # Submit inlineto2d to the scheduler
         os.system(f'sbatch {run_inln_path}')
         return
+
+    def inlineto2d(self, start_date, end_date=None):
+        """
+        Grid the in-line point-source outputs onto the 2D model grid in Python, rather 
+        than submitting the SMOKE `inlineto2d` utility to the scheduler once per day (see 
+        `run_inlineto2d`). The grid cell of each stack is computed once from the stack groups 
+        file, and then every date is processed in this process, so a whole month runs 
+        without any scheduler jobs.
+
+        Parameters
+        ----------
+        :param start_date: string 
+            First date for which you want to grid the in-line emissions.
+        :param end_date: string
+            Last date for which you want to grid the in-line emissions. Defaults to
+            the `start_date`.
+        :return out_files: list of strings
+            Paths of the 2D files that were written.
+        """
+        # Format the dates
+        start_date = utils.format_date(start_date)
+        if end_date is None:
+            end_date = start_date
+        else:
+            end_date = utils.format_date(end_date)
+
+        # Find the grid cell of each stack
+        smoke_out_ptsector = f'{self.SMOKE_OUT}/{self.sector}'
+        stack_groups_file = f'{smoke_out_ptsector}/stack_groups_{self.sector}_{self.grid_name}_{self.nei_case_name}.ncf'
+        cells, grid = stack_cells(stack_groups_file, self.GRIDDESC, self.grid_name)
+
+        out_files = []
+        date = start_date
+        while date <= end_date:
+            t0 = time.time()
+            inln_file = f'{smoke_out_ptsector}/inln_mole_{self.sector}_{date.strftime("%Y%m%d")}_{self.grid_name}_{self.chem_mech}_{self.nei_case_name}.ncf'
+            out_file = f'{smoke_out_ptsector}/2d_mole_{self.sector}_{date.strftime("%Y%m%d")}_{self.grid_name}_{self.chem_mech}_{self.nei_case_name}.ncf'
+            if not os.path.exists(inln_file):
+                print(f'Warning: {inln_file} does not exist... skipping')
+            else:
+                n_outside = inln_to_2d(inln_file, out_file, cells, grid)
+                out_files.append(out_file)
+                if self.verbose:
+                    print(f'Wrote {out_file} in {time.time() - t0:.1f} s ({n_outside} stacks outside the grid)')
+            date += datetime.timedelta(days=1)
+        return out_files
+
+    def log_summary(self, pattern='*.log'):
+        """
+        Parse the SMOKE log files for this sector (in `intermed/{sector}/logs`).
+
+        Parameters
+        ----------
+        :param pattern: string
+            Glob pattern for the log files within the logs directory.
+        :return logs_df: `pandas.DataFrame`
+            Status, timing, warning counts, and errors for each log file (see `smoke_log_summary`).
+        :return timing_df: `pandas.DataFrame`
+            Number of runs and total/mean/max run time of each SMOKE program.
+        """
+        states = {}
+        for log_file in sorted(glob.glob(f'{self.SMOKE_LOGS}/{pattern}')):
+            states[log_file] = parse_smoke_log(log_file)
+        return smoke_log_summary(states)
+
+    def monitor_logs(self, poll_seconds=60, job_ids=None, pattern='*.log', stop_on_error=True, 
+                     on_complete=None, max_hours=24):
+        """
+        Follow the SMOKE log files for this sector as they are written. Newly started, completed, 
+        and failed programs are reported as they happen, and each log file is only read from where
+        the previous check left off.
+
+        Parameters
+        ----------
+        :param poll_seconds: int
+            Number of seconds to wait between checks.
+        :param job_ids: list of strings
+            Slurm job IDs to follow. Monitoring stops once none of these jobs is pending or running.
+            Defaults to the onetime and daily jobs submitted by this object (if any).
+        :param pattern: string
+            Glob pattern for the log files within the logs directory.
+        :param stop_on_error: bool
+            Option to stop monitoring as soon as a fatal error is found in any log.
+        :param on_complete: function
+            Optional function called as `on_complete(program, log_file)` when a program completes 
+            normally (e.g., to start a downstream step once a day's smkmerge has finished).
+        :param max_hours: float
+            Maximum number of hours to monitor.
+        :return logs_df: `pandas.DataFrame`
+            Status, timing, warning counts, and errors for each log file (see `smoke_log_summary`).
+        :return timing_df: `pandas.DataFrame`
+            Number of runs and total/mean/max run time of each SMOKE program.
+        """
+        if job_ids is None:
+            job_ids = [job_id for job_id in [self.onetime_job_id, self.daily_job_id] if job_id is not None]
+        monitor_start = datetime.datetime.now()
+        states = {}
+        while True:
+            for log_file in sorted(glob.glob(f'{self.SMOKE_LOGS}/{pattern}')):
+                # Skip logs left over from earlier runs
+                if (log_file not in states) and (datetime.datetime.fromtimestamp(os.path.getmtime(log_file)) < monitor_start):
+                    continue
+                old_status = states[log_file]['status'] if log_file in states else None
+                states[log_file] = parse_smoke_log(log_file, state=states.get(log_file))
+                state = states[log_file]
+                if state['status'] == old_status:
+                    continue
+                if self.verbose and (old_status is None):
+                    print(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S} Started {state["program"]}: {os.path.basename(log_file)}')
+                if state['status'] == 'complete':
+                    if self.verbose:
+                        print(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S} Completed {state["program"]}: {os.path.basename(log_file)}')
+                    if on_complete is not None:
+                        on_complete(state['program'], log_file)
+                elif state['status'] == 'failed':
+                    print(f'\nCMAQPyError: {state["program"]} has failed ({log_file}). Errors were:')
+                    print('\n'.join(state['errors']))
+            failed = any([state['status'] == 'failed' for state in states.values()])
+            if failed and stop_on_error:
+                break
+            if len(job_ids) > 0:
+                active = False
+                for job_id in job_ids:
+                    job_states = utils.job_states(job_id)
+                    # Jobs that sacct doesn't know about yet are still queued
+                    if (len(job_states) == 0) or any([state in SLURM_ACTIVE_STATES for state, _ in job_states.values()]):
+                        active = True
+                if not active:
+                    break
+            if (datetime.datetime.now() - monitor_start).total_seconds() > max_hours * 3600:
+                print(f'Warning: stopped monitoring the SMOKE logs after {max_hours} hours')
+                break
+            time.sleep(poll_seconds)
+        logs_df, timing_df = smoke_log_summary(states)
+        if self.verbose:
+            print(timing_df)
+        return logs_df, timing_df
+
+
+def warning_category(message):
+    """
+    Reduces a SMOKE warning message to a category by replacing the parts that 
+    change from one warning to the next (quoted strings, numbers, IDs) with "#".
+
+    Parameters
+    ----------
+    :param message: string
+        Warning message (i.e., the text after "WARNING:").
+    :return category: string
+        Warning category.
+    """
+    category = re.sub(r'"[^"]*"|\'[^\']*\'', '#', message)
+    category = re.sub(r'[\w./-]*\d[\w./-]*', '#', category)
+    category = re.sub(r'#(\W*#)+', '#', category)
+    category = ' '.join(category.split())
+    return category[:80]
+
+
+def parse_smoke_log(log_file, state=None):
+    """
+    Parses a SMOKE log file, starting where a previous call left off so that large, 
+    growing log files can be followed without re-reading them.
+
+    Parameters
+    ----------
+    :param log_file: string
+        Path to the SMOKE log file.
+    :param state: dict
+        State returned by a previous call for the same file. Defaults to None, which
+        parses the file from the beginning.
+    :return state: dict
+        Program name, status ('running', 'complete', or 'failed'), warning counts by 
+        category, fatal errors, the byte offset read so far, when the file was first seen 
+        (and whether it was still running at that point), and its last modification time.
+    """
+    if state is None:
+        # The program name can be read from the log banner, but fall back on the file name
+        state = {'log_file': log_file,
+                 'program': os.path.basename(log_file).split('_')[0].lower(),
+                 'status': 'running',
+                 'warnings': Counter(),
+                 'errors': [],
+                 'offset': 0,
+                 'first_seen': datetime.datetime.now(),
+                 'seen_running': None,
+                 'last_modified': None}
+    state['last_modified'] = datetime.datetime.fromtimestamp(os.path.getmtime(log_file))
+    with open(log_file, mode='rb') as f:
+        f.seek(state['offset'])
+        new_text = f.read()
+    # Only parse complete lines
+    n_complete = new_text.rfind(b'\n') + 1
+    state['offset'] += n_complete
+    for line in new_text[:n_complete].decode(errors='replace').splitlines():
+        banner = re.match(r'\s*Program\s+([A-Za-z0-9_]+),\s+Version', line)
+        if banner is not None:
+            state['program'] = banner.group(1).lower()
+        elif 'Normal Completion of program' in line:
+            state['status'] = 'complete'
+        elif ('ERROR ABORT' in line) or line.strip().startswith('ERROR:'):
+            state['status'] = 'failed'
+            state['errors'].append(line.strip())
+        elif 'WARNING:' in line:
+            state['warnings'][warning_category(line.split('WARNING:', 1)[1])] += 1
+    if state['seen_running'] is None:
+        state['seen_running'] = state['status'] == 'running'
+    return state
+
+
+def smoke_log_summary(states):
+    """
+    Summarizes parsed SMOKE logs (see `parse_smoke_log`) by log file and by program.
+
+    SMOKE doesn't write time stamps to its logs, so the start of a program is taken as 
+    the time its log was first seen if it was still running then (i.e., when following 
+    the logs with `SMOKEModel.monitor_logs`). Otherwise, since SMOKE programs run one after 
+    the other, it is taken as the last modification time of the previous log.
+
+    Parameters
+    ----------
+    :param states: dict
+        Parsed logs, keyed by the log file path.
+    :return logs_df: `pandas.DataFrame`
+        Program, status, start, end, run time, number of warnings, most common
+        warning category, and the first fatal error for each log file.
+    :return timing_df: `pandas.DataFrame`
+        Number of runs, failures, and warnings, and the total/mean/max run time of each program.
+    """
+    rows = []
+    previous_end = None
+    for state in sorted(states.values(), key=lambda state: state['last_modified']):
+        end = state['last_modified']
+        start = state['first_seen'] if state['seen_running'] else previous_end
+        rows.append({'log_file': state['log_file'],
+                     'program': state['program'],
+                     'status': state['status'],
+                     'start': start,
+                     'end': end,
+                     'run_time': (end - start) if start is not None else pd.NaT,
+                     'n_warnings': sum(state['warnings'].values()),
+                     'top_warning': state['warnings'].most_common(1)[0][0] if len(state['warnings']) > 0 else '',
+                     'n_errors': len(state['errors']),
+                     'first_error': state['errors'][0] if len(state['errors']) > 0 else ''})
+        previous_end = end
+    columns = ['log_file', 'program', 'status', 'start', 'end', 'run_time', 'n_warnings', 'top_warning', 'n_errors', 'first_error']
+    logs_df = pd.DataFrame(rows, columns=columns).set_index('log_file')
+    logs_df['run_time'] = pd.to_timedelta(logs_df['run_time'])
+    timing_df = logs_df.groupby('program').agg(n_runs=('status', 'size'),
+                                               n_failed=('status', lambda status: (status == 'failed').sum()),
+                                               n_warnings=('n_warnings', 'sum'),
+                                               total_time=('run_time', 'sum'),
+                                               mean_time=('run_time', 'mean'),
+                                               max_time=('run_time', 'max'))
+    # List the main SMOKE programs first, in the order they run
+    order = [program for program in SMOKE_PROGRAMS if program in timing_df.index]
+    order += [program for program in timing_df.index if program not in order]
+    return logs_df, timing_df.loc[order]
@@ -0,0 +1,119 @@
+"""
+Tests evaluate functions using a small, synthetic Lambert conformal grid and sites.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.evaluate as evaluate
+import cmaqpy.utils as utils
+
+
+GRID = {'GDNAM': 'EVAL', 'GDTYP': 2, 'P_ALP': 33., 'P_BET': 45., 'P_GAM': -97., 'XCENT': -97., 'YCENT': 40.,
+        'XORIG': -60000., 'YORIG': -36000., 'XCELL': 12000., 'YCELL': 12000., 'NCOLS': 10, 'NROWS': 6}
+
+
+def grid_ds(n_steps=48):
+    """
+    Makes a lazy dataset like those from `postcmaq.open_cctm`, with O3 = time step + 100 * row + col.
+    """
+    lon, lat = utils.grid_lonlat(GRID)
+    times = pd.date_range('2016-08-01', periods=n_steps, freq='h')
+    o3 = (np.arange(n_steps)[:, None, None, None] + 100. * np.arange(6)[:, None] + np.arange(10)) * np.ones((1, 1, 6, 10))
+    ds = xr.Dataset({'O3': (('time', 'z', 'y', 'x'), o3, {'units': 'ppbV'})},
+                    coords={'time': times, 'latitude': (('y', 'x'), lat), 'longitude': (('y', 'x'), lon)},
+                    attrs=GRID)
+    return ds.chunk({'time': 24})
+
+
+def test_site_locator(tmp_path):
+    """
+    Checks the projected and KD-tree cell lookups and the bilinear weights.
+    """
+    lon, lat = utils.grid_lonlat(GRID)
+    corner_lon, corner_lat = utils.grid_lonlat(GRID, stagger=True)
+    # Cell centers, a point just inside a cell corner, and a point outside the grid
+    site_lat = np.array([lat[2, 3], lat[5, 9], corner_lat[1, 1] + 0.01, 50.])
+    site_lon = np.array([lon[2, 3], lon[5, 9], corner_lon[1, 1] + 0.01, -97.])
+    projected = evaluate.GridLocator(GRID)
+    rows, cols, inside = projected.nearest(site_lat, site_lon)
+    assert rows[:3].tolist() == [2, 5, 1] and cols[:3].tolist() == [3, 9, 1]
+    assert inside.tolist() == [True, True, True, False]
+    tree = evaluate.site_locator({'GDTYP': 1}, lat, lon, cache_dir=str(tmp_path))
+    assert tree.tree is not None
+    tree_rows, tree_cols, tree_inside = tree.nearest(site_lat, site_lon)
+    assert (tree_rows[:3] == rows[:3]).all() and (tree_cols[:3] == cols[:3]).all()
+    assert tree_inside.tolist() == inside.tolist()
+    assert len(list(tmp_path.glob('site_locator_latlon_*.pkl'))) == 1
+    rows, cols, weights, inside = projected.bilinear(site_lat[:2], site_lon[:2])
+    assert np.allclose(weights.sum(axis=1), 1.)
+    assert rows[0, np.argmax(weights[0])] == 2 and cols[0, np.argmax(weights[0])] == 3
+    assert np.isclose(weights[0].max(), 1.) and np.isclose(weights[1].max(), 1.)
+
+
+def test_extract_and_stats(tmp_path):
+    """
+    Checks the site time series, the AQS reader, and the paired statistics by site and day.
+    """
+    lon, lat = utils.grid_lonlat(GRID)
+    times = pd.date_range('2016-08-01', periods=48, freq='h')
+    csv = pd.DataFrame({'State Code': '36', 'County Code': '1', 'Site Num': '12', 'Parameter Code': 44201, 'POC': 1,
+                        'Latitude': lat[2, 3], 'Longitude': lon[2, 3], 'Date GMT': times.strftime('%Y-%m-%d'),
+                        'Time GMT': times.strftime('%H:%M'), 'Sample Measurement': np.arange(48) + 203. + 2.})
+    other = csv.assign(**{'Site Num': '13', 'Latitude': lat[4, 8], 'Longitude': lon[4, 8],
+                          'Sample Measurement': (np.arange(48) + 408.) * 2})
+    # A collocated monitor is averaged with the first one
+    poc = csv.assign(POC=2, **{'Sample Measurement': np.arange(48) + 203. - 2.})
+    pd.concat([csv, other, poc]).to_csv(tmp_path / 'hourly_44201_2016.csv', index=False)
+    obs = evaluate.read_aqs(str(tmp_path / 'hourly_44201_2016.csv'), end='2016-08-02 23:00')
+    assert obs['siteid'].unique().tolist() == ['360010012', '360010013']
+    assert np.allclose(obs.loc[obs['siteid'] == '360010012', 'obs'], np.arange(48) + 203.)
+    site_ds = evaluate.extract_sites(grid_ds(), obs)
+    assert site_ds['O3'].dims == ('time', 'z', 'site')
+    assert site_ds['O3'].chunks is not None
+    assert np.allclose(site_ds['O3'].sel(site='360010013').values[:, 0], np.arange(48) + 408.)
+    bilinear_ds = evaluate.extract_sites(grid_ds(), obs, method='bilinear')
+    assert np.allclose(bilinear_ds['O3'].values, site_ds['O3'].values)
+    pairs = evaluate.pair_sites(site_ds['O3'], obs)
+    assert len(pairs) == 96
+    stats = evaluate.paired_stats(pairs, by='siteid')
+    assert stats.loc['360010012', 'MB'] == pytest.approx(0.)
+    assert stats.loc['360010012', 'R'] == pytest.approx(1.)
+    assert stats.loc['360010013', 'NMB'] == pytest.approx(-50.)
+    assert stats.loc['360010013', 'NME'] == pytest.approx(50.)
+    diff = pairs.loc[pairs['siteid'] == '360010013', 'model'] - pairs.loc[pairs['siteid'] == '360010013', 'obs']
+    assert stats.loc['360010013', 'RMSE'] == pytest.approx(np.sqrt((diff**2).mean()))
+    daily = evaluate.paired_stats(pairs, by=['siteid', 'date'])
+    assert daily['N'].tolist() == [24] * 4
+    assert daily.loc[('360010013', pd.Timestamp('2016-08-02')), 'MB'] == pytest.approx(-(np.arange(24, 48) + 408.).mean())
+    assert evaluate.paired_stats(pairs, by=None)['N'].tolist() == [96]
+
+
+def test_pair_daily(tmp_path):
+    """
+    Checks that daily observations are paired with the model means of the local days and
+    are not paired without the UTC offsets.
+    """
+    lon, lat = utils.grid_lonlat(GRID)
+    csv = pd.DataFrame({'State Code': '36', 'County Code': '1', 'Site Num': '12', 'Parameter Code': 88101, 'POC': 1,
+                        'Latitude': lat[2, 3], 'Longitude': lon[2, 3], 'Date Local': ['2016-08-01', '2016-08-02'],
+                        'Arithmetic Mean': [10., 12.]})
+    csv.to_csv(tmp_path / 'daily_88101_2016.csv', index=False)
+    obs = evaluate.read_aqs(str(tmp_path / 'daily_88101_2016.csv'))
+    assert obs['freq'].tolist() == ['daily', 'daily']
+    assert obs['time'].tolist() == [pd.Timestamp('2016-08-01'), pd.Timestamp('2016-08-02')]
+    site_ds = evaluate.extract_sites(grid_ds(), obs)
+    with pytest.raises(ValueError):
+        evaluate.pair_sites(site_ds['O3'], obs)
+    # The local day of 2016-08-01 is 05:00 UTC to 04:00 UTC the next day (time steps 5 to 28)
+    pairs = evaluate.pair_sites(site_ds['O3'], obs, utc_offset=pd.Series({'360010012': -5.}))
+    assert pairs['model'].tolist() == [np.arange(5, 29).mean() + 203., np.arange(29, 48).mean() + 203.]
+    # Only 13 hours of the second local day are simulated
+    pairs = evaluate.pair_sites(site_ds['O3'], obs, utc_offset=-11)
+    assert pairs['time'].tolist() == [pd.Timestamp('2016-08-01')]
+    assert pairs['model'].tolist() == [np.arange(11, 35).mean() + 203.]
+    # Hourly and daily observations can be paired at once
+    hourly = pd.DataFrame({'siteid': '360010012', 'latitude': lat[2, 3], 'longitude': lon[2, 3],
+                           'time': pd.date_range('2016-08-01', periods=3, freq='h'), 'obs': 1., 'freq': 'hourly'})
+    pairs = evaluate.pair_sites(site_ds['O3'], pd.concat([hourly, obs]), utc_offset=-5)
+    assert pairs['model'].tolist() == [203., 204., 205., np.arange(5, 29).mean() + 203., np.arange(29, 48).mean() + 203.]
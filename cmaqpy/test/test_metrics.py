@@ -0,0 +1,85 @@
+"""
+Tests metrics functions using small, synthetic hourly datasets.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.metrics as metrics
+
+
+def hourly_ds(o3, pm25, start='2016-08-01'):
+    """
+    Makes a lazy dataset like those from `postcmaq.open_cctm`.
+    """
+    times = pd.date_range(start, periods=o3.shape[0], freq='h')
+    ds = xr.Dataset({'O3': (('time', 'z', 'y', 'x'), o3[:, None], {'units': 'ppmV'}),
+                     'PM25_TOT': (('time', 'z', 'y', 'x'), pm25[:, None], {'units': 'ug/m3'})},
+                    coords={'time': times, 'latitude': (('y', 'x'), np.full(o3.shape[1:], 40.))})
+    return ds.chunk({'time': 24})
+
+
+def test_daily_metrics():
+    """
+    Checks MDA8 ozone windows that cross days, local days, and the exceedance summary.
+    """
+    times = pd.date_range('2016-08-01', periods=24 * 5, freq='h')
+    o3 = np.full((len(times), 2, 3), 0.040)
+    # 12:00 to 19:59 EST on Aug 2 (17:00 to 00:59 UTC): the 8-hour window crosses the file boundary 
+    o3[(times >= '2016-08-02 17:00') & (times < '2016-08-03 01:00'), 0, 0] = 0.080
+    # 23:00 EST on Aug 3 to 06:59 EST on Aug 4: counts for Aug 3 only
+    o3[(times >= '2016-08-04 04:00') & (times < '2016-08-04 12:00'), 1, 1] = 0.090
+    pm25 = np.full((len(times), 2, 3), 10.)
+    pm25[(times >= '2016-08-03 05:00') & (times < '2016-08-04 05:00'), 0, 1] = 40.
+    daily_ds = metrics.daily_metrics(hourly_ds(o3, pm25))
+    assert daily_ds['MDA8_O3'].chunks is not None
+    assert daily_ds['MDA8_O3'].attrs['units'] == 'ppbV'
+    mda8 = daily_ds['MDA8_O3'].to_series().dropna()
+    assert mda8[('2016-08-02', 0, 0)] == pytest.approx(80.)
+    assert mda8[('2016-08-01', 0, 0)] == pytest.approx(40.)
+    assert mda8[('2016-08-03', 1, 1)] == pytest.approx(90.)
+    assert mda8[('2016-08-04', 1, 1)] == pytest.approx(40.)
+    # The first local day only has 5 hours, and the last day's windows run past the end
+    assert daily_ds['MDA8_O3'].sel(date='2016-07-31').isnull().all()
+    assert daily_ds['MDA8_O3'].sel(date='2016-08-05').isnull().all()
+    pm25_24h = daily_ds['PM25_24H'].sel(date='2016-08-03')
+    assert float(pm25_24h[0, 1]) == pytest.approx(40.)
+    assert float(pm25_24h[0, 0]) == pytest.approx(10.)
+    summary_ds = metrics.exceedances(daily_ds.compute())
+    assert int(summary_ds['MDA8_O3_EXCEED_DAYS'][0, 0]) == 1
+    assert int(summary_ds['MDA8_O3_EXCEED_DAYS'][1, 1]) == 1
+    assert float(summary_ds['MDA8_O3_4TH_MAX'][0, 0]) == pytest.approx(40.)
+    assert int(summary_ds['PM25_24H_EXCEED_DAYS'][0, 1]) == 1
+    assert int(summary_ds['MDA8_O3_N_DAYS'][0, 0]) == 4
+
+
+def test_check_hourly():
+    """
+    Checks that the rolling windows require continuous hourly data.
+    """
+    o3 = np.full((48, 2, 3), 0.04)
+    ds = hourly_ds(o3, o3)
+    with pytest.raises(ValueError):
+        metrics.mda8(ds['O3'].isel(time=list(range(10)) + list(range(11, 48))))
+
+
+def test_local_offsets():
+    """
+    Checks that per-cell UTC offsets give the same daily metrics as converting each cell
+    with its own offset.
+    """
+    rng = np.random.default_rng(0)
+    o3 = rng.random((24 * 4, 2, 3)) * 0.08
+    ds = hourly_ds(o3, o3 * 500)
+    offsets = np.array([[-5, -6, -7], [-8, -5, -4]])
+    local = metrics.to_local(ds['O3'], offsets)
+    assert local.sizes['time'] == 24 * 4 + 4
+    assert np.isnan(local.isel(time=0, y=0, x=0)).all()
+    assert np.allclose(local.sel(time='2016-08-01 00:00').isel(z=0, y=1, x=0), o3[8, 1, 0])
+    daily_ds = metrics.daily_metrics(ds, utc_offset=offsets).compute()
+    for row in range(2):
+        for col in range(3):
+            cell_ds = metrics.daily_metrics(ds.isel(y=[row], x=[col]), utc_offset=offsets[row, col]).compute()
+            for var in ['MDA8_O3', 'PM25_24H']:
+                expected = cell_ds[var].isel(y=0, x=0).to_series().dropna()
+                assert np.allclose(daily_ds[var].isel(y=row, x=col).to_series().dropna().reindex(expected.index), expected)
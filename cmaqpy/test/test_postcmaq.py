@@ -0,0 +1,230 @@
+"""
+Tests postcmaq functions using small, synthetic IOAPI-like files.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.postcmaq as postcmaq
+from cmaqpy.postcmaq import QuantileSketch
+
+
+def write_ioapi(path, values, n_steps=24, start='2016-08-05'):
+    """
+    Writes a small file with IOAPI-like dimensions, attributes, and TFLAG.
+    """
+    times = pd.date_range(start, periods=n_steps, freq='h')
+    ds = xr.Dataset({var: (('TSTEP', 'LAY', 'ROW', 'COL'), value) for var, value in values.items()},
+                    attrs={'GDNAM': '12US1', 'GDTYP': np.int32(2), 'P_ALP': 33., 'P_BET': 45., 'P_GAM': -97., 'XCENT': -97.,
+                           'YCENT': 40., 'XORIG': -2556000., 'YORIG': -1728000., 'XCELL': 12000., 'YCELL': 12000.,
+                           'NCOLS': np.int32(3), 'NROWS': np.int32(2), 'SDATE': np.int32(times[0].strftime('%Y%j')),
+                           'STIME': np.int32(0), 'TSTEP': np.int32(10000)})
+    tflag = np.zeros((n_steps, len(values), 2), dtype='int32')
+    tflag[:, :, 0] = np.asarray(times.strftime('%Y%j').astype(int))[:, None]
+    tflag[:, :, 1] = np.asarray(times.hour * 10000)[:, None]
+    ds['TFLAG'] = (('TSTEP', 'VAR', 'DATE-TIME'), tflag)
+    ds.to_netcdf(path)
+
+
+def test_compile_expr():
+    """
+    Checks the evaluation of SpecDef expressions.
+    """
+    values = {('A', 1): np.array([1.0, 5.0]), ('B', 2): np.array([2.0, 4.0])}
+    get = lambda name, idx: values[(name, idx)]
+    evaluate, refs = postcmaq.compile_expr('-A[1]*(B[2]-2) != 0 ? MIN(A[1], 3.) : -1')
+    assert refs == {('A', 1), ('B', 2)}
+    assert list(evaluate(get)) == [-1.0, 3.0]
+    assert list(postcmaq.compile_expr('1.0E3*A[1]/B[2] + 2')[0](get)) == [502.0, 1252.0]
+    with pytest.raises(ValueError):
+        postcmaq.compile_expr('1000*O3[1] +')
+    with pytest.raises(ValueError):
+        postcmaq.compile_expr('FOO(O3[1])')
+
+
+def test_combine_day(tmp_path):
+    """
+    Checks that combine_day computes the species, matches the time steps of the METCRO files,
+    and selects the layer.
+    """
+    ones = lambda n_steps, n_lays: np.ones((n_steps, n_lays, 2, 3), dtype='float32')
+    write_ioapi(tmp_path / 'aconc.nc', {'O3': 0.04 * ones(24, 3), 'ANO3J': -ones(24, 3), 'ASO4J': 2 * ones(24, 3)})
+    temp2 = 295.0 * ones(25, 1)
+    temp2[5] = 300.0
+    write_ioapi(tmp_path / 'metcro2d.nc', {'TEMP2': temp2}, n_steps=25, start='2016-08-04 23:00')
+    write_ioapi(tmp_path / 'apmdiag.nc', {'PM25AC': 0.5 * ones(24, 3)})
+    with open(tmp_path / 'SpecDef.txt', 'w') as f:
+        f.write('/ Test species definitions\n#layer         1\n/\n')
+        f.write('O3              ,ppbV      ,1000.0*O3[1]\n')
+        f.write('ANO3J           ,ug m-3    ,ANO3J[1] > 0 ? ANO3J[1] : 0.0  ! no negatives\n')
+        f.write('PM25_SO4        ,ug m-3    ,ASO4J[1]*PM25AC[3]\n')
+        f.write('SFC_TMP         ,C         ,(TEMP2[4]-273.15)\n')
+        f.write('O3_x2           ,ppbV      ,2*O3[0]\n')
+    in_files = [tmp_path / 'aconc.nc', tmp_path / 'metcro3d.nc', tmp_path / 'apmdiag.nc', tmp_path / 'metcro2d.nc']
+    names = postcmaq.combine_day(tmp_path / 'SpecDef.txt', in_files, tmp_path / 'combine.nc', chunk_steps=5)
+    assert names == ['O3', 'ANO3J', 'PM25_SO4', 'SFC_TMP', 'O3_x2']
+    with xr.open_dataset(tmp_path / 'combine.nc') as ds:
+        assert ds.sizes['LAY'] == 1
+        assert np.allclose(ds['O3'], 40.0)
+        assert (ds['ANO3J'] == 0).all()
+        assert np.allclose(ds['PM25_SO4'], 1.0)
+        assert np.allclose(ds['O3_x2'], 80.0)
+        # The METCRO2D file starts an hour earlier
+        assert np.isclose(ds['SFC_TMP'][4, 0, 0, 0], 26.85)
+        assert ds['O3'].attrs['units'].strip() == 'ppbV'
+        assert ds.attrs['VAR-LIST'].split() == names
+    postcmaq.combine(tmp_path / 'SpecDef.txt', [in_files] * 2, [tmp_path / 'c1.nc', tmp_path / 'c2.nc'], n_procs=2, layer=2)
+    with xr.open_dataset(tmp_path / 'c2.nc') as ds:
+        assert ds.sizes['LAY'] == 1
+        assert np.allclose(ds['SFC_TMP'][0], 21.85)
+
+
+def test_day_complete(tmp_path):
+    """
+    Checks that a file is only complete when the TFLAG values of every time step are set.
+    """
+    ones = np.ones((24, 1, 2, 3), dtype='float32')
+    write_ioapi(tmp_path / 'aconc.nc', {'O3': ones, 'NO2': ones})
+    assert postcmaq.day_complete(tmp_path / 'aconc.nc')
+    assert not postcmaq.day_complete(tmp_path / 'aconc.nc', n_steps=25)
+    assert not postcmaq.day_complete(tmp_path / 'missing.nc')
+    with xr.open_dataset(tmp_path / 'aconc.nc') as ds:
+        ds = ds.load()
+    # CCTM has not written NO2 for the last hour yet
+    ds['TFLAG'][-1, 1, :] = 0
+    ds.to_netcdf(tmp_path / 'partial.nc')
+    assert not postcmaq.day_complete(tmp_path / 'partial.nc')
+
+
+def test_postprocess_day(tmp_path):
+    """
+    Checks the combine output, daily summary, and extra functions for one day.
+    """
+    o3 = np.full((24, 1, 2, 3), 0.03, dtype='float32')
+    o3[12] = 0.07
+    write_ioapi(tmp_path / 'aconc.nc', {'O3': o3})
+    with open(tmp_path / 'SpecDef.txt', 'w') as f:
+        f.write('O3              ,ppbV      ,1000.0*O3[1]\n')
+    combine_args = [(tmp_path / 'SpecDef.txt', [tmp_path / 'aconc.nc'], tmp_path / 'combine.nc')]
+    out_files = postcmaq.postprocess_day(pd.Timestamp('2016-08-05'), combine_args, summary_files=[tmp_path / 'daily.nc'],
+                                         day_funcs=[write_day_list])
+    assert out_files == [tmp_path / 'combine.nc', tmp_path / 'daily.nc']
+    with xr.open_dataset(tmp_path / 'daily.nc') as ds:
+        assert ds.sizes['TSTEP'] == 1
+        assert np.allclose(ds['O3_MAX'], 70.0)
+        assert np.allclose(ds['O3_MEAN'], (23 * 30.0 + 70.0) / 24)
+        assert ds.attrs['VAR-LIST'].split() == ['O3_MEAN', 'O3_MAX']
+    with open(tmp_path / 'days.txt') as f:
+        assert f.read() == '20160805 2\n'
+
+
+def write_day_list(date, out_files):
+    """
+    Records the day and the number of files passed to a day function.
+    """
+    with open(os.path.join(os.path.dirname(out_files[0]), 'days.txt'), 'a') as f:
+        f.write(f'{date.strftime("%Y%m%d")} {len(out_files)}\n')
+
+
+def test_open_cctm(tmp_path):
+    """
+    Checks that daily files are opened as one lazy dataset with the selected variables,
+    layers, and times.
+    """
+    values = np.arange(24 * 3 * 2 * 3, dtype='float32').reshape(24, 3, 2, 3)
+    write_ioapi(tmp_path / 'day1.nc', {'O3': np.concatenate([values, values[:1]]), 'NO2': np.concatenate([values, values[:1]])}, n_steps=25, start='2016-08-05')
+    write_ioapi(tmp_path / 'day2.nc', {'O3': -values, 'NO2': values}, start='2016-08-06')
+    ds = postcmaq.open_cctm([tmp_path / 'day1.nc', tmp_path / 'day2.nc'], var_names=['O3'], layers=0,
+                            start='2016-08-05 06:00', end='2016-08-06 03:00', chunk_steps=6)
+    assert list(ds.data_vars) == ['O3']
+    assert ds['O3'].chunks is not None
+    assert dict(ds.sizes) == {'time': 22, 'z': 1, 'y': 2, 'x': 3}
+    assert ds['time'].values[0] == np.datetime64('2016-08-05T06:00')
+    # The time step in both files is taken from the first file
+    assert np.allclose(ds['O3'].sel(time='2016-08-06 00:00'), values[0, 0])
+    assert np.allclose(ds['O3'].sel(time='2016-08-06 01:00'), -values[1, 0])
+    assert np.allclose(ds['O3'].isel(time=0), values[6, 0])
+    assert ds['latitude'].shape == (2, 3)
+    assert np.isclose(ds['longitude'][0, 0], -121.0, atol=0.1)
+    assert ds.attrs['proj4_srs'].startswith('+proj=lcc +lat_1=33.0 +lat_2=45.0 +lat_0=40.0 +lon_0=-97.0')
+    with pytest.raises(ValueError):
+        postcmaq.open_cctm([tmp_path / 'day1.nc'], start='2017-01-01')
+
+
+def test_quantile_sketch():
+    """
+    Checks the sketch quantiles against exact quantiles, including after a merge.
+    """
+    rng = np.random.default_rng(0)
+    values = rng.normal(0., 1., (1000, 2, 3)) * np.array([1., 10., 100.])
+    values[:, 1, 2] = np.nan
+    sketch = QuantileSketch((2, 3), n_bins=64)
+    for t0 in range(0, 1000, 100):
+        # The values grow over time, so the bins need to be widened
+        sketch.add(values[t0:t0 + 100] * (1 + t0 / 250))
+    scaled = np.concatenate([values[t0:t0 + 100] * (1 + t0 / 250) for t0 in range(0, 1000, 100)])
+    quantiles = sketch.quantile([0.05, 0.5, 0.95])
+    assert np.isnan(quantiles[:, 1, 2]).all()
+    error = np.abs(quantiles - np.nanquantile(scaled, [0.05, 0.5, 0.95], axis=0))
+    assert (error[:, [0, 0, 0, 1, 1], [0, 1, 2, 0, 1]] < sketch.width[[0, 0, 0, 1, 1], [0, 1, 2, 0, 1]]).all()
+    other = QuantileSketch((2, 3), n_bins=64)
+    other.add(values[:500] + 1000.)
+    merged = QuantileSketch((2, 3), n_bins=64)
+    merged.add(values[500:])
+    merged.merge(other)
+    assert merged.counts[:, 0, 0].sum() == 1000
+    exact = np.quantile(np.concatenate([values[500:], values[:500] + 1000.])[:, 0, 0], [0.25, 0.75])
+    assert np.allclose(merged.quantile([0.25, 0.75])[:, 0, 0], exact, atol=2 * merged.width[0, 0])
+    with pytest.raises(ValueError):
+        QuantileSketch((2, 3), n_bins=63)
+
+
+def test_scenario_diff(tmp_path):
+    """
+    Checks the streamed difference statistics between a base case and a scenario.
+    """
+    base = np.full((24, 1, 2, 3), 40., dtype='float32')
+    base[:, 0, 1, 2] = 0.
+    scen = base + np.arange(24, dtype='float32')[:, None, None, None] / 10
+    for day, start in [(1, '2016-08-05'), (2, '2016-08-06')]:
+        write_ioapi(tmp_path / f'base{day}.nc', {'O3': base}, start=start)
+        write_ioapi(tmp_path / f'scen{day}.nc', {'O3': scen}, start=start)
+    diff_ds = postcmaq.scenario_diff([tmp_path / 'base1.nc', tmp_path / 'base2.nc'], [tmp_path / 'scen1.nc', tmp_path / 'scen2.nc'], 
+                                     ['O3'], chunk_steps=5, percentiles=[50, 100])
+    assert diff_ds['O3_diff_mean'].dims == ('y', 'x')
+    assert 'latitude' in diff_ds.coords
+    assert np.allclose(diff_ds['O3_diff_mean'], 1.15)
+    assert np.allclose(diff_ds['O3_diff_max'], 2.3)
+    assert np.allclose(diff_ds['O3_scen_max'][0, 0], 42.3)
+    assert np.allclose(diff_ds['O3_pct_mean_diff'][0, 0], 1.15 / 40 * 100)
+    assert np.isnan(diff_ds['O3_pct_diff_mean'][1, 2])
+    assert np.allclose(diff_ds['O3_diff_p100'], 2.3)
+    assert np.allclose(diff_ds['O3_diff_p50'], 1.15, atol=0.05)
+    assert diff_ds.attrs['n_steps'] == 48
+
+
+def test_ensemble_stats(tmp_path):
+    """
+    Checks the ensemble statistics, and that the process pool gives the same results.
+    """
+    members = []
+    for member in range(5):
+        o3 = np.full((24, 1, 2, 3), 40. + member, dtype='float32')
+        o3[12, 0, 0, 0] = 100. - member
+        write_ioapi(tmp_path / f'member{member}.nc', {'O3': o3})
+        members.append([tmp_path / f'member{member}.nc'])
+    ens_ds = postcmaq.ensemble_stats(members, ['O3'], percentiles=[50])
+    assert np.allclose(ens_ds['O3_mean'][1, 1], 42.)
+    assert np.allclose(ens_ds['O3_std'][1, 1], np.std(np.arange(5), ddof=1))
+    assert (ens_ds['O3_argmax'][1] == 4).all()
+    assert np.allclose(ens_ds['O3_p50'][1, 1], 42., atol=0.1)
+    assert ens_ds.attrs['members'].split(', ')[0] == 'member_0'
+    parallel_ds = postcmaq.ensemble_stats(members, ['O3'], percentiles=[50], n_procs=2)
+    for var in ['O3_mean', 'O3_std', 'O3_min', 'O3_max', 'O3_argmin', 'O3_argmax']:
+        assert np.allclose(parallel_ds[var], ens_ds[var])
+    # Statistics over every hour: the largest hourly value is in the first member
+    hourly_ds = postcmaq.ensemble_stats(members, ['O3'], time_stat=None, percentiles=[])
+    assert np.allclose(hourly_ds['O3_max'][0, 0], 100.)
+    assert hourly_ds['O3_argmax'][0, 0] == 0
+    assert 'O3_p50' not in hourly_ds
@@ -0,0 +1,416 @@
+"""
+Tests prepemis functions using small, synthetic inventory files.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.prepemis as prepemis
+
+ff10_header = ['#FORMAT=FF10_HOURLY_POINT\n', '#COUNTRY=US\n', '#YEAR=2016\n', '#DESC=ERTAC EGU test\n']
+ff10_cols = ['country_cd', 'region_cd', 'tribal_code', 'facility_id', 'unit_id', 'rel_point_id',
+             'process_id', 'scc', 'poll', 'op_type_cd', 'calc_method', 'date_updated', 'date',
+             'daytot'] + [f'hrvl{hr}' for hr in range(1, 25)] + ['comment']
+ff10_units = [('1056111', '47671513', '61246814'), ('1056111', '47671213', '61247114')]
+
+
+def write_test_ff10(ff10_file):
+    """
+    Writes a small FF10 hourly point inventory with two units, two pollutants, and two days.
+    """
+    rows = []
+    for facility_id, unit_id, process_id in ff10_units:
+        for poll in ['NOX', 'SO2']:
+            for date in ['20160805', '20160806']:
+                row = ['US', '01097', '', facility_id, unit_id, '45197212', process_id, '10100201',
+                       poll, '', '', '', date, '24.0'] + ['1.0'] * 24 + ['"Tri-Center, long comment"']
+                rows.append(','.join(row) + '\n')
+    with open(ff10_file, 'w') as f:
+        f.writelines(ff10_header)
+        f.write(','.join(ff10_cols) + '\n')
+        f.writelines(rows)
+
+
+def test_read_write_ff10(tmp_path):
+    """
+    Checks that the FF10 header block, column order, and string identifiers survive a round trip.
+    """
+    in_file = tmp_path / 'test_fs_ff10_hourly_future.csv'
+    out_file = tmp_path / 'test_out.csv'
+    write_test_ff10(in_file)
+    ff10_df = prepemis.read_ff10(in_file)
+    assert list(ff10_df.index.names) == prepemis.FF10_INDEX
+    assert (ff10_df['region_cd'] == '01097').all()
+    prepemis.write_ff10(ff10_df, out_file)
+    header, columns = prepemis.read_ff10_header(out_file)
+    assert header == ff10_header
+    assert columns == ff10_cols
+
+
+def test_edit_ff10_hourly(tmp_path):
+    """
+    Checks that only the selected unit and pollutant are edited and that daytot is updated.
+    """
+    in_file = tmp_path / 'test_fs_ff10_hourly_future.csv'
+    out_file = tmp_path / 'test_out.csv'
+    write_test_ff10(in_file)
+    n_edited = prepemis.edit_ff10_hourly(in_file, out_file, [ff10_units[0][:2]], action='scale',
+                                         factor=2.0, polls=['NOX'], clear_comments=True, chunksize=3)
+    assert n_edited == 2
+    ff10_df = prepemis.read_ff10(out_file)
+    edited = ff10_df.loc[ff10_units[0]]
+    assert (edited.loc[edited['poll'] == 'NOX', 'daytot'] == 48.0).all()
+    assert (edited.loc[edited['poll'] == 'SO2', 'daytot'] == 24.0).all()
+    assert (ff10_df.loc[ff10_units[1], 'hrvl1'] == 1.0).all()
+    assert ff10_df['comment'].isna().all()
+
+
+def test_edit_ff10_hourly_no_units(tmp_path):
+    """
+    Checks that an empty list of units copies the inventory unchanged.
+    """
+    in_file = tmp_path / 'test_fs_ff10_hourly_future.csv'
+    out_file = tmp_path / 'test_out.csv'
+    write_test_ff10(in_file)
+    assert prepemis.edit_ff10_hourly(in_file, out_file, []) == 0
+    assert out_file.read_text() == in_file.read_text()
+    assert prepemis.edit_ff10_hourly(in_file, out_file, [], clear_comments=True, chunksize=3) == 0
+    assert prepemis.read_ff10(out_file)['comment'].isna().all()
+
+
+def test_ml_to_ff10_hourly(tmp_path):
+    """
+    Checks the even and base process splits of unit predictions written into the FF10 hourly inventory.
+    """
+    lu_file = os.path.join(os.path.dirname(prepemis.__file__), 'data/ny_emis/ed_output/RGGI_to_NYISO.csv')
+    # Allegany (ORISPL 10619, unit 1) has two processes with base NOX of 1 and 3 tons per hour
+    point_file = tmp_path / 'test_fs_ff10_future.csv'
+    with open(point_file, 'w') as f:
+        f.write('#FORMAT=FF10_POINT\n')
+        f.write(','.join(prepemis.FF10_INDEX + ['oris_facility_code', 'oris_boiler_id']) + '\n')
+        f.write('1001,2001,3001,10619,1\n1001,2001,3002,10619,1\n1056111,47671513,61246814,,\n')
+    hourly_file = tmp_path / 'test_fs_ff10_hourly_future.csv'
+    rows = []
+    for process_id, base in [('3001', '1.0'), ('3002', '3.0')]:
+        for poll in ['NOX', 'SO2']:
+            rows.append(','.join(['US', '36003', '', '1001', '2001', '1', process_id, '10100201', poll, '', '', '',
+                                  '20160805', str(24 * float(base))] + [base] * 24 + ['']) + '\n')
+    rows.append(','.join(['US', '01097', '', '1056111', '47671513', '1', '61246814', '10100201', 'NOX', '', '', '',
+                          '20160805', '24.0'] + ['1.0'] * 24 + ['']) + '\n')
+    with open(hourly_file, 'w') as f:
+        f.writelines(ff10_header)
+        f.write(','.join(ff10_cols) + '\n')
+        f.writelines(rows)
+    # 8000 lbs (4 tons) per hour for the first 6 hours of the day
+    pred_file = tmp_path / 'pred_xg_nox.csv'
+    pd.DataFrame({'TimeStamp': pd.date_range('2016-08-05', periods=6, freq='h'), 'Allegany': 8000.}).to_csv(pred_file, index=False)
+    out_file = tmp_path / 'test_out.csv'
+    for process_split, expected in [('even', [2., 2.]), ('base', [1., 3.])]:
+        n_edited = prepemis.ml_to_ff10_hourly(hourly_file, out_file, point_file, lu_file=lu_file, 
+                                              pred_files={'NOX': pred_file}, process_split=process_split, chunksize=2)
+        assert n_edited == 2
+        ff10_df = prepemis.read_ff10(out_file).reset_index()
+        nox = ff10_df[(ff10_df['facility_id'] == '1001') & (ff10_df['poll'] == 'NOX')].set_index('process_id')
+        assert nox.loc[['3001', '3002'], 'hrvl1'].tolist() == expected
+        # Hours without predictions keep their base values
+        assert nox.loc[['3001', '3002'], 'hrvl7'].tolist() == [1., 3.]
+        assert nox.loc[['3001', '3002'], 'daytot'].tolist() == [6 * expected[0] + 18., 6 * expected[1] + 54.]
+        assert (ff10_df.loc[ff10_df['poll'] == 'SO2', 'hrvl1'] == [1., 3.]).all()
+        assert (ff10_df.loc[ff10_df['facility_id'] == '1056111', 'hrvl1'] == 1.).all()
+    # Predictions for units that aren't in the inventory leave it unchanged
+    pd.DataFrame({'TimeStamp': pd.date_range('2016-08-05', periods=6, freq='h'), 'Gowanus 5': 1.}).to_csv(pred_file, index=False)
+    assert prepemis.ml_to_ff10_hourly(hourly_file, out_file, point_file, lu_file=lu_file, pred_files={'NOX': pred_file}) == 0
+    assert out_file.read_text() == hourly_file.read_text()
+
+
+def test_ingest_predictions(tmp_path):
+    """
+    Checks clipping, gap filling, lookup validation, and caching of prediction files.
+    """
+    lu_file = os.path.join(os.path.dirname(prepemis.__file__), 'data/ny_emis/ed_output/RGGI_to_NYISO.csv')
+    data_file = tmp_path / 'pred_xg_nox.csv'
+    time_stamps = pd.date_range('2016-08-05', periods=8, freq='h')
+    pred_df = pd.DataFrame({'TimeStamp': time_stamps,
+                            'Allegany': [1.0, np.nan, 3.0, -2.0, np.nan, np.nan, np.nan, 5.0],
+                            'Astoria 3': 1.0,
+                            'Not A Unit': 1.0})
+    pred_df.to_csv(data_file, index=False)
+    pred_df, report = prepemis.ingest_predictions(data_file, lu_file=lu_file, max_gap=2, cache_dir=tmp_path / 'cache')
+    assert pred_df.loc[time_stamps[1], 'Allegany'] == 2.0
+    assert pred_df.loc[time_stamps[3], 'Allegany'] == 0.0
+    assert pred_df['Allegany'].isna().sum() == 3
+    assert report.loc['Allegany', 'status'] == 'found'
+    assert report.loc['Astoria 3', 'status'] == 'multiple'
+    assert report.loc['Not A Unit', 'status'] == 'missing'
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    cached_df, _ = prepemis.ingest_predictions(data_file, lu_file=lu_file, max_gap=2, cache_dir=tmp_path / 'cache')
+    assert cached_df.equals(pred_df)
+
+
+def test_apply_camd_delta(tmp_path):
+    """
+    Checks that only the rows in the delta are rewritten and that a mismatched delta is rejected.
+    """
+    in_file = tmp_path / 'calc_hourly_base.csv'
+    out_file = tmp_path / 'updated_calc_hourly_base.csv'
+    lines = [','.join(['state', 'facility_name'] + prepemis.CAMD_KEYS + prepemis.CAMD_UPD_COLS + ['heat_input (mmBtu)']) + '\n']
+    for hr in range(6):
+        lines.append(f'NY,"Plant, Inc",2480,{1 + hr % 2},2016-08-05,{hr},1.00,,0.50,12,100\n')
+    with open(in_file, 'w') as f:
+        f.writelines(lines)
+    delta_df = pd.DataFrame({'orispl_code': '2480', 'unitid': '2', 'op_date': '2016-08-05',
+                             'op_hour': ['01', '03'], 'co2_mass (tons)': 2.5, 'so2_mass (lbs)': np.nan,
+                             'nox_mass (lbs)': 0.25, 'gload (MW-hr)': 10.0}, index=pd.Index([1, 3], name='row'))
+    delta_file = tmp_path / 'delta.csv'
+    delta_df.to_csv(delta_file)
+    assert prepemis.apply_camd_delta(in_file, delta_file, out_file, block_size=16) == 2
+    with open(out_file) as f:
+        out_lines = f.readlines()
+    assert out_lines[2] == 'NY,"Plant, Inc",2480,2,2016-08-05,1,2.5,,0.25,10.0,100\n'
+    assert [out_lines[i] for i in [0, 1, 3, 5, 6]] == [lines[i] for i in [0, 1, 3, 5, 6]]
+    delta_df['unitid'] = '1'
+    with pytest.raises(ValueError):
+        prepemis.apply_camd_delta(in_file, delta_df, out_file)
+
+
+def test_inln_to_2d(tmp_path):
+    """
+    Checks that stacks are summed into the correct cells and stacks outside the grid are dropped.
+    """
+    griddesc_file = os.path.join(os.path.dirname(prepemis.__file__), 'data/GRIDDESC2')
+    stk_file = tmp_path / 'stack_groups.ncf'
+    inln_file = tmp_path / 'inln_mole.ncf'
+    out_file = tmp_path / '2d_mole.ncf'
+    # Two stacks in cell (row=1, col=2), one in (row=0, col=0), and one outside the 12OTC2 grid
+    xloca = np.array([-936000 + 2.5 * 12000, -936000 + 2.1 * 12000, -936000 + 0.5 * 12000, -2000000.])
+    yloca = np.array([-1620000 + 1.5 * 12000, -1620000 + 1.9 * 12000, -1620000 + 0.5 * 12000, 0.])
+    xr.Dataset({'XLOCA': (('TSTEP', 'LAY', 'ROW', 'COL'), xloca.reshape(1, 1, 4, 1)),
+                'YLOCA': (('TSTEP', 'LAY', 'ROW', 'COL'), yloca.reshape(1, 1, 4, 1))}).to_netcdf(stk_file)
+    emis = np.arange(2 * 4, dtype='float32').reshape(2, 1, 4, 1)
+    tflag = np.zeros((2, 1, 2), dtype='int32')
+    inln_ds = xr.Dataset({'TFLAG': (('TSTEP', 'VAR', 'DATE-TIME'), tflag),
+                          'NOX': (('TSTEP', 'LAY', 'ROW', 'COL'), emis, {'units': 'moles/s'})},
+                         attrs={'FTYPE': np.int32(1), 'NCOLS': np.int32(1), 'NROWS': np.int32(4)})
+    inln_ds.to_netcdf(inln_file)
+    cells, grid = prepemis.stack_cells(stk_file, griddesc_file, '12OTC2')
+    assert list(cells) == [1 * 273 + 2, 1 * 273 + 2, 0, -1]
+    assert prepemis.inln_to_2d(inln_file, out_file, cells, grid) == 1
+    with xr.open_dataset(out_file) as out_ds:
+        assert out_ds['NOX'].shape == (2, 1, 246, 273)
+        assert out_ds['NOX'].values[1, 0, 1, 2] == 4 + 5
+        assert out_ds['NOX'].values[1, 0, 0, 0] == 6
+        assert out_ds['NOX'].values.sum() == emis[:, 0, :3, 0].sum()
+        assert out_ds.attrs['NCOLS'] == 273
+        assert out_ds['NOX'].attrs['units'] == 'moles/s'
+
+
+def test_scale_inln(tmp_path):
+    """
+    Checks that only the stacks of predicted units are scaled, by the scenario/base ratio, in UTC.
+    """
+    ff10_file = tmp_path / 'test_fs_ff10_future.csv'
+    stk_file = tmp_path / 'stack_groups.ncf'
+    inln_file = tmp_path / 'inln_mole.ncf'
+    with open(ff10_file, 'w') as f:
+        f.write('#FORMAT=FF10_POINT\n')
+        f.write('facility_id,unit_id,process_id,rel_point_id,oris_facility_code,oris_boiler_id,latitude,longitude\n')
+        f.write('1,11,111,1111,2480,1,40.0,-74.0\n')
+        f.write('1,12,121,1211,2480,2,40.0,-74.0\n')
+        f.write('2,21,211,2111,,,41.0,-75.0\n')
+    lat = np.array([41.0, 40.00001, 42.0])
+    lon = np.array([-75.0, -74.00001, -76.0])
+    xr.Dataset({'LATITUDE': (('TSTEP', 'LAY', 'ROW', 'COL'), lat.reshape(1, 1, 3, 1)),
+                'LONGITUDE': (('TSTEP', 'LAY', 'ROW', 'COL'), lon.reshape(1, 1, 3, 1))}).to_netcdf(stk_file)
+    xref_df = prepemis.stack_unit_xref(stk_file, ff10_file)
+    assert list(xref_df['stack']) == [1, 1]
+    # Local standard time (EST) predictions: the two units on stack 1 sum to 2 (base) and 3 (scenario)
+    time_stamps = pd.date_range('2016-08-04 19:00', periods=2, freq='h')
+    units = pd.MultiIndex.from_tuples([('2480', '1'), ('2480', '2')], names=['ORISPL', 'Unit ID'])
+    base_df = pd.DataFrame([[1.0, 1.0], [0.0, 0.0]], index=time_stamps, columns=units)
+    scen_df = pd.DataFrame([[2.0, 1.0], [1.0, 0.0]], index=time_stamps, columns=units)
+    factor_df = prepemis.stack_scaling_factors(xref_df, base_df, scen_df, utc_offset=-5)
+    assert factor_df.index[0] == pd.Timestamp('2016-08-05 00:00')
+    assert factor_df.loc['2016-08-05 00:00', 1] == 1.5
+    assert factor_df.loc['2016-08-05 01:00', 1] == 1.0
+    tflag = np.array([[[2016218, 0]], [[2016218, 10000]]], dtype='int32')
+    emis = np.ones((2, 1, 3, 1), dtype='float32')
+    xr.Dataset({'TFLAG': (('TSTEP', 'VAR', 'DATE-TIME'), tflag),
+                'NO': (('TSTEP', 'LAY', 'ROW', 'COL'), emis),
+                'CO': (('TSTEP', 'LAY', 'ROW', 'COL'), emis)}).to_netcdf(inln_file)
+    out_file = tmp_path / 'out' / 'inln_mole.ncf'
+    os.makedirs(out_file.parent)
+    assert prepemis.scale_inln(inln_file, out_file, {'NOX': factor_df}) == 1
+    with xr.open_dataset(out_file) as out_ds:
+        assert list(out_ds['NO'].values[:, 0, :, 0].ravel()) == [1.0, 1.5, 1.0, 1.0, 1.0, 1.0]
+        assert (out_ds['CO'].values == 1.0).all()
+
+
+def test_ml_scale_inln(tmp_path, monkeypatch):
+    """
+    Checks that the default predictions scale the base case (without renewables) down to 
+    the lower S0 (with renewables) emissions.
+    """
+    lu_file = os.path.join(os.path.dirname(prepemis.__file__), 'data', 'ny_emis', 'ed_output', 'RGGI_to_NYISO.csv')
+    monkeypatch.chdir(tmp_path)
+    time_stamps = pd.date_range('2016-08-04 19:00', periods=2, freq='h')
+    for poll in ['nox', 'so2']:
+        pd.DataFrame({'TimeStamp': time_stamps, 'Allegany': [4.0, 4.0]}).to_csv(f'pred_without_renewable_xg_{poll}.csv', index=False)
+        pd.DataFrame({'TimeStamp': time_stamps, 'Allegany': [3.0, 1.0]}).to_csv(f'pred_xg_{poll}.csv', index=False)
+    with open('test_fs_ff10_future.csv', 'w') as f:
+        f.write('#FORMAT=FF10_POINT\n')
+        f.write('facility_id,unit_id,process_id,rel_point_id,oris_facility_code,oris_boiler_id,latitude,longitude\n')
+        f.write('1,11,111,1111,10619,1,42.5,-78.0\n')
+    xr.Dataset({'LATITUDE': (('TSTEP', 'LAY', 'ROW', 'COL'), np.array([42.5, 41.0]).reshape(1, 1, 2, 1)),
+                'LONGITUDE': (('TSTEP', 'LAY', 'ROW', 'COL'), np.array([-78.0, -75.0]).reshape(1, 1, 2, 1))}).to_netcdf('stack_groups.ncf')
+    tflag = np.array([[[2016218, 0]], [[2016218, 10000]]], dtype='int32')
+    emis = np.ones((2, 1, 2, 1), dtype='float32')
+    xr.Dataset({'TFLAG': (('TSTEP', 'VAR', 'DATE-TIME'), tflag), 'NO': (('TSTEP', 'LAY', 'ROW', 'COL'), emis),
+                'SO2': (('TSTEP', 'LAY', 'ROW', 'COL'), emis)}).to_netcdf('inln_mole.ncf')
+    out_files = prepemis.ml_scale_inln(['inln_mole.ncf'], 'out', 'stack_groups.ncf', 'test_fs_ff10_future.csv', lu_file=lu_file)
+    with xr.open_dataset(out_files[0]) as out_ds:
+        for var in ['NO', 'SO2']:
+            factors = out_ds[var].values[:, 0, :, 0]
+            assert (factors <= 1.0).all()
+            assert factors[:, 0].tolist() == [0.75, 0.25]
+            assert factors[:, 1].tolist() == [1.0, 1.0]
+    assert os.path.islink(os.path.join('out', 'stack_groups.ncf'))
+
+
+def test_stack_unit_xref_colocated(tmp_path):
+    """
+    Checks that co-located stacks are matched to their units by the stack parameters, and
+    that release points that can't be told apart are rejected.
+    """
+    ff10_file = tmp_path / 'test_fs_ff10_future.csv'
+    stk_file = tmp_path / 'stack_groups.ncf'
+    with open(ff10_file, 'w') as f:
+        f.write('#FORMAT=FF10_POINT\n')
+        f.write('facility_id,unit_id,process_id,rel_point_id,oris_facility_code,oris_boiler_id,latitude,longitude,'
+                'stkhgt,stkdiam,stktemp,stkvel\n')
+        # Three units of one plant on three stacks at the same location (ft, F, and ft/s)
+        f.write('1,11,111,1111,2480,1,40.0,-74.0,100.0,10.0,300.0,50.0\n')
+        f.write('1,11,112,1111,2480,1,40.0,-74.0,100.0,10.0,300.0,50.0\n')
+        f.write('1,12,121,1211,2480,2,40.0,-74.0,200.0,10.0,300.0,50.0\n')
+        f.write('1,13,131,1311,2480,3,40.0,-74.0,200.0,10.0,250.0,50.0\n')
+    # The stack groups are in metric units and a different order
+    params = {'STKHT': [60.96, 30.48, 60.96], 'STKDM': [3.048] * 3, 'STKTK': [394.26, 422.04, 422.04],
+              'STKVE': [15.24] * 3, 'LATITUDE': [40.0] * 3, 'LONGITUDE': [-74.0] * 3}
+    xr.Dataset({var: (('TSTEP', 'LAY', 'ROW', 'COL'), np.array(values).reshape(1, 1, 3, 1)) 
+                for var, values in params.items()}).to_netcdf(stk_file)
+    xref_df = prepemis.stack_unit_xref(stk_file, ff10_file)
+    assert xref_df.set_index('Unit ID')['stack'].to_dict() == {'1': 1, '2': 2, '3': 0}
+    # Without the temperatures, units 2 and 3 match two stacks each
+    ff10_df = pd.read_csv(ff10_file, skiprows=1).drop(columns='stktemp')
+    with open(ff10_file, 'w') as f:
+        f.write('#FORMAT=FF10_POINT\n')
+    ff10_df.to_csv(ff10_file, mode='a', index=False)
+    with pytest.raises(ValueError):
+        prepemis.stack_unit_xref(stk_file, ff10_file)
+
+
+def test_merge_emissions(tmp_path):
+    """
+    Checks that gridded sectors are summed and inline sectors are combined into one stack list.
+    """
+    def write_ioapi(path, values, attrs={}):
+        ds = xr.Dataset({spc: (('TSTEP', 'LAY', 'ROW', 'COL'), value) for spc, value in values.items()}, attrs=attrs)
+        ds['TFLAG'] = (('TSTEP', 'VAR', 'DATE-TIME'), np.zeros((ds.sizes['TSTEP'], len(values), 2), dtype='int32'))
+        ds.to_netcdf(path)
+    grid_attrs = {'NCOLS': np.int32(3), 'NROWS': np.int32(2), 'NLAYS': np.int32(1), 'SDATE': np.int32(2016218)}
+    ones = np.ones((2, 1, 2, 3), dtype='float32')
+    write_ioapi(tmp_path / 'gr1.ncf', {'NO': ones, 'CO': ones}, grid_attrs)
+    write_ioapi(tmp_path / 'gr2.ncf', {'NO': 2 * ones, 'POC': ones}, grid_attrs)
+    assert prepemis.merge_gridded([tmp_path / 'gr1.ncf', tmp_path / 'gr2.ncf'], tmp_path / 'gr.ncf') == ['NO', 'CO', 'POC']
+    with xr.open_dataset(tmp_path / 'gr.ncf') as ds:
+        assert list(ds.data_vars)[0] == 'TFLAG'
+        assert (ds['NO'].values == 3).all()
+        assert ds.attrs['VAR-LIST'] == f'{"NO":<16}{"CO":<16}{"POC":<16}'
+    write_ioapi(tmp_path / 'gr3.ncf', {'NO': ones}, {**grid_attrs, 'SDATE': np.int32(2016219)})
+    with pytest.raises(ValueError):
+        prepemis.merge_gridded([tmp_path / 'gr1.ncf', tmp_path / 'gr3.ncf'], tmp_path / 'gr.ncf')
+    for name, n_stacks, spcs in [('pt1', 2, ['NO', 'SO2']), ('pt2', 3, ['NO'])]:
+        write_ioapi(tmp_path / f'inln_{name}.ncf', {spc: np.ones((2, 1, n_stacks, 1), dtype='float32') for spc in spcs}, 
+                    {'SDATE': np.int32(2016218)})
+        stk_vars = {'ISTACK': np.arange(1, n_stacks + 1, dtype='int32').reshape(1, 1, n_stacks, 1),
+                    'STKHT': np.full((1, 1, n_stacks, 1), n_stacks, dtype='float32')}
+        if name == 'pt2':
+            # Fire sectors have extra stack parameters
+            stk_vars['ACRESBURNED'] = np.full((1, 1, n_stacks, 1), 10., dtype='float32')
+        write_ioapi(tmp_path / f'stk_{name}.ncf', stk_vars)
+    n_stacks = prepemis.merge_inline([tmp_path / 'inln_pt1.ncf', tmp_path / 'inln_pt2.ncf'], 
+                                     [tmp_path / 'stk_pt1.ncf', tmp_path / 'stk_pt2.ncf'],
+                                     tmp_path / 'inln.ncf', tmp_path / 'stk.ncf')
+    assert n_stacks == 5
+    with xr.open_dataset(tmp_path / 'inln.ncf') as ds:
+        assert list(ds['SO2'].values[0, 0, :, 0]) == [1, 1, 0, 0, 0]
+        assert ds.attrs['NROWS'] == 5
+    with xr.open_dataset(tmp_path / 'stk.ncf') as ds:
+        assert list(ds['ISTACK'].values.ravel()) == [1, 2, 3, 4, 5]
+        assert list(ds['STKHT'].values.ravel()) == [2, 2, 3, 3, 3]
+        assert list(ds['ACRESBURNED'].values.ravel()) == [0, 0, 10, 10, 10]
+    # Inline files for different days aren't merged
+    write_ioapi(tmp_path / 'inln_pt3.ncf', {'NO': np.ones((2, 1, 3, 1), dtype='float32')}, {'SDATE': np.int32(2016219)})
+    with pytest.raises(ValueError):
+        prepemis.merge_inline([tmp_path / 'inln_pt1.ncf', tmp_path / 'inln_pt3.ncf'], 
+                              [tmp_path / 'stk_pt1.ncf', tmp_path / 'stk_pt2.ncf'],
+                              tmp_path / 'inln.ncf', tmp_path / 'stk.ncf')
+
+
+def test_emis_qa(tmp_path):
+    """
+    Checks that the emissions QA flags negatives, NaNs, zero days, jumps and missing files.
+    """
+    emis_files = {'all': []}
+    for day, scale in zip(range(1, 6), [1.0, 1.0, 0.0, 10.0, 100.0]):
+        values = np.full((2, 1, 2, 3), scale, dtype='float32')
+        nox = values.copy()
+        if day == 2:
+            nox[0, 0, 0, 0] = -1.0
+            nox[1, 0, 0, 0] = np.nan
+        ds = xr.Dataset({'NO': (('TSTEP', 'LAY', 'ROW', 'COL'), nox), 'CO': (('TSTEP', 'LAY', 'ROW', 'COL'), values)},
+                        attrs={'SDATE': np.int32(2016217 + day), 'STIME': np.int32(0)})
+        ds['TFLAG'] = (('TSTEP', 'VAR', 'DATE-TIME'), np.zeros((2, 2, 2), dtype='int32'))
+        ds.to_netcdf(tmp_path / f'emis_mole_all_{day}.ncf')
+        emis_files['all'].append(str(tmp_path / f'emis_mole_all_{day}.ncf'))
+    emis_files['rwc'] = [str(tmp_path / 'emis_mole_rwc_1.ncf')]
+    report_file = tmp_path / 'qa.txt'
+    stats_df = prepemis.emis_qa(emis_files, n_procs=2, jump_factor=5.0, chunk_steps=1, report_file=report_file)
+    flags = stats_df.set_index(['sector', 'species', 'date'])['flags']
+    assert flags[('all', 'NO', pd.Timestamp('2016-08-06'))] == 'negative;nan'
+    assert flags[('all', 'CO', pd.Timestamp('2016-08-06'))] == ''
+    assert flags[('all', 'CO', pd.Timestamp('2016-08-07'))] == 'zero_day'
+    # Emissions that resume after a zero day and ratios above jump_factor are jumps
+    assert flags[('all', 'CO', pd.Timestamp('2016-08-08'))] == 'jump'
+    assert flags[('all', 'CO', pd.Timestamp('2016-08-09'))] == 'jump'
+    assert stats_df.loc[stats_df['sector'] == 'rwc', 'flags'].tolist() == ['missing']
+    assert stats_df.loc[(stats_df['species'] == 'CO') & (stats_df['flags'] == ''), 'total'].tolist() == [12.0, 12.0]
+    assert 'zero_day' in open(report_file).read()
+
+
+def test_emis_changes(tmp_path):
+    """
+    Checks that only the scenario days with different emissions (not just different metadata) are flagged.
+    """
+    base_files, scen_files = [], []
+    for day in range(3):
+        ds = xr.Dataset({'NO': (('TSTEP', 'LAY', 'ROW', 'COL'), np.full((2, 1, 2, 2), day, dtype='float32'))}, 
+                        attrs={'FILEDESC': 'base'})
+        ds.to_netcdf(tmp_path / f'base_{day}.ncf')
+        base_files.append(str(tmp_path / f'base_{day}.ncf'))
+        if day == 0:
+            # Scenario links to the base case file
+            os.symlink(tmp_path / f'base_{day}.ncf', tmp_path / f'scen_{day}.ncf')
+        else:
+            ds.attrs['FILEDESC'] = 'scenario'
+            if day == 2:
+                ds['NO'].values[1, 0, 1, 1] += 1e-6
+            ds.to_netcdf(tmp_path / f'scen_{day}.ncf')
+        scen_files.append(str(tmp_path / f'scen_{day}.ncf'))
+    dates = pd.date_range('2016-08-01', periods=3)
+    changes_df = prepemis.emis_changes({'ptertac': base_files, 'rwc': base_files}, {'ptertac': scen_files, 'rwc': base_files}, 
+                                       dates, n_procs=2)
+    assert changes_df['ptertac'].tolist() == [False, False, True]
+    assert not changes_df['rwc'].any()
+    with pytest.raises(ValueError):
+        prepemis.emis_changes({'ptertac': base_files}, {'ptertac': scen_files[:2]}, dates)
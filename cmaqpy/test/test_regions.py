@@ -0,0 +1,70 @@
+"""
+Tests regions functions using polygons drawn on a small, synthetic Lambert conformal grid.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.regions as regions
+import cmaqpy.utils as utils
+
+
+GRID = {'GDNAM': 'REGIONS', 'GDTYP': 2, 'P_ALP': 33., 'P_BET': 45., 'P_GAM': -97., 'XCENT': -97., 'YCENT': 40.,
+        'XORIG': -60000., 'YORIG': -36000., 'XCELL': 12000., 'YCELL': 12000., 'NCOLS': 10, 'NROWS': 6}
+
+
+def cell_ring(cols, rows):
+    """
+    Converts a polygon in grid cell units (column, row from the grid corner) to longitudes and latitudes.
+    """
+    x = GRID['XORIG'] + np.asarray(cols, dtype='float64') * GRID['XCELL']
+    y = GRID['YORIG'] + np.asarray(rows, dtype='float64') * GRID['YCELL']
+    return np.column_stack(utils.lcc_inverse(x, y, GRID))
+
+
+def test_region_weights(tmp_path):
+    """
+    Checks the coverage fractions (including a hole and a part outside the grid), the cache, 
+    and the regional means and totals.
+    """
+    square = cell_ring([1.5, 4, 4, 1.5, 1.5], [1, 1, 3, 3, 1])
+    # A 3x3 cell block with a one-cell hole, and a part that is half outside the grid
+    donut = [cell_ring([5, 8, 8, 5], [0, 0, 3, 3]), cell_ring([6, 7, 7, 6], [1, 1, 2, 2]),
+             cell_ring([9, 11, 11, 9], [5, 5, 7, 7])]
+    names, weights = regions.region_weights(GRID, {'square': [square], 'donut': donut}, n_sub=4, cache_dir=str(tmp_path))
+    assert names == ['square', 'donut']
+    coverage = weights.toarray().reshape(2, 6, 10)
+    expected = np.zeros((6, 10))
+    expected[1:3, 1] = 0.5
+    expected[1:3, 2:4] = 1.
+    assert np.allclose(coverage[0], expected)
+    expected = np.zeros((6, 10))
+    expected[0:3, 5:8] = 1.
+    expected[1, 6] = 0.
+    expected[5, 9] = 1.
+    assert np.allclose(coverage[1], expected)
+    assert len(list(tmp_path.glob('regions_REGIONS_10x6_*.npz'))) == 1
+    regions.REGION_WEIGHTS.clear()
+    cached_names, cached = regions.region_weights(GRID, {'square': [square], 'donut': donut}, n_sub=4, cache_dir=str(tmp_path))
+    assert cached_names == names and (cached != weights).nnz == 0
+    times = pd.date_range('2016-08-01', periods=48, freq='h')
+    values = np.random.default_rng(0).random((48, 1, 6, 10))
+    ds = xr.Dataset({'O3': (('time', 'z', 'y', 'x'), values, {'units': 'ppbV'})}, coords={'time': times}).chunk({'time': 24})
+    region_ds = regions.regional_series(ds, names, weights)
+    assert region_ds['O3'].dims == ('time', 'z', 'region')
+    assert region_ds['O3'].chunks is not None
+    assert region_ds['O3'].attrs['units'] == 'ppbV'
+    square_mean = (values[..., 1:3, 1] * 0.5).sum(axis=-1) + values[..., 1:3, 2:4].sum(axis=(-2, -1))
+    assert np.allclose(region_ds['O3'].sel(region='square').values, square_mean / 5.)
+    totals = regions.regional_series(ds['O3'], names, weights, how='sum')
+    assert np.allclose(totals.sel(region='square').values, square_mean)
+    with pytest.raises(ValueError):
+        regions.regional_series(ds.isel(x=slice(0, 5)), names, weights)
+    # Regions outside the grid have no values rather than zeros
+    outside = cell_ring([20, 22, 22, 20, 20], [20, 20, 22, 22, 20])
+    names, weights = regions.region_weights(GRID, {'square': [square], 'outside': [outside]}, n_sub=4)
+    assert weights[1].nnz == 0
+    for how in ['mean', 'sum']:
+        region_ds = regions.regional_series(ds, names, weights, how=how)
+        assert np.isnan(region_ds['O3'].sel(region='outside').values).all()
+        assert np.isfinite(region_ds['O3'].sel(region='square').values).all()
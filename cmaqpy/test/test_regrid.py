@@ -0,0 +1,70 @@
+"""
+Tests regrid functions between small, synthetic 12-km and 4-km grids read from a GRIDDESC file.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.regrid as regrid
+import cmaqpy.utils as utils
+
+
+GRIDDESC = """' '
+'LAM_40N97W'
+  2 33.000 45.000 -97.000 -97.000 40.000
+'LAM_40N95W'
+  2 33.000 45.000 -95.000 -95.000 40.000
+' '
+'12TEST'
+'LAM_40N97W' -60000.000 -36000.000 12000.000 12000.000 9 6 1
+'4TEST'
+'LAM_40N97W' -36000.000 -24000.000 4000.000 4000.000 12 9 1
+'4TEST95'
+'LAM_40N95W' -208000.000 -24000.000 4000.000 4000.000 12 9 1
+' '
+"""
+
+
+def grid_ds(grid, values):
+    """
+    Makes a lazy dataset like those from `postcmaq.open_cctm` on a grid.
+    """
+    times = pd.date_range('2016-08-01', periods=values.shape[0], freq='h')
+    ds = xr.Dataset({'O3': (('time', 'z', 'y', 'x'), values[:, None], {'units': 'ppbV'})}, coords={'time': times},
+                    attrs=grid)
+    return ds.chunk({'time': 2})
+
+
+def test_regrid(tmp_path):
+    """
+    Checks conservative and bilinear regridding from 12 km to 4 km and back, the weights
+    cache, and sampled weights between different projections.
+    """
+    (tmp_path / 'GRIDDESC').write_text(GRIDDESC)
+    grid_12 = utils.read_griddesc(str(tmp_path / 'GRIDDESC'), '12TEST')
+    grid_4 = utils.read_griddesc(str(tmp_path / 'GRIDDESC'), '4TEST')
+    # The 4-km grid covers columns 2 to 5 and rows 1 to 3 of the 12-km grid
+    values = np.random.default_rng(0).random((4, 6, 9))
+    fine = regrid.regrid(grid_ds(grid_12, values), grid_4, cache_dir=str(tmp_path / 'cache'))
+    assert fine['O3'].dims == ('time', 'z', 'y', 'x')
+    assert fine['O3'].chunks is not None
+    assert fine.attrs['GDNAM'] == '4TEST' and fine['latitude'].shape == (9, 12)
+    assert np.allclose(fine['O3'].values[:, 0], np.repeat(np.repeat(values[:, 1:4, 2:6], 3, axis=1), 3, axis=2))
+    assert len(list((tmp_path / 'cache').glob('regrid_12TEST_9x6_*_to_4TEST_12x9_*_conservative.npz'))) == 1
+    # Back to 12 km: the covered cells are recovered, and the others are NaN
+    coarse = regrid.regrid(fine, grid_12)
+    assert np.allclose(coarse['O3'].values[:, 0, 1:4, 2:6], values[:, 1:4, 2:6])
+    assert np.isnan(coarse['O3'].values[:, 0, 0]).all()
+    # Bilinear interpolation of a linear field is exact away from the edges
+    linear = np.arange(6)[:, None] * 10. + np.arange(9) * np.ones((4, 1, 1))
+    fine = regrid.regrid(grid_ds(grid_12, linear), grid_4, method='bilinear')
+    rows, cols = (np.arange(9) + 0.5) / 3 + 1 - 0.5, (np.arange(12) + 0.5) / 3 + 2 - 0.5
+    assert np.allclose(fine['O3'].values[0, 0], rows[:, None] * 10. + cols)
+    # Different projections are sampled; a uniform field stays uniform
+    grid_95 = utils.read_griddesc(str(tmp_path / 'GRIDDESC'), '4TEST95')
+    weights = regrid.regrid_weights(grid_12, grid_95, n_sub=4)
+    assert np.allclose(weights.sum(axis=1), 1.)
+    uniform = regrid.regrid(grid_ds(grid_12, np.full((4, 6, 9), 40.)), grid_95, weights=weights)
+    assert np.allclose(uniform['O3'].values, 40.)
+    with pytest.raises(ValueError):
+        regrid.regrid_weights(grid_12, grid_4, method='nearest')
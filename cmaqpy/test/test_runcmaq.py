@@ -2,8 +2,16 @@
 Tests runcmaq functions without running the CMAQ subprograms.
 """
 import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from cmaqpy.postcmaq import grid_coords
+import cmaqpy.runcmaq as runcmaq
 from cmaqpy.runcmaq import CMAQModel
 import cmaqpy.utils as utils
+from cmaqpy.test.test_postcmaq import write_ioapi
 
 start_datetime = 'Dec 31, 2011'
 end_datetime = 'Jan 01, 2012'
@@ -68,3 +76,288 @@ def test_run_cctm():
     cmaq_sim.run_cctm(cctm_vrsn='v533', delete_existing_output='TRUE', new_sim='TRUE', tstep='010000', n_procs=16, setup_only=True)
     assert os.path.exists(f'{cmaq_sim.CCTM_SCRIPTS}/run_cctm.csh') == 1
     assert os.path.exists(f'{cmaq_sim.CCTM_SCRIPTS}/submit_cctm.csh') == 1
+
+
+def cmaq_model(tmp_path, appl, start='2016-08-01', end='2016-08-04'):
+    """
+    Makes a CMAQModel on the 12OTC2 grid with its directories in tmp_path and two inline 
+    point sectors (ptertac with daily files and othpt with representative days).
+    """
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    setup_yaml = tmp_path / 'dirpaths.yml'
+    if not setup_yaml.exists():
+        templates = os.path.abspath(os.path.join(os.path.dirname(utils.__file__), '..', 'templates'))
+        griddesc = os.path.join(os.path.dirname(utils.__file__), 'data', 'GRIDDESC2')
+        setup_yaml.write_text(f'directory_paths:\n  CMAQ_HOME: {tmp_path}/home\n  CMAQ_DATA: {tmp_path}/data\n'
+                              f'  LOC_IC: {tmp_path}/ic\n  LOC_SMK_MERGE_DATES: {tmp_path}/dates\n'
+                              f'  DIR_TEMPLATES: {templates}\nfile_paths:\n  GRIDDESC: {griddesc}\n'
+                              'file_names:\n  STK_EMIS_001: inln_mole_ptertac_${YYYYMMDD}_${STKCASEE}.ncf\n'
+                              '  STK_GRPS_001: stack_groups_ptertac_${STKCASEG}.ncf\n'
+                              '  STK_EMIS_002: inln_mole_othpt_${mwdss_N}_${STKCASEE}.ncf\n'
+                              '  STK_GRPS_002: stack_groups_othpt_${STKCASEG}.ncf\n')
+    return CMAQModel(start, end, appl, 'LAM_40N97W', '12OTC2', setup_yaml=str(setup_yaml))
+
+
+def write_outputs(cmaq_sim, dates, prefixes=['ACONC', 'CGRID']):
+    """
+    Writes empty CCTM output files for the given days.
+    """
+    utils.make_dirs(cmaq_sim.CCTM_OUTDIR)
+    for date in dates:
+        for prefix in prefixes:
+            open(f'{cmaq_sim.CCTM_OUTDIR}/CCTM_{prefix}_{cmaq_sim.cctm_runid}_{date}.nc', 'w').close()
+
+
+def test_link_outputs(tmp_path):
+    """
+    Checks that the base case outputs are linked with the scenario's RUNID.
+    """
+    base = cmaq_model(tmp_path, 'base')
+    scen = cmaq_model(tmp_path, 'scen')
+    write_outputs(base, ['20160801', '20160802', '20160803'])
+    n_files = scen.link_outputs(base, list(pd.date_range('2016-08-01', periods=2)))
+    assert n_files == 4
+    linked = sorted(os.listdir(scen.CCTM_OUTDIR))
+    assert linked == [f'CCTM_{prefix}_{scen.cctm_runid}_{date}.nc' for prefix in ['ACONC', 'CGRID'] for date in ['20160801', '20160802']]
+    assert os.path.realpath(f'{scen.CCTM_OUTDIR}/{linked[0]}') == f'{base.CCTM_OUTDIR}/CCTM_ACONC_{base.cctm_runid}_20160801.nc'
+
+
+def scenario_run(tmp_path, monkeypatch, changed_days):
+    """
+    Runs `CMAQModel.run_cctm_scenario` with stubbed inputs, emissions comparison, and CCTM.
+    Returns the scenario, the base case, and the start date and options of each CCTM run.
+    """
+    base = cmaq_model(tmp_path, 'base')
+    scen = cmaq_model(tmp_path, 'scen')
+    write_outputs(base, ['20160801', '20160802', '20160803', '20160804'])
+    dates = pd.date_range('2016-08-01', '2016-08-04')
+    runs = []
+    monkeypatch.setattr(scen, 'setup_inpdir', lambda **kwargs: None)
+    monkeypatch.setattr(scen, 'emis_changes', lambda base_sim, **kwargs: pd.DataFrame({'ptertac': dates.isin(changed_days)}, index=dates))
+    monkeypatch.setattr(scen, 'run_cctm', lambda **kwargs: runs.append((scen.start_datetime, scen.LOC_IC, kwargs, scen.hot_start_date)))
+    scen.run_cctm_scenario(base)
+    return scen, base, runs
+
+
+def test_run_cctm_scenario(tmp_path, monkeypatch):
+    """
+    Checks that the scenario reuses the base case before the first day that differs and
+    restarts CCTM on that day, then restores its own period.
+    """
+    scen, base, runs = scenario_run(tmp_path, monkeypatch, ['2016-08-03', '2016-08-04'])
+    assert len(runs) == 1
+    start, loc_ic, kwargs, hot_start_date = runs[0]
+    assert start == pd.Timestamp('2016-08-03') and loc_ic == base.CCTM_OUTDIR
+    assert hot_start_date == pd.Timestamp('2016-08-03')
+    assert kwargs['delete_existing_output'] == 'TRUE'
+    linked = sorted(os.listdir(scen.CCTM_OUTDIR))
+    assert [name for name in linked if name.startswith('CCTM_ACONC')] == [f'CCTM_ACONC_{scen.cctm_runid}_{date}.nc' for date in ['20160801', '20160802']]
+    # The restart file for the day before the hot start is linked
+    assert f'CCTM_CGRID_{scen.cctm_runid}_20160802.nc' in linked
+    assert scen.start_datetime == pd.Timestamp('2016-08-01') and scen.delt.days == 3
+    assert scen.LOC_IC == f'{tmp_path}/ic'
+    assert scen.hot_start_date is None and scen.base_sim is None
+    assert len(scen.cctm_dates()) == 4
+
+
+def test_run_cctm_scenario_first_day(tmp_path, monkeypatch):
+    """
+    Checks that a scenario that differs on its first day runs CCTM for the whole period, and
+    that one that does not differ only links the base case outputs.
+    """
+    scen, base, runs = scenario_run(tmp_path, monkeypatch, ['2016-08-01'])
+    assert len(runs) == 1
+    assert runs[0][0] == pd.Timestamp('2016-08-01') and runs[0][1] == f'{tmp_path}/ic'
+    assert not os.path.exists(scen.CCTM_OUTDIR) or len(os.listdir(scen.CCTM_OUTDIR)) == 0
+    scen, base, runs = scenario_run(tmp_path / 'same', monkeypatch, [])
+    assert len(runs) == 0
+    assert len([name for name in os.listdir(scen.CCTM_OUTDIR) if name.startswith('CCTM_ACONC')]) == 4
+
+
+def test_cctm_segments(tmp_path):
+    """
+    Checks the segment boundaries of a parallel-in-time run and that the kept days cover
+    the period once.
+    """
+    cmaq_sim = cmaq_model(tmp_path, 'par', start='2016-08-01', end='2016-08-10')
+    segments = cmaq_sim.cctm_segments(n_segments=3, spinup_days=5)
+    assert [seg['segment'] for seg in segments] == [1, 2, 3]
+    assert [seg['keep_start'].strftime('%m%d') for seg in segments] == ['0801', '0804', '0807']
+    assert [seg['end'].strftime('%m%d') for seg in segments] == ['0803', '0806', '0810']
+    # The spin-up of the second segment is clipped to the start of the simulation
+    assert [seg['start'].strftime('%m%d') for seg in segments] == ['0801', '0801', '0802']
+    kept = [day for seg in segments for day in pd.date_range(seg['keep_start'], seg['end'])]
+    assert kept == list(pd.date_range('2016-08-01', '2016-08-10'))
+    assert len(cmaq_sim.cctm_segments(n_segments=10, spinup_days=2)) == 10
+    for n_segments in [0, 11]:
+        with pytest.raises(ValueError):
+            cmaq_sim.cctm_segments(n_segments=n_segments)
+
+
+def test_stitch_segments(tmp_path):
+    """
+    Checks that each day is linked from the segment that keeps it, not from a spin-up.
+    """
+    cmaq_sim = cmaq_model(tmp_path, 'par', start='2016-08-01', end='2016-08-10')
+    segments = cmaq_sim.cctm_segments(n_segments=3, spinup_days=5)
+    seg_sims = [cmaq_sim.segment_sim(seg, ic_dir=f'{tmp_path}/cgrid') for seg in segments]
+    assert [seg_sim.LOC_IC for seg_sim in seg_sims] == [f'{tmp_path}/ic', f'{tmp_path}/cgrid', f'{tmp_path}/cgrid']
+    # The segments after the first can only be restarted from CGRID files
+    with pytest.raises(ValueError):
+        cmaq_sim.segment_sim(segments[1])
+    with pytest.raises(ValueError):
+        cmaq_sim.run_cctm_parallel(n_segments=3, spinup_days=5, setup_only=True)
+    for seg_sim in seg_sims:
+        write_outputs(seg_sim, pd.date_range(seg_sim.start_datetime, seg_sim.end_datetime).strftime('%Y%m%d'), prefixes=['ACONC'])
+    assert cmaq_sim.stitch_segments(seg_sims) == 10
+    for day in pd.date_range('2016-08-01', '2016-08-10'):
+        out_file = f'{cmaq_sim.CCTM_OUTDIR}/CCTM_ACONC_{cmaq_sim.cctm_runid}_{day.strftime("%Y%m%d")}.nc'
+        seg = [seg_sim for seg_sim in seg_sims if seg_sim.segment['keep_start'] <= day <= seg_sim.segment['end']][0]
+        assert os.path.realpath(out_file) == os.path.realpath(out_file.replace(cmaq_sim.CCTM_OUTDIR, seg.CCTM_OUTDIR))
+
+
+def follow_run(tmp_path, monkeypatch, log_msg, n_days_run, job_id=None):
+    """
+    Runs `CMAQModel.follow_postprocess` on a 3-day simulation whose CCTM writes one more 
+    day each time the postprocessing waits, until n_days_run days are written. The CCTM 
+    log ends with log_msg. Returns the days that were postprocessed and the simulation.
+    """
+    cmaq_sim = cmaq_model(tmp_path, 'follow', start='2016-08-01', end='2016-08-03')
+    utils.make_dirs(cmaq_sim.CCTM_SCRIPTS)
+    with open(f'{cmaq_sim.CCTM_SCRIPTS}/cctm_{cmaq_sim.cctm_appl}.log', 'w') as f:
+        f.write(f'Processing completed...\n{log_msg}\n')
+    days = pd.date_range('2016-08-01', periods=n_days_run).strftime('%Y%m%d')
+    write_outputs(cmaq_sim, days[:1], prefixes=['ACONC', 'APMDIAG', 'DRYDEP', 'WETDEP1'])
+
+    def fake_sleep(seconds):
+        n_written = len([name for name in os.listdir(cmaq_sim.CCTM_OUTDIR) if name.startswith('CCTM_ACONC')])
+        if n_written < n_days_run:
+            write_outputs(cmaq_sim, days[n_written:n_written+1], prefixes=['ACONC', 'APMDIAG', 'DRYDEP', 'WETDEP1'])
+
+    monkeypatch.setattr(runcmaq, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(runcmaq, 'day_complete', lambda in_file, n_steps: os.path.exists(in_file))
+    monkeypatch.setattr(runcmaq, 'postprocess_day', lambda date, combine_args, **kwargs: [date.strftime('%Y%m%d')])
+    monkeypatch.setattr(runcmaq.time, 'sleep', fake_sleep)
+    return cmaq_sim.follow_postprocess(job_id=job_id), cmaq_sim
+
+
+def test_follow_postprocess(tmp_path, monkeypatch):
+    """
+    Checks that a log that reports a completed day does not stop the postprocessing, while 
+    a failed run does.
+    """
+    processed, _ = follow_run(tmp_path, monkeypatch, '|>---   PROGRAM COMPLETED SUCCESSFULLY   ---<|', 3)
+    assert sorted(processed) == ['20160801', '20160802', '20160803']
+    processed, _ = follow_run(tmp_path / 'failed', monkeypatch, 'Runscript Detected an Error', 1)
+    assert processed == ['20160801']
+
+
+def test_follow_postprocess_job(tmp_path, monkeypatch):
+    """
+    Checks that the Slurm job state is used to follow CCTM when its job ID is given.
+    """
+    states = iter([{}, {None: ('RUNNING', '00:10:00')}])
+    monkeypatch.setattr(utils, 'job_states', lambda job_id: next(states, {None: ('TIMEOUT', '01:00:00')}))
+    processed, _ = follow_run(tmp_path, monkeypatch, 'Runscript Detected an Error', 2, job_id='1001')
+    assert sorted(processed) == ['20160801', '20160802']
+
+
+def write_combine(cmaq_sim, values):
+    """
+    Writes daily COMBINE_ACONC files with constant values for each day of the simulation.
+    """
+    utils.make_dirs(cmaq_sim.POST)
+    for date in cmaq_sim.cctm_dates():
+        write_ioapi(f'{cmaq_sim.POST}/COMBINE_ACONC_{cmaq_sim.cctm_runid}_{date.strftime("%Y%m%d")}.nc', 
+                    {var: np.full((24, 1, 2, 3), value, dtype='float32') for var, value in values.items()}, 
+                    start=date.strftime('%Y-%m-%d'))
+
+
+def test_daily_metrics_cache(tmp_path, monkeypatch):
+    """
+    Checks that the saved daily metrics are only reused for the same source variables and
+    ozone start hours.
+    """
+    cmaq_sim = cmaq_model(tmp_path, 'metrics', start='2016-08-01', end='2016-08-03')
+    write_combine(cmaq_sim, {'O3': 40., 'O3_BIAS': 60., 'PM25_TOT': 10., 'PM25_FRM': 12.})
+    daily_ds = cmaq_sim.daily_metrics(utc_offset=0)
+    assert np.allclose(daily_ds['MDA8_O3'].isel(date=0), 40.) and np.allclose(daily_ds['PM25_24H'].isel(date=0), 10.)
+    assert daily_ds['MDA8_O3'].attrs['source'] == 'O3'
+    daily_ds.close()
+    daily_ds = cmaq_sim.daily_metrics(o3_var='O3_BIAS', pm25_var='PM25_FRM', utc_offset=0)
+    assert np.allclose(daily_ds['MDA8_O3'].isel(date=0), 60.) and np.allclose(daily_ds['PM25_24H'].isel(date=0), 12.)
+    daily_ds.close()
+    # A change of the ozone windows recomputes the metrics, while dropping PM2.5 reuses them
+    daily_ds = cmaq_sim.daily_metrics(o3_var='O3_BIAS', pm25_var=None, utc_offset=0, start_hours=range(0, 17))
+    assert daily_ds['MDA8_O3'].attrs['start_hours'].tolist() == list(range(17))
+    assert 'PM25_24H' not in daily_ds
+    daily_ds.close()
+    monkeypatch.setattr(cmaq_sim, 'open_output', None)
+    daily_ds = cmaq_sim.daily_metrics(o3_var='O3_BIAS', pm25_var=None, utc_offset=0, start_hours=range(0, 17))
+    assert np.allclose(daily_ds['MDA8_O3'].isel(date=0), 60.)
+    daily_ds.close()
+
+
+def test_match_obs_daily(tmp_path):
+    """
+    Checks that daily observations are paired with the model means of the site's local days.
+    """
+    cmaq_sim = cmaq_model(tmp_path, 'obs', start='2016-08-01', end='2016-08-02')
+    write_combine(cmaq_sim, {'PM25_TOT': 10.})
+    with xr.open_dataset(f'{cmaq_sim.POST}/COMBINE_ACONC_{cmaq_sim.cctm_runid}_20160801.nc') as ds:
+        grid = dict(ds.attrs)
+    lat, lon = grid_coords(grid)
+    lat, lon, offset = lat[1, 2], lon[1, 2], utils.utc_offset_grid(grid, lat, lon)[1, 2]
+    # The hours of the first local day are 20 and the others are 10
+    for date in cmaq_sim.cctm_dates():
+        local_days = (pd.date_range(date, periods=24, freq='h') + pd.Timedelta(hours=offset)).day
+        pm25 = np.where(local_days == 1, 20., 10.).astype('float32')[:, None, None, None] * np.ones((24, 1, 2, 3), dtype='float32')
+        write_ioapi(f'{cmaq_sim.POST}/COMBINE_ACONC_{cmaq_sim.cctm_runid}_{date.strftime("%Y%m%d")}.nc', {'PM25_TOT': pm25},
+                    start=date.strftime('%Y-%m-%d'))
+    obs = pd.DataFrame({'siteid': 'A', 'latitude': lat, 'longitude': lon, 'time': pd.to_datetime(['2016-08-01', '2016-08-02']), 
+                        'obs': 15., 'freq': 'daily'})
+    pairs = cmaq_sim.match_obs(obs, 'PM25_TOT')
+    # The second local day is missing the hours after the end of the simulation
+    assert pairs['time'].tolist() == [pd.Timestamp('2016-08-01')]
+    assert np.allclose(pairs['model'], 20.)
+    # Hourly observations at midnight UTC are paired with the model at that time
+    pairs = cmaq_sim.match_obs(obs.assign(freq='hourly'), 'PM25_TOT')
+    assert pairs['model'].tolist() == [10., 20.]
+
+
+def test_merge_emissions_rep_dates(tmp_path):
+    """
+    Checks that a sector with representative days is merged with a daily sector and that 
+    the merged files are stamped with the simulation days.
+    """
+    cmaq_sim = cmaq_model(tmp_path, 'merge', start='2016-08-01', end='2016-08-02')
+    os.makedirs(tmp_path / 'dates')
+    with open(tmp_path / 'dates' / 'smk_merge_dates_201608.txt', 'w') as f:
+        f.write('    Date, aveday_N, aveday_Y,  mwdss_N,  mwdss_Y,   week_N,   week_Y,      all\n')
+        for day in range(1, 32):
+            date = f'201608{day:02d}'
+            f.write(f'{date}, 20160801, 20160801, 20160805, 20160805, {date}, {date}, {date}\n')
+    utils.make_dirs(f'{cmaq_sim.CCTM_PT}/stack_groups')
+
+    def write_inline(name, date, n_stacks):
+        times = pd.date_range(date, periods=25, freq='h')
+        ds = xr.Dataset({'NO': (('TSTEP', 'LAY', 'ROW', 'COL'), np.ones((25, 1, n_stacks, 1), dtype='float32'))},
+                        attrs={'SDATE': np.int32(times[0].strftime('%Y%j')), 'STIME': np.int32(0), 'TSTEP': np.int32(10000)})
+        ds = utils.set_ioapi_vars(ds, utils.datetime_to_tflag(times))
+        ds.to_netcdf(f'{cmaq_sim.CCTM_PT}/{name}')
+
+    for lab, n_stacks in [('ptertac', 2), ('othpt', 3)]:
+        stk = xr.Dataset({'ISTACK': (('TSTEP', 'LAY', 'ROW', 'COL'), np.arange(1, n_stacks + 1, dtype='int32').reshape(1, 1, n_stacks, 1))})
+        utils.set_ioapi_vars(stk, np.zeros((1, 2), dtype='int32')).to_netcdf(
+            f'{cmaq_sim.CCTM_PT}/stack_groups/stack_groups_{lab}_12US1_2016fh_16j.ncf')
+    write_inline('inln_mole_othpt_20160805_12US1_cmaq_cb6_2016fh_16j.ncf', '2016-08-05', 3)
+    for date in cmaq_sim.cctm_dates():
+        write_inline(f'inln_mole_ptertac_{date.strftime("%Y%m%d")}_12US1_cmaq_cb6_2016fh_16j.ncf', date, 2)
+    gr_streams, pt_streams = cmaq_sim.merge_emissions(gr_emis_labs=[], pt_emis_labs=['ptertac', 'othpt'], merge_gr=False)
+    assert [stream['label'] for stream in pt_streams] == ['pt_merged']
+    for date in cmaq_sim.cctm_dates():
+        with xr.open_dataset(f'{cmaq_sim.CCTM_PT}/inln_mole_pt_merged_{date.strftime("%Y%m%d")}.ncf') as ds:
+            assert ds.attrs['SDATE'] == int(date.strftime('%Y%j')) and ds.attrs['NROWS'] == 5
+            times = utils.tflag_to_datetime(ds['TFLAG'].values[:, 0, :])
+            assert (times == pd.date_range(date, periods=25, freq='h')).all()
+            assert (ds['NO'].values == 1).all()
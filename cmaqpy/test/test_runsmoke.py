@@ -0,0 +1,119 @@
+"""
+Tests the SMOKE log parsing functions using small, synthetic log files.
+"""
+import os
+import subprocess
+import time
+import pandas as pd
+import cmaqpy.runsmoke as runsmoke
+import cmaqpy.utils as utils
+
+
+def smoke_model(tmp_path, monkeypatch, sacct_output=''):
+    """
+    Makes a SMOKEModel with its directories in tmp_path and the repository templates. 
+    Calls to sbatch return increasing job IDs starting at 1001, and calls to sacct
+    return sacct_output. The commands are recorded in the returned list.
+    """
+    nei_home = tmp_path / 'nei'
+    for directory in ['2016fh_16j/scripts/point', '2016fh_16j/intermed/ptertac/logs']:
+        (nei_home / directory).mkdir(parents=True)
+    templates = os.path.abspath(os.path.join(os.path.dirname(runsmoke.__file__), '..', 'templates'))
+    setup_yaml = tmp_path / 'dirpaths.yml'
+    setup_yaml.write_text(f'directory_paths:\n  NEI_HOME: {nei_home}\n  LOC_MCIP: {tmp_path}/mcip\n'
+                          f'  SMOKE_HOME: {tmp_path}/smoke\n  ERTAC_HOME: {tmp_path}/ertac\n'
+                          f'  CMAQ_DATA: {tmp_path}/data\n  DIR_TEMPLATES: {templates}\n'
+                          f'file_paths:\n  GRIDDESC: {tmp_path}/GRIDDESC\n')
+    commands = []
+
+    def fake_run(cmd, **kwargs):
+        commands.append(cmd)
+        if cmd[0] == 'sbatch':
+            n_submitted = len([command for command in commands if command[0] == 'sbatch'])
+            return subprocess.CompletedProcess(cmd, 0, stdout=f'{1000 + n_submitted}\n', stderr='')
+        return subprocess.CompletedProcess(cmd, 0, stdout=sacct_output, stderr='')
+
+    monkeypatch.setattr(utils.subprocess, 'run', fake_run)
+    smoke = runsmoke.SMOKEModel('2016fh_16j_ptertac', '12OTC2', run_months=[7, 8, 9], setup_yaml=str(setup_yaml))
+    return smoke, commands
+
+
+def test_run_sector_pipeline(tmp_path, monkeypatch):
+    """
+    Checks that the daily job array depends on the onetime job and processes one month per task.
+    """
+    smoke, commands = smoke_model(tmp_path, monkeypatch)
+    assert smoke.run_sector_pipeline(setup_only=True) == (None, None)
+    assert len(commands) == 0
+    onetime_id, daily_id = smoke.run_sector_pipeline(daily_gb_mem=20)
+    assert (onetime_id, daily_id) == ('1001', '1002')
+    onetime_cmd, daily_cmd = commands
+    assert '--dependency=afterok:1001' not in onetime_cmd
+    assert '--dependency=afterok:1001' in daily_cmd
+    with open(daily_cmd[-1]) as f:
+        script = f.read()
+    assert '#SBATCH --array=1-3' in script
+    assert '#SBATCH --mem=20000M' in script
+    assert 'set MONTHS_LIST = ( 7 8 9 )' in script
+    assert 'setenv RUN_MONTHS " $MONTHS_LIST[$SLURM_ARRAY_TASK_ID] "' in script
+    assert f'{smoke.SMOKE_LOGS}/out_ptertac_summer.%A_%a' in script
+    assert all([marker not in script for marker in ['%SLURM%', '%MONTHS%', '%DIR_DEF%', '%GRID%', '%EMIS%']])
+    with open(onetime_cmd[-1]) as f:
+        script = f.read()
+    assert '--array' not in script
+    assert 'setenv RUN_MONTHS " 7 8 9 "' in script
+    assert (smoke.daily_job_id, smoke.daily_split_months) == ('1002', True)
+
+
+def test_daily_status(tmp_path, monkeypatch):
+    """
+    Checks that the sacct states (including grouped pending tasks) and stdout errors are reported per month.
+    """
+    sacct_output = ('1002_1|COMPLETED|00:41:07\n'
+                    '1002_2|CANCELLED by 4321|00:02:13\n'
+                    '1002_[3]|PENDING|00:00:00\n')
+    smoke, commands = smoke_model(tmp_path, monkeypatch, sacct_output=sacct_output)
+    with open(f'{smoke.SMOKE_LOGS}/out_ptertac_summer.1002_2', 'w') as f:
+        f.write(' Processing month 8\n ERROR: Could not open file PTPRO_HOURLY\n *** ERROR ABORT in subroutine TEMPORAL\n')
+    status_df = smoke.daily_status(job_id='1002')
+    assert commands[0][:3] == ['sacct', '-j', '1002']
+    assert list(status_df.index) == [7, 8, 9]
+    assert status_df['state'].tolist() == ['COMPLETED', 'CANCELLED', 'PENDING']
+    assert status_df['elapsed'].tolist() == ['00:41:07', '00:02:13', '00:00:00']
+    assert status_df['n_errors'].tolist() == [0, 2, 0]
+    assert status_df.loc[8, 'first_error'].strip() == 'ERROR: Could not open file PTPRO_HOURLY'
+    assert status_df.loc[9, 'task_id'] == 3
+
+
+def test_parse_smoke_log(tmp_path):
+    """
+    Checks that a log is parsed incrementally and that warnings, errors, and timing are summarized.
+    """
+    inven_log = tmp_path / 'smkinven_ptertac_2016fh_16j_inv.log'
+    inven_log.write_text(' Program SMKINVEN, Version 4.7\n'
+                         ' WARNING: Stack height 0.0 for FIP 36005 replaced by default\n'
+                         ' WARNING: Stack height 0.0 for FIP 36047 replaced by default\n'
+                         ' WARNING: Missing "NOX" in inventory\n'
+                         ' --->> Normal Completion of program SMKINVEN\n')
+    os.utime(inven_log, (time.time() - 60, time.time() - 60))
+    temporal_log = tmp_path / 'temporal_ptertac_20160801_2016fh_16j.log'
+    temporal_log.write_text(' Program TEMPORAL, Version 4.7\n WARNING: Date 2016213 is a holiday\n')
+    state = runsmoke.parse_smoke_log(temporal_log)
+    assert (state['program'], state['status']) == ('temporal', 'running')
+    # Append to the log (including a partial line) and continue parsing from the last offset
+    with open(temporal_log, 'a') as f:
+        f.write(' ERROR: Could not open file PTPRO_HOURLY\n *** ERROR ABORT in subroutine TEMPORAL\n partial')
+    state = runsmoke.parse_smoke_log(temporal_log, state=state)
+    assert state['status'] == 'failed'
+    assert state['errors'] == ['ERROR: Could not open file PTPRO_HOURLY', '*** ERROR ABORT in subroutine TEMPORAL']
+    assert state['offset'] == os.path.getsize(temporal_log) - len(' partial')
+    states = {temporal_log: state, inven_log: runsmoke.parse_smoke_log(inven_log)}
+    logs_df, timing_df = runsmoke.smoke_log_summary(states)
+    assert list(timing_df.index) == ['smkinven', 'temporal']
+    assert timing_df.loc['smkinven', 'n_warnings'] == 3
+    assert timing_df.loc['temporal', 'n_failed'] == 1
+    assert logs_df.loc[inven_log, 'top_warning'] == 'Stack height # for FIP # replaced by default'
+    # temporal was seen while running, so its run time is measured from then rather than 
+    # from the end of the previous (smkinven) log
+    assert 0 <= logs_df.loc[temporal_log, 'run_time'].total_seconds() < 30
+    assert logs_df.loc[inven_log, 'run_time'] is pd.NaT
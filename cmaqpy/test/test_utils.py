@@ -0,0 +1,119 @@
+"""
+Tests utils functions that don't depend on any CMAQ or SMOKE files.
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import cmaqpy.utils as utils
+
+
+def test_compact_df():
+    """
+    Checks that a compacted DataFrame uses less memory and writes the same CSV.
+    """
+    n = 1000
+    df = pd.DataFrame({'state': np.where(np.arange(n) % 2 == 0, 'NY', 'PA').astype('object'),
+                       'unitid': [f'CT{ii}' for ii in range(n)],
+                       'so2_mass (lbs)': np.round(np.linspace(0, 10, n), 3).astype('str').astype('object'),
+                       'gload (MW-hr)': np.arange(n, dtype='float64'),
+                       'heat_input (mmBtu)': np.linspace(0, 1, n),
+                       'orispl_code': np.arange(n, dtype='int64')})
+    compact = utils.compact_df(df)
+    assert compact['state'].dtype == 'category'
+    assert compact['unitid'].dtype == 'object'
+    assert compact['so2_mass (lbs)'].dtype == 'float64'
+    assert compact['gload (MW-hr)'].dtype == 'float32'
+    assert compact['heat_input (mmBtu)'].dtype == 'float64'
+    report = utils.memory_report(df, compact)
+    assert report.loc['Total', 'reduction'] > 1
+    csv_orig, csv_compact = io.StringIO(), io.StringIO()
+    df.to_csv(csv_orig, index=False)
+    utils.expand_df(compact).to_csv(csv_compact, index=False)
+    assert csv_orig.getvalue() == csv_compact.getvalue()
+
+
+def test_read_griddesc():
+    """
+    Checks that the grid and coordinate system parameters are read from the GRIDDESC file.
+    """
+    griddesc_file = os.path.join(os.path.dirname(utils.__file__), 'data/GRIDDESC2')
+    grid = utils.read_griddesc(griddesc_file, '4OTC2')
+    assert grid['COORD_NAME'] == 'LAM_40N97W'
+    assert (grid['GDTYP'], grid['P_ALP'], grid['P_BET'], grid['YCENT']) == (2, 33.0, 45.0, 40.0)
+    assert (grid['XORIG'], grid['YORIG'], grid['XCELL']) == (1644000.0, -144000.0, 4000.0)
+    assert (grid['NCOLS'], grid['NROWS']) == (126, 156)
+
+
+def test_rep_dates(tmp_path):
+    """
+    Checks that the representative dates are read once per month and resolved for a date range.
+    """
+    header = '    Date, aveday_N, aveday_Y,  mwdss_N,  mwdss_Y,   week_N,   week_Y,      all\n'
+    for month, n_days in [('201607', 31), ('201608', 31)]:
+        with open(tmp_path / f'smk_merge_dates_{month}.txt', 'w') as f:
+            f.write(header)
+            for day in range(1, n_days + 1):
+                date = f'{month}{day:02d}'
+                f.write(f'{date}, {month}01, {month}01, {month}0{1 + day % 2}, {month}01, {date}, {date}, {date}\n')
+    rep_dates = utils.RepDates(tmp_path)
+    dates = pd.date_range('2016-07-30', '2016-08-03')
+    rep_df = rep_dates.resolve(dates, date_types=['  mwdss_N', 'all'])
+    assert list(rep_df['mwdss_N'].dt.strftime('%Y%m%d')) == ['20160701', '20160702', '20160802', '20160801', '20160802']
+    assert (rep_df['all'] == dates).all()
+    assert sorted(rep_dates.tables) == ['201607', '201608']
+    assert list(utils.get_rep_dates(tmp_path, dates, '  mwdss_N').strftime('%Y%m%d')) == ['20160701', '20160702', '20160802', '20160801']
+    with pytest.raises(ValueError):
+        rep_dates.lookup(dates, 'mwdss')
+
+
+def test_ioapi_diff_stats(tmp_path):
+    """
+    Checks the difference statistics between two IOAPI-like files.
+    """
+    o3 = np.full((2, 2, 3, 3), 0.04)
+    ref = xr.Dataset({'O3': (('TSTEP', 'LAY', 'ROW', 'COL'), o3), 'NO2': (('TSTEP', 'LAY', 'ROW', 'COL'), o3 / 4)})
+    ref.to_netcdf(tmp_path / 'ref.nc')
+    o3 = o3.copy()
+    o3[0, 0, 0, 0] += 0.018
+    o3[:, 1] += 1.0
+    ref.assign(O3=(('TSTEP', 'LAY', 'ROW', 'COL'), o3)).to_netcdf(tmp_path / 'seg.nc')
+    stats_df = utils.ioapi_diff_stats(tmp_path / 'seg.nc', tmp_path / 'ref.nc', var_names=['O3', 'NO2'])
+    assert np.isclose(stats_df.loc['O3', 'max_abs_diff'], 0.018)
+    assert np.isclose(stats_df.loc['O3', 'mae'], 0.001)
+    assert np.isclose(stats_df.loc['O3', 'nmae'], 0.025)
+    assert stats_df.loc['NO2', 'rmse'] == 0
+    assert np.isclose(utils.ioapi_diff_stats(tmp_path / 'seg.nc', tmp_path / 'ref.nc', layer=None).loc['O3', 'max_abs_diff'], 1.0)
+
+
+def test_lcc_projection():
+    """
+    Checks the Lambert conformal projection of the cell centers against the corners of 12US1.
+    """
+    grid = {'GDNAM': '12US1', 'GDTYP': 2, 'P_ALP': 33., 'P_BET': 45., 'P_GAM': -97., 'XCENT': -97., 'YCENT': 40., 
+            'XORIG': -2556000., 'YORIG': -1728000., 'XCELL': 12000., 'YCELL': 12000., 'NCOLS': 459, 'NROWS': 299}
+    lon, lat = utils.grid_lonlat(grid, stagger=True)
+    assert lon.shape == (300, 460)
+    assert np.allclose([lon[0, 0], lat[0, 0]], [-121.063, 21.557], atol=1e-3)
+    assert np.allclose(utils.lcc_forward(-97., 40., grid), 0.)
+    x, y = utils.lcc_forward(lon, lat, grid)
+    assert np.allclose(x[0, :3], [-2556000., -2544000., -2532000.])
+    assert np.allclose(y[-1, 0], 1860000.)
+    assert utils.grid_key(grid) == utils.grid_key(dict(grid, NTHIK=1))
+    assert utils.grid_key(grid) != utils.grid_key(dict(grid, XORIG=-2544000.))
+
+
+def test_utc_offset_grid(tmp_path):
+    """
+    Checks the standard time UTC offsets of cells well inside the US time zones.
+    """
+    grid = {'GDNAM': 'TEST', 'GDTYP': 2, 'P_ALP': 33., 'P_BET': 45., 'P_GAM': -97., 'XCENT': -97., 'YCENT': 40., 
+            'XORIG': 0., 'YORIG': 0., 'XCELL': 12000., 'YCELL': 12000., 'NCOLS': 2, 'NROWS': 2}
+    lat = np.array([[40., 41.9], [39.7, 34.]])
+    lon = np.array([[-75., -87.6], [-105., -118.]])
+    offsets = utils.utc_offset_grid(grid, lat, lon, cache_dir=str(tmp_path))
+    assert offsets.tolist() == [[-5., -6.], [-7., -8.]]
+    # The offsets are kept for the grid
+    assert utils.utc_offset_grid(grid, lat * 0, lon * 0) is offsets
@@ -5,9 +5,13 @@ Known Issues/Wishlist:
 
 """
 import datetime
+import hashlib
 import os
+import numpy as np
 import pandas as pd
 import string
+import subprocess
+import xarray as xr
 from shutil import rmtree
 
 
@@ -192,20 +196,681 @@ def make_dirs(directory):
         os.makedirs(directory, 0o755)
 
 
+def file_checksum(file_name, block_size=2**20):
+    """
+    Computes the SHA-256 checksum of a file, reading it in blocks so that large
+    files don't need to fit in memory.
+
+    Parameters
+    ----------
+    :param file_name: string
+        Complete path of the file.
+    :param block_size: int
+        Number of bytes to read at a time.
+    :return: string
+        Hexadecimal checksum.
+    """
+    sha = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def compact_df(df, max_cat_frac=0.5, exclude=[]):
+    """
+    Reduces the memory used by a DataFrame without changing how it is written to CSV:
+
+    - Object columns with few unique values (relative to the number of rows) become categoricals.
+    - Object columns holding numbers become float64 if `to_csv` would write them identically.
+    - Float64 columns become float32 if this is lossless for every value.
+    - Int64 columns are downcast to the smallest integer type that holds them.
+
+    Use `expand_df` to restore float64 columns before writing to CSV.
+
+    Parameters
+    ----------
+    :param df: `pandas.DataFrame`
+        DataFrame to compact.
+    :param max_cat_frac: float
+        Object columns are converted to categoricals only if the number of unique 
+        values is smaller than this fraction of the number of rows.
+    :param exclude: list of strings
+        Columns that should not be changed.
+    :return df: `pandas.DataFrame`
+        Compacted DataFrame.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col in exclude:
+            continue
+        s = df[col]
+        if s.dtype == 'object':
+            valid = s.dropna()
+            num = pd.to_numeric(valid, errors='coerce')
+            if len(valid) > 0 and num.notna().all() and (num.astype('float64').astype('str') == valid.astype('str')).all():
+                df[col] = pd.to_numeric(s).astype('float64')
+                s = df[col]
+            elif s.nunique() < max_cat_frac * len(s):
+                df[col] = s.astype('category')
+                continue
+            else:
+                continue
+        if s.dtype == 'float64':
+            s32 = s.astype('float32')
+            if ((s32.astype('float64') == s) | s.isna()).all():
+                df[col] = s32
+        elif s.dtype == 'int64':
+            df[col] = pd.to_numeric(s, downcast='integer')
+    return df
+
+
+def expand_df(df):
+    """
+    Restores float32 columns created by `compact_df` to float64, so the DataFrame
+    is written to CSV exactly as the original would have been. Categorical columns 
+    are written identically, so they are left alone.
+
+    Parameters
+    ----------
+    :param df: `pandas.DataFrame`
+        Compacted DataFrame.
+    :return df: `pandas.DataFrame`
+        DataFrame with float64 in place of float32 columns.
+    """
+    float32_cols = df.columns[df.dtypes == 'float32']
+    return df.astype({col: 'float64' for col in float32_cols})
+
+
+def memory_report(df, compare_df=None):
+    """
+    Reports the memory used by each column of a DataFrame (including the memory
+    held by Python string objects).
+
+    Parameters
+    ----------
+    :param df: `pandas.DataFrame`
+        DataFrame to report on.
+    :param compare_df: `pandas.DataFrame`
+        Optional second DataFrame with the same columns (e.g., the compacted version of 
+        `df`). If specified, its dtypes, memory, and the reduction factor are included.
+    :return report: `pandas.DataFrame`
+        Memory usage (MB) and dtype for each column, plus a "Total" row.
+    """
+    report = pd.DataFrame({'dtype': df.dtypes.astype('str'),
+                           'memory_mb': df.memory_usage(deep=True, index=False) / 2**20})
+    if compare_df is not None:
+        report['compare_dtype'] = compare_df.dtypes.astype('str').reindex(report.index)
+        report['compare_memory_mb'] = (compare_df.memory_usage(deep=True, index=False) / 2**20).reindex(report.index)
+    report.loc['Total'] = report.sum(numeric_only=True)
+    report.loc['Total', 'dtype'] = ''
+    if compare_df is not None:
+        report.loc['Total', 'compare_dtype'] = ''
+        report['reduction'] = report['memory_mb'] / report['compare_memory_mb']
+    return report
+
+
+def find_line_offsets(file_name, line_numbers, block_size=2**24):
+    """
+    Finds the byte offsets of selected lines in a text file with a single pass 
+    over the file, without holding the file (or the offsets of every line) in memory.
+
+    Parameters
+    ----------
+    :param file_name: string
+        Complete path of the file.
+    :param line_numbers: array-like of ints
+        Zero-based line numbers (counting the header lines) to locate. 
+    :param block_size: int
+        Number of bytes to read at a time.
+    :return starts: `numpy.ndarray`
+        Byte offset of the first character of each line (in the order of `line_numbers`).
+    :return ends: `numpy.ndarray`
+        Byte offset just past the end of each line (including the newline character).
+    """
+    line_numbers = np.asarray(line_numbers, dtype='int64')
+    # Line k starts after newline k-1 and ends after newline k
+    wanted = np.unique(np.concatenate([line_numbers - 1, line_numbers]))
+    wanted = wanted[wanted >= 0]
+    found = np.full(len(wanted), -1, dtype='int64')
+    n_seen, pos, last = 0, 0, b''
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype='uint8') == ord('\n')) + pos
+            lo, hi = np.searchsorted(wanted, [n_seen, n_seen + len(newlines)])
+            found[lo:hi] = newlines[wanted[lo:hi] - n_seen]
+            n_seen += len(newlines)
+            pos += len(block)
+            last = block[-1:]
+    # A last line without a trailing newline ends at the end of the file
+    if last not in (b'', b'\n'):
+        found[wanted == n_seen] = pos - 1
+    if (found == -1).any():
+        raise ValueError(f'{file_name} has fewer lines than requested')
+    ends = found[np.searchsorted(wanted, line_numbers)] + 1
+    starts = np.zeros(len(line_numbers), dtype='int64')
+    not_first = line_numbers > 0
+    starts[not_first] = found[np.searchsorted(wanted, line_numbers[not_first] - 1)] + 1
+    return starts, ends
+
+
+def copy_bytes(f_in, f_out, start, end, block_size=2**24):
+    """
+    Copies a byte range from one open (binary) file to another.
+
+    Parameters
+    ----------
+    :param f_in: file object
+        File to copy from.
+    :param f_out: file object
+        File to copy to.
+    :param start: int
+        Byte offset where the range starts.
+    :param end: int
+        Byte offset just past the end of the range. If None, copies to the end of the file.
+    :param block_size: int
+        Number of bytes to copy at a time.
+    """
+    f_in.seek(start)
+    n_left = None if end is None else end - start
+    while n_left is None or n_left > 0:
+        block = f_in.read(block_size if n_left is None else min(block_size, n_left))
+        if not block:
+            break
+        f_out.write(block)
+        if n_left is not None:
+            n_left -= len(block)
+
+
+def read_griddesc(griddesc_file, grid_name):
+    """
+    Reads the definition of a grid (and its coordinate system) from a GRIDDESC file.
+
+    Parameters
+    ----------
+    :param griddesc_file: string
+        Complete path to the GRIDDESC file.
+    :param grid_name: string
+        Grid name, which should match that in the GRIDDESC file (e.g., 12OTC2).
+    :return grid: dict
+        Grid parameters using the IOAPI attribute names (GDNAM, GDTYP, P_ALP, P_BET, 
+        P_GAM, XCENT, YCENT, XORIG, YORIG, XCELL, YCELL, NCOLS, NROWS, NTHIK), plus
+        COORD_NAME.
+    """
+    with open(griddesc_file, 'r') as f:
+        lines = [line.strip() for line in f if line.strip() != '']
+    # The file has a coordinate system segment and a grid segment, each 
+    # ending with a blank name (i.e., ' ') 
+    segments, segment = [], []
+    for line in lines[1:]:
+        if line.strip("'").strip() == '':
+            segments.append(segment)
+            segment = []
+        else:
+            segment.append(line)
+    coords = {segments[0][ii].strip("'"): segments[0][ii + 1].split() for ii in range(0, len(segments[0]), 2)}
+    grids = {segments[1][ii].strip("'"): segments[1][ii + 1].split() for ii in range(0, len(segments[1]), 2)}
+    if grid_name not in grids:
+        raise ValueError(f'Grid {grid_name} was not found in {griddesc_file}. Options are: {list(grids.keys())}')
+    coord_name = grids[grid_name][0].strip("'")
+    coord = coords[coord_name]
+    grid_info = grids[grid_name][1:]
+    grid = {'GDNAM': grid_name, 
+            'COORD_NAME': coord_name,
+            'GDTYP': int(coord[0])}
+    for key, value in zip(['P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT'], coord[1:]):
+        grid[key] = float(value)
+    for key, value in zip(['XORIG', 'YORIG', 'XCELL', 'YCELL'], grid_info[:4]):
+        grid[key] = float(value)
+    for key, value in zip(['NCOLS', 'NROWS', 'NTHIK'], grid_info[4:]):
+        grid[key] = int(value)
+    return grid
+
+
+def submit_job(script_path, depend_on=None, options=''):
+    """
+    Submits a script to the Slurm scheduler and returns the job ID.
+
+    Parameters
+    ----------
+    :param script_path: string
+        Complete path to the script that will be submitted.
+    :param depend_on: string
+        Job ID that must complete successfully before this job can start. 
+        Defaults to None (no dependency).
+    :param options: string
+        Additional options passed to sbatch (e.g., "--requeue").
+    :return job_id: string
+        Slurm job ID, or None if the submission failed.
+    """
+    cmd = ['sbatch', '--parsable']
+    if depend_on is not None:
+        cmd.append(f'--dependency=afterok:{depend_on}')
+    cmd += options.split() + [script_path]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        print(f'CMAQPyError: submitting {script_path} failed with:\n{result.stderr}')
+        return None
+    # With --parsable, sbatch prints "jobid" or "jobid;cluster"
+    return result.stdout.strip().split(';')[0]
+
+
+def job_states(job_id):
+    """
+    Gets the Slurm state and elapsed time of a job, or of each task in a job array.
+
+    Parameters
+    ----------
+    :param job_id: string
+        Slurm job ID.
+    :return states: dict
+        Dictionary with the array task ID (int) or None (for a job that isn't an array) 
+        as keys, and a tuple (state, elapsed) as values.
+    """
+    cmd = ['sacct', '-j', str(job_id), '-X', '-n', '-P', '--format=JobID,State,Elapsed']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    states = {}
+    for line in result.stdout.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 3:
+            continue
+        sub_id, state, elapsed = fields[:3]
+        # Only keep the first word (e.g., "CANCELLED by 1234")
+        state = state.split()[0]
+        if '_' not in sub_id:
+            states[None] = (state, elapsed)
+            continue
+        tasks = sub_id.split('_', 1)[1].strip('[]')
+        # Pending array tasks are grouped (e.g., "1234_[2-5,7]")
+        for task_range in tasks.split(','):
+            task_range = task_range.split('%')[0]
+            if '-' in task_range:
+                first, last = task_range.split('-')
+                task_ids = range(int(first), int(last) + 1)
+            else:
+                task_ids = [int(task_range)]
+            for task_id in task_ids:
+                states[task_id] = (state, elapsed)
+    return states
+
+
+def find_errors(file_name, patterns=['ERROR:', 'ERROR ABORT', 'Error:', 'error:']):
+    """
+    Finds the lines of a log file that contain error messages.
+
+    Parameters
+    ----------
+    :param file_name: string
+        Complete path of the log file.
+    :param patterns: list of strings
+        Lines containing any of these strings are reported.
+    :return errors: list of strings
+        Lines containing errors (without the trailing newline).
+    """
+    errors = []
+    try:
+        with open(file_name, mode='r', errors='replace') as f:
+            for line in f:
+                if any(pattern in line for pattern in patterns):
+                    errors.append(line.rstrip('\n'))
+    except IOError:
+        pass
+    return errors
+
+
+def hhmmss_to_timedelta(hhmmss):
+    """
+    Converts IOAPI times or time steps (HHMMSS) to time deltas.
+
+    Parameters
+    ----------
+    :param hhmmss: int or `numpy.ndarray`
+        Times in HHMMSS format (e.g., the STIME and TSTEP attributes).
+    :return: `pandas.Timedelta` or `pandas.TimedeltaIndex`
+    """
+    hhmmss = np.asarray(hhmmss).astype('int64')
+    return pd.to_timedelta(hhmmss // 10000 * 3600 + hhmmss // 100 % 100 * 60 + hhmmss % 100, unit='s')
+
+
+def datetime_to_tflag(times):
+    """
+    Converts datetimes to IOAPI TFLAG values (YYYYDDD, HHMMSS).
+
+    Parameters
+    ----------
+    :param times: `pandas.DatetimeIndex`
+        Datetimes of each time step.
+    :return tflag: `numpy.ndarray`
+        TFLAG values with shape (TSTEP, 2).
+    """
+    times = pd.DatetimeIndex(times)
+    return np.column_stack([times.year * 1000 + times.dayofyear, 
+                            times.hour * 10000 + times.minute * 100 + times.second]).astype('int32')
+
+
+def tflag_to_datetime(tflag):
+    """
+    Converts IOAPI TFLAG values (YYYYDDD, HHMMSS) to datetimes.
+
+    Parameters
+    ----------
+    :param tflag: `numpy.ndarray`
+        Array with a last dimension of length 2 holding the date (YYYYDDD) and time (HHMMSS), 
+        e.g., the TFLAG values of a single variable with shape (TSTEP, 2).
+    :return times: `pandas.DatetimeIndex`
+        Flattened datetimes.
+    """
+    tflag = np.asarray(tflag).reshape(-1, 2).astype('int64')
+    dates = pd.to_datetime((tflag[:, 0] // 1000).astype('str'), format='%Y') + pd.to_timedelta(tflag[:, 0] % 1000 - 1, unit='D')
+    return dates + hhmmss_to_timedelta(tflag[:, 1])
+
+
+def set_ioapi_vars(ds, tflag):
+    """
+    Updates the IOAPI variable list attributes (NVARS, VAR-LIST) and the TFLAG variable
+    of a Dataset to match its data variables.
+
+    Parameters
+    ----------
+    :param ds: `xarray.Dataset`
+        IOAPI Dataset. All data variables other than TFLAG are listed, in order.
+    :param tflag: `numpy.ndarray`
+        TFLAG values for a single variable with shape (TSTEP, 2).
+    :return ds: `xarray.Dataset`
+        Dataset with the updated attributes and TFLAG.
+    """
+    var_names = [var for var in ds.data_vars if var != 'TFLAG']
+    tflag = np.repeat(np.asarray(tflag, dtype='int32')[:, None, :], len(var_names), axis=1)
+    ds['TFLAG'] = (('TSTEP', 'VAR', 'DATE-TIME'), tflag, 
+                   {'units': '<YYYYDDD,HHMMSS>', 'long_name': 'TFLAG           ', 
+                    'var_desc': 'Timestep-valid flags:  (1) YYYYDDD or (2) HHMMSS                                '})
+    ds.attrs['NVARS'] = np.int32(len(var_names))
+    ds.attrs['VAR-LIST'] = ''.join([f'{var:<16}' for var in var_names])
+    # IOAPI files list TFLAG first
+    return ds[['TFLAG'] + var_names]
+
+
+def ioapi_diff_stats(file_name, ref_file_name, var_names=None, layer=0):
+    """
+    Compares the variables of two IOAPI files on the same grid and times (e.g., the CCTM 
+    outputs of two simulations for the same day), one variable at a time.
+
+    Parameters
+    ----------
+    :param file_name: string
+        Path to the file to check.
+    :param ref_file_name: string
+        Path to the reference file.
+    :param var_names: list of strings
+        Variables to compare. If None, all variables found in both files are compared.
+    :param layer: int
+        Index of the layer to compare. If None, all layers are compared.
+    :return stats_df: `pandas.DataFrame`
+        Mean reference value, mean bias, mean absolute difference, maximum absolute 
+        difference, RMSE, and normalized mean absolute difference (NMAE) indexed by variable.
+    """
+    rows = []
+    with xr.open_dataset(file_name) as ds, xr.open_dataset(ref_file_name) as ref:
+        if var_names is None:
+            var_names = [var for var in ref.data_vars if (var != 'TFLAG') and (var in ds)]
+        for var in var_names:
+            values, ref_values = ds[var], ref[var]
+            if (layer is not None) and ('LAY' in values.dims):
+                values, ref_values = values.isel(LAY=layer), ref_values.isel(LAY=layer)
+            diff = values.values.astype('float64') - ref_values.values.astype('float64')
+            ref_mean = float(np.nanmean(np.abs(ref_values.values)))
+            mae = float(np.nanmean(np.abs(diff)))
+            rows.append({'variable': var, 'ref_mean': float(np.nanmean(ref_values.values)), 'mean_bias': float(np.nanmean(diff)), 
+                         'mae': mae, 'max_abs_diff': float(np.nanmax(np.abs(diff))), 'rmse': float(np.sqrt(np.nanmean(diff**2))), 
+                         'nmae': mae / ref_mean if ref_mean > 0 else np.nan})
+    return pd.DataFrame(rows).set_index('variable')
+
+
+EARTH_RADIUS = 6370000.
+# UTC offsets of the grid cells (see `utc_offset_grid`)
+UTC_OFFSETS = {}
+
+
+def grid_key(grid):
+    """
+    Makes a short key that identifies a grid, e.g., for caching values that only depend on 
+    the grid (coordinates, site indices, weights).
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (e.g., the attributes of an IOAPI 
+        file or the output of `read_griddesc`).
+    :return key: string
+        Key with the grid name, its size, and a hash of its definition.
+    """
+    params = [str(grid.get(key, '')).strip() for key in ['GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT']]
+    params += [f'{float(grid[key]):.3f}' for key in ['XORIG', 'YORIG', 'XCELL', 'YCELL']]
+    params += [str(int(grid[key])) for key in ['NCOLS', 'NROWS']]
+    name = str(grid.get('GDNAM', 'grid')).strip().replace(' ', '_')
+    return f'{name}_{int(grid["NCOLS"])}x{int(grid["NROWS"])}_{hashlib.md5(" ".join(params).encode()).hexdigest()[:8]}'
+
+
+def lcc_params(grid):
+    """
+    Computes the constants of the spherical Lambert conformal conic projection of an IOAPI grid
+    (GDTYP = 2).
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :return n, rho_f, rho_0, lon_0: floats
+        Cone constant, scaled radius factor, radius of the origin latitude, and central
+        longitude (radians).
+    """
+    if int(grid.get('GDTYP', 2)) != 2:
+        raise ValueError(f'Only Lambert conformal grids (GDTYP = 2) are supported, not GDTYP = {grid.get("GDTYP")}')
+    lat_1, lat_2, lat_0 = np.radians([float(grid['P_ALP']), float(grid['P_BET']), float(grid['YCENT'])])
+    if np.isclose(lat_1, lat_2):
+        n = np.sin(lat_1)
+    else:
+        n = np.log(np.cos(lat_1) / np.cos(lat_2)) / np.log(np.tan(np.pi / 4 + lat_2 / 2) / np.tan(np.pi / 4 + lat_1 / 2))
+    rho_f = EARTH_RADIUS * np.cos(lat_1) * np.tan(np.pi / 4 + lat_1 / 2)**n / n
+    rho_0 = rho_f / np.tan(np.pi / 4 + lat_0 / 2)**n
+    return n, rho_f, rho_0, np.radians(float(grid['P_GAM']))
+
+
+def lcc_forward(lon, lat, grid):
+    """
+    Projects longitudes and latitudes to the x and y coordinates (m) of an IOAPI Lambert 
+    conformal grid, i.e., the coordinates used by XORIG and YORIG.
+
+    Parameters
+    ----------
+    :param lon: `numpy.ndarray`
+        Longitudes (degrees).
+    :param lat: `numpy.ndarray`
+        Latitudes (degrees).
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :return x, y: `numpy.ndarray`
+        Projected coordinates (m).
+    """
+    n, rho_f, rho_0, lon_0 = lcc_params(grid)
+    rho = rho_f / np.tan(np.pi / 4 + np.radians(lat) / 2)**n
+    theta = n * (np.radians(lon) - lon_0)
+    # The projection is centered on (XCENT, YCENT), which can differ from P_GAM
+    x_0 = rho_0 * np.sin(n * (np.radians(float(grid['XCENT'])) - lon_0))
+    y_0 = rho_0 - rho_0 * np.cos(n * (np.radians(float(grid['XCENT'])) - lon_0))
+    return rho * np.sin(theta) - x_0, rho_0 - rho * np.cos(theta) - y_0
+
+
+def lcc_inverse(x, y, grid):
+    """
+    Converts the x and y coordinates (m) of an IOAPI Lambert conformal grid to longitudes
+    and latitudes (the inverse of `lcc_forward`).
+
+    Parameters
+    ----------
+    :param x: `numpy.ndarray`
+        Projected x coordinates (m).
+    :param y: `numpy.ndarray`
+        Projected y coordinates (m).
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :return lon, lat: `numpy.ndarray`
+        Longitudes and latitudes (degrees).
+    """
+    n, rho_f, rho_0, lon_0 = lcc_params(grid)
+    x_0 = rho_0 * np.sin(n * (np.radians(float(grid['XCENT'])) - lon_0))
+    y_0 = rho_0 - rho_0 * np.cos(n * (np.radians(float(grid['XCENT'])) - lon_0))
+    x, y = np.asarray(x, dtype='float64') + x_0, np.asarray(y, dtype='float64') + y_0
+    rho = np.sign(n) * np.sqrt(x**2 + (rho_0 - y)**2)
+    theta = np.arctan2(np.sign(n) * x, np.sign(n) * (rho_0 - y))
+    lat = 2 * np.arctan((rho_f / rho)**(1 / n)) - np.pi / 2
+    return np.degrees(lon_0 + theta / n), np.degrees(lat)
+
+
+def grid_lonlat(grid, stagger=False):
+    """
+    Computes the longitudes and latitudes of the cell centers (or corners) of an IOAPI grid.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :param stagger: bool
+        If True, the cell corners (NROWS+1, NCOLS+1) are returned instead of the centers.
+    :return lon, lat: `numpy.ndarray`
+        Longitudes and latitudes (degrees) with shape (NROWS, NCOLS).
+    """
+    offset = 0. if stagger else 0.5
+    n_cols, n_rows = int(grid['NCOLS']) + int(stagger), int(grid['NROWS']) + int(stagger)
+    x = float(grid['XORIG']) + (np.arange(n_cols) + offset) * float(grid['XCELL'])
+    y = float(grid['YORIG']) + (np.arange(n_rows) + offset) * float(grid['YCELL'])
+    x, y = np.meshgrid(x, y)
+    return lcc_inverse(x, y, grid)
+
+
+def grid_proj4(grid):
+    """
+    Writes the proj4 string of an IOAPI Lambert conformal grid in the form expected by 
+    `plots.get_proj`.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names.
+    :return proj4_srs: string
+    """
+    return (f'+proj=lcc +lat_1={float(grid["P_ALP"])} +lat_2={float(grid["P_BET"])} +lat_0={float(grid["YCENT"])} '
+            f'+lon_0={float(grid["XCENT"])} +x_0=0 +y_0=0 +a={EARTH_RADIUS} +b={EARTH_RADIUS} +units=m +no_defs')
+
+
+class RepDates:
+    """
+    Resolves representative dates from the `smk_merge_dates_YYYYMM.txt` files produced by 
+    smkmerge. Each month's table is read once and kept, so a whole simulation period can 
+    be resolved for all the date types without re-reading the files.
+
+    The date types are: 'aveday_N', 'aveday_Y', 'mwdss_N', 'mwdss_Y', 'week_N', 'week_Y', 
+    and 'all'. The white space that SMOKE adds to the column names is optional. 
+
+    Parameters
+    ----------
+    :param smk_dates_dir: string
+        Full path to the directory where the smoke merge date text files are located.
+    """
+    DATE_TYPES = ['aveday_N', 'aveday_Y', 'mwdss_N', 'mwdss_Y', 'week_N', 'week_Y', 'all']
+
+    def __init__(self, smk_dates_dir):
+        self.smk_dates_dir = smk_dates_dir
+        self.tables = {}
+
+    def month_table(self, month):
+        """
+        Returns the merge dates table for one month, reading it only the first time.
+
+        Parameters
+        ----------
+        :param month: string
+            Month in YYYYMM format.
+        :return: `pandas.DataFrame`
+            Representative dates (as datetimes) indexed by date, with one column per date type.
+        """
+        if month not in self.tables:
+            smk_dates = pd.read_csv(f'{self.smk_dates_dir}/smk_merge_dates_{month}.txt', index_col=0, dtype=str)
+            smk_dates.columns = smk_dates.columns.str.strip()
+            smk_dates.index = pd.to_datetime(smk_dates.index.astype(str).str.strip(), format='%Y%m%d')
+            self.tables[month] = smk_dates.apply(lambda col: pd.to_datetime(col.str.strip(), format='%Y%m%d'))
+        return self.tables[month]
+
+    def lookup(self, dates, date_type='mwdss_N'):
+        """
+        Gets the representative date for each simulation date.
+
+        Parameters
+        ----------
+        :param dates: list of `Timestamp` (or `datetime.datetime`)
+            Simulation dates.
+        :param date_type: string
+            Column of the merge dates files to use (e.g., 'mwdss_N').
+        :return: `pandas.DatetimeIndex`
+            Representative date for each of the simulation dates (in the same order). 
+        """
+        dates = pd.DatetimeIndex(pd.to_datetime(dates)).normalize()
+        date_type = date_type.strip()
+        if date_type not in self.DATE_TYPES:
+            raise ValueError(f'date_type must be one of {self.DATE_TYPES}')
+        table = pd.concat([self.month_table(month)[date_type] for month in dates.strftime('%Y%m').unique()])
+        rep_dates = table.reindex(dates)
+        if rep_dates.isna().any():
+            raise ValueError(f'No representative dates for {list(dates[rep_dates.isna().values].strftime("%Y-%m-%d"))}')
+        return pd.DatetimeIndex(rep_dates.values)
+
+    def unique(self, dates, date_type='mwdss_N'):
+        """
+        Gets the unique representative dates needed for a list of simulation dates, in 
+        the order they are first needed.
+
+        Parameters
+        ----------
+        :param dates: list of `Timestamp` (or `datetime.datetime`)
+            Simulation dates.
+        :param date_type: string
+            Column of the merge dates files to use (e.g., 'mwdss_N').
+        :return: `pandas.DatetimeIndex`
+            Index of representative dates.
+        """
+        return pd.DatetimeIndex(pd.unique(self.lookup(dates, date_type)))
+
+    def resolve(self, dates, date_types=None):
+        """
+        Gets the representative dates of several date types for a list of simulation dates.
+
+        Parameters
+        ----------
+        :param dates: list of `Timestamp` (or `datetime.datetime`)
+            Simulation dates.
+        :param date_types: list of strings
+            Date types to resolve. If None, all date types are resolved.
+        :return: `pandas.DataFrame`
+            Representative dates indexed by simulation date with one column per date type.
+        """
+        if date_types is None:
+            date_types = self.DATE_TYPES
+        index = pd.DatetimeIndex(pd.to_datetime(dates)).normalize()
+        return pd.DataFrame({date_type.strip(): self.lookup(index, date_type) for date_type in date_types}, index=index)
+
+
 def get_rep_dates(smk_dates_dir, dates_list, date_type='  mwdss_N'):
     """
     Get representative dates from the files produced by smkmerge.
 
-    Make sure that you include the correct white space in the date_type
-    parameter. The options are: 
+    The options for date_type are: 
     ' aveday_N', ' aveday_Y', 
     '  mwdss_N', '  mwdss_Y', 
     '   week_N', '   week_Y', 
     '      all'
-
-    NOTE: this woudld be slightly faster if I didn't reopen the file each time, 
-    but it's such a small fraction of the time for CCTM that I'm not
-    going to worry about it now.
+    The white space that SMOKE adds to these labels is optional. Use a `RepDates` 
+    object instead when resolving several date types or date ranges, since it 
+    keeps the merge dates tables that it has already read.
 
     Parameters
     ----------
@@ -215,28 +880,10 @@ def get_rep_dates(smk_dates_dir, dates_list, date_type='  mwdss_N'):
         Simulation dates for which you want the corresponding representative dates.
     :param date_type: string
         Label from the `smk_merge_dates_YYYYMM.txt` file that you want to extract. 
-        Note that SMOKE appends white space to the beginning of these, so you have 
-        to include this white space for this function to run successfully (see function
-        header).
     :retrun: `pandas.DatetimeIndex`
-        Index of representative dates. 
-    """
-    rep_days = []
-    # Loop through each day in the input list and append the respective representative day to the list
-    for date in dates_list:
-        d_str = date.strftime("%Y%m")
-        smk_dates = pd.read_csv(f'{smk_dates_dir}/smk_merge_dates_{d_str}.txt', index_col=0, parse_dates=[0], infer_datetime_format=True)
-        s = smk_dates[date_type]
-        rep_days.append(s[date])
-
-    # Remove duplicates in the represenatitive days 
-    result = [] 
-    [result.append(x) for x in rep_days if x not in result]
-
-    # Convert to datetimes
-    result = pd.to_datetime(result, format='%Y%m%d') 
-    
-    return result
+        Index of representative dates (without duplicates). 
+    """
+    return RepDates(smk_dates_dir).unique(dates_list, date_type)
 
 
 def convert_tz_xr(ds, input_tz='UTC', output_tz='US/Eastern', time_coord='time'):
@@ -245,6 +892,8 @@ def convert_tz_xr(ds, input_tz='UTC', output_tz='US/Eastern', time_coord='time')
 
     Note that this will not work if you have problematic date features within your 
     simulation (e.g., time changes). This is why xarray hasn't integrated this feature yet. 
+    It also uses one time zone for the whole domain; see `utc_offset_grid` and 
+    `metrics.to_local` to convert each grid cell to its own local time.
 
     Parameters
     ----------
@@ -263,3 +912,62 @@ def convert_tz_xr(ds, input_tz='UTC', output_tz='US/Eastern', time_coord='time')
     tidx_in = ds.time.to_index().tz_localize(tz=input_tz)
     ds.coords[time_coord] = tidx_in.tz_convert(output_tz).tz_localize(None)
     return ds
+
+
+def utc_offset_grid(grid, lat, lon, date=None, cache_dir=None):
+    """
+    Finds the UTC offset (hours) of each grid cell from its time zone. The time zones are 
+    looked up with the optional timezonefinder package; if it isn't installed, the offsets
+    are approximated from the longitudes (15 degrees per hour). The offsets are computed 
+    once per grid and kept in memory (UTC_OFFSETS) and, optionally, in cache_dir.
+
+    Parameters
+    ----------
+    :param grid: dict
+        Grid parameters using the IOAPI attribute names (used for the cache key, see `grid_key`).
+    :param lat: `numpy.ndarray`
+        Latitudes of the cell centers (NROWS, NCOLS).
+    :param lon: `numpy.ndarray`
+        Longitudes of the cell centers (NROWS, NCOLS).
+    :param date: string or datetime
+        Date for which daylight saving time is applied. Defaults to None, which gives the
+        standard time offsets (as used for regulatory metrics).
+    :param cache_dir: string
+        Directory where the offsets are saved, so other runs on the same grid can reuse them.
+    :return offsets: `numpy.ndarray`
+        UTC offsets (hours) of each cell (NROWS, NCOLS).
+    """
+    date_str = 'standard' if date is None else pd.Timestamp(date).strftime('%Y%m%d')
+    key = f'{grid_key(grid)}_{date_str}'
+    cache_file = None if cache_dir is None else f'{cache_dir}/utc_offsets_{key}.npy'
+    if key in UTC_OFFSETS:
+        return UTC_OFFSETS[key]
+    if (cache_file is not None) and os.path.exists(cache_file):
+        UTC_OFFSETS[key] = np.load(cache_file)
+        return UTC_OFFSETS[key]
+    lat, lon = np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')
+    try:
+        from timezonefinder import TimezoneFinder
+    except ImportError:
+        print('Warning: timezonefinder is not installed, so the UTC offsets are approximated from the longitudes')
+        # Not saved to cache_dir, so that the time zones are used once timezonefinder is installed
+        cache_file = None
+        offsets = np.round(lon / 15.)
+    else:
+        finder = TimezoneFinder()
+        zones = np.array([finder.timezone_at(lng=x, lat=y) for x, y in zip(lon.ravel(), lat.ravel())], dtype=object)
+        offsets = np.round(lon / 15.).ravel()
+        # Each time zone only needs to be converted once
+        for zone in set(zones) - set([None]):
+            if date is None:
+                # Standard time is the smaller of the winter and summer offsets
+                zone_offset = min([pd.Timestamp(f'{day} 12:00').tz_localize(zone).utcoffset() for day in ['2016-01-15', '2016-07-15']])
+            else:
+                zone_offset = (pd.Timestamp(date).normalize() + pd.Timedelta(hours=12)).tz_localize(zone).utcoffset()
+            offsets[zones == zone] = zone_offset.total_seconds() / 3600
+        offsets = offsets.reshape(lat.shape)
+    UTC_OFFSETS[key] = offsets
+    if cache_file is not None:
+        make_dirs(cache_dir)
+        np.save(cache_file, offsets)
+    return offsets
@@ -0,0 +1,21 @@
+"""
+This example shows how to edit the hourly emissions for a few units in the
+`{ertac_case}_fs_ff10_hourly_future.csv` file that SMOKE reads as EMISHOUR_A.
+The file is processed in chunks, so the national inventory never needs to 
+fit in memory, and the FF10 header block is carried over to the new file.
+"""
+
+from cmaqpy.prepemis import edit_ff10_hourly
+
+# Define the paths to the original and edited FF10 hourly inventories
+in_ff10_file = '/home/jas983/models/ertac_egu/CONUS2016_Base/for_SMOKE/CONUS2016_Base_fs_ff10_hourly_future.csv'
+out_ff10_file = '/home/jas983/models/ertac_egu/CONUS2016_S0/for_SMOKE/CONUS2016_S0_fs_ff10_hourly_future.csv'
+
+# Units are identified by (facility_id, unit_id) or (facility_id, unit_id, process_id)
+units = [('1056111', '47671513'), ('1056111', '47671213')]
+
+# Cut NOx emissions from these units in half and remove the long comments
+# that sometimes cause SMOKE parsing errors
+n_edited = edit_ff10_hourly(in_ff10_file, out_ff10_file, units, action='scale', factor=0.5,
+                            polls=['NOX'], clear_comments=True)
+print(f'Edited {n_edited} rows')
@@ -0,0 +1,24 @@
+"""
+This example shows how to write the ML emissions predictions for the NY units 
+directly into the FF10 hourly point inventory (EMISHOUR_A) used by SMOKE. 
+This replaces the update_camd -> ERTAC EGU -> SMOKE chain when only the NY 
+dispatch changes, so there is no need to rerun ERTAC for all of CONUS.
+"""
+
+from cmaqpy.prepemis import ml_to_ff10_hourly
+
+# Base case FF10 inventories output by ERTAC EGU 
+for_smoke_dir = '/home/jas983/models/ertac_egu/CONUS2016_Base/for_SMOKE'
+in_ff10_hourly_file = f'{for_smoke_dir}/CONUS2016_Base_fs_ff10_hourly_future.csv'
+ff10_point_file = f'{for_smoke_dir}/CONUS2016_Base_fs_ff10_future.csv'
+# Scenario FF10 hourly inventory, named so that SMOKEModel(ertac_case='CONUS2016_S0') finds it
+out_ff10_hourly_file = '/home/jas983/models/ertac_egu/CONUS2016_S0/for_SMOKE/CONUS2016_S0_fs_ff10_hourly_future.csv'
+
+# ML predictions and the NYISO lookup table
+pred_files = {'NOX': '../cmaqpy/data/ny_emis/ml_output/pred_xg_nox_fix.csv',
+              'SO2': '../cmaqpy/data/ny_emis/ml_output/pred_xg_so2_fix.csv'}
+lu_file = '../cmaqpy/data/ny_emis/ed_output/RGGI_to_NYISO.csv'
+
+n_edited = ml_to_ff10_hourly(in_ff10_hourly_file, out_ff10_hourly_file, ff10_point_file,
+                             lu_file=lu_file, pred_files=pred_files, process_split='base')
+print(f'Replaced {n_edited} rows')
@@ -31,3 +31,9 @@ smoke_sim = SMOKEModel(appl, grid_name, sector='ptertac', run_months=[8], ertac_
     setup_yaml=f'dirpaths_{appl}.yml', compiler='gcc', compiler_vrsn='9.3.1', verbose=True)
 # Call the "run_sector" method using the "daily" type
 smoke_sim.run_sector(type='daily', season='summer', n_procs=1, gb_mem=50, run_hours=12, setup_only=setup_only)
+# ... or process each month in `run_months` as an element of a job array
+# smoke_sim.run_sector(type='daily', season='summer', n_procs=1, gb_mem=50, run_hours=12, 
+#     setup_only=setup_only, split_months=True)
+# print(smoke_sim.daily_status())
+# Follow the SMOKE logs until the jobs finish and print the time spent in each program
+# logs_df, timing_df = smoke_sim.monitor_logs(poll_seconds=60)
@@ -0,0 +1,49 @@
+"""
+This example shows how to run CCTM for an emissions scenario (e.g., renewables replacing
+some NY EGU generation) that shares its meteorology, boundary conditions, and initial 
+conditions with a base case that has already been run.
+
+The scenario only pays for the days that actually differ: the base case outputs are reused
+for the days before the first day on which the emissions differ, and CCTM is hot-started on
+that day from the base case CGRID file for the previous day.
+
+You should run this inside a tmux window because this ties up the terminal.
+"""
+
+from cmaqpy.runcmaq import CMAQModel
+
+# Specify the start/end times
+start_datetime = 'August 06, 2016'  # first day that you want run
+end_datetime = 'August 14, 2016'  # DAY AFTER the last day you want run
+
+# Base case and scenario application names (each needs its own dirpaths yaml file)
+base_appl = '2016Base_12OTC2'
+scen_appl = '2016Scen_12OTC2'
+coord_name = 'LAM_40N97W'
+grid_name = '12OTC2'
+
+# Emissions sectors (the same for both simulations)
+gr_emis_labs = ['all', 'rwc']
+pt_emis_labs = ['ptnonertac', 'ptertac', 'othpt', 'ptagfire', 'ptfire', 'ptfire_othna', 'pt_oilgas', 'cmv_c3_12', 'cmv_c1c2_12']
+stkgrps_daily = [False, False, False, True, True, True, False, False, False]
+
+# Create CMAQModel objects for the base case and the scenario
+base_sim = CMAQModel(start_datetime, end_datetime, base_appl, coord_name, grid_name, 
+    setup_yaml=f'dirpaths_{base_appl}.yml', new_mcip=False, new_icon=False, new_bcon=False, verbose=True)
+scen_sim = CMAQModel(start_datetime, end_datetime, scen_appl, coord_name, grid_name, 
+    setup_yaml=f'dirpaths_{scen_appl}.yml', new_mcip=False, new_icon=False, new_bcon=False, verbose=True)
+
+# Compare the scenario emissions with the base case and only run the days that differ
+changes_df = scen_sim.run_cctm_scenario(base_sim, n_emis_gr=2, gr_emis_labs=gr_emis_labs, n_emis_pt=9, 
+    pt_emis_labs=pt_emis_labs, stkgrps_daily=stkgrps_daily, 
+    stkcaseg='12US1_2016fh_16j', stkcasee='12US1_cmaq_cb6_2016fh_16j', 
+    ctm_abflux='Y', tstep='010000', cctm_hours=24, n_procs=48, gb_mem=50, run_hours=72, setup_only=False)
+print(changes_df)
+
+# If you already know when the emissions start to differ, you can hot-start the scenario 
+# directly instead of comparing the emissions
+# scen_sim = CMAQModel(start_datetime, end_datetime, scen_appl, coord_name, grid_name, 
+#     setup_yaml=f'dirpaths_{scen_appl}.yml', new_mcip=False, new_icon=False, new_bcon=False, verbose=True,
+#     base_sim=base_sim, hot_start_date='August 09, 2016')
+# scen_sim.run_cctm(n_emis_gr=2, gr_emis_labs=gr_emis_labs, n_emis_pt=9, pt_emis_labs=pt_emis_labs, 
+#     stkgrps_daily=stkgrps_daily, n_procs=48, gb_mem=50, run_hours=72, setup_only=False)
@@ -2,8 +2,9 @@
 This example shows you how to produce NetCDF files to help visualize the smoke in-line 
 point sources on the CMAQ model grid.
 
-Since this example submits a job to the slurm scheduler, there's no need to run this 
-inside a tmux window.
+Since `run_inlineto2d` submits a job to the slurm scheduler, there's no need to run this 
+inside a tmux window. The `inlineto2d` method grids the same files in Python (no SMOKE 
+executable or scheduler jobs), processing a range of dates in this process.
 """
 
 from cmaqpy.runsmoke import SMOKEModel
@@ -33,3 +34,5 @@ elif appl == '2016Base_4OTC2':
 smoke_sim = SMOKEModel(appl, grid_name, sector=sector, setup_yaml=f'dirpaths_{appl}.yml', verbose=True)
 # Call the "run_inlineto2d" method
 smoke_sim.run_inlineto2d(date, run_hours=1, mem_per_node=20)
+# ... or grid the whole episode in Python
+# smoke_sim.inlineto2d('2016-08-01', '2016-08-31')
@@ -0,0 +1,28 @@
+"""
+This example shows how to create a scenario's inline point source files by scaling
+the base case SMOKE outputs (inln_mole_ptertac_*) for the NY units with the ratio of
+the scenario to the base ML emissions predictions. This skips the ERTAC EGU -> SMOKE 
+cycle entirely. Point LOC_ERTAC in your dirpaths yaml file at `out_dir` to use the 
+new files in CCTM.
+
+Note that the inline files must be unzipped.
+"""
+import glob
+from cmaqpy.prepemis import ml_scale_inln
+
+# Base case SMOKE outputs and the FF10 point inventory used to create them
+smoke_out_dir = '/share/mzhang/jas983/emissions_data/nei_platform2016/v1/2016fh_16j/smoke_out/2016fh_16j/12OTC2/cmaq_cb6/ptertac'
+inln_files = sorted(glob.glob(f'{smoke_out_dir}/inln_mole_ptertac_201608*_12OTC2_cmaq_cb6_2016fh_16j.ncf'))
+stack_groups_file = f'{smoke_out_dir}/stack_groups_ptertac_12OTC2_2016fh_16j.ncf'
+ff10_point_file = '/home/jas983/models/ertac_egu/CONUS2016_Base/for_SMOKE/CONUS2016_Base_fs_ff10_future.csv'
+# Directory for the scenario files
+out_dir = '/share/mzhang/jas983/emissions_data/nei_platform2016/v1/2016fh_16j/smoke_out/2016fh_16j/12OTC2/cmaq_cb6/ptertac_s0'
+
+# (base, scenario) ML predictions, i.e., without and with renewables (S0), and the NYISO lookup table
+ml_dir = '../cmaqpy/data/ny_emis/ml_output'
+pred_files = {'NOX': (f'{ml_dir}/pred_without_renewable_xg_nox_fix.csv', f'{ml_dir}/pred_xg_nox_fix.csv'),
+              'SO2': (f'{ml_dir}/pred_without_renewable_xg_so2_fix.csv', f'{ml_dir}/pred_xg_so2_fix.csv')}
+lu_file = '../cmaqpy/data/ny_emis/ed_output/RGGI_to_NYISO.csv'
+
+out_files = ml_scale_inln(inln_files, out_dir, stack_groups_file, ff10_point_file,
+                          lu_file=lu_file, pred_files=pred_files)
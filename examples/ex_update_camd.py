@@ -5,7 +5,12 @@ CEMS data for all EGUs in the US (or a subregion if you have subsetted the file)
 
 Takes more than for hours on a high-memory node to run this one -- I think because the
 dataset takes up so much memory... could defitiely improve this... so definitely run
-this via an interactive job and not on the head node.
+this via an interactive job and not on the head node. Setting `compact=True` holds the 
+base emissions with categorical/downcast columns, which cuts the memory use substantially
+without changing the output file. Setting `patch=True` goes further: only the key columns 
+are read and the output is written by copying the base file and rewriting just the edited 
+rows. The `delta_file` holds only the edited rows, and can be re-applied to the base file 
+later with `apply_camd_delta`.
 """
 
 from cmaqpy.prepemis import update_camd
@@ -20,8 +25,10 @@ so2_file = '../cmaqpy/data/ny_emis/ml_output/pred_without_renewable_xg_so2_fix.c
 gen_file = '../cmaqpy/data/ny_emis/ed_output/thermal_without_renewable_20160805_20160815.csv'
 lu_file = '../cmaqpy/data/ny_emis/ed_output/RGGI_to_NYISO.csv'
 out_emis_file = '/home/jas983/models/ertac_egu/CONUS2016_Base/outputs/updated_calc_hourly_base_fix.csv'
+delta_file = '/home/jas983/models/ertac_egu/CONUS2016_Base/outputs/updated_calc_hourly_base_fix_delta.csv'
 
 update_camd(in_emis_file=in_emis_file, co2_file=co2_file, 
             nox_file=nox_file, so2_file=so2_file, 
             gen_file=gen_file, lu_file=lu_file, 
-            out_emis_file=out_emis_file)
\ No newline at end of file
+            out_emis_file=out_emis_file, patch=True,
+            delta_file=delta_file)
\ No newline at end of file
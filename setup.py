@@ -34,6 +34,7 @@ INSTALL_REQUIRES = [
     "scipy",
     "pandas",
     "xarray",
+    "dask",
 ]
 PYTHON_REQUIRES = ">=3.7"
 